@@ -0,0 +1,8 @@
+from __future__ import annotations
+
+import pytest
+
+
+@pytest.fixture(name="anyio_backend", scope="session")
+def anyio_backend_fixture() -> str:
+    return "asyncio"
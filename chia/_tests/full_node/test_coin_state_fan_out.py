@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from chia.full_node.coin_state_fan_out import build_coin_state_updates
+from chia.full_node.subscriptions import PeerSubscriptions
+from chia.protocols.wallet_protocol import CoinStateUpdate
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.util.ints import uint32, uint64
+
+PEER_1 = bytes32([1] * 32)
+PEER_2 = bytes32([2] * 32)
+PUZZLE_HASH = bytes32([3] * 32)
+HINT = bytes32([4] * 32)
+
+
+def coin_record(amount: int, confirmed: int, spent: int = 0) -> CoinRecord:
+    coin = Coin(bytes32([5] * 32), PUZZLE_HASH, uint64(amount))
+    return CoinRecord(coin, uint32(confirmed), uint32(spent), False, uint64(0))
+
+
+def test_coin_state_updates() -> None:
+    subscriptions = PeerSubscriptions()
+    first = coin_record(1, confirmed=10)
+    second = coin_record(2, confirmed=11)
+    subscriptions.add_puzzle_subscriptions(PEER_1, [PUZZLE_HASH], 100)
+    subscriptions.add_coin_subscriptions(PEER_1, [first.name], 100)
+    subscriptions.add_coin_subscriptions(PEER_2, [second.name], 100)
+
+    updates = build_coin_state_updates(
+        subscriptions, uint32(12), uint32(9), bytes32([6] * 32), [first, second, coin_record(3, 12)], {}
+    )
+    assert set(updates) == {PEER_1, PEER_2}
+    update = CoinStateUpdate.from_bytes(updates[PEER_1].message.data)
+    assert (update.height, update.fork_height, update.peak_hash) == (12, 9, bytes32([6] * 32))
+    # subscribed to the first coin twice, it's only sent once
+    assert update.items == [first.coin_state, second.coin_state, coin_record(3, 12).coin_state]
+    assert CoinStateUpdate.from_bytes(updates[PEER_2].message.data).items == [second.coin_state]
+
+
+def test_coin_state_updates_hint() -> None:
+    subscriptions = PeerSubscriptions()
+    record = CoinRecord(Coin(bytes32([5] * 32), bytes32([7] * 32), uint64(1)), uint32(10), uint32(0), False, uint64(0))
+    subscriptions.add_puzzle_subscriptions(PEER_1, [HINT], 100)
+
+    updates = build_coin_state_updates(subscriptions, uint32(10), uint32(9), bytes32([6] * 32), [record], {})
+    assert updates == {}
+    updates = build_coin_state_updates(
+        subscriptions, uint32(10), uint32(9), bytes32([6] * 32), [record], {record.name: HINT}
+    )
+    assert CoinStateUpdate.from_bytes(updates[PEER_1].message.data).items == [record.coin_state]
+
+
+def test_coin_state_updates_reorg() -> None:
+    subscriptions = PeerSubscriptions()
+    subscriptions.add_puzzle_subscriptions(PEER_1, [PUZZLE_HASH], 100)
+    # the coin was spent at 12, the reorg rolled it back to unspent, and the
+    # new peak spends it at 13
+    rolled_back = coin_record(1, confirmed=10)
+    new_state = coin_record(1, confirmed=10, spent=13)
+    records = [rolled_back, rolled_back, new_state]
+
+    updates = build_coin_state_updates(subscriptions, uint32(13), uint32(11), bytes32([6] * 32), records, {})
+    items = CoinStateUpdate.from_bytes(updates[PEER_1].message.data).items
+    assert items == [rolled_back.coin_state, new_state.coin_state]
+    assert items[-1].spent_height == 13
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import contextlib
+from pathlib import Path
+from typing import AsyncIterator, List
+
+import pytest
+from chia_rs import AugSchemeMPL, G1Element, G2Element
+
+from chia.consensus.default_constants import DEFAULT_CONSTANTS
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.spend_bundle import SpendBundle
+from chia.util.ints import uint32, uint64
+from chia.wallet.conditions import ConditionValidTimes
+from chia.wallet.derivation_record import DerivationRecord
+from chia.wallet.trade_record import TradeRecord
+from chia.wallet.trading.trade_status import TradeStatus
+from chia.wallet.transaction_record import TransactionRecord
+from chia.wallet.util.transaction_type import TransactionType
+from chia.wallet.util.wallet_types import WalletType
+from chia.wallet.wallet_balance_cache import WalletBalanceCache, compute_balance, compute_full_balance
+from chia.wallet.wallet_coin_record import WalletCoinRecord
+from chia.wallet.wallet_state_manager import WalletStateManager
+
+OUR_PUZZLE_HASHES = [bytes32([i] * 32) for i in range(1, 4)]
+OTHER_PUZZLE_HASH = bytes32([9] * 32)
+
+
+@contextlib.asynccontextmanager
+async def wallet_state_manager(tmp_path: Path) -> AsyncIterator[WalletStateManager]:
+    config = {"initial_num_public_keys": 3, "testing": True, "derivation_processes": 1}
+    private_key = AugSchemeMPL.key_gen(bytes([1] * 32))
+    # the server and wallet node are only used to subscribe to new puzzle hashes
+    wsm = await WalletStateManager.create(
+        private_key,
+        config,
+        tmp_path / "wallet.sqlite",
+        DEFAULT_CONSTANTS,
+        None,  # type: ignore[arg-type]
+        tmp_path,
+        None,  # type: ignore[arg-type]
+    )
+    try:
+        await wsm.puzzle_store.add_derivation_paths(
+            [
+                DerivationRecord(uint32(i), puzzle_hash, G1Element(), WalletType.STANDARD_WALLET, uint32(1), False)
+                for i, puzzle_hash in enumerate(OUR_PUZZLE_HASHES)
+            ]
+        )
+        yield wsm
+    finally:
+        await wsm._await_closed()
+
+
+def coin(parent: int, amount: int, puzzle_hash: bytes32 = OUR_PUZZLE_HASHES[0]) -> Coin:
+    return Coin(bytes32([parent] * 32), puzzle_hash, uint64(amount))
+
+
+async def add_coin(wsm: WalletStateManager, coin: Coin, height: int) -> None:
+    await wsm.coin_store.add_coin_record(
+        WalletCoinRecord(coin, uint32(height), uint32(0), False, False, WalletType.STANDARD_WALLET, 1)
+    )
+
+
+def transaction(removals: List[Coin], additions: List[Coin]) -> TransactionRecord:
+    return TransactionRecord(
+        confirmed_at_height=uint32(0),
+        created_at_time=uint64(0),
+        to_puzzle_hash=OTHER_PUZZLE_HASH,
+        amount=uint64(sum(coin.amount for coin in additions if coin.puzzle_hash == OTHER_PUZZLE_HASH)),
+        fee_amount=uint64(0),
+        confirmed=False,
+        sent=uint32(0),
+        spend_bundle=None,
+        additions=additions,
+        removals=removals,
+        wallet_id=uint32(1),
+        sent_to=[],
+        trade_id=None,
+        type=uint32(TransactionType.OUTGOING_TX.value),
+        name=bytes32([len(removals) + 50] * 32),
+        memos=[],
+        valid_times=ConditionValidTimes(),
+    )
+
+
+def offer(coins: List[Coin], status: TradeStatus = TradeStatus.PENDING_ACCEPT) -> TradeRecord:
+    return TradeRecord(
+        confirmed_at_index=uint32(0),
+        accepted_at_time=None,
+        created_at_time=uint64(0),
+        is_my_offer=True,
+        sent=uint32(0),
+        offer=bytes(SpendBundle([], G2Element())),
+        taken_offer=None,
+        coins_of_interest=coins,
+        trade_id=bytes32([60] * 32),
+        status=uint32(status.value),
+        sent_to=[],
+        valid_times=ConditionValidTimes(),
+    )
+
+
+async def check_balance(wsm: WalletStateManager, cache: WalletBalanceCache) -> None:
+    balance = await compute_balance(wsm, uint32(1))
+    assert balance == await compute_full_balance(wsm, uint32(1))
+    async with wsm.lock:
+        assert await cache.check(wsm, uint32(1))
+    assert cache.get(1) == balance
+
+
+@pytest.mark.anyio
+async def test_balance_events(tmp_path: Path) -> None:
+    async with wallet_state_manager(tmp_path) as wsm:
+        cache = WalletBalanceCache()
+        wsm.coin_store.wallet_changed_callback = cache.wallet_changed
+        wsm.tx_store.wallet_changed_callback = cache.wallet_changed
+        wsm.trade_manager.trade_store.trades_changed_callback = cache.trades_changed
+        await check_balance(wsm, cache)
+
+        # add
+        coins = [coin(10, 100), coin(11, 200, OUR_PUZZLE_HASHES[1]), coin(12, 50), coin(13, 75)]
+        for height, added in enumerate(coins, start=1):
+            await add_coin(wsm, added, height)
+        # not ours
+        await wsm.coin_store.add_coin_record(
+            WalletCoinRecord(coin(14, 1000, OTHER_PUZZLE_HASH), uint32(1), uint32(0), False, False, WalletType.CAT, 2)
+        )
+        await check_balance(wsm, cache)
+        assert cache.balances[1].confirmed_wallet_balance == 425
+        assert cache.balances[1].unspent_coin_count == 4
+
+        # spend
+        await wsm.coin_store.set_spent(coins[0].name(), uint32(5))
+        await check_balance(wsm, cache)
+        assert cache.balances[1].confirmed_wallet_balance == 325
+
+        # pending transaction, spending a coin with change back to us
+        change = coin(15, 150, OUR_PUZZLE_HASHES[2])
+        await wsm.tx_store.add_transaction_record(transaction([coins[1]], [change, coin(15, 50, OTHER_PUZZLE_HASH)]))
+        await check_balance(wsm, cache)
+        assert cache.balances[1].unconfirmed_wallet_balance == 275
+        assert cache.balances[1].spendable_balance == 125
+        assert cache.balances[1].pending_change == 150
+
+        # offer locking a coin
+        trade = offer([coins[2]])
+        await wsm.trade_manager.trade_store.add_trade_record(trade, bytes32([61] * 32))
+        await check_balance(wsm, cache)
+        assert cache.balances[1].spendable_balance == 75
+        await wsm.trade_manager.trade_store.set_status(trade.trade_id, TradeStatus.CANCELLED)
+        await check_balance(wsm, cache)
+        assert cache.balances[1].spendable_balance == 125
+
+        # the pending transaction is confirmed
+        await wsm.coin_store.set_spent(coins[1].name(), uint32(6))
+        await add_coin(wsm, change, 6)
+        await wsm.tx_store.set_confirmed(transaction([coins[1]], []).name, uint32(6))
+        await check_balance(wsm, cache)
+        assert cache.balances[1].confirmed_wallet_balance == 275
+
+        # rollback of the chain, unspending the first coin and deleting the change
+        await wsm.coin_store.rollback_to_block(4)
+        await wsm.tx_store.rollback_to_block(4)
+        await check_balance(wsm, cache)
+        assert cache.balances[1].confirmed_wallet_balance == 425
+
+        # rollback of a transaction that wrote coins
+        with pytest.raises(RuntimeError):
+            async with wsm.db_wrapper.writer():
+                await add_coin(wsm, coin(16, 500), 5)
+                await wsm.coin_store.set_spent(coins[3].name(), uint32(5))
+                raise RuntimeError("rolled back")
+        await check_balance(wsm, cache)
+        assert cache.balances[1].confirmed_wallet_balance == 425
+
+
+@pytest.mark.anyio
+async def test_balance_check_repairs(tmp_path: Path) -> None:
+    async with wallet_state_manager(tmp_path) as wsm:
+        cache = WalletBalanceCache()
+        await add_coin(wsm, coin(10, 100), 1)
+        # the totals drift from the coin records
+        wsm.coin_store.unspent_totals.clear()
+        async with wsm.lock:
+            assert not await cache.check(wsm, uint32(1))
+            assert cache.balances[1].confirmed_wallet_balance == 100
+            assert await cache.check(wsm, uint32(1))
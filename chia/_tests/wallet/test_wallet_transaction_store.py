@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import List, Optional
+
+import pytest
+
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.db_wrapper import DBWrapper2
+from chia.util.ints import uint32, uint64
+from chia.wallet.conditions import ConditionValidTimes
+from chia.wallet.transaction_record import TransactionRecord
+from chia.wallet.util.transaction_type import TransactionType
+from chia.wallet.wallet_transaction_store import TransactionHistoryCursor, WalletTransactionStore
+
+
+def make_record(index: int, confirmed: bool, height: int, created_at: int, wallet_id: int = 1) -> TransactionRecord:
+    return TransactionRecord(
+        confirmed_at_height=uint32(height),
+        created_at_time=uint64(created_at),
+        to_puzzle_hash=bytes32([index] * 32),
+        amount=uint64(index),
+        fee_amount=uint64(0),
+        confirmed=confirmed,
+        sent=uint32(0),
+        spend_bundle=None,
+        additions=[],
+        removals=[],
+        wallet_id=uint32(wallet_id),
+        sent_to=[],
+        trade_id=None,
+        type=uint32(TransactionType.OUTGOING_TX.value),
+        name=bytes32([index + 100] * 32),
+        memos=[],
+        valid_times=ConditionValidTimes(),
+    )
+
+
+async def add_records(store: WalletTransactionStore) -> List[TransactionRecord]:
+    # repeated heights and times, so the pages split inside the ties
+    records = [make_record(i, confirmed=i % 3 != 0, height=10 + i % 4, created_at=1000 + i % 5) for i in range(1, 24)]
+    records.append(make_record(30, confirmed=True, height=11, created_at=1001, wallet_id=2))
+    for record in records:
+        await store.add_transaction_record(record)
+    return records
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("sort_key", ["CONFIRMED_AT_HEIGHT", "RELEVANCE"])
+@pytest.mark.parametrize("reverse", [False, True])
+async def test_get_transactions_between(tmp_path: Path, sort_key: str, reverse: bool) -> None:
+    async with DBWrapper2.managed(tmp_path / "wallet.sqlite", db_version=2) as db_wrapper:
+        store = await WalletTransactionStore.create(db_wrapper)
+        records = await add_records(store)
+        wallet_records = [record for record in records if record.wallet_id == 1]
+
+        all_records = await store.get_transactions_between(1, 0, 100, sort_key=sort_key, reverse=reverse)
+        assert sorted(record.name for record in all_records) == sorted(record.name for record in wallet_records)
+        if sort_key == "CONFIRMED_AT_HEIGHT":
+            heights = [record.confirmed_at_height for record in all_records]
+            assert heights == sorted(heights, reverse=reverse)
+        else:
+            keys = [(r.confirmed, -r.confirmed_at_height, -r.created_at_time) for r in all_records]
+            assert keys == sorted(keys, reverse=reverse)
+
+        page = await store.get_transactions_between(1, 5, 12, sort_key=sort_key, reverse=reverse)
+        assert page == all_records[5:12]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("sort_key", ["CONFIRMED_AT_HEIGHT", "RELEVANCE"])
+@pytest.mark.parametrize("reverse", [False, True])
+@pytest.mark.parametrize("limit", [1, 4, 7])
+async def test_get_transaction_summaries_pages(tmp_path: Path, sort_key: str, reverse: bool, limit: int) -> None:
+    async with DBWrapper2.managed(tmp_path / "wallet.sqlite", db_version=2) as db_wrapper:
+        store = await WalletTransactionStore.create(db_wrapper)
+        await add_records(store)
+        all_records = await store.get_transactions_between(1, 0, 100, sort_key=sort_key, reverse=reverse)
+
+        names: List[bytes32] = []
+        cursor: Optional[TransactionHistoryCursor] = None
+        while True:
+            summaries, cursor = await store.get_transaction_summaries(
+                1, limit, cursor=cursor, sort_key=sort_key, reverse=reverse
+            )
+            assert len(summaries) <= limit
+            names.extend(summary.name for summary in summaries)
+            if cursor is None:
+                break
+        assert names == [record.name for record in all_records]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("reverse", [False, True])
+async def test_get_transaction_summaries_query_plan(tmp_path: Path, reverse: bool) -> None:
+    log_path = tmp_path / "sql.log"
+    async with DBWrapper2.managed(tmp_path / "wallet.sqlite", db_version=2, log_path=log_path) as db_wrapper:
+        store = await WalletTransactionStore.create(db_wrapper)
+        await add_records(store)
+        _, cursor = await store.get_transaction_summaries(1, 5, sort_key="RELEVANCE", reverse=reverse)
+        assert cursor is not None
+        await store.get_transaction_summaries(1, 5, cursor=cursor, sort_key="RELEVANCE", reverse=reverse)
+
+        queries = [
+            line[line.index("SELECT") :].strip()
+            for line in log_path.read_text().splitlines()
+            if "rowid FROM transaction_record" in line
+        ]
+        # the first page, and the ranges of the second one
+        assert len(queries) > 2
+        async with db_wrapper.reader_no_transaction() as conn:
+            for query in queries:
+                plan = " ".join(row[3] for row in await conn.execute_fetchall(f"EXPLAIN QUERY PLAN {query}"))
+                assert "USING INDEX tx_wallet_relevance_sorted" in plan
+                assert "TEMP B-TREE" not in plan
@@ -1,10 +1,11 @@
 from __future__ import annotations
 
 import sys
-from typing import Dict, List, Optional, Sequence, Tuple, Union
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 from chia.cmds.cmds_util import CMDCoinSelectionConfigLoader, CMDTXConfigLoader, cli_confirm, get_wallet_client
 from chia.cmds.param_types import CliAmount
+from chia.cmds.units import units
 from chia.cmds.wallet_funcs import get_mojo_per_unit, get_wallet_type, print_balance
 from chia.types.blockchain_format.coin import Coin
 from chia.types.blockchain_format.sized_bytes import bytes32
@@ -12,6 +13,7 @@ from chia.types.coin_record import CoinRecord
 from chia.util.bech32m import decode_puzzle_hash, encode_puzzle_hash
 from chia.util.config import selected_network_address_prefix
 from chia.util.ints import uint64, uint128
+from chia.wallet.dust_consolidation import AutoConsolidateDustSettings, DustConsolidationReport
 from chia.wallet.transaction_record import TransactionRecord
 from chia.wallet.util.wallet_types import WalletType
 
@@ -260,3 +262,99 @@ async def async_split(
                 f"you decrease the dust limit to below {final_amount_per_coin} mojos or disable it by setting it to 0."
             )
         return [transaction]
+
+
+def print_consolidation_report(report: DustConsolidationReport, address_prefix: str) -> None:
+    mojo_per_unit = units["lottery"]
+    print(f"Dust coins: {report.dust_coins}")
+    for batch in report.batches:
+        print(
+            f"{'Would merge' if report.dry_run else 'Merging'} {len(batch.coin_ids)} coins worth "
+            f"{print_balance(batch.amount, mojo_per_unit, address_prefix)} with a fee of "
+            f"{print_balance(batch.fee, mojo_per_unit, address_prefix)}"
+        )
+    if report.uneconomical_batches > 0:
+        print(f"{report.uneconomical_batches} batches left out, their coins don't add up to more than the fee")
+    if len(report.batches) == 0:
+        print("Nothing to consolidate.")
+
+
+async def async_consolidate(
+    *,
+    wallet_rpc_port: Optional[int],
+    fingerprint: Optional[int],
+    fee: Optional[uint64],
+    dust_threshold: CliAmount,
+    batch_size: Optional[int],
+    max_batches: Optional[int],
+    dry_run: bool,
+    push: bool,
+) -> List[TransactionRecord]:
+    async with get_wallet_client(wallet_rpc_port, fingerprint) as (wallet_client, fingerprint, config):
+        if not await wallet_client.get_synced():
+            print("Wallet not synced. Please wait.")
+            return []
+        settings: Dict[str, Any] = {}
+        final_dust_threshold = dust_threshold.convert_amount_with_default(units["lottery"], None)
+        if final_dust_threshold is not None:
+            settings["dust_threshold"] = final_dust_threshold
+        if batch_size is not None:
+            settings["batch_size"] = batch_size
+        if max_batches is not None:
+            settings["max_batches"] = max_batches
+        if fee is not None:
+            settings["tx_fee"] = fee
+        tx_config = CMDTXConfigLoader().to_tx_config(units["lottery"], config, fingerprint)
+        # always dry run first, for the user to confirm
+        report, _ = await wallet_client.consolidate_dust(tx_config, settings, dry_run=True, push=False)
+        print_consolidation_report(report, selected_network_address_prefix(config))
+        if dry_run or len(report.batches) == 0:
+            return []
+        cli_confirm("Would you like to Continue? (y/n): ")
+        report, transactions = await wallet_client.consolidate_dust(tx_config, settings, push=push)
+        if push:
+            for transaction in transactions:
+                print(f"Transaction sent: {transaction.name.hex()}")
+        return transactions
+
+
+async def async_auto_consolidate(
+    *,
+    wallet_rpc_port: Optional[int],
+    fingerprint: Optional[int],
+    enabled: Optional[bool],
+    interval: Optional[int],
+    dust_threshold: CliAmount,
+    min_coins: Optional[int],
+    batch_size: Optional[int],
+    fee: Optional[uint64],
+    max_fee: CliAmount,
+    max_batches: Optional[int],
+) -> None:
+    async with get_wallet_client(wallet_rpc_port, fingerprint) as (wallet_client, _, config):
+        settings = await wallet_client.get_auto_consolidate_dust()
+        changes: Dict[str, Any] = {
+            "enabled": enabled,
+            "interval": interval,
+            "dust_threshold": dust_threshold.convert_amount_with_default(units["lottery"], None),
+            "min_coins": min_coins,
+            "batch_size": batch_size,
+            "tx_fee": fee,
+            "max_fee": max_fee.convert_amount_with_default(units["lottery"], None),
+            "max_batches": max_batches,
+        }
+        changes = {key: value for key, value in changes.items() if value is not None}
+        if len(changes) > 0:
+            settings = await wallet_client.set_auto_consolidate_dust(
+                AutoConsolidateDustSettings.from_json_dict({**settings.to_json_dict(), **changes})
+            )
+        address_prefix = selected_network_address_prefix(config)
+        mojo_per_unit = units["lottery"]
+        print(f"Automatic dust consolidation: {'enabled' if settings.enabled else 'disabled'}")
+        print(f"Interval: {settings.interval} seconds")
+        print(f"Dust threshold: {print_balance(settings.dust_threshold, mojo_per_unit, address_prefix)}")
+        print(f"Minimum dust coins: {settings.min_coins}")
+        print(f"Coins per transaction: {settings.batch_size}")
+        print(f"Fee per transaction: {print_balance(settings.tx_fee, mojo_per_unit, address_prefix)}")
+        print(f"Fee cap per run: {print_balance(settings.max_fee, mojo_per_unit, address_prefix)}")
+        print(f"Transactions per run: {settings.max_batches}")
@@ -7,7 +7,13 @@ import click
 
 from chia.cmds import options
 from chia.cmds.cmds_util import tx_out_cmd
-from chia.cmds.param_types import AmountParamType, Bytes32ParamType, CliAmount, cli_amount_none
+from chia.cmds.param_types import (
+    AmountParamType,
+    Bytes32ParamType,
+    CliAmount,
+    TransactionFeeParamType,
+    cli_amount_none,
+)
 from chia.types.blockchain_format.sized_bytes import bytes32
 from chia.util.ints import uint64
 from chia.wallet.transaction_record import TransactionRecord
@@ -236,3 +242,118 @@ def split_cmd(
             push=push,
         )
     )
+
+
+@coins_cmd.command("consolidate", help="Merge the dust coins of the standard wallet")
+@click.option(
+    "-p",
+    "--wallet-rpc-port",
+    help="Set the port where the Wallet is hosting the RPC interface. See the rpc_port under wallet in config.yaml",
+    type=int,
+    default=None,
+)
+@options.create_fingerprint()
+@click.option(
+    "--dust-threshold",
+    help="Merge the coins worth less than this much LOT. Defaults to the auto_consolidate_dust config",
+    type=AmountParamType(),
+    default=cli_amount_none,
+)
+@click.option("--batch-size", help="The number of coins merged by each transaction", type=int, default=None)
+@click.option("--max-batches", help="The most transactions to create", type=int, default=None)
+@click.option(
+    "-m",
+    "--fee",
+    help="Set the fee of each transaction, in LOT. Defaults to the auto_consolidate_dust config",
+    type=TransactionFeeParamType(),
+    default=None,
+)
+@click.option("--dry-run", help="Only report what would be merged", is_flag=True, default=False)
+@tx_out_cmd
+def consolidate_cmd(
+    wallet_rpc_port: Optional[int],
+    fingerprint: int,
+    dust_threshold: CliAmount,
+    batch_size: Optional[int],
+    max_batches: Optional[int],
+    fee: Optional[uint64],
+    dry_run: bool,
+    push: bool,
+) -> List[TransactionRecord]:
+    from .coin_funcs import async_consolidate
+
+    return asyncio.run(
+        async_consolidate(
+            wallet_rpc_port=wallet_rpc_port,
+            fingerprint=fingerprint,
+            fee=fee,
+            dust_threshold=dust_threshold,
+            batch_size=batch_size,
+            max_batches=max_batches,
+            dry_run=dry_run,
+            push=push,
+        )
+    )
+
+
+@coins_cmd.command("auto_consolidate", help="Show or change the automatic dust consolidation settings")
+@click.option(
+    "-p",
+    "--wallet-rpc-port",
+    help="Set the port where the Wallet is hosting the RPC interface. See the rpc_port under wallet in config.yaml",
+    type=int,
+    default=None,
+)
+@options.create_fingerprint()
+@click.option("--enable/--disable", "enabled", default=None, help="Turn automatic dust consolidation on or off")
+@click.option("--interval", help="Seconds between two consolidation runs", type=int, default=None)
+@click.option(
+    "--dust-threshold",
+    help="Merge the coins worth less than this much LOT",
+    type=AmountParamType(),
+    default=cli_amount_none,
+)
+@click.option("--min-coins", help="Only merge when there are at least this many dust coins", type=int, default=None)
+@click.option("--batch-size", help="The number of coins merged by each transaction", type=int, default=None)
+@click.option(
+    "-m",
+    "--fee",
+    help="Set the fee of each transaction, in LOT",
+    type=TransactionFeeParamType(),
+    default=None,
+)
+@click.option(
+    "--max-fee",
+    help="The most fees a run spends, in LOT, 0 for no cap",
+    type=AmountParamType(),
+    default=cli_amount_none,
+)
+@click.option("--max-batches", help="The most transactions a run creates", type=int, default=None)
+def auto_consolidate_cmd(
+    wallet_rpc_port: Optional[int],
+    fingerprint: int,
+    enabled: Optional[bool],
+    interval: Optional[int],
+    dust_threshold: CliAmount,
+    min_coins: Optional[int],
+    batch_size: Optional[int],
+    fee: Optional[uint64],
+    max_fee: CliAmount,
+    max_batches: Optional[int],
+) -> None:
+    from .coin_funcs import async_auto_consolidate
+
+    asyncio.run(
+        async_auto_consolidate(
+            wallet_rpc_port=wallet_rpc_port,
+            fingerprint=fingerprint,
+            enabled=enabled,
+            interval=interval,
+            dust_threshold=dust_threshold,
+            min_coins=min_coins,
+            batch_size=batch_size,
+            fee=fee,
+            max_fee=max_fee,
+            max_batches=max_batches,
+        )
+    )
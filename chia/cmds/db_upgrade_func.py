@@ -431,13 +431,15 @@ def convert_v1_to_v2(in_path: Path, out_path: Path) -> None:
             "\r-- [4/4] Creating coin_record coin_spent_index index SUCCEEDED in "
             f"{end_time - coin_spent_index_start_time:.2f} seconds                             "
         )
-        print("-- [4/4] Creating coin_record coin_puzzle_hash index")
+        print("-- [4/4] Creating coin_record coin_puzzle_hash_heights index")
         coin_puzzle_hash_index_start_time = monotonic()
-        conn.execute("CREATE INDEX out_db.coin_puzzle_hash ON coin_record(puzzle_hash)")
+        conn.execute(
+            "CREATE INDEX out_db.coin_puzzle_hash_heights ON coin_record(puzzle_hash, confirmed_index, spent_index)"
+        )
         conn.commit()
         end_time = monotonic()
         print(
-            "\r-- [4/4] Creating coin_record coin_puzzle_hash index SUCCEEDED in "
+            "\r-- [4/4] Creating coin_record coin_puzzle_hash_heights index SUCCEEDED in "
             f"{end_time - coin_puzzle_hash_index_start_time:.2f} seconds                             "
         )
         print("-- [4/4] Creating coin_record coin_parent_index index")
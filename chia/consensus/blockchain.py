@@ -27,6 +27,7 @@ from chia.consensus.find_fork_point import lookup_fork_chain
 from chia.consensus.full_block_to_block_record import block_to_block_record
 from chia.consensus.multiprocess_validation import (
     PreValidationResult,
+    ShippedBlockRecords,
     _run_generator,
     pre_validate_blocks_multiprocessing,
 )
@@ -47,7 +48,7 @@ from chia.types.full_block import FullBlock
 from chia.types.generator_types import BlockGenerator
 from chia.types.header_block import HeaderBlock
 from chia.types.spend_bundle import SpendBundle
-from chia.types.stake_record import StakeRecord, STAKE_LOCK_MIN_MOJO, get_stake_value
+from chia.types.stake_record import STAKE_LOCK_MIN_MOJO, StakeRecord, get_stake_value
 from chia.types.unfinished_block import UnfinishedBlock
 from chia.types.unfinished_header_block import UnfinishedHeaderBlock
 from chia.types.weight_proof import SubEpochChallengeSegment
@@ -118,6 +119,8 @@ class Blockchain(BlockchainInterface):
     stake_store: StakeStore
     # Used to verify blocks in parallel
     pool: Executor
+    # The BlockRecords the workers in pool already have
+    _shipped_block_records: ShippedBlockRecords
     # Set holding seen compact proofs, in order to avoid duplicates.
     _seen_compact_proofs: Set[Tuple[VDFInfo, uint32]]
 
@@ -163,6 +166,8 @@ class Blockchain(BlockchainInterface):
             )
             log.info(f"Started {num_workers} processes for block validation")
 
+        self._shipped_block_records = ShippedBlockRecords()
+
         self.constants = consensus_constants
         self.coin_store = coin_store
         self.block_store = block_store
@@ -861,6 +866,7 @@ class Blockchain(BlockchainInterface):
             batch_size,
             wp_summaries,
             validate_signatures=validate_signatures,
+            shipped_block_records=self._shipped_block_records,
         )
 
     async def run_generator(self, unfinished_block: bytes, generator: BlockGenerator, height: uint32) -> NPCResult:
@@ -5,7 +5,7 @@ import logging
 import time
 import traceback
 from concurrent.futures import Executor
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
 
 from chia_rs import AugSchemeMPL
@@ -48,9 +48,44 @@ class PreValidationResult(Streamable):
     timing: uint32  # the time (in milliseconds) it took to pre-validate the block
 
 
+# The number of BlockRecords each block validation worker process keeps
+# (deserialized) between batches. The main process only ships the records the
+# workers haven't been sent yet, rather than all recent blocks for every batch
+WORKER_BLOCK_RECORD_CACHE_SIZE = 20000
+
+# BlockRecords cached in this (worker) process, by header hash, in insertion
+# order
+_worker_block_records: Dict[bytes32, BlockRecord] = {}
+
+
+@dataclass
+class ShippedBlockRecords:
+    """
+    Keeps track of which BlockRecords have been sent to the block validation
+    workers, so only new ones are sent along with the next batches. A worker
+    that didn't receive some of them (because the batches carrying them went to
+    other workers) reports the ones it's missing, and the batch is re-sent with
+    all records.
+    """
+
+    max_size: int = WORKER_BLOCK_RECORD_CACHE_SIZE
+    _hashes: Dict[bytes32, None] = field(default_factory=dict)
+
+    def new_records(self, recent_blocks: Dict[bytes32, BlockRecord]) -> Dict[bytes, bytes]:
+        ret: Dict[bytes, bytes] = {}
+        for header_hash, block_record in recent_blocks.items():
+            if header_hash not in self._hashes:
+                ret[bytes(header_hash)] = bytes(block_record)
+                self._hashes[header_hash] = None
+        while len(self._hashes) > self.max_size:
+            del self._hashes[next(iter(self._hashes))]
+        return ret
+
+
 def batch_pre_validate_blocks(
     constants: ConsensusConstants,
-    blocks_pickled: Dict[bytes, bytes],
+    recent_block_hashes: List[bytes],
+    new_block_records: Dict[bytes, bytes],
     full_blocks_pickled: List[bytes],
     prev_transaction_generators: List[Optional[bytes]],
     npc_results: Dict[uint32, bytes],
@@ -58,10 +93,55 @@ def batch_pre_validate_blocks(
     expected_difficulty: List[uint64],
     expected_sub_slot_iters: List[uint64],
     validate_signatures: bool,
-) -> List[bytes]:
+) -> Tuple[List[bytes], List[bytes]]:
+    """
+    This is meant to be called under a ProcessPoolExecutor. new_block_records
+    are added to this process' BlockRecord cache, and the records in
+    recent_block_hashes are looked up from it. If any of them are missing,
+    nothing is validated and their hashes are returned. Otherwise returns the
+    serialized PreValidationResults.
+    """
+    for k, v in new_block_records.items():
+        _worker_block_records[bytes32(k)] = BlockRecord.from_bytes_unchecked(v)
+
     blocks: Dict[bytes32, BlockRecord] = {}
-    for k, v in blocks_pickled.items():
-        blocks[bytes32(k)] = BlockRecord.from_bytes_unchecked(v)
+    missing: List[bytes] = []
+    for k in recent_block_hashes:
+        block_record = _worker_block_records.get(bytes32(k))
+        if block_record is None:
+            missing.append(k)
+        else:
+            blocks[block_record.header_hash] = block_record
+    if len(missing) > 0:
+        return missing, []
+
+    results = _pre_validate_blocks(
+        constants,
+        blocks,
+        full_blocks_pickled,
+        prev_transaction_generators,
+        npc_results,
+        check_filter,
+        expected_difficulty,
+        expected_sub_slot_iters,
+        validate_signatures,
+    )
+    while len(_worker_block_records) > WORKER_BLOCK_RECORD_CACHE_SIZE:
+        del _worker_block_records[next(iter(_worker_block_records))]
+    return [], results
+
+
+def _pre_validate_blocks(
+    constants: ConsensusConstants,
+    blocks: Dict[bytes32, BlockRecord],
+    full_blocks_pickled: List[bytes],
+    prev_transaction_generators: List[Optional[bytes]],
+    npc_results: Dict[uint32, bytes],
+    check_filter: bool,
+    expected_difficulty: List[uint64],
+    expected_sub_slot_iters: List[uint64],
+    validate_signatures: bool,
+) -> List[bytes]:
     results: List[PreValidationResult] = []
 
     # In this case, we are validating full blocks, not headers
@@ -165,6 +245,7 @@ async def pre_validate_blocks_multiprocessing(
     wp_summaries: Optional[List[SubEpochSummary]] = None,
     *,
     validate_signatures: bool = True,
+    shipped_block_records: Optional[ShippedBlockRecords] = None,
 ) -> List[PreValidationResult]:
     """
     This method must be called under the blockchain lock
@@ -180,6 +261,8 @@ async def pre_validate_blocks_multiprocessing(
         blocks: list of full blocks to validate (must be connected to current chain)
         npc_results
         get_block_generator
+        shipped_block_records: the BlockRecords already sent to the workers in pool. Only records not in here
+            are sent along with the batches
     """
     prev_b: Optional[BlockRecord] = None
     # Collects all the recent blocks (up to the previous sub-epoch)
@@ -305,9 +388,44 @@ async def pre_validate_blocks_multiprocessing(
     npc_results_pickled = {}
     for k, v in npc_results.items():
         npc_results_pickled[k] = bytes(v)
+    if shipped_block_records is None:
+        shipped_block_records = ShippedBlockRecords()
+    recent_block_hashes = [bytes(k) for k in recent_blocks.keys()]
+    new_block_records = shipped_block_records.new_records(recent_blocks)
+
+    async def validate_batch(
+        b_pickled: List[bytes],
+        previous_generators: List[Optional[bytes]],
+        expected_difficulty: List[uint64],
+        expected_sub_slot_iters: List[uint64],
+    ) -> List[bytes]:
+        async def run(block_records: Dict[bytes, bytes]) -> Tuple[List[bytes], List[bytes]]:
+            return await asyncio.get_running_loop().run_in_executor(
+                pool,
+                batch_pre_validate_blocks,
+                constants,
+                recent_block_hashes,
+                block_records,
+                b_pickled,
+                previous_generators,
+                npc_results_pickled,
+                check_filter,
+                expected_difficulty,
+                expected_sub_slot_iters,
+                validate_signatures,
+            )
+
+        missing, results = await run(new_block_records)
+        if len(missing) > 0:
+            # this worker wasn't sent all the block records we need yet, try
+            # again with all of them
+            log.debug(f"block validation worker is missing {len(missing)} block records")
+            missing, results = await run({bytes(k): bytes(v) for k, v in recent_blocks.items()})
+            assert len(missing) == 0
+        return results
+
     futures = []
     # Pool of workers to validate blocks concurrently
-    recent_blocks_bytes = {bytes(k): bytes(v) for k, v in recent_blocks.items()}  # convert to bytes
     for i in range(0, len(blocks), batch_size):
         end_i = min(i + batch_size, len(blocks))
         blocks_to_validate = blocks[i:end_i]
@@ -342,18 +460,11 @@ async def pre_validate_blocks_multiprocessing(
                 previous_generators.append(None)
 
         futures.append(
-            asyncio.get_running_loop().run_in_executor(
-                pool,
-                batch_pre_validate_blocks,
-                constants,
-                recent_blocks_bytes,
+            validate_batch(
                 b_pickled,
                 previous_generators,
-                npc_results_pickled,
-                check_filter,
                 [diff_ssis[j][0] for j in range(i, end_i)],
                 [diff_ssis[j][1] for j in range(i, end_i)],
-                validate_signatures,
             )
         )
     # Collect all results into one flat list
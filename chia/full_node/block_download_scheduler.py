@@ -0,0 +1,343 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from chia.server.peer_scores import PeerScores
+from chia.server.ws_connection import WSLotteryConnection
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.full_block import FullBlock
+from chia.util.ints import uint32
+
+log = logging.getLogger(__name__)
+
+# we aim for each request to take about this many seconds. Batches for slow
+# peers are shrunk accordingly, so they don't hold up the ranges the validator
+# is waiting on
+TARGET_REQUEST_SECONDS = 5.0
+MIN_BATCH_SIZE = 4
+
+# weight of the most recent sample in the exponential moving averages of peer
+# throughput and latency
+EWMA_ALPHA = 0.3
+
+# a request is considered a straggler once it has taken this many times longer
+# than expected (and at least STRAGGLER_MIN_SECONDS). The range is then also
+# requested from an idle peer, whichever responds first wins
+STRAGGLER_FACTOR = 3.0
+STRAGGLER_MIN_SECONDS = 5.0
+MAX_REQUESTS_PER_RANGE = 2
+
+# how often we wake up to look for stragglers when no request completes
+SCHEDULE_INTERVAL = 1.0
+
+FetchBlocks = Callable[[WSLotteryConnection, uint32, uint32], Awaitable[Optional[List[FullBlock]]]]
+
+
+@dataclasses.dataclass
+class StageRate:
+    """
+    Counts blocks processed by one stage of the sync pipeline and computes a
+    blocks/sec rate over a sliding time window.
+    """
+
+    window: float = 30.0
+    total: int = 0
+    _samples: Deque[Tuple[float, int]] = dataclasses.field(default_factory=deque)
+
+    def add(self, count: int, now: Optional[float] = None) -> None:
+        if now is None:
+            now = time.monotonic()
+        self.total += count
+        self._samples.append((now, count))
+        self._expire(now)
+
+    def rate(self, now: Optional[float] = None) -> float:
+        if now is None:
+            now = time.monotonic()
+        self._expire(now)
+        if len(self._samples) == 0:
+            return 0.0
+        elapsed = max(now - self._samples[0][0], 1.0)
+        return sum(count for _, count in self._samples) / elapsed
+
+    def _expire(self, now: float) -> None:
+        while len(self._samples) > 0 and self._samples[0][0] < now - self.window:
+            self._samples.popleft()
+
+
+@dataclasses.dataclass
+class PeerSyncStats:
+    blocks_per_second: Optional[float] = None
+    latency: Optional[float] = None
+    requests: int = 0
+    failures: int = 0
+
+    def record_success(self, num_blocks: int, duration: float) -> None:
+        duration = max(duration, 0.001)
+        self.requests += 1
+        bps = num_blocks / duration
+        if self.blocks_per_second is None or self.latency is None:
+            self.blocks_per_second = bps
+            self.latency = duration
+        else:
+            self.blocks_per_second = EWMA_ALPHA * bps + (1 - EWMA_ALPHA) * self.blocks_per_second
+            self.latency = EWMA_ALPHA * duration + (1 - EWMA_ALPHA) * self.latency
+
+    def record_failure(self) -> None:
+        self.requests += 1
+        self.failures += 1
+
+
+@dataclasses.dataclass
+class SyncMetrics:
+    """
+    Live throughput of the long sync pipeline, by stage.
+    """
+
+    download: StageRate = dataclasses.field(default_factory=StageRate)
+    validate: StageRate = dataclasses.field(default_factory=StageRate)
+    peers: Dict[bytes32, PeerSyncStats] = dataclasses.field(default_factory=dict)
+
+    def peer_stats(self, peer_id: bytes32) -> PeerSyncStats:
+        stats = self.peers.get(peer_id)
+        if stats is None:
+            stats = PeerSyncStats()
+            self.peers[peer_id] = stats
+        return stats
+
+    def reset(self) -> None:
+        self.download = StageRate()
+        self.validate = StageRate()
+        self.peers = {}
+
+    def to_json_dict(self) -> Dict[str, float]:
+        return {
+            "download_blocks_per_second": round(self.download.rate(), 2),
+            "validate_blocks_per_second": round(self.validate.rate(), 2),
+        }
+
+
+@dataclasses.dataclass(frozen=True)
+class _BlockRange:
+    start: uint32
+    end: uint32  # inclusive
+
+
+@dataclasses.dataclass
+class _Request:
+    block_range: _BlockRange
+    peer: WSLotteryConnection
+    started: float
+
+
+@dataclasses.dataclass
+class BlockDownloadScheduler:
+    """
+    Downloads the (inclusive) block range start_height to end_height from
+    several peers concurrently and feeds the batches, in height order, to
+    batch_queue. Batch sizes are chosen per peer based on its measured
+    throughput, failed ranges are retried with other peers and ranges held up
+    by a slow peer are requested again from an idle one.
+    """
+
+    start_height: uint32
+    end_height: uint32
+    max_batch_size: int
+    get_peers: Callable[[], List[WSLotteryConnection]]
+    fetch_blocks: FetchBlocks
+    metrics: SyncMetrics
+    # the maximum number of blocks that have been requested past the batch the
+    # validator is waiting on. This bounds the memory used by out-of-order
+    # batches
+    window: int = 1024
+    # scores of peers from earlier connections, to start with the fastest
+    # peers before their throughput has been measured in this sync
+    peer_scores: Optional[PeerScores] = None
+
+    _next_height: int = dataclasses.field(init=False)
+    _emit_height: int = dataclasses.field(init=False)
+    _retry: List[_BlockRange] = dataclasses.field(init=False, default_factory=list)
+    _completed: Dict[int, Tuple[WSLotteryConnection, List[FullBlock]]] = dataclasses.field(
+        init=False, default_factory=dict
+    )
+    _in_flight: Dict[asyncio.Task[Optional[List[FullBlock]]], _Request] = dataclasses.field(
+        init=False, default_factory=dict
+    )
+    _failed_peers: Dict[int, Set[bytes32]] = dataclasses.field(init=False, default_factory=dict)
+
+    def __post_init__(self) -> None:
+        self._next_height = self.start_height
+        self._emit_height = self.start_height
+
+    async def run(self, batch_queue: asyncio.Queue[Optional[Tuple[WSLotteryConnection, List[FullBlock]]]]) -> None:
+        try:
+            await self._run(batch_queue)
+        finally:
+            for task in self._in_flight:
+                task.cancel()
+            self._in_flight.clear()
+            # finished signal with None
+            await batch_queue.put(None)
+
+    async def _run(self, batch_queue: asyncio.Queue[Optional[Tuple[WSLotteryConnection, List[FullBlock]]]]) -> None:
+        while self._emit_height <= self.end_height:
+            peers = [peer for peer in self.get_peers() if not peer.closed]
+            self._schedule(peers)
+            if len(self._in_flight) == 0:
+                log.error(f"failed fetching blocks {self._emit_height} to {self.end_height}, no peers to fetch from")
+                return
+
+            done, _ = await asyncio.wait(
+                set(self._in_flight), timeout=SCHEDULE_INTERVAL, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                request = self._in_flight.pop(task)
+                if not self._handle_response(request, task, peers):
+                    return
+
+            while self._emit_height in self._completed:
+                peer, blocks = self._completed.pop(self._emit_height)
+                self._failed_peers.pop(self._emit_height, None)
+                await batch_queue.put((peer, blocks))
+                self.metrics.download.add(len(blocks))
+                self._emit_height = blocks[-1].height + 1
+
+    def _handle_response(
+        self,
+        request: _Request,
+        task: asyncio.Task[Optional[List[FullBlock]]],
+        peers: List[WSLotteryConnection],
+    ) -> bool:
+        """
+        Records the outcome of a finished request. Returns False if the range
+        can't be fetched from any of the peers.
+        """
+        block_range = request.block_range
+        stats = self.metrics.peer_stats(request.peer.peer_node_id)
+        blocks: Optional[List[FullBlock]] = None
+        if not task.cancelled():
+            exc = task.exception()
+            if exc is not None:
+                log.warning(
+                    f"Exception fetching {block_range.start} to {block_range.end} "
+                    f"from {request.peer.peer_info.host}: {exc}"
+                )
+            else:
+                blocks = task.result()
+
+        if blocks is not None and not _is_complete_range(blocks, block_range):
+            log.warning(f"peer {request.peer.peer_info.host} sent an incomplete block range, ignoring")
+            blocks = None
+
+        if blocks is not None:
+            duration = time.monotonic() - request.started
+            stats.record_success(len(blocks), duration)
+            if self.peer_scores is not None:
+                self.peer_scores.record_blocks(request.peer.peer_info.host, len(blocks), duration)
+            if block_range.start >= self._emit_height and block_range.start not in self._completed:
+                self._completed[block_range.start] = (request.peer, blocks)
+            return True
+
+        stats.record_failure()
+        if block_range.start < self._emit_height or block_range.start in self._completed:
+            # another peer already delivered this range
+            return True
+        failed = self._failed_peers.setdefault(block_range.start, set())
+        failed.add(request.peer.peer_node_id)
+        if all(peer.peer_node_id in failed for peer in peers if not peer.closed):
+            if not self._is_requested(block_range):
+                log.error(f"failed fetching {block_range.start} to {block_range.end} from peers")
+                return False
+        elif not self._is_requested(block_range) and block_range not in self._retry:
+            self._retry.append(block_range)
+        return True
+
+    def _schedule(self, peers: List[WSLotteryConnection]) -> None:
+        busy: Set[bytes32] = {request.peer.peer_node_id for request in self._in_flight.values()}
+        # give work to the fastest peers first
+        idle = sorted((peer for peer in peers if peer.peer_node_id not in busy), key=self._peer_rank)
+        for peer in idle:
+            block_range = self._next_range(peer)
+            if block_range is None:
+                break
+            self._start_request(peer, block_range)
+
+    def _peer_rank(self, peer: WSLotteryConnection) -> Tuple[float, float]:
+        """
+        Sort key, the fastest peers in this sync first, then the best scored
+        ones from earlier connections.
+        """
+        bps = self.metrics.peer_stats(peer.peer_node_id).blocks_per_second or 0.0
+        score = 0.0 if self.peer_scores is None else self.peer_scores.score(peer.peer_info.host)
+        return -bps, -score
+
+    def _next_range(self, peer: WSLotteryConnection) -> Optional[_BlockRange]:
+        peer_id = peer.peer_node_id
+        for block_range in self._retry:
+            if peer_id not in self._failed_peers.get(block_range.start, set()):
+                self._retry.remove(block_range)
+                return block_range
+
+        if self._next_height <= self.end_height and self._next_height - self._emit_height < self.window:
+            batch_size = self._batch_size(peer)
+            block_range = _BlockRange(
+                uint32(self._next_height), uint32(min(self.end_height, self._next_height + batch_size - 1))
+            )
+            self._next_height = block_range.end + 1
+            return block_range
+
+        return self._straggler(peer)
+
+    def _batch_size(self, peer: WSLotteryConnection) -> int:
+        bps = self.metrics.peer_stats(peer.peer_node_id).blocks_per_second
+        if bps is None:
+            return self.max_batch_size
+        return max(MIN_BATCH_SIZE, min(self.max_batch_size, int(bps * TARGET_REQUEST_SECONDS)))
+
+    def _straggler(self, peer: WSLotteryConnection) -> Optional[_BlockRange]:
+        """
+        Returns the lowest in-flight range that is taking much longer than
+        expected, so it can also be requested from peer.
+        """
+        now = time.monotonic()
+        requests_per_range: Dict[_BlockRange, List[_Request]] = {}
+        for request in self._in_flight.values():
+            requests_per_range.setdefault(request.block_range, []).append(request)
+
+        for block_range in sorted(requests_per_range, key=lambda r: r.start):
+            if block_range.start in self._completed:
+                continue
+            requests = requests_per_range[block_range]
+            if len(requests) >= MAX_REQUESTS_PER_RANGE:
+                continue
+            if any(r.peer.peer_node_id == peer.peer_node_id for r in requests):
+                continue
+            if peer.peer_node_id in self._failed_peers.get(block_range.start, set()):
+                continue
+            request = requests[0]
+            expected = self.metrics.peer_stats(request.peer.peer_node_id).latency or STRAGGLER_MIN_SECONDS
+            if now - request.started > max(STRAGGLER_MIN_SECONDS, STRAGGLER_FACTOR * expected):
+                log.info(
+                    f"re-requesting blocks {block_range.start} to {block_range.end} from {peer.peer_info.host}, "
+                    f"{request.peer.peer_info.host} is slow"
+                )
+                return block_range
+        return None
+
+    def _start_request(self, peer: WSLotteryConnection, block_range: _BlockRange) -> None:
+        task = asyncio.create_task(self.fetch_blocks(peer, block_range.start, block_range.end))
+        self._in_flight[task] = _Request(block_range, peer, time.monotonic())
+
+    def _is_requested(self, block_range: _BlockRange) -> bool:
+        return any(request.block_range == block_range for request in self._in_flight.values())
+
+
+def _is_complete_range(blocks: List[FullBlock], block_range: _BlockRange) -> bool:
+    if len(blocks) != block_range.end - block_range.start + 1:
+        return False
+    return blocks[0].height == block_range.start and blocks[-1].height == block_range.end
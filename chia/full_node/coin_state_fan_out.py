@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import dataclasses
+from typing import Dict, List, Set, Tuple
+
+from chia.full_node.subscriptions import PeerSubscriptions
+from chia.protocols.protocol_message_types import ProtocolMessageTypes
+from chia.server.outbound_message import Message, SerializedMessage
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.types.coin_record import CoinRecord
+from chia.util.ints import uint8, uint32
+
+
+@dataclasses.dataclass
+class CoinStateFanOutMetrics:
+    """
+    The cost of pushing coin state updates to subscribed wallets, for the
+    last peak and in total.
+    """
+
+    last_height: int = 0
+    last_coin_states: int = 0
+    last_peers: int = 0
+    last_bytes: int = 0
+    last_seconds: float = 0.0
+    total_bytes: int = 0
+    total_seconds: float = 0.0
+
+    def record(self, height: int, coin_states: int, peers: int, num_bytes: int, seconds: float) -> None:
+        self.last_height = height
+        self.last_coin_states = coin_states
+        self.last_peers = peers
+        self.last_bytes = num_bytes
+        self.last_seconds = seconds
+        self.total_bytes += num_bytes
+        self.total_seconds += seconds
+
+    def to_json_dict(self) -> Dict[str, float]:
+        return dataclasses.asdict(self)
+
+
+def build_coin_state_updates(
+    subscriptions: PeerSubscriptions,
+    height: uint32,
+    fork_height: uint32,
+    peak_hash: bytes32,
+    coin_records: List[CoinRecord],
+    hints: Dict[bytes32, bytes32],
+) -> Dict[bytes32, SerializedMessage]:
+    """
+    Returns the CoinStateUpdate message for every peer subscribed to any of
+    the coin ids, puzzle hashes or hints of coin_records, in a single pass
+    over the records. Each CoinState is serialized once, and peers that are
+    sent the same set of coin states share the same message.
+    """
+
+    # the serialized CoinState of coin_records[i], for the records any peer
+    # is subscribed to
+    fragments: Dict[int, bytes] = {}
+    items_for_peer: Dict[bytes32, List[int]] = {}
+    # a coin may have several records, e.g. its rolled back state and its
+    # state in the new peak, each distinct state is sent once
+    seen: Set[bytes] = set()
+    for i, coin_record in enumerate(coin_records):
+        coin_id = coin_record.name
+        peer_sets = [
+            subscriptions.peers_for_coin_id(coin_id),
+            subscriptions.peers_for_puzzle_hash(coin_record.coin.puzzle_hash),
+        ]
+        hint = hints.get(coin_id)
+        if hint is not None:
+            peer_sets.append(subscriptions.peers_for_puzzle_hash(hint))
+        if all(len(peers) == 0 for peers in peer_sets):
+            continue
+
+        fragment = bytes(coin_record.coin_state)
+        if fragment in seen:
+            continue
+        seen.add(fragment)
+        fragments[i] = fragment
+
+        for peers in peer_sets:
+            for peer in peers:
+                items = items_for_peer.setdefault(peer, [])
+                # a peer may be subscribed to both the coin and its puzzle hash
+                if len(items) > 0 and items[-1] == i:
+                    continue
+                items.append(i)
+
+    # CoinStateUpdate(height, fork_height, peak_hash, items), serialized by hand
+    # so the coin states can be shared
+    header = bytes(height) + bytes(fork_height) + peak_hash
+    messages: Dict[Tuple[int, ...], SerializedMessage] = {}
+    updates: Dict[bytes32, SerializedMessage] = {}
+    for peer, items in items_for_peer.items():
+        key = tuple(items)
+        message = messages.get(key)
+        if message is None:
+            data = b"".join([header, bytes(uint32(len(items)))] + [fragments[i] for i in items])
+            message = SerializedMessage.create(Message(uint8(ProtocolMessageTypes.coin_state_update.value), None, data))
+            messages[key] = message
+        updates[peer] = message
+    return updates
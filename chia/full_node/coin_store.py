@@ -1,10 +1,11 @@
 from __future__ import annotations
 
 import dataclasses
+import heapq
 import logging
 import sqlite3
 import time
-from typing import Any, Collection, Dict, List, Optional, Set, Tuple
+from typing import Any, AsyncIterator, Collection, Dict, List, Optional, Set, Tuple
 
 import typing_extensions
 from aiosqlite import Cursor
@@ -16,7 +17,8 @@ from chia.types.blockchain_format.sized_bytes import bytes32
 from chia.types.coin_record import CoinRecord
 from chia.types.eligible_coin_spends import UnspentLineageInfo
 from chia.util.batches import to_batches
-from chia.util.db_wrapper import SQLITE_MAX_VARIABLE_NUMBER, DBWrapper2
+from chia.util.bloom_filter import KeyPrefilter
+from chia.util.db_wrapper import SQLITE_MAX_VARIABLE_NUMBER, DBWrapper2, execute_fetchone
 from chia.util.ints import uint32, uint64
 from chia.util.lru_cache import LRUCache
 
@@ -32,12 +34,14 @@ class CoinStore:
 
     db_wrapper: DBWrapper2
     coins_added_at_height_cache: LRUCache[uint32, List[CoinRecord]]
+    # the puzzle hashes in the DB. It's only used once built by rebuild_prefilter()
+    prefilter: KeyPrefilter = dataclasses.field(default_factory=KeyPrefilter)
 
     @classmethod
-    async def create(cls, db_wrapper: DBWrapper2) -> CoinStore:
+    async def create(cls, db_wrapper: DBWrapper2, *, prefilter_false_positive_rate: float = 0.01) -> CoinStore:
         if db_wrapper.db_version != 2:
             raise RuntimeError(f"CoinStore does not support database schema v{db_wrapper.db_version}")
-        self = CoinStore(db_wrapper, LRUCache(100))
+        self = CoinStore(db_wrapper, LRUCache(100), KeyPrefilter(prefilter_false_positive_rate))
 
         async with self.db_wrapper.writer_maybe_transaction() as conn:
             log.info("DB: Creating coin store tables and indexes.")
@@ -62,8 +66,15 @@ class CoinStore:
             log.info("DB: Creating index coin_spent_index")
             await conn.execute("CREATE INDEX IF NOT EXISTS coin_spent_index on coin_record(spent_index)")
 
-            log.info("DB: Creating index coin_puzzle_hash")
-            await conn.execute("CREATE INDEX IF NOT EXISTS coin_puzzle_hash on coin_record(puzzle_hash)")
+            # lets puzzle hash queries filter by height without visiting the
+            # rows, for wallets paging through a long history
+            log.info("DB: Creating index coin_puzzle_hash_heights")
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS coin_puzzle_hash_heights "
+                "on coin_record(puzzle_hash, confirmed_index, spent_index)"
+            )
+            # it serves every lookup the puzzle hash index it replaces did
+            await conn.execute("DROP INDEX IF EXISTS coin_puzzle_hash")
 
             log.info("DB: Creating index coin_parent_index")
             await conn.execute("CREATE INDEX IF NOT EXISTS coin_parent_index on coin_record(coin_parent)")
@@ -237,12 +248,16 @@ class CoinStore:
         start_height: uint32 = uint32(0),
         end_height: uint32 = uint32((2**32) - 1),
     ) -> List[CoinRecord]:
+        if len(self.prefilter.filter_keys([puzzle_hash])) == 0:
+            return []
+
         coins = set()
 
         async with self.db_wrapper.reader_no_transaction() as conn:
             async with conn.execute(
                 f"SELECT confirmed_index, spent_index, coinbase, puzzle_hash, "
-                f"coin_parent, amount, timestamp FROM coin_record INDEXED BY coin_puzzle_hash WHERE puzzle_hash=? "
+                f"coin_parent, amount, timestamp FROM coin_record INDEXED BY coin_puzzle_hash_heights "
+                f"WHERE puzzle_hash=? "
                 f"AND confirmed_index>=? AND confirmed_index<? "
                 f"{'' if include_spent_coins else 'AND spent_index=0'}",
                 (puzzle_hash, start_height, end_height),
@@ -259,6 +274,7 @@ class CoinStore:
         start_height: uint32 = uint32(0),
         end_height: uint32 = uint32((2**32) - 1),
     ) -> List[CoinRecord]:
+        puzzle_hashes = self.prefilter.filter_keys(puzzle_hashes)
         if len(puzzle_hashes) == 0:
             return []
 
@@ -269,7 +285,7 @@ class CoinStore:
         async with self.db_wrapper.reader_no_transaction() as conn:
             async with conn.execute(
                 f"SELECT confirmed_index, spent_index, coinbase, puzzle_hash, "
-                f"coin_parent, amount, timestamp FROM coin_record INDEXED BY coin_puzzle_hash "
+                f"coin_parent, amount, timestamp FROM coin_record INDEXED BY coin_puzzle_hash_heights "
                 f'WHERE puzzle_hash in ({"?," * (len(puzzle_hashes) - 1)}?) '
                 f"AND confirmed_index>=? AND confirmed_index<? "
                 f"{'' if include_spent_coins else 'AND spent_index=0'}",
@@ -325,6 +341,7 @@ class CoinStore:
         *,
         max_items: int = 50000,
     ) -> Set[CoinState]:
+        puzzle_hashes = set(self.prefilter.filter_keys(puzzle_hashes))
         if len(puzzle_hashes) == 0:
             return set()
 
@@ -334,7 +351,7 @@ class CoinStore:
                 puzzle_hashes_db: Tuple[Any, ...] = tuple(batch.entries)
                 async with conn.execute(
                     f"SELECT confirmed_index, spent_index, coinbase, puzzle_hash, "
-                    f"coin_parent, amount, timestamp FROM coin_record INDEXED BY coin_puzzle_hash "
+                    f"coin_parent, amount, timestamp FROM coin_record INDEXED BY coin_puzzle_hash_heights "
                     f'WHERE puzzle_hash in ({"?," * (len(batch.entries) - 1)}?) '
                     f"AND (confirmed_index>=? OR spent_index>=?)"
                     f"{'' if include_spent_coins else 'AND spent_index=0'}"
@@ -438,76 +455,77 @@ class CoinStore:
         if len(puzzle_hashes) == 0:
             return [], None
 
-        # Coin states are keyed by coin id to filter out and prevent duplicates.
-        coin_states_dict: Dict[bytes32, CoinState] = dict()
-        coin_states: List[CoinState]
-
-        async with self.db_wrapper.reader() as conn:
-            puzzle_hashes_db = tuple(puzzle_hashes)
-            puzzle_hash_count = len(puzzle_hashes_db)
-
-            require_spent = "spent_index>0"
-            require_unspent = "spent_index=0"
-            amount_filter = "AND amount>=? " if min_amount > 0 else ""
-
-            if include_spent and include_unspent:
-                height_filter = ""
-            elif include_spent:
-                height_filter = f"AND {require_spent}"
-            elif include_unspent:
-                height_filter = f"AND {require_unspent}"
-            else:
-                # There are no coins which are both spent and unspent, so we're finished.
-                return [], None
-
-            cursor = await conn.execute(
-                f"SELECT confirmed_index, spent_index, coinbase, puzzle_hash, "
-                f"coin_parent, amount, timestamp FROM coin_record INDEXED BY coin_puzzle_hash "
-                f'WHERE puzzle_hash in ({"?," * (puzzle_hash_count - 1)}?) '
-                f"AND (confirmed_index>=? OR spent_index>=?) "
-                f"{height_filter} {amount_filter}"
-                f"ORDER BY MAX(confirmed_index, spent_index) ASC "
-                f"LIMIT ?",
-                (
-                    puzzle_hashes_db
-                    + (min_height, min_height)
-                    + ((min_amount.to_bytes(8, "big"),) if min_amount > 0 else ())
-                    + (max_items + 1,)
-                ),
-            )
+        # The coin ids already returned, the hinted coins may include coins
+        # with a matching puzzle hash.
+        seen: Set[bytes] = set()
+        coin_states: List[CoinState] = []
+
+        require_spent = "spent_index>0"
+        require_unspent = "spent_index=0"
+        amount_filter = "AND amount>=? " if min_amount > 0 else ""
+
+        if include_spent and include_unspent:
+            height_filter = ""
+        elif include_spent:
+            height_filter = f"AND {require_spent}"
+        elif include_unspent:
+            height_filter = f"AND {require_unspent}"
+        else:
+            # There are no coins which are both spent and unspent, so we're finished.
+            return [], None
 
-            for row in await cursor.fetchall():
-                coin_state = self.row_to_coin_state(row)
-                coin_states_dict[coin_state.coin.name()] = coin_state
+        puzzle_hashes_db = tuple(puzzle_hashes)
+        puzzle_hash_count = len(puzzle_hashes_db)
+        params = (
+            puzzle_hashes_db
+            + (min_height, min_height)
+            + ((min_amount.to_bytes(8, "big"),) if min_amount > 0 else ())
+            + (max_items + 1,)
+        )
+        filters = f"AND (confirmed_index>=? OR spent_index>=?) {height_filter} {amount_filter}"
+        columns = (
+            "confirmed_index, spent_index, coinbase, puzzle_hash, coin_parent, amount, timestamp, coin_record.coin_name"
+        )
 
-            if include_hinted:
-                cursor = await conn.execute(
-                    f"SELECT confirmed_index, spent_index, coinbase, puzzle_hash, "
-                    f"coin_parent, amount, timestamp FROM coin_record INDEXED BY sqlite_autoindex_coin_record_1 "
-                    f"WHERE coin_name IN (SELECT coin_id FROM hints "
-                    f'WHERE hint IN ({"?," * (puzzle_hash_count - 1)}?)) '
-                    f"AND (confirmed_index>=? OR spent_index>=?) "
-                    f"{height_filter} {amount_filter}"
-                    f"ORDER BY MAX(confirmed_index, spent_index) ASC "
-                    f"LIMIT ?",
-                    (
-                        puzzle_hashes_db
-                        + (min_height, min_height)
-                        + ((min_amount.to_bytes(8, "big"),) if min_amount > 0 else ())
-                        + (max_items + 1,)
-                    ),
+        async with self.db_wrapper.reader() as conn:
+            cursors: List[Cursor] = []
+            try:
+                cursors.append(
+                    await conn.execute(
+                        f"SELECT {columns} FROM coin_record INDEXED BY coin_puzzle_hash_heights "
+                        f'WHERE puzzle_hash in ({"?," * (puzzle_hash_count - 1)}?) '
+                        f"{filters}"
+                        f"ORDER BY MAX(confirmed_index, spent_index) ASC "
+                        f"LIMIT ?",
+                        params,
+                    )
                 )
+                if include_hinted:
+                    cursors.append(
+                        await conn.execute(
+                            f"SELECT {columns} FROM hints INDEXED BY hint_index "
+                            f"CROSS JOIN coin_record INDEXED BY sqlite_autoindex_coin_record_1 "
+                            f"ON coin_record.coin_name=hints.coin_id "
+                            f'WHERE hints.hint IN ({"?," * (puzzle_hash_count - 1)}?) '
+                            f"{filters}"
+                            f"ORDER BY MAX(confirmed_index, spent_index) ASC "
+                            f"LIMIT ?",
+                            params,
+                        )
+                    )
 
-                for row in await cursor.fetchall():
-                    coin_state = self.row_to_coin_state(row)
-                    coin_states_dict[coin_state.coin.name()] = coin_state
-
-            coin_states = list(coin_states_dict.values())
-
-            if include_hinted:
-                coin_states.sort(key=lambda cr: max(cr.created_height or uint32(0), cr.spent_height or uint32(0)))
-                while len(coin_states) > max_items + 1:
-                    coin_states.pop()
+                # both queries are sorted by height, merging them only reads
+                # as many rows as the page needs
+                async for row in _merge_by_height([_stream_rows(cursor) for cursor in cursors]):
+                    if row[7] in seen:
+                        continue
+                    seen.add(row[7])
+                    coin_states.append(self.row_to_coin_state(row))
+                    if len(coin_states) > max_items:
+                        break
+            finally:
+                for cursor in cursors:
+                    await cursor.close()
 
         # If there aren't too many coin states, we've finished syncing these hashes.
         # There is no next height to start from, so return `None`.
@@ -590,6 +608,7 @@ class CoinStore:
                     "INSERT INTO coin_record VALUES(?, ?, ?, ?, ?, ?, ?, ?)",
                     values2,
                 )
+                self.prefilter.add([record.coin.puzzle_hash for record in records])
 
     # Update coin_record to be spent in DB
     async def _set_spent(self, coin_names: List[bytes32], index: uint32) -> None:
@@ -624,7 +643,7 @@ class CoinStore:
                 "unspent.coin_parent, "
                 "parent.amount, "
                 "parent.coin_parent "
-                "FROM coin_record AS unspent INDEXED BY coin_puzzle_hash "
+                "FROM coin_record AS unspent INDEXED BY coin_puzzle_hash_heights "
                 "LEFT JOIN coin_record AS parent ON unspent.coin_parent = parent.coin_name "
                 "WHERE unspent.spent_index = 0 "
                 "AND parent.spent_index > 0 "
@@ -658,7 +677,8 @@ class CoinStore:
             limit_where = f" LIMIT {limit}" if limit is not None and limit > 0 else ''
             async with conn.execute(
                 f"SELECT confirmed_index, spent_index, coinbase, puzzle_hash, "
-                f"coin_parent, amount, timestamp FROM coin_record INDEXED BY coin_puzzle_hash WHERE puzzle_hash=? "
+                f"coin_parent, amount, timestamp FROM coin_record INDEXED BY coin_puzzle_hash_heights "
+                f"WHERE puzzle_hash=? "
                 f"AND confirmed_index>=? AND confirmed_index<?"
                 f"{'' if include_spent_coins else ' AND spent_index=0'}{limit_where}",
                 (puzzle_hash, start_height, end_height),
@@ -667,3 +687,57 @@ class CoinStore:
                     coin = self.row_to_coin(row)
                     coins.add(CoinRecord(coin, row[0], row[1], row[2], row[6]))
                 return list(coins)
+
+    async def rebuild_prefilter(self) -> None:
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            row = await execute_fetchone(conn, "SELECT MAX(rowid) FROM coin_record")
+        num_coins = 0 if row is None or row[0] is None else int(row[0])
+        await self.prefilter.rebuild(num_coins, self._all_puzzle_hashes())
+
+    async def _all_puzzle_hashes(self) -> AsyncIterator[bytes]:
+        # Coins written by a transaction that's still in progress may have been
+        # added to the prefilter before the rebuild started, but aren't visible
+        # to readers yet. Wait for it to finish.
+        async with self.db_wrapper.writer_maybe_transaction():
+            pass
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            sql = "SELECT DISTINCT puzzle_hash FROM coin_record INDEXED BY coin_puzzle_hash_heights"
+            async with conn.execute(sql) as cursor:
+                async for row in _stream_rows(cursor):
+                    yield row[0]
+
+
+# rows are read from the cursors this many at a time
+FETCH_CHUNK_SIZE = 1000
+
+
+async def _stream_rows(cursor: Cursor) -> AsyncIterator[sqlite3.Row]:
+    while True:
+        rows = await cursor.fetchmany(FETCH_CHUNK_SIZE)
+        if len(rows) == 0:
+            return
+        for row in rows:
+            yield row
+
+
+async def _merge_by_height(streams: List[AsyncIterator[sqlite3.Row]]) -> AsyncIterator[sqlite3.Row]:
+    """
+    Merges coin record rows, each stream sorted by MAX(confirmed_index, spent_index),
+    into a single sorted stream.
+    """
+    heap: List[Tuple[int, int, sqlite3.Row]] = []
+
+    async def advance(index: int) -> None:
+        try:
+            row = await streams[index].__anext__()
+        except StopAsyncIteration:
+            return
+        heapq.heappush(heap, (max(row[0], row[1]), index, row))
+
+    for index in range(len(streams)):
+        await advance(index)
+
+    while len(heap) > 0:
+        _, index, row = heapq.heappop(heap)
+        yield row
+        await advance(index)
@@ -29,6 +29,7 @@ from typing import (
     final,
 )
 
+import aiofiles
 from chia_rs import AugSchemeMPL, BLSCache
 from packaging.version import Version
 
@@ -43,14 +44,17 @@ from chia.consensus.difficulty_adjustment import get_next_sub_slot_iters_and_dif
 from chia.consensus.make_sub_epoch_summary import next_sub_epoch_summary
 from chia.consensus.multiprocess_validation import PreValidationResult
 from chia.consensus.pot_iterations import calculate_sp_iters
+from chia.full_node.block_download_scheduler import BlockDownloadScheduler, SyncMetrics
 from chia.full_node.block_store import BlockStore
+from chia.full_node.coin_state_fan_out import CoinStateFanOutMetrics, build_coin_state_updates
 from chia.full_node.coin_store import CoinStore
 from chia.full_node.full_node_api import FullNodeAPI
 from chia.full_node.full_node_store import FullNodeStore, FullNodeStorePeakResult, UnfinishedBlockEntry
 from chia.full_node.hint_management import get_hints_and_subscription_coin_ids
 from chia.full_node.hint_store import HintStore
 from chia.full_node.mempool import MempoolRemoveInfo
-from chia.full_node.mempool_manager import MempoolManager, NewPeakItem
+from chia.full_node.mempool_manager import MempoolManager, MempoolSnapshot, NewPeakItem
+from chia.full_node.peak_snapshot import PeakSnapshot, complete_peak_snapshot, create_peak_snapshot
 from chia.full_node.signage_point import SignagePoint
 from chia.full_node.stake_store import StakeStore
 from chia.full_node.subscriptions import PeerSubscriptions, peers_for_spend_bundle
@@ -62,7 +66,7 @@ from chia.protocols.farmer_protocol import SignagePointSourceData, SPSubSlotSour
 from chia.protocols.full_node_protocol import RequestBlocks, RespondBlock, RespondBlocks, RespondSignagePoint
 from chia.protocols.protocol_message_types import ProtocolMessageTypes
 from chia.protocols.shared_protocol import Capability
-from chia.protocols.wallet_protocol import CoinState, CoinStateUpdate, RemovedMempoolItem
+from chia.protocols.wallet_protocol import RemovedMempoolItem
 from chia.rpc.rpc_server import StateChangedProtocol
 from chia.server.node_discovery import FullNodePeers
 from chia.server.outbound_message import Message, NodeType, make_msg
@@ -91,8 +95,9 @@ from chia.util.condition_tools import pkm_pairs
 from chia.util.config import process_config_start_method
 from chia.util.db_synchronous import db_synchronous_on
 from chia.util.db_version import lookup_db_version, set_db_version_async
-from chia.util.db_wrapper import DBWrapper2, manage_connection
+from chia.util.db_wrapper import DBWrapper2, ReaderClass, manage_connection
 from chia.util.errors import ConsensusError, Err, TimestampError, ValidationError
+from chia.util.files import write_file_async
 from chia.util.ints import uint8, uint32, uint64, uint128
 from chia.util.limited_semaphore import LimitedSemaphore
 from chia.util.log_exceptions import log_exceptions
@@ -144,6 +149,7 @@ class FullNode:
     full_node_peers: Optional[FullNodePeers] = None
     sync_store: SyncStore = dataclasses.field(default_factory=SyncStore)
     uncompact_task: Optional[asyncio.Task[None]] = None
+    _prefilter_task: Optional[asyncio.Task[None]] = None
     compact_vdf_requests: Set[bytes32] = dataclasses.field(default_factory=set)
     # TODO: Logging isn't setup yet so the log entries related to parsing the
     #       config would end up on stdout if handled here.
@@ -171,6 +177,13 @@ class FullNode:
     bad_peak_cache: Dict[bytes32, uint32] = dataclasses.field(default_factory=dict)
     wallet_sync_task: Optional[asyncio.Task[None]] = None
     _bls_cache: BLSCache = dataclasses.field(default_factory=lambda: BLSCache(50000))
+    sync_metrics: SyncMetrics = dataclasses.field(default_factory=SyncMetrics)
+    coin_state_fan_out_metrics: CoinStateFanOutMetrics = dataclasses.field(default_factory=CoinStateFanOutMetrics)
+    # replaced (never modified) on every new peak, for RPCs to read without the blockchain lock
+    peak_snapshot: Optional[PeakSnapshot] = None
+    # fills in the DB figures of peak_snapshot, off the blockchain lock
+    _peak_snapshot_task: Optional[asyncio.Task[None]] = None
+    _peak_snapshot_pending: bool = False
 
     @property
     def server(self) -> LotteryServer:
@@ -241,6 +254,12 @@ class FullNode:
             reader_count=self.config.get("db_readers", 4),
             log_path=sql_log_path,
             synchronous=db_sync,
+            reader_pools={
+                ReaderClass.PEER: self.config.get("db_readers_peer", 2),
+                ReaderClass.RPC: self.config.get("db_readers_rpc", 2),
+            },
+            query_stats=self.config.get("db_query_stats", True),
+            slow_query_seconds=self.config.get("db_slow_query_seconds", 1.0),
         ) as self._db_wrapper:
             if self.db_wrapper.db_version != 2:
                 async with self.db_wrapper.reader_no_transaction() as conn:
@@ -260,8 +279,13 @@ class FullNode:
                                 pass
 
             self._block_store = await BlockStore.create(self.db_wrapper)
-            self._hint_store = await HintStore.create(self.db_wrapper)
-            self._coin_store = await CoinStore.create(self.db_wrapper)
+            prefilter_false_positive_rate = self.config.get("lookup_prefilter_false_positive_rate", 0.01)
+            self._hint_store = await HintStore.create(
+                self.db_wrapper, prefilter_false_positive_rate=prefilter_false_positive_rate
+            )
+            self._coin_store = await CoinStore.create(
+                self.db_wrapper, prefilter_false_positive_rate=prefilter_false_positive_rate
+            )
             self._stake_store = await StakeStore.create(self.db_wrapper)
             self.log.info("Initializing blockchain from disk")
             start_time = time.monotonic()
@@ -326,6 +350,7 @@ class FullNode:
                 async with self.blockchain.priority_mutex.acquire(priority=BlockchainMutexPriority.high):
                     pending_tx = await self.mempool_manager.new_peak(self.blockchain.get_tx_peak(), None)
                 assert len(pending_tx.items) == 0  # no pending transactions when starting up
+                await self.load_mempool_snapshot()
 
                 full_peak: Optional[FullBlock] = await self.blockchain.get_full_peak()
                 assert full_peak is not None
@@ -348,6 +373,10 @@ class FullNode:
                 )
             if self.wallet_sync_task is None or self.wallet_sync_task.done():
                 self.wallet_sync_task = asyncio.create_task(self._wallets_sync_task_handler())
+            if self.config.get("lookup_prefilter", True):
+                self._prefilter_task = asyncio.create_task(
+                    self._maintain_lookup_prefilters(self.config.get("lookup_prefilter_rebuild_interval", 86400))
+                )
 
             self.initialized = True
             if self.full_node_peers is not None:
@@ -364,12 +393,17 @@ class FullNode:
                     self.blockchain.shut_down()
                 # same for mempool_manager
                 if self._mempool_manager is not None:
+                    await self.save_mempool_snapshot()
                     self.mempool_manager.shut_down()
 
                 if self.full_node_peers is not None:
                     asyncio.create_task(self.full_node_peers.close())
                 if self.uncompact_task is not None:
                     self.uncompact_task.cancel()
+                if self._prefilter_task is not None:
+                    self._prefilter_task.cancel()
+                if self._peak_snapshot_task is not None:
+                    self._peak_snapshot_task.cancel()
                 if self._transaction_queue_task is not None:
                     self._transaction_queue_task.cancel()
                 cancel_task_safe(task=self.wallet_sync_task, log=self.log)
@@ -383,6 +417,45 @@ class FullNode:
                     with contextlib.suppress(asyncio.CancelledError):
                         await self._sync_task
 
+    def mempool_snapshot_path(self) -> Optional[Path]:
+        if not self.config.get("persist_mempool", True):
+            return None
+        path_str: str = self.config.get("mempool_snapshot_path", "db/mempool_CHALLENGE.dat")
+        return path_from_root(self.root_path, path_str.replace("CHALLENGE", self.config["selected_network"]))
+
+    async def save_mempool_snapshot(self) -> None:
+        path = self.mempool_snapshot_path()
+        if path is None:
+            return
+        try:
+            snapshot = self.mempool_manager.create_snapshot()
+            if snapshot is None or len(snapshot.items) == 0:
+                return
+            await write_file_async(path, bytes(snapshot))
+            self.log.info(f"Saved {len(snapshot.items)} mempool items to {path}")
+        except Exception as e:
+            self.log.error(f"Failed to save mempool snapshot: {e} {traceback.format_exc()}")
+
+    async def load_mempool_snapshot(self) -> None:
+        path = self.mempool_snapshot_path()
+        if path is None or not path.exists():
+            return
+        try:
+            start_time = time.monotonic()
+            async with aiofiles.open(path, "rb") as f:
+                snapshot = MempoolSnapshot.from_bytes(await f.read())
+            async with self.blockchain.priority_mutex.acquire(priority=BlockchainMutexPriority.high):
+                added = await self.mempool_manager.load_snapshot(snapshot)
+            self.log.info(
+                f"Loaded {added} of {len(snapshot.items)} mempool items from {path} "
+                f"(saved at height {snapshot.peak_height}) in {time.monotonic() - start_time:0.2f}s"
+            )
+        except Exception as e:
+            self.log.error(f"Failed to load mempool snapshot: {e} {traceback.format_exc()}")
+        finally:
+            # the snapshot is only valid for a single restart
+            path.unlink(missing_ok=True)
+
     @property
     def block_store(self) -> BlockStore:
         assert self._block_store is not None
@@ -1071,40 +1144,36 @@ class FullNode:
         # block between the main chain and the fork. Here "fork_point_height"
         # seems to refer to the first diverging block
 
-        async def fetch_block_batches(
-            batch_queue: asyncio.Queue[Optional[Tuple[WSLotteryConnection, List[FullBlock]]]]
-        ) -> None:
-            start_height, end_height = 0, 0
-            new_peers_with_peak: List[WSLotteryConnection] = peers_with_peak[:]
-            try:
-                # block request ranges are *inclusive*, this requires some
-                # gymnastics of this range (+1 to make it exclusive, like normal
-                # ranges) and then -1 when forming the request message
-                for start_height in range(fork_point_height, target_peak_sb_height + 1, batch_size):
-                    end_height = min(target_peak_sb_height, start_height + batch_size - 1)
-                    request = RequestBlocks(uint32(start_height), uint32(end_height), True)
-                    fetched = False
-                    for peer in random.sample(new_peers_with_peak, len(new_peers_with_peak)):
-                        if peer.closed:
-                            continue
-                        response = await peer.call_api(FullNodeAPI.request_blocks, request, timeout=30)
-                        if response is None:
-                            await peer.close()
-                        elif isinstance(response, RespondBlocks):
-                            await batch_queue.put((peer, response.blocks))
-                            fetched = True
-                            break
-                    if fetched is False:
-                        self.log.error(f"failed fetching {start_height} to {end_height} from peers")
-                        return
-                    if self.sync_store.peers_changed.is_set():
-                        new_peers_with_peak = self.get_peers_with_peak(peak_hash)
-                        self.sync_store.peers_changed.clear()
-            except Exception as e:
-                self.log.error(f"Exception fetching {start_height} to {end_height} from peer {e}")
-            finally:
-                # finished signal with None
-                await batch_queue.put(None)
+        def get_sync_peers() -> List[WSLotteryConnection]:
+            nonlocal peers_with_peak
+            if self.sync_store.peers_changed.is_set():
+                peers_with_peak = self.get_peers_with_peak(peak_hash)
+                self.sync_store.peers_changed.clear()
+            return peers_with_peak
+
+        async def fetch_blocks(
+            peer: WSLotteryConnection, start_height: uint32, end_height: uint32
+        ) -> Optional[List[FullBlock]]:
+            # block request ranges are *inclusive*
+            request = RequestBlocks(start_height, end_height, True)
+            response = await peer.call_api(FullNodeAPI.request_blocks, request, timeout=30)
+            if response is None:
+                await peer.close()
+                return None
+            if isinstance(response, RespondBlocks):
+                return response.blocks
+            return None
+
+        self.sync_metrics.reset()
+        scheduler = BlockDownloadScheduler(
+            start_height=fork_point_height,
+            end_height=target_peak_sb_height,
+            max_batch_size=batch_size,
+            get_peers=get_sync_peers,
+            fetch_blocks=fetch_blocks,
+            metrics=self.sync_metrics,
+            peer_scores=self.server.peer_scores,
+        )
 
         async def validate_block_batches(
             inner_batch_queue: asyncio.Queue[Optional[Tuple[WSLotteryConnection, List[FullBlock]]]]
@@ -1152,7 +1221,9 @@ class FullNode:
                     await peer.close(600)
                     raise ValueError(f"Failed to validate block batch {start_height} to {end_height}")
                 self.log.info(f"Added blocks {start_height} to {end_height}")
+                self.sync_metrics.validate.add(len(blocks))
                 peak = self.blockchain.get_peak()
+                self.refresh_peak_snapshot(peak)
                 if state_change_summary is not None:
                     assert peak is not None
                     # Hints must be added to the DB. The other post-processing tasks are not required when syncing
@@ -1172,7 +1243,7 @@ class FullNode:
         batch_queue_input: asyncio.Queue[Optional[Tuple[WSLotteryConnection, List[FullBlock]]]] = asyncio.Queue(
             maxsize=buffer_size
         )
-        fetch_task = asyncio.Task(fetch_block_batches(batch_queue_input))
+        fetch_task = asyncio.Task(scheduler.run(batch_queue_input))
         validate_task = asyncio.Task(validate_block_batches(batch_queue_input))
         try:
             with log_exceptions(log=self.log, message="sync from fork point failed"):
@@ -1181,6 +1252,38 @@ class FullNode:
             assert validate_task.done()
             fetch_task.cancel()  # no need to cancel validate_task, if we end up here validate_task is already done
 
+    def refresh_peak_snapshot(self, peak: Optional[BlockRecord]) -> None:
+        """
+        Publishes the snapshot of a new peak, and fills in its DB figures in
+        the background. Snapshots published meanwhile are completed by the
+        same task, for the latest peak only.
+        """
+        self.peak_snapshot = create_peak_snapshot(self.blockchain, peak, self.peak_snapshot)
+        self._peak_snapshot_pending = True
+        if self._peak_snapshot_task is None or self._peak_snapshot_task.done():
+            self._peak_snapshot_task = asyncio.create_task(self._complete_peak_snapshots())
+
+    async def _complete_peak_snapshots(self) -> None:
+        while self._peak_snapshot_pending and not self._shut_down:
+            self._peak_snapshot_pending = False
+            snapshot = self.peak_snapshot
+            assert snapshot is not None
+            try:
+                completed = await complete_peak_snapshot(self.blockchain, snapshot)
+            except Exception:
+                self.log.exception("Failed to compute the peak snapshot")
+                continue
+            current = self.peak_snapshot
+            assert current is not None
+            # a newer snapshot keeps these figures until it's completed in turn
+            self.peak_snapshot = dataclasses.replace(
+                current,
+                space=completed.space,
+                average_block_time=completed.average_block_time,
+                stake_lock=completed.stake_lock,
+                stake_lock_calc=completed.stake_lock_calc,
+            )
+
     def get_peers_with_peak(self, peak_hash: bytes32) -> List[WSLotteryConnection]:
         peer_ids: Set[bytes32] = self.sync_store.get_peers_that_have_peak([peak_hash])
         if len(peer_ids) == 0:
@@ -1188,6 +1291,33 @@ class FullNode:
             return []
         return [c for c in self.server.all_connections.values() if c.peer_node_id in peer_ids]
 
+    async def _maintain_lookup_prefilters(self, rebuild_interval: float) -> None:
+        """
+        Builds the hint and puzzle hash prefilters, which let lookups of
+        unknown hints and puzzle hashes skip the DB. They are rebuilt when
+        they fill up, and every rebuild_interval seconds to drop the keys of
+        coins removed by reorgs.
+        """
+        stores: Dict[str, Union[HintStore, CoinStore]] = {"hint": self.hint_store, "puzzle hash": self.coin_store}
+        last_rebuild: Dict[str, float] = {}
+        while not self._shut_down:
+            for name, store in stores.items():
+                since_rebuild = time.monotonic() - last_rebuild.get(name, 0.0)
+                if not store.prefilter.needs_rebuild() and since_rebuild < rebuild_interval:
+                    continue
+                start = time.monotonic()
+                try:
+                    await store.rebuild_prefilter()
+                except Exception:
+                    self.log.exception(f"Failed to build {name} prefilter")
+                    continue
+                last_rebuild[name] = time.monotonic()
+                self.log.info(
+                    f"Built {name} prefilter with {store.prefilter.to_json_dict()['keys']} keys "
+                    f"in {last_rebuild[name] - start:0.2f}s"
+                )
+            await asyncio.sleep(60)
+
     async def _wallets_sync_task_handler(self) -> None:
         while not self._shut_down:
             try:
@@ -1201,27 +1331,27 @@ class FullNode:
         self.log.debug(
             f"update_wallets - fork_height: {wallet_update.fork_height}, peak_height: {wallet_update.peak.height}"
         )
-        changes_for_peer: Dict[bytes32, Set[CoinState]] = {}
-        for coin_record in wallet_update.coin_records:
-            coin_id = coin_record.name
-            subscribed_peers = self.subscriptions.peers_for_coin_id(coin_id)
-            subscribed_peers.update(self.subscriptions.peers_for_puzzle_hash(coin_record.coin.puzzle_hash))
-            hint = wallet_update.hints.get(coin_id)
-            if hint is not None:
-                subscribed_peers.update(self.subscriptions.peers_for_puzzle_hash(hint))
-            for peer in subscribed_peers:
-                changes_for_peer.setdefault(peer, set()).add(coin_record.coin_state)
-
-        for peer, changes in changes_for_peer.items():
+        start = time.monotonic()
+        updates = build_coin_state_updates(
+            self.subscriptions,
+            wallet_update.peak.height,
+            wallet_update.fork_height,
+            wallet_update.peak.header_hash,
+            wallet_update.coin_records,
+            wallet_update.hints,
+        )
+        num_bytes = 0
+        for peer, message in updates.items():
             connection = self.server.all_connections.get(peer)
-            if connection is not None:
-                state = CoinStateUpdate(
-                    wallet_update.peak.height,
-                    wallet_update.fork_height,
-                    wallet_update.peak.header_hash,
-                    list(changes),
-                )
-                await connection.send_message(make_msg(ProtocolMessageTypes.coin_state_update, state))
+            if connection is not None and await connection.send_serialized_message(message):
+                num_bytes += len(message.data)
+        self.coin_state_fan_out_metrics.record(
+            wallet_update.peak.height,
+            len(wallet_update.coin_records),
+            len(updates),
+            num_bytes,
+            time.monotonic() - start,
+        )
 
         # Tell wallets about the new peak
         new_peak_message = make_msg(
@@ -1551,6 +1681,8 @@ class FullNode:
         spent_coins: List[bytes32] = [coin_id for coin_id, _ in state_change_summary.removals]
         mempool_new_peak_result = await self.mempool_manager.new_peak(self.blockchain.get_tx_peak(), spent_coins)
 
+        self.refresh_peak_snapshot(record)
+
         return PeakPostProcessingResult(
             mempool_new_peak_result.items,
             mempool_new_peak_result.removals,
@@ -273,6 +273,10 @@ class FullNodeAPI:
         if not self.full_node.blockchain.contains_block(request.tip):
             self.log.error(f"got weight proof request for unknown peak {request.tip}")
             return None
+        # Serialization of wp is slow, serve the cached message if we have one
+        message = self.full_node.full_node_store.serialized_wp_messages.get(request.tip)
+        if message is not None:
+            return message
         if request.tip in self.full_node.pow_creation:
             event = self.full_node.pow_creation[request.tip]
             await event.wait()
@@ -293,17 +297,13 @@ class FullNodeAPI:
             self.log.error(f"failed creating weight proof for peak {request.tip}")
             return None
 
-        # Serialization of wp is slow
-        if (
-            self.full_node.full_node_store.serialized_wp_message_tip is not None
-            and self.full_node.full_node_store.serialized_wp_message_tip == request.tip
-        ):
-            return self.full_node.full_node_store.serialized_wp_message
+        message = self.full_node.full_node_store.serialized_wp_messages.get(request.tip)
+        if message is not None:
+            return message
         message = make_msg(
             ProtocolMessageTypes.respond_proof_of_weight, full_node_protocol.RespondProofOfWeight(wp, request.tip)
         )
-        self.full_node.full_node_store.serialized_wp_message_tip = request.tip
-        self.full_node.full_node_store.serialized_wp_message = message
+        self.full_node.full_node_store.serialized_wp_messages.put(request.tip, message)
         return message
 
     @api_request()
@@ -137,8 +137,8 @@ class FullNodeStore:
     pending_tx_request: Dict[bytes32, bytes32]  # tx_id: peer_id
     peers_with_tx: Dict[bytes32, Set[bytes32]]  # tx_id: Set[peer_ids}
     tx_fetch_tasks: Dict[bytes32, asyncio.Task[None]]  # Task id: task
-    serialized_wp_message: Optional[Message]
-    serialized_wp_message_tip: Optional[bytes32]
+    # serialized RespondProofOfWeight messages, by tip
+    serialized_wp_messages: LRUCache[bytes32, Message]
 
     max_seen_unfinished_blocks: int
 
@@ -160,8 +160,7 @@ class FullNodeStore:
         self.pending_tx_request = {}
         self.peers_with_tx = {}
         self.tx_fetch_tasks = {}
-        self.serialized_wp_message = None
-        self.serialized_wp_message_tip = None
+        self.serialized_wp_messages = LRUCache(4)
         self.max_seen_unfinished_blocks = 1000
 
     def is_requesting_unfinished_block(
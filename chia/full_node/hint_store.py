@@ -2,13 +2,14 @@ from __future__ import annotations
 
 import dataclasses
 import logging
-from typing import List, Set, Tuple
+from typing import AsyncIterator, List, Set, Tuple
 
 import typing_extensions
 
 from chia.types.blockchain_format.sized_bytes import bytes32
 from chia.util.batches import to_batches
-from chia.util.db_wrapper import SQLITE_MAX_VARIABLE_NUMBER, DBWrapper2
+from chia.util.bloom_filter import KeyPrefilter
+from chia.util.db_wrapper import SQLITE_MAX_VARIABLE_NUMBER, DBWrapper2, execute_fetchone
 
 log = logging.getLogger(__name__)
 
@@ -17,13 +18,15 @@ log = logging.getLogger(__name__)
 @dataclasses.dataclass
 class HintStore:
     db_wrapper: DBWrapper2
+    # the hints in the DB. It's only used once built by rebuild_prefilter()
+    prefilter: KeyPrefilter = dataclasses.field(default_factory=KeyPrefilter)
 
     @classmethod
-    async def create(cls, db_wrapper: DBWrapper2) -> HintStore:
+    async def create(cls, db_wrapper: DBWrapper2, *, prefilter_false_positive_rate: float = 0.01) -> HintStore:
         if db_wrapper.db_version != 2:
             raise RuntimeError(f"HintStore does not support database schema v{db_wrapper.db_version}")
 
-        self = HintStore(db_wrapper)
+        self = HintStore(db_wrapper, KeyPrefilter(prefilter_false_positive_rate))
 
         async with self.db_wrapper.writer_maybe_transaction() as conn:
             log.info("DB: Creating hint store tables and indexes.")
@@ -33,27 +36,39 @@ class HintStore:
         return self
 
     async def get_coin_ids(self, hint: bytes, *, max_items: int = 50000) -> List[bytes32]:
+        if len(self.prefilter.filter_keys([hint])) == 0:
+            return []
         async with self.db_wrapper.reader_no_transaction() as conn:
             cursor = await conn.execute("SELECT coin_id from hints WHERE hint=? LIMIT ?", (hint, max_items))
             rows = await cursor.fetchall()
             await cursor.close()
+        if len(rows) == 0:
+            self.prefilter.record_false_positives(1)
         return [bytes32(row[0]) for row in rows]
 
     async def get_coin_ids_multi(self, hints: Set[bytes], *, max_items: int = 50000) -> List[bytes32]:
         coin_ids: List[bytes32] = []
+        hints_to_query = self.prefilter.filter_keys(hints)
+        if len(hints_to_query) == 0:
+            return coin_ids
+        found_hints: Set[bytes] = set()
 
         async with self.db_wrapper.reader_no_transaction() as conn:
-            for batch in to_batches(hints, SQLITE_MAX_VARIABLE_NUMBER):
+            for batch in to_batches(hints_to_query, SQLITE_MAX_VARIABLE_NUMBER):
                 hints_db: Tuple[bytes, ...] = tuple(batch.entries)
                 cursor = await conn.execute(
-                    f"SELECT coin_id from hints INDEXED BY hint_index "
+                    f"SELECT coin_id, hint from hints INDEXED BY hint_index "
                     f'WHERE hint IN ({"?," * (len(batch.entries) - 1)}?) LIMIT ?',
                     hints_db + (max_items,),
                 )
                 rows = await cursor.fetchall()
                 coin_ids.extend([bytes32(row[0]) for row in rows])
+                found_hints.update(row[1] for row in rows)
                 await cursor.close()
 
+        # if the results were truncated, we can't tell which hints are missing
+        if len(coin_ids) < max_items:
+            self.prefilter.record_false_positives(len(hints_to_query) - len(found_hints))
         return coin_ids
 
     async def get_hints(self, coin_ids: List[bytes32]) -> List[bytes32]:
@@ -82,6 +97,7 @@ class HintStore:
                 coin_hint_list,
             )
             await cursor.close()
+            self.prefilter.add([hint for _, hint in coin_hint_list])
 
     async def count_hints(self) -> int:
         async with self.db_wrapper.reader_no_transaction() as conn:
@@ -92,3 +108,20 @@ class HintStore:
 
         [count] = row
         return int(count)
+
+    async def rebuild_prefilter(self) -> None:
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            row = await execute_fetchone(conn, "SELECT MAX(rowid) FROM hints")
+        num_hints = 0 if row is None or row[0] is None else int(row[0])
+        await self.prefilter.rebuild(num_hints, self._all_hints())
+
+    async def _all_hints(self) -> AsyncIterator[bytes]:
+        # Hints written by a transaction that's still in progress may have been
+        # added to the prefilter before the rebuild started, but aren't visible
+        # to readers yet. Wait for it to finish.
+        async with self.db_wrapper.writer_maybe_transaction():
+            pass
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            async with conn.execute("SELECT DISTINCT hint FROM hints INDEXED BY hint_index") as cursor:
+                async for row in cursor:
+                    yield row[0]
@@ -7,7 +7,7 @@ from concurrent.futures import Executor
 from concurrent.futures.process import ProcessPoolExecutor
 from dataclasses import dataclass
 from multiprocessing.context import BaseContext
-from typing import Awaitable, Callable, Collection, Dict, List, Optional, Set, Tuple, TypeVar
+from typing import Awaitable, Callable, Collection, Dict, Iterable, List, Optional, Set, Tuple, TypeVar
 
 from chia_rs import ELIGIBLE_FOR_DEDUP, ELIGIBLE_FOR_FF, BLSCache, G1Element, supports_fast_forward
 from chiabip158 import PyBIP158
@@ -38,6 +38,7 @@ from chia.util.errors import Err, ValidationError
 from chia.util.inline_executor import InlineExecutor
 from chia.util.ints import uint32, uint64
 from chia.util.setproctitle import getproctitle, setproctitle
+from chia.util.streamable import Streamable, streamable
 
 log = logging.getLogger(__name__)
 
@@ -166,6 +167,29 @@ class NewPeakItem:
     conds: SpendBundleConditions
 
 
+@streamable
+@dataclass(frozen=True)
+class MempoolSnapshotItem(Streamable):
+    spend_bundle: SpendBundle
+    spend_bundle_name: bytes32
+    conds: SpendBundleConditions
+    height_added_to_mempool: uint32
+
+
+@streamable
+@dataclass(frozen=True)
+class MempoolSnapshot(Streamable):
+    """
+    The mempool items (with their already validated conditions) as they were
+    at the time of shutdown. Loading this back avoids re-running CLVM and
+    signature validation for every transaction after a restart.
+    """
+
+    peak_hash: bytes32
+    peak_height: uint32
+    items: List[MempoolSnapshotItem]
+
+
 class MempoolManager:
     pool: Executor
     constants: ConsensusConstants
@@ -240,6 +264,74 @@ class MempoolManager:
     def shut_down(self) -> None:
         self.pool.shutdown(wait=True)
 
+    def create_snapshot(self) -> Optional[MempoolSnapshot]:
+        """
+        Returns the current mempool items in a form that can be persisted and
+        loaded back with load_snapshot(). Returns None if the mempool has not
+        been initialized with a peak yet.
+        """
+        if self.peak is None:
+            return None
+        items = [
+            MempoolSnapshotItem(item.spend_bundle, item.spend_bundle_name, item.conds, item.height_added_to_mempool)
+            for item in self.mempool.items_by_feerate()
+        ]
+        return MempoolSnapshot(self.peak.header_hash, self.peak.height, items)
+
+    async def load_snapshot(self, snapshot: MempoolSnapshot) -> int:
+        """
+        Re-adds the items of a snapshot created by create_snapshot() to the
+        mempool. The spend bundles were validated (CLVM and signatures) when
+        they first entered the mempool, so only the checks against the
+        current peak's coin set are performed. All spent coins are looked up
+        in a single query. Returns the number of items added.
+        """
+        if self.peak is None:
+            return 0
+        local_get_coin_records = await self._batch_get_coin_records(item.spend_bundle for item in snapshot.items)
+        added = 0
+        for item in snapshot.items:
+            if self.seen(item.spend_bundle_name):
+                continue
+            info = await self.add_spend_bundle(
+                item.spend_bundle,
+                item.conds,
+                item.spend_bundle_name,
+                item.height_added_to_mempool,
+                local_get_coin_records,
+            )
+            if info.status == MempoolInclusionStatus.SUCCESS:
+                self.add_and_maybe_pop_seen(item.spend_bundle_name)
+                added += 1
+        return added
+
+    async def _batch_get_coin_records(
+        self, spend_bundles: Iterable[SpendBundle]
+    ) -> Callable[[Collection[bytes32]], Awaitable[List[CoinRecord]]]:
+        """
+        Looks up the coin records of all coins spent by spend_bundles in a
+        single query, and returns a get_coin_records function answering from
+        that result.
+        """
+        removals: Set[bytes32] = set()
+        for bundle in spend_bundles:
+            for s in bundle.coin_spends:
+                removals.add(s.coin.name())
+
+        coin_records: Dict[bytes32, CoinRecord] = {}
+        for record in await self.get_coin_records(removals):
+            coin_records[record.coin.name()] = record
+
+        async def local_get_coin_records(names: Collection[bytes32]) -> List[CoinRecord]:
+            ret: List[CoinRecord] = []
+            for name in names:
+                r = coin_records.get(name)
+                if r is not None:
+                    ret.append(r)
+            return ret
+
+        return local_get_coin_records
+
     async def create_bundle_from_mempool(
         self,
         last_tb_header_hash: bytes32,
@@ -728,24 +820,9 @@ class MempoolManager:
 
             # in order to make this a bit quicker, we look-up all the spends in
             # a single query, rather than one at a time.
-            coin_records: Dict[bytes32, CoinRecord] = {}
-
-            removals: Set[bytes32] = set()
-            for item in old_pool.all_items():
-                for s in item.spend_bundle.coin_spends:
-                    removals.add(s.coin.name())
-
-            for record in await self.get_coin_records(removals):
-                name = record.coin.name()
-                coin_records[name] = record
-
-            async def local_get_coin_records(names: Collection[bytes32]) -> List[CoinRecord]:
-                ret: List[CoinRecord] = []
-                for name in names:
-                    r = coin_records.get(name)
-                    if r is not None:
-                        ret.append(r)
-                return ret
+            local_get_coin_records = await self._batch_get_coin_records(
+                item.spend_bundle for item in old_pool.all_items()
+            )
 
             for item in old_pool.all_items():
                 info = await self.add_spend_bundle(
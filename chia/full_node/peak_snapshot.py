@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import dataclasses
+import time
+from typing import Optional
+
+from chia.consensus.block_record import BlockRecord
+from chia.consensus.blockchain import Blockchain
+from chia.consensus.constants import ConsensusConstants
+from chia.consensus.pos_quality import UI_ACTUAL_SPACE_CONSTANT_FACTOR
+from chia.types.blockchain_format.proof_of_space import calculate_prefix_bits
+from chia.util.ints import uint32, uint64, uint128
+
+# the network space and average block time are estimated over this many
+# blocks (about a day)
+ESTIMATE_BLOCKS = 4608
+
+
+async def get_nearest_transaction_block(blockchain: Blockchain, block: BlockRecord) -> BlockRecord:
+    if block.is_transaction_block:
+        return block
+
+    prev_hash = blockchain.height_to_hash(block.prev_transaction_block_height)
+    # Genesis block is a transaction block, so theoretically `prev_hash` of all blocks
+    # other than genesis block cannot be `None`.
+    assert prev_hash
+
+    tb = await blockchain.get_block_record_from_db(prev_hash)
+    assert tb
+
+    return tb
+
+
+async def get_average_block_time(
+    blockchain: Blockchain,
+    base_block: BlockRecord,
+    height_distance: int,
+) -> Optional[uint32]:
+    newer_block = await get_nearest_transaction_block(blockchain, base_block)
+    if newer_block.height < 1:
+        return None
+
+    prev_height = uint32(max(1, newer_block.height - height_distance))
+    prev_hash = blockchain.height_to_hash(prev_height)
+    assert prev_hash
+    prev_block = await blockchain.get_block_record_from_db(prev_hash)
+    assert prev_block
+
+    older_block = await get_nearest_transaction_block(blockchain, prev_block)
+
+    assert newer_block.timestamp is not None and older_block.timestamp is not None
+
+    if newer_block.height == older_block.height:  # small chain not long enough to have a block in between
+        return None
+
+    average_block_time = uint32(
+        (newer_block.timestamp - older_block.timestamp) / (newer_block.height - older_block.height)
+    )
+    return average_block_time
+
+
+def estimate_network_space(
+    constants: ConsensusConstants, newer_block: BlockRecord, older_block: BlockRecord
+) -> uint128:
+    """
+    Estimates the total space validating the chain between two blocks.
+    """
+    delta_weight = newer_block.weight - older_block.weight
+
+    plot_filter_size = calculate_prefix_bits(constants, newer_block.height)
+    delta_iters = newer_block.total_iters - older_block.total_iters
+    weight_div_iters = delta_weight / delta_iters
+    additional_difficulty_constant = constants.DIFFICULTY_CONSTANT_FACTOR
+    eligible_plots_filter_multiplier = 2**plot_filter_size
+    network_space_bytes_estimate = (
+        UI_ACTUAL_SPACE_CONSTANT_FACTOR
+        * weight_div_iters
+        * additional_difficulty_constant
+        * eligible_plots_filter_multiplier
+    )
+    return uint128(int(network_space_bytes_estimate))
+
+
+@dataclasses.dataclass(frozen=True)
+class PeakSnapshot:
+    """
+    The state of the chain as of a peak, for read-only RPCs to be answered
+    without the blockchain lock or DB queries. A new snapshot replaces the
+    previous one on every new peak and after every sync batch, it's never
+    modified. The peak is None for an empty blockchain.
+
+    The figures that need the DB (space, average block time and stake
+    totals) are filled in by complete_peak_snapshot() in the background,
+    until then they're those of the previous snapshot.
+    """
+
+    peak: Optional[BlockRecord]
+    difficulty: uint64
+    sub_slot_iters: uint64
+    space: uint128 = uint128(0)
+    average_block_time: Optional[uint32] = None
+    stake_lock: int = 0
+    stake_lock_calc: float = 0
+    timestamp: float = dataclasses.field(default_factory=time.time)
+
+
+def create_peak_snapshot(
+    blockchain: Blockchain, peak: Optional[BlockRecord], previous: Optional[PeakSnapshot] = None
+) -> PeakSnapshot:
+    """
+    Creates the snapshot of a peak from the block records in memory, with the
+    DB figures of the previous snapshot.
+    """
+    constants = blockchain.constants
+    if peak is not None and peak.height > 0:
+        difficulty = uint64(peak.weight - blockchain.block_record(peak.prev_hash).weight)
+        sub_slot_iters = peak.sub_slot_iters
+    else:
+        difficulty = constants.DIFFICULTY_STARTING
+        sub_slot_iters = constants.SUB_SLOT_ITERS_STARTING
+    if previous is None or previous.peak is None or peak is None:
+        return PeakSnapshot(peak, difficulty, sub_slot_iters)
+    return dataclasses.replace(
+        previous, peak=peak, difficulty=difficulty, sub_slot_iters=sub_slot_iters, timestamp=time.time()
+    )
+
+
+async def complete_peak_snapshot(blockchain: Blockchain, snapshot: PeakSnapshot) -> PeakSnapshot:
+    """
+    Returns the snapshot with the figures that need the DB computed for its
+    peak. This doesn't need the blockchain lock.
+    """
+    peak = snapshot.peak
+    if peak is None or peak.height <= 1:
+        return snapshot
+    older_hash = blockchain.height_to_hash(uint32(max(1, peak.height - ESTIMATE_BLOCKS)))
+    assert older_hash is not None
+    older_block = blockchain.try_block_record(older_hash)
+    if older_block is None:
+        older_block = await blockchain.get_block_record_from_db(older_hash)
+    assert older_block is not None
+    transaction_block = await get_nearest_transaction_block(blockchain, peak)
+    assert transaction_block.timestamp is not None
+    stake_lock, stake_lock_calc = await blockchain.stake_store.get_stake_amount_total(transaction_block.timestamp)
+    return dataclasses.replace(
+        snapshot,
+        space=estimate_network_space(blockchain.constants, peak, older_block),
+        average_block_time=await get_average_block_time(blockchain, transaction_block, ESTIMATE_BLOCKS),
+        stake_lock=stake_lock,
+        stake_lock_calc=stake_lock_calc,
+    )
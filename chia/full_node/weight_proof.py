@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import asyncio
+import dataclasses
 import logging
 import math
 import pathlib
@@ -8,7 +9,7 @@ import random
 import tempfile
 from concurrent.futures.process import ProcessPoolExecutor
 from multiprocessing.context import BaseContext
-from typing import IO, Dict, List, Optional, Tuple
+from typing import IO, Dict, List, Optional, Sequence, Tuple
 
 from chia.consensus.block_header_validation import validate_finished_header_block
 from chia.consensus.block_record import BlockRecord
@@ -43,6 +44,7 @@ from chia.util.batches import to_batches
 from chia.util.block_cache import BlockCache
 from chia.util.hash import std_hash
 from chia.util.ints import uint8, uint32, uint64, uint128
+from chia.util.lru_cache import LRUCache
 from chia.util.setproctitle import getproctitle, setproctitle
 
 log = logging.getLogger(__name__)
@@ -70,6 +72,14 @@ class WeightProofHandler:
         self.lock = asyncio.Lock()
         self._num_processes = 4
         self.multiprocessing_context = multiprocessing_context
+        # recently created proofs, by tip
+        self._proofs: LRUCache[bytes32, WeightProof] = LRUCache(4)
+        # challenge segments of finished sub epochs, by the header hash of the
+        # block including the sub epoch summary
+        self._segments: LRUCache[bytes32, List[SubEpochChallengeSegment]] = LRUCache(2 * self.MAX_SAMPLES)
+        # the recent chain of the last proof we created, extended
+        # incrementally as the peak moves
+        self._recent_chain: Optional[List[HeaderBlock]] = None
 
     async def get_proof_of_weight(self, tip: bytes32) -> Optional[WeightProof]:
         tip_rec = self.blockchain.try_block_record(tip)
@@ -82,12 +92,13 @@ class WeightProofHandler:
             return None
 
         async with self.lock:
-            if self.proof is not None:
-                if self.proof.recent_chain_data[-1].header_hash == tip:
-                    return self.proof
+            wp = self._proofs.get(tip)
+            if wp is not None:
+                return wp
             wp = await self._create_proof_of_weight(tip)
             if wp is None:
                 return None
+            self._proofs.put(tip, wp)
             self.proof = wp
             self.tip = tip
             return wp
@@ -150,15 +161,9 @@ class WeightProofHandler:
 
             if _sample_sub_epoch(prev_ses_block.weight, ses_block.weight, weight_to_check):
                 sample_n += 1
-                segments = await self.blockchain.get_sub_epoch_challenge_segments(ses_block.header_hash)
+                segments = await self._get_sub_epoch_segments(prev_ses_block, ses_block, ses_height, sub_epoch_n)
                 if segments is None:
-                    segments = await self.__create_sub_epoch_segments(ses_block, prev_ses_block, uint32(sub_epoch_n))
-                    if segments is None:
-                        log.error(
-                            f"failed while building segments for sub epoch {sub_epoch_n}, ses height {ses_height} "
-                        )
-                        return None
-                    await self.blockchain.persist_sub_epoch_challenge_segments(ses_block.header_hash, segments)
+                    return None
                 sub_epoch_segments.extend(segments)
             prev_ses_block = ses_block
         log.debug(f"sub_epochs: {len(sub_epoch_data)}")
@@ -189,6 +194,25 @@ class WeightProofHandler:
                 min_height = ses_height - 1
                 break
         log.debug(f"start {min_height} end {tip_height}")
+        recent_chain_prefix = self._reusable_recent_chain(min_height, tip_height)
+        if recent_chain_prefix is not None:
+            # the recent chain is the range of blocks min_height to tip_height,
+            # so we only need to fetch the blocks added since the last time
+            start = recent_chain_prefix[-1].height + 1
+            new_headers = await self.blockchain.get_header_blocks_in_range(start, tip_height, tx_filter=False)
+            recent_chain = recent_chain_prefix[:]
+            for height in range(start, tip_height + 1):
+                header_hash = self.blockchain.height_to_hash(uint32(height))
+                assert header_hash is not None
+                header_block = new_headers.get(header_hash)
+                if header_block is None:
+                    log.error("creating recent chain failed")
+                    return None
+                recent_chain.append(header_block)
+            self._recent_chain = recent_chain
+            log.info(f"recent chain, start: {min_height} end: {tip_height} (extended from {start - 1})")
+            return recent_chain
+
         headers = await self.blockchain.get_header_blocks_in_range(min_height, tip_height, tx_filter=False)
         blocks = await self.blockchain.get_block_records_in_range(min_height, tip_height)
         ses_count = 0
@@ -221,8 +245,26 @@ class WeightProofHandler:
             f"start: {recent_chain[0].reward_chain_block.height} "
             f"end:  {recent_chain[-1].reward_chain_block.height} "
         )
+        self._recent_chain = recent_chain
         return recent_chain
 
+    def _reusable_recent_chain(self, min_height: int, tip_height: uint32) -> Optional[List[HeaderBlock]]:
+        """
+        Returns the part of the previously built recent chain that starts at
+        min_height and is still on the main chain, if there is one.
+        """
+        prev_chain = self._recent_chain
+        if prev_chain is None or len(prev_chain) == 0:
+            return None
+        first_height = prev_chain[0].height
+        last = prev_chain[-1]
+        if not first_height <= min_height <= last.height <= tip_height:
+            return None
+        # if the last block is on the main chain, so are all its ancestors
+        if self.blockchain.height_to_hash(last.height) != last.header_hash:
+            return None
+        return prev_chain[min_height - first_height :]
+
     async def create_prev_sub_epoch_segments(self) -> None:
         log.debug("create prev sub_epoch_segments")
         heights = self.blockchain.get_ses_heights()
@@ -235,6 +277,7 @@ class WeightProofHandler:
         segments = await self.__create_sub_epoch_segments(ses_sub_block, prev_ses_sub_block, uint32(count))
         assert segments is not None
         await self.blockchain.persist_sub_epoch_challenge_segments(ses_sub_block.header_hash, segments)
+        self._segments.put(ses_sub_block.header_hash, segments)
         log.debug("sub_epoch_segments done")
         return None
 
@@ -286,6 +329,26 @@ class WeightProofHandler:
                 return None
             await self.blockchain.persist_sub_epoch_challenge_segments(ses_block.header_hash, segments)
 
+    async def _get_sub_epoch_segments(
+        self, prev_ses_block: BlockRecord, ses_block: BlockRecord, ses_height: uint32, sub_epoch_n: int
+    ) -> Optional[List[SubEpochChallengeSegment]]:
+        """
+        Returns the challenge segments of a finished sub epoch, from the
+        in-memory cache, the DB, or by creating (and persisting) them.
+        """
+        segments = self._segments.get(ses_block.header_hash)
+        if segments is not None:
+            return segments
+        segments = await self.blockchain.get_sub_epoch_challenge_segments(ses_block.header_hash)
+        if segments is None:
+            segments = await self.__create_sub_epoch_segments(ses_block, prev_ses_block, uint32(sub_epoch_n))
+            if segments is None:
+                log.error(f"failed while building segments for sub epoch {sub_epoch_n}, ses height {ses_height} ")
+                return None
+            await self.blockchain.persist_sub_epoch_challenge_segments(ses_block.header_hash, segments)
+        self._segments.put(ses_block.header_hash, segments)
+        return segments
+
     async def __create_sub_epoch_segments(
         self, ses_block: BlockRecord, se_start: BlockRecord, sub_epoch_n: uint32
     ) -> Optional[List[SubEpochChallengeSegment]]:
@@ -927,56 +990,143 @@ def _validate_sub_epoch_segments(
 ) -> Optional[List[Tuple[VDFProof, ClassgroupElement, VDFInfo]]]:
     summaries = summaries_from_bytes(summaries_bytes)
     sub_epoch_segments: SubEpochSegments = SubEpochSegments.from_bytes(weight_proof_bytes)
-    rc_sub_slot_hash = constants.GENESIS_CHALLENGE
-    total_blocks, total_ip_iters = 0, 0
-    total_slot_iters, total_slots = 0, 0
-    total_ip_iters = 0
-    prev_ses: Optional[SubEpochSummary] = None
-    segments_by_sub_epoch = map_segments_by_sub_epoch(sub_epoch_segments.challenge_segments)
-    curr_ssi = constants.SUB_SLOT_ITERS_STARTING
     vdfs_to_validate = []
-    for sub_epoch_n, segments in segments_by_sub_epoch.items():
+    for job in _sub_epoch_validation_jobs(constants, rng, sub_epoch_segments.challenge_segments, summaries):
+        vdf_list = _validate_sub_epoch(
+            constants,
+            job.sub_epoch_n,
+            job.segments,
+            summaries,
+            job.curr_ssi,
+            job.prev_ssi,
+            job.curr_difficulty,
+            job.sampled_seg_index,
+            height,
+            job.sub_epoch_n >= validate_from,
+        )
+        if vdf_list is None:
+            return None
+        vdfs_to_validate.extend(vdf_list)
+    return vdfs_to_validate
+
+
+@dataclasses.dataclass(frozen=True)
+class _SubEpochValidationJob:
+    sub_epoch_n: int
+    segments: List[SubEpochChallengeSegment]
+    curr_ssi: uint64
+    prev_ssi: uint64
+    curr_difficulty: uint64
+    sampled_seg_index: int
+
+
+def _sub_epoch_validation_jobs(
+    constants: ConsensusConstants,
+    rng: random.Random,
+    challenge_segments: List[SubEpochChallengeSegment],
+    summaries: List[SubEpochSummary],
+) -> List[_SubEpochValidationJob]:
+    """
+    Splits the segment validation into one independent job per sub epoch. The
+    sampling (which consumes rng) and the sub slot iters carried over from the
+    previous sub epoch are resolved here, in order, so the jobs themselves can
+    run in any order.
+    """
+    jobs: List[_SubEpochValidationJob] = []
+    curr_ssi = constants.SUB_SLOT_ITERS_STARTING
+    for sub_epoch_n, segments in map_segments_by_sub_epoch(challenge_segments).items():
         prev_ssi = curr_ssi
         curr_difficulty, curr_ssi = _get_curr_diff_ssi(constants, sub_epoch_n, summaries)
-        log.debug(f"validate sub epoch {sub_epoch_n}")
-        # recreate RewardChainSubSlot for next ses rc_hash
         sampled_seg_index = rng.choice(range(len(segments)))
-        if sub_epoch_n > 0:
-            rc_sub_slot = __get_rc_sub_slot(constants, segments[0], summaries, curr_ssi)
-            prev_ses = summaries[sub_epoch_n - 1]
-            rc_sub_slot_hash = rc_sub_slot.get_hash()
-        if not summaries[sub_epoch_n].reward_chain_hash == rc_sub_slot_hash:
-            log.error(f"failed reward_chain_hash validation sub_epoch {sub_epoch_n}")
-            return None
+        jobs.append(
+            _SubEpochValidationJob(sub_epoch_n, segments, curr_ssi, prev_ssi, curr_difficulty, sampled_seg_index)
+        )
+    return jobs
 
-        # skip validation up to fork height
-        if sub_epoch_n < validate_from:
-            continue
 
-        for idx, segment in enumerate(segments):
-            valid_segment, ip_iters, slot_iters, slots, vdf_list = _validate_segment(
-                constants,
-                segment,
-                curr_ssi,
-                prev_ssi,
-                curr_difficulty,
-                prev_ses,
-                idx == 0,
-                sampled_seg_index == idx,
-                height,
-            )
-            vdfs_to_validate.extend(vdf_list)
-            if not valid_segment:
-                log.error(f"failed to validate sub_epoch {segment.sub_epoch_n} segment {idx} slots")
-                return None
-            prev_ses = None
-            total_blocks += 1
-            total_slot_iters += slot_iters
-            total_slots += slots
-            total_ip_iters += ip_iters
+def _validate_sub_epoch(
+    constants: ConsensusConstants,
+    sub_epoch_n: int,
+    segments: List[SubEpochChallengeSegment],
+    summaries: List[SubEpochSummary],
+    curr_ssi: uint64,
+    prev_ssi: uint64,
+    curr_difficulty: uint64,
+    sampled_seg_index: int,
+    height: uint32,
+    validate_segments: bool,
+) -> Optional[List[Tuple[VDFProof, ClassgroupElement, VDFInfo]]]:
+    log.debug(f"validate sub epoch {sub_epoch_n}")
+    prev_ses: Optional[SubEpochSummary] = None
+    rc_sub_slot_hash = constants.GENESIS_CHALLENGE
+    # recreate RewardChainSubSlot for next ses rc_hash
+    if sub_epoch_n > 0:
+        rc_sub_slot = __get_rc_sub_slot(constants, segments[0], summaries, curr_ssi)
+        prev_ses = summaries[sub_epoch_n - 1]
+        rc_sub_slot_hash = rc_sub_slot.get_hash()
+    if not summaries[sub_epoch_n].reward_chain_hash == rc_sub_slot_hash:
+        log.error(f"failed reward_chain_hash validation sub_epoch {sub_epoch_n}")
+        return None
+
+    # skip validation up to fork height
+    if not validate_segments:
+        return []
+
+    vdfs_to_validate = []
+    for idx, segment in enumerate(segments):
+        valid_segment, _, _, _, vdf_list = _validate_segment(
+            constants,
+            segment,
+            curr_ssi,
+            prev_ssi,
+            curr_difficulty,
+            prev_ses,
+            idx == 0,
+            sampled_seg_index == idx,
+            height,
+        )
+        vdfs_to_validate.extend(vdf_list)
+        if not valid_segment:
+            log.error(f"failed to validate sub_epoch {segment.sub_epoch_n} segment {idx} slots")
+            return None
+        prev_ses = None
     return vdfs_to_validate
 
 
+def _validate_sub_epoch_job(
+    constants: ConsensusConstants,
+    job_bytes: bytes,
+    summaries_bytes: List[bytes],
+    curr_ssi: uint64,
+    prev_ssi: uint64,
+    curr_difficulty: uint64,
+    sampled_seg_index: int,
+    height: uint32,
+    validate_segments: bool,
+) -> Optional[List[Tuple[bytes, bytes, bytes]]]:
+    """
+    Runs _validate_sub_epoch() for a single sub epoch in a worker process.
+    job_bytes are the sub epoch's serialized SubEpochSegments. Returns the
+    serialized VDFs to validate, or None if the sub epoch is invalid.
+    """
+    sub_epoch_segments = SubEpochSegments.from_bytes(job_bytes).challenge_segments
+    vdf_list = _validate_sub_epoch(
+        constants,
+        sub_epoch_segments[0].sub_epoch_n,
+        sub_epoch_segments,
+        summaries_from_bytes(summaries_bytes),
+        curr_ssi,
+        prev_ssi,
+        curr_difficulty,
+        sampled_seg_index,
+        height,
+        validate_segments,
+    )
+    if vdf_list is None:
+        return None
+    return [(bytes(vdf_proof), bytes(classgroup), bytes(vdf_info)) for vdf_proof, classgroup, vdf_info in vdf_list]
+
+
 def _validate_segment(
     constants: ConsensusConstants,
     segment: SubEpochChallengeSegment,
@@ -1199,7 +1349,7 @@ def validate_recent_blocks(
     constants: ConsensusConstants,
     recent_chain_bytes: bytes,
     summaries_bytes: List[bytes],
-    shutdown_file_path: Optional[pathlib.Path] = None,
+    shutdown_file_paths: Sequence[pathlib.Path] = (),
 ) -> Tuple[bool, List[bytes]]:
     recent_chain: RecentChainData = RecentChainData.from_bytes(recent_chain_bytes)
     summaries = summaries_from_bytes(summaries_bytes)
@@ -1283,7 +1433,7 @@ def validate_recent_blocks(
             ses_blocks += 1
         prev_block_record = block_record
 
-        if shutdown_file_path is not None and not shutdown_file_path.is_file():
+        if _shutdown_requested(shutdown_file_paths):
             log.info(f"cancelling block {block.header_hash} validation, shutdown requested")
             return False, []
 
@@ -1625,10 +1775,14 @@ def map_segments_by_sub_epoch(
     return segments
 
 
+def _shutdown_requested(shutdown_file_paths: Sequence[pathlib.Path]) -> bool:
+    return any(not path.is_file() for path in shutdown_file_paths)
+
+
 def _validate_vdf_batch(
     constants: ConsensusConstants,
     vdf_list: List[Tuple[bytes, bytes, bytes]],
-    shutdown_file_path: Optional[pathlib.Path] = None,
+    shutdown_file_paths: Sequence[pathlib.Path] = (),
 ) -> bool:
     for vdf_proof_bytes, class_group_bytes, info in vdf_list:
         vdf = VDFProof.from_bytes(vdf_proof_bytes)
@@ -1637,7 +1791,7 @@ def _validate_vdf_batch(
         if not validate_vdf(vdf, constants, class_group, vdf_info):
             return False
 
-        if shutdown_file_path is not None and not shutdown_file_path.is_file():
+        if _shutdown_requested(shutdown_file_paths):
             log.info("cancelling VDF validation, shutdown requested")
             return False
 
@@ -1667,53 +1821,72 @@ async def validate_weight_proof_inner(
         log.error("failed weight proof sub epoch sample validation")
         return False, []
 
-    loop = asyncio.get_running_loop()
-    summary_bytes, wp_segment_bytes, wp_recent_chain_bytes = vars_to_bytes(summaries, weight_proof)
-    recent_blocks_validation_task = loop.run_in_executor(
-        executor,
-        validate_recent_blocks,
-        constants,
-        wp_recent_chain_bytes,
-        summary_bytes,
-        pathlib.Path(shutdown_file_name),
-    )
-
+    summary_bytes = [bytes(summary) for summary in summaries]
+    wp_recent_chain_bytes = bytes(RecentChainData(weight_proof.recent_chain_data))
+    jobs: List[_SubEpochValidationJob] = []
     if not skip_segment_validation:
-        vdfs_to_validate = _validate_sub_epoch_segments(
-            constants, rng, wp_segment_bytes, summary_bytes, peak_height, validate_from
-        )
-        await asyncio.sleep(0)  # break up otherwise multi-second sync code
-
-        if vdfs_to_validate is None:
-            return False, []
-
-        vdf_tasks = []
-        for batch in to_batches(vdfs_to_validate, num_processes):
-            byte_chunks = []
-            for vdf_proof, classgroup, vdf_info in batch.entries:
-                byte_chunks.append((bytes(vdf_proof), bytes(classgroup), bytes(vdf_info)))
-            vdf_task = asyncio.get_running_loop().run_in_executor(
+        jobs = _sub_epoch_validation_jobs(constants, rng, weight_proof.sub_epoch_segments, summaries)
+
+    # The recent chain and each sub epoch (its segments, then its VDFs) are
+    # validated concurrently. As soon as any of them fails, the others are
+    # cancelled. Removing cancel_file stops the work already running in the
+    # executor.
+    with _create_shutdown_file() as cancel_file:
+        shutdown_file_paths = [pathlib.Path(shutdown_file_name), pathlib.Path(cancel_file.name)]
+        records_bytes: List[bytes] = []
+
+        async def validate_recent_chain() -> bool:
+            valid_recent_blocks, recent_records_bytes = await asyncio.get_running_loop().run_in_executor(
                 executor,
-                _validate_vdf_batch,
+                validate_recent_blocks,
                 constants,
-                byte_chunks,
-                pathlib.Path(shutdown_file_name),
+                wp_recent_chain_bytes,
+                summary_bytes,
+                shutdown_file_paths,
             )
-            vdf_tasks.append(vdf_task)
-            # give other stuff a turn
-            await asyncio.sleep(0)
-
-        for vdf_task in asyncio.as_completed(fs=vdf_tasks):
-            validated = await vdf_task
-            if not validated:
-                return False, []
-
-    valid_recent_blocks, records_bytes = await recent_blocks_validation_task
+            if not valid_recent_blocks or recent_records_bytes is None:
+                log.error("failed validating weight proof recent blocks")
+                return False
+            records_bytes.extend(recent_records_bytes)
+            return True
 
-    if not valid_recent_blocks or records_bytes is None:
-        log.error("failed validating weight proof recent blocks")
-        # Verify the data
-        return False, []
+        async def validate_sub_epoch(job: _SubEpochValidationJob) -> bool:
+            vdfs_to_validate = await asyncio.get_running_loop().run_in_executor(
+                executor,
+                _validate_sub_epoch_job,
+                constants,
+                bytes(SubEpochSegments(job.segments)),
+                summary_bytes,
+                job.curr_ssi,
+                job.prev_ssi,
+                job.curr_difficulty,
+                job.sampled_seg_index,
+                peak_height,
+                job.sub_epoch_n >= validate_from,
+            )
+            if vdfs_to_validate is None:
+                return False
+            vdf_tasks = [
+                asyncio.get_running_loop().run_in_executor(
+                    executor,
+                    _validate_vdf_batch,
+                    constants,
+                    batch.entries,
+                    shutdown_file_paths,
+                )
+                for batch in to_batches(vdfs_to_validate, num_processes)
+            ]
+            return all(await asyncio.gather(*vdf_tasks))
+
+        tasks = [asyncio.create_task(validate_recent_chain())]
+        tasks.extend(asyncio.create_task(validate_sub_epoch(job)) for job in jobs)
+        try:
+            for task in asyncio.as_completed(tasks):
+                if not await task:
+                    return False, []
+        finally:
+            for task in tasks:
+                task.cancel()
 
     records = [BlockRecord.from_bytes(b) for b in records_bytes]
     return True, records
@@ -4,8 +4,7 @@ from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional
 
 from chia.consensus.block_record import BlockRecord
-from chia.consensus.blockchain import Blockchain, BlockchainMutexPriority
-from chia.consensus.pos_quality import UI_ACTUAL_SPACE_CONSTANT_FACTOR
+from chia.consensus.blockchain import BlockchainMutexPriority
 from chia.full_node.fee_estimator_interface import FeeEstimatorInterface
 from chia.full_node.full_node import FullNode
 from chia.full_node.mempool_check_conditions import (
@@ -13,9 +12,9 @@ from chia.full_node.mempool_check_conditions import (
     get_spends_for_block,
     get_spends_for_block_with_conditions,
 )
+from chia.full_node.peak_snapshot import create_peak_snapshot, estimate_network_space
 from chia.rpc.rpc_server import Endpoint, EndpointResult
 from chia.server.outbound_message import NodeType
-from chia.types.blockchain_format.proof_of_space import calculate_prefix_bits
 from chia.types.blockchain_format.sized_bytes import bytes32
 from chia.types.coin_record import CoinRecord
 from chia.types.coin_spend import CoinSpend
@@ -27,7 +26,7 @@ from chia.types.spend_bundle_conditions import SpendBundleConditions
 from chia.types.stake_record import StakeRecord
 from chia.types.unfinished_header_block import UnfinishedHeaderBlock
 from chia.util.byte_types import hexstr_to_bytes
-from chia.util.ints import uint32, uint64, uint128
+from chia.util.ints import uint32, uint64
 from chia.util.log_exceptions import log_exceptions
 from chia.util.math import make_monotonically_decreasing
 from chia.util.ws_message import WsRpcMessage, create_payload_dict
@@ -38,49 +37,6 @@ def coin_record_dict_backwards_compat(coin_record: Dict[str, Any]) -> Dict[str,
     return coin_record
 
 
-async def get_nearest_transaction_block(blockchain: Blockchain, block: BlockRecord) -> BlockRecord:
-    if block.is_transaction_block:
-        return block
-
-    prev_hash = blockchain.height_to_hash(block.prev_transaction_block_height)
-    # Genesis block is a transaction block, so theoretically `prev_hash` of all blocks
-    # other than genesis block cannot be `None`.
-    assert prev_hash
-
-    tb = await blockchain.get_block_record_from_db(prev_hash)
-    assert tb
-
-    return tb
-
-
-async def get_average_block_time(
-    blockchain: Blockchain,
-    base_block: BlockRecord,
-    height_distance: int,
-) -> Optional[uint32]:
-    newer_block = await get_nearest_transaction_block(blockchain, base_block)
-    if newer_block.height < 1:
-        return None
-
-    prev_height = uint32(max(1, newer_block.height - height_distance))
-    prev_hash = blockchain.height_to_hash(prev_height)
-    assert prev_hash
-    prev_block = await blockchain.get_block_record_from_db(prev_hash)
-    assert prev_block
-
-    older_block = await get_nearest_transaction_block(blockchain, prev_block)
-
-    assert newer_block.timestamp is not None and older_block.timestamp is not None
-
-    if newer_block.height == older_block.height:  # small chain not long enough to have a block in between
-        return None
-
-    average_block_time = uint32(
-        (newer_block.timestamp - older_block.timestamp) / (newer_block.height - older_block.height)
-    )
-    return average_block_time
-
-
 class FullNodeRpcApi:
     def __init__(self, service: FullNode) -> None:
         self.service = service
@@ -114,6 +70,8 @@ class FullNodeRpcApi:
             "/get_coin_records_by_names": self.get_coin_records_by_names,
             "/get_coin_records_by_parent_ids": self.get_coin_records_by_parent_ids,
             "/get_coin_records_by_hint": self.get_coin_records_by_hint,
+            "/get_lookup_prefilter_stats": self.get_lookup_prefilter_stats,
+            "/get_db_query_stats": self.get_db_query_stats,
             "/push_tx": self.push_tx,
             "/get_puzzle_and_solution": self.get_puzzle_and_solution,
             # Mempool
@@ -198,14 +156,13 @@ class FullNodeRpcApi:
                 },
             }
             return res
-        peak: Optional[BlockRecord] = self.service.blockchain.get_peak()
-
-        if peak is not None and peak.height > 0:
-            difficulty = uint64(peak.weight - self.service.blockchain.block_record(peak.prev_hash).weight)
-            sub_slot_iters = peak.sub_slot_iters
-        else:
-            difficulty = self.service.constants.DIFFICULTY_STARTING
-            sub_slot_iters = self.service.constants.SUB_SLOT_ITERS_STARTING
+        # the chain figures are answered from the latest peak snapshot, which
+        # doesn't need the blockchain lock or the DB
+        snapshot = self.service.peak_snapshot
+        if snapshot is None:
+            # empty blockchain
+            snapshot = create_peak_snapshot(self.service.blockchain, None)
+        peak: Optional[BlockRecord] = snapshot.peak
 
         sync_mode: bool = self.service.sync_store.get_sync_mode() or self.service.sync_store.get_long_sync()
 
@@ -225,28 +182,6 @@ class FullNodeRpcApi:
         else:
             sync_progress_height = uint32(0)
 
-        average_block_time: Optional[uint32] = None
-        if peak is not None and peak.height > 1:
-            newer_block_hex = peak.header_hash.hex()
-            # Average over the last day
-            header_hash = self.service.blockchain.height_to_hash(uint32(max(1, peak.height - 4608)))
-            assert header_hash is not None
-            older_block_hex = header_hash.hex()
-            space = await self.get_network_space(
-                {"newer_block_header_hash": newer_block_hex, "older_block_header_hash": older_block_hex}
-            )
-            transaction_block = await get_nearest_transaction_block(self.service.blockchain, peak)
-            average_block_time = await get_average_block_time(
-                self.service.blockchain, transaction_block, 4608
-            )
-            stake_lock, stake_lock_calc = (
-                await self.service.blockchain.stake_store.get_stake_amount_total(transaction_block.timestamp)
-            )
-        else:
-            stake_lock: int = 0
-            stake_lock_calc: float = 0
-            space = {"space": uint128(0)}
-
         if self.service.mempool_manager is not None:
             mempool_size = self.service.mempool_manager.mempool.size()
             mempool_cost = self.service.mempool_manager.mempool.total_mempool_cost()
@@ -259,6 +194,7 @@ class FullNodeRpcApi:
             mempool_fees = 0
             mempool_min_fee_5m = 0
             mempool_max_total_cost = 0
+
         if self.service.server is not None:
             is_connected = len(self.service.server.get_connections(NodeType.FULL_NODE)) > 0 or "simulator" in str(
                 self.service.config.get("selected_network")
@@ -267,7 +203,6 @@ class FullNodeRpcApi:
             is_connected = False
         synced = await self.service.synced() and is_connected
 
-        assert space is not None
         response = {
             "blockchain_state": {
                 "peak": peak,
@@ -277,13 +212,14 @@ class FullNodeRpcApi:
                     "synced": synced,
                     "sync_tip_height": sync_tip_height,
                     "sync_progress_height": sync_progress_height,
+                    "blocks_per_second": self.service.sync_metrics.to_json_dict(),
                 },
-                "stake_lock": stake_lock,
-                "stake_lock_calc": stake_lock_calc,
-                "difficulty": difficulty,
-                "sub_slot_iters": sub_slot_iters,
-                "space": space["space"],
-                "average_block_time": average_block_time,
+                "stake_lock": snapshot.stake_lock,
+                "stake_lock_calc": snapshot.stake_lock_calc,
+                "difficulty": snapshot.difficulty,
+                "sub_slot_iters": snapshot.sub_slot_iters,
+                "space": snapshot.space,
+                "average_block_time": snapshot.average_block_time,
                 "mempool_size": mempool_size,
                 "mempool_cost": mempool_cost,
                 "mempool_fees": mempool_fees,
@@ -295,6 +231,7 @@ class FullNodeRpcApi:
                 "mempool_max_total_cost": mempool_max_total_cost,
                 "block_max_cost": self.service.constants.MAX_BLOCK_COST_CLVM,
                 "node_id": node_id,
+                "wallet_fan_out": self.service.coin_state_fan_out_metrics.to_json_dict(),
             },
         }
         self.cached_blockchain_state = dict(response["blockchain_state"])
@@ -606,20 +543,7 @@ class FullNodeRpcApi:
         older_block = await self.service.block_store.get_block_record(older_block_bytes)
         if older_block is None:
             raise ValueError(f"Older block {older_block_hex} not found")
-        delta_weight = newer_block.weight - older_block.weight
-
-        plot_filter_size = calculate_prefix_bits(self.service.constants, newer_block.height)
-        delta_iters = newer_block.total_iters - older_block.total_iters
-        weight_div_iters = delta_weight / delta_iters
-        additional_difficulty_constant = self.service.constants.DIFFICULTY_CONSTANT_FACTOR
-        eligible_plots_filter_multiplier = 2**plot_filter_size
-        network_space_bytes_estimate = (
-            UI_ACTUAL_SPACE_CONSTANT_FACTOR
-            * weight_div_iters
-            * additional_difficulty_constant
-            * eligible_plots_filter_multiplier
-        )
-        return {"space": uint128(int(network_space_bytes_estimate))}
+        return {"space": estimate_network_space(self.service.constants, newer_block, older_block)}
 
     async def get_coin_records_by_puzzle_hash(self, request: Dict[str, Any]) -> EndpointResult:
         """
@@ -749,6 +673,18 @@ class FullNodeRpcApi:
 
         return {"coin_records": [coin_record_dict_backwards_compat(cr.to_json_dict()) for cr in coin_records]}
 
+    async def get_lookup_prefilter_stats(self, _: Dict[str, Any]) -> EndpointResult:
+        return {
+            "hints": self.service.hint_store.prefilter.to_json_dict(),
+            "puzzle_hashes": self.service.coin_store.prefilter.to_json_dict(),
+        }
+
+    async def get_db_query_stats(self, request: Dict[str, Any]) -> EndpointResult:
+        query_stats = self.service.db_wrapper.query_stats
+        if query_stats is None:
+            raise ValueError("DB query stats are disabled (db_query_stats)")
+        return query_stats.to_json_dict(limit=int(request.get("limit", 50)))
+
     async def push_tx(self, request: Dict[str, Any]) -> EndpointResult:
         if "spend_bundle" not in request:
             raise ValueError("Spend bundle not in request")
@@ -20,6 +20,7 @@ from chia.server.ws_connection import WSLotteryConnection
 from chia.types.peer_info import PeerInfo
 from chia.util.byte_types import hexstr_to_bytes
 from chia.util.config import str2bool
+from chia.util.db_wrapper import ReaderClass, reader_class
 from chia.util.ints import uint16
 from chia.util.json_util import dict_to_json_str
 from chia.util.network import WebServer, resolve
@@ -237,6 +238,7 @@ class RpcServer(Generic[_T_RpcApiProtocol]):
             **self.rpc_api.get_routes(),
             "/get_network_info": self.get_network_info,
             "/get_connections": self.get_connections,
+            "/get_server_metrics": self.get_server_metrics,
             "/open_connection": self.open_connection,
             "/close_connection": self.close_connection,
             "/stop_node": self.stop_node,
@@ -266,6 +268,27 @@ class RpcServer(Generic[_T_RpcApiProtocol]):
         con_info = self.rpc_api.service.get_connections(request_node_type=request_node_type)
         return {"connections": con_info}
 
+    async def get_server_metrics(self, request: Dict[str, Any]) -> EndpointResult:
+        if self.rpc_api.service.server is None:
+            raise ValueError("Global connections is not set")
+        server: LotteryServer = self.rpc_api.service.server
+        rate_limits = [
+            {
+                "type": con.connection_type,
+                "peer_host": con.peer_info.host,
+                "peer_port": con.peer_info.port,
+                "node_id": con.peer_node_id,
+                "inbound": con.inbound_rate_limiter.to_json_dict(),
+                "outbound": con.outbound_rate_limiter.to_json_dict(),
+            }
+            for con in server.get_connections()
+        ]
+        return {
+            "broadcast": server.broadcast_metrics.to_json_dict(),
+            "rate_limits": rate_limits,
+            "peer_scores": server.peer_scores.to_json_dict(),
+        }
+
     async def open_connection(self, request: Dict[str, Any]) -> EndpointResult:
         host = request["host"]
         port = request["port"]
@@ -330,7 +353,8 @@ class RpcServer(Generic[_T_RpcApiProtocol]):
         try:
             message = json.loads(payload)
             log.debug(f"Rpc call <- {message['command']}")
-            response = await self.ws_api(message)
+            with reader_class(ReaderClass.RPC):
+                response = await self.ws_api(message)
 
             # Only respond if we return something from api call
             if response is not None:
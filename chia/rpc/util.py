@@ -11,6 +11,7 @@ from chia_rs import AugSchemeMPL
 from chia.types.blockchain_format.coin import Coin
 from chia.types.coin_spend import CoinSpend
 from chia.types.spend_bundle import SpendBundle
+from chia.util.db_wrapper import ReaderClass, reader_class
 from chia.util.json_util import obj_to_response
 from chia.util.streamable import Streamable
 from chia.wallet.conditions import Condition, ConditionValidTimes, conditions_from_json_dicts, parse_timelock_info
@@ -81,7 +82,8 @@ def wrap_http_handler(f) -> Callable:
     async def inner(request) -> aiohttp.web.Response:
         request_data = await request.json()
         try:
-            res_object = await f(request_data)
+            with reader_class(ReaderClass.RPC):
+                res_object = await f(request_data)
             if res_object is None:
                 res_object = {}
             if "success" not in res_object:
@@ -91,6 +91,7 @@ from chia.wallet.did_wallet.did_wallet_puzzles import (
     match_did_puzzle,
     metadata_to_program,
 )
+from chia.wallet.dust_consolidation import AutoConsolidateDustSettings
 from chia.wallet.nft_wallet import nft_puzzles
 from chia.wallet.nft_wallet.nft_info import NFTCoinInfo, NFTInfo
 from chia.wallet.nft_wallet.nft_puzzles import get_metadata_and_phs
@@ -99,6 +100,7 @@ from chia.wallet.nft_wallet.uncurry_nft import UncurriedNFT
 from chia.wallet.notification_store import Notification
 from chia.wallet.outer_puzzles import AssetType
 from chia.wallet.payment import Payment
+from chia.wallet.payment_batch import BatchPayment, max_payments_cost, plan_payment_batches
 from chia.wallet.puzzle_drivers import PuzzleInfo, Solver
 from chia.wallet.puzzles import p2_delegated_conditions
 from chia.wallet.puzzles.clawback.metadata import AutoClaimSettings, ClawbackMetadata
@@ -121,7 +123,13 @@ from chia.wallet.util.curry_and_treehash import NIL_TREEHASH
 from chia.wallet.util.puzzle_decorator_type import PuzzleDecoratorType
 from chia.wallet.util.query_filter import HashFilter, TransactionTypeFilter
 from chia.wallet.util.transaction_type import CLAWBACK_INCOMING_TRANSACTION_TYPES, TransactionType
-from chia.wallet.util.tx_config import DEFAULT_TX_CONFIG, CoinSelectionConfig, CoinSelectionConfigLoader, TXConfig
+from chia.wallet.util.tx_config import (
+    DEFAULT_TX_CONFIG,
+    CoinSelectionConfig,
+    CoinSelectionConfigLoader,
+    TXConfig,
+    TXConfigLoader,
+)
 from chia.wallet.util.wallet_sync_utils import fetch_coin_spend_for_coin_state
 from chia.wallet.util.wallet_types import CoinType, WalletType
 from chia.wallet.vc_wallet.cr_cat_drivers import ProofsChecker
@@ -135,6 +143,7 @@ from chia.wallet.wallet_coin_store import CoinRecordOrder, GetCoinRecords, unspe
 from chia.wallet.wallet_info import WalletInfo
 from chia.wallet.wallet_node import WalletNode
 from chia.wallet.wallet_protocol import WalletProtocol
+from chia.wallet.wallet_transaction_store import TransactionHistoryCursor
 
 # Timeout for response from wallet/full node for sending a transaction
 TIMEOUT = 30
@@ -170,6 +179,7 @@ class WalletRpcApi:
             "/set_wallet_resync_on_startup": self.set_wallet_resync_on_startup,
             "/get_sync_status": self.get_sync_status,
             "/get_height_info": self.get_height_info,
+            "/get_peer_request_cache_stats": self.get_peer_request_cache_stats,
             "/push_tx": self.push_tx,
             "/push_transactions": self.push_transactions,
             "/get_timestamp_for_height": self.get_timestamp_for_height,
@@ -187,9 +197,11 @@ class WalletRpcApi:
             "/get_transaction": self.get_transaction,
             "/get_transactions": self.get_transactions,
             "/get_transaction_count": self.get_transaction_count,
+            "/get_transaction_summaries": self.get_transaction_summaries,
             "/get_next_address": self.get_next_address,
             "/send_transaction": self.send_transaction,
             "/send_transaction_multi": self.send_transaction_multi,
+            "/send_transaction_batch": self.send_transaction_batch,
             "/spend_clawback_coins": self.spend_clawback_coins,
             "/get_coin_records": self.get_coin_records,
             "/get_farmed_amount": self.get_farmed_amount,
@@ -317,6 +329,10 @@ class WalletRpcApi:
             "/stake_info": self.stake_info,
             "/send_stake": self.send_stake,
             "/spend_withdraw_coins": self.spend_withdraw_coins,
+            # Dust consolidation
+            "/set_auto_consolidate_dust": self.set_auto_consolidate_dust,
+            "/get_auto_consolidate_dust": self.get_auto_consolidate_dust,
+            "/consolidate_dust": self.consolidate_dust,
             # guess
             "/send_guess": self.send_guess,
         }
@@ -628,6 +644,9 @@ class WalletRpcApi:
         height = await self.service.wallet_state_manager.blockchain.get_finished_sync_up_to()
         return {"height": height}
 
+    async def get_peer_request_cache_stats(self, request: Dict[str, Any]) -> EndpointResult:
+        return self.service.get_peer_request_cache_stats()
+
     async def push_tx(self, request: Dict[str, Any]) -> EndpointResult:
         nodes = self.service.server.get_connections(NodeType.FULL_NODE)
         if len(nodes) == 0:
@@ -1116,6 +1135,50 @@ class WalletRpcApi:
             "wallet_id": wallet_id,
         }
 
+    async def get_transaction_summaries(self, request: Dict[str, Any]) -> EndpointResult:
+        """
+        Pages through the transaction history of a wallet. Pass the returned
+        next_cursor to get the next page, it's null after the last one. Use
+        get_transaction for the full record of a transaction.
+        """
+        wallet_id = int(request["wallet_id"])
+        limit = int(request.get("limit", 50))
+        cursor: Optional[TransactionHistoryCursor] = None
+        if request.get("cursor") is not None:
+            cursor = TransactionHistoryCursor.from_bytes(hexstr_to_bytes(request["cursor"]))
+        to_puzzle_hash: Optional[bytes32] = None
+        if request.get("to_address") is not None:
+            to_puzzle_hash = decode_puzzle_hash(request["to_address"])
+        type_filter = None
+        if "type_filter" in request:
+            type_filter = TransactionTypeFilter.from_json_dict(request["type_filter"])
+
+        summaries, next_cursor = await self.service.wallet_state_manager.tx_store.get_transaction_summaries(
+            wallet_id,
+            limit,
+            cursor=cursor,
+            sort_key=request.get("sort_key", None),
+            reverse=request.get("reverse", False),
+            confirmed=request.get("confirmed", None),
+            to_puzzle_hash=to_puzzle_hash,
+            type_filter=type_filter,
+        )
+        selected = self.service.config["selected_network"]
+        prefix = self.service.config["network_overrides"]["config"][selected]["address_prefix"]
+        transactions = []
+        for summary in summaries:
+            tx = summary.to_json_dict()
+            converted_puzzle_hash = await self.service.wallet_state_manager.convert_puzzle_hash(
+                summary.wallet_id, summary.to_puzzle_hash
+            )
+            tx["to_address"] = encode_puzzle_hash(converted_puzzle_hash, prefix)
+            transactions.append(tx)
+        return {
+            "transactions": transactions,
+            "next_cursor": None if next_cursor is None else bytes(next_cursor).hex(),
+            "wallet_id": wallet_id,
+        }
+
     async def get_transaction_count(self, request: Dict[str, Any]) -> EndpointResult:
         wallet_id = int(request["wallet_id"])
         type_filter = None
@@ -1242,6 +1305,195 @@ class WalletRpcApi:
             "unsigned_transactions": response["unsigned_transactions"],
         }
 
+    async def _batch_payment(self, wallet: Wallet, index: int, item: Dict[str, Any]) -> BatchPayment:
+        if not isinstance(item.get("amount"), int) or not isinstance(item.get("fee", 0), int):
+            raise ValueError("An integer amount or fee is required (too many decimals)")
+        amount: uint64 = uint64(item["amount"])
+        fee: uint64 = uint64(item.get("fee", 0))
+        if "guess" in item:
+            if fee < int(0.01 * MOJO_PER_LOTTERY):
+                raise ValueError("guess fee must >= 0.01")
+            memo = await self._guess_memo(wallet, amount, item["guess"], item.get("award_address"), item.get("rebate"))
+            return BatchPayment(index, Payment(GUESS_PUZZLE_HASH[0], amount, [memo]), fee, guess=True)
+
+        address = item["address"]
+        selected_network = self.service.config["selected_network"]
+        expected_prefix = self.service.config["network_overrides"]["config"][selected_network]["address_prefix"]
+        if address[0 : len(expected_prefix)] != expected_prefix:
+            raise ValueError("Unexpected Address Prefix")
+        memos: List[bytes] = [mem.encode("utf-8") for mem in item.get("memos", [])]
+        return BatchPayment(index, Payment(decode_puzzle_hash(address), amount, memos), fee)
+
+    async def send_transaction_batch(self, request: Dict[str, Any]) -> EndpointResult:
+        """
+        Send many payments from a standard wallet, in as few spend bundles as the cost limits allow. The payments
+        of a bundle that aren't guesses share one transaction, each guess has a transaction of its own. The coins
+        funding a bundle are selected once for its total, and split between its transactions by its first one.
+        :param request: Example {"wallet_id": 1, "fee": 0, "push": true, "max_payments_per_bundle": 100,
+            "payments": [{"address": "lot1...", "amount": 1000, "memos": ["..."]},
+            {"guess": "{...}", "amount": 1000000000, "fee": 10000000, "award_address": "lot1...", "rebate": 0}]}
+            "fee" is paid by each bundle, in addition to the payments' own fees.
+        :return: the result of each payment, in order, and the transactions. The results of each bundle are also
+            sent as a "batch_payments_sent" state change as soon as it's signed and submitted.
+        """
+        wallet_state_manager = self.service.wallet_state_manager
+        if await wallet_state_manager.synced() is False:
+            raise ValueError("Wallet needs to be fully synced before sending transactions")
+
+        wallet_id = uint32(request.get("wallet_id", 1))
+        wallet = wallet_state_manager.get_wallet(id=wallet_id, required_type=Wallet)
+        if "payments" not in request or len(request["payments"]) < 1:
+            raise ValueError("Specify payments list")
+        if not isinstance(request.get("fee", 0), int):
+            raise ValueError("An integer fee is required (too many decimals)")
+        bundle_fee: uint64 = uint64(request.get("fee", 0))
+        push: bool = request.get("push", True)
+        assert self.service.logged_in_fingerprint is not None
+        tx_config: TXConfig = TXConfigLoader.from_json_dict(request).autofill(
+            constants=wallet_state_manager.constants,
+            config=wallet_state_manager.config,
+            logged_in_fingerprint=self.service.logged_in_fingerprint,
+        )
+
+        results: List[Dict[str, Any]] = [{"index": index} for index in range(len(request["payments"]))]
+        payments: List[BatchPayment] = []
+        for index, item in enumerate(request["payments"]):
+            try:
+                payments.append(await self._batch_payment(wallet, index, item))
+            except Exception as e:
+                results[index].update({"success": False, "error": str(e)})
+        batches = plan_payment_batches(
+            payments,
+            max_payments_cost(self.service.constants),
+            self.service.constants,
+            wallet.cost_of_single_tx,
+            request.get("max_payments_per_bundle"),
+        )
+
+        transactions: List[TransactionRecord] = []
+        for bundle, batch in enumerate(batches):
+            # one transaction per guess, and one for the other payments, more if some of them would create the
+            # same coin. The coins for the whole bundle are selected once, the first transaction spends them, pays
+            # the bundle fee and creates a coin funding each of the other ones
+            shared: List[Tuple[Set[Tuple[bytes32, int]], List[BatchPayment]]] = []
+            for payment in batch:
+                if payment.guess:
+                    continue
+                coin = (payment.payment.puzzle_hash, payment.payment.amount)
+                for coins, group in shared:
+                    if coin not in coins:
+                        break
+                else:
+                    coins, group = set(), []
+                    shared.append((coins, group))
+                coins.add(coin)
+                group.append(payment)
+            funding_group: List[BatchPayment] = shared[0][1] if len(shared) > 0 else []
+            funded_groups = [group for _, group in shared[1:]] + [[payment] for payment in batch if payment.guess]
+            if len(funding_group) == 0 and len(funded_groups) == 1:
+                funding_group = funded_groups.pop()
+            bundle_tx_config = tx_config
+            # the payments of each transaction, with its position in the action scope
+            positions: List[Tuple[List[BatchPayment], int]] = []
+            failures: List[Dict[str, Any]] = []
+            try:
+                async with wallet_state_manager.new_action_scope(
+                    push=push, merge_spends=True, sign=self.service.config.get("auto_sign_txs", True)
+                ) as action_scope:
+                    async with wallet_state_manager.lock:
+                        total = sum(payment.payment.amount + payment.fee for payment in batch) + bundle_fee
+                        selected = await wallet.select_coins(uint64(total), tx_config.coin_selection_config)
+                        outputs = [payment.payment for payment in funding_group]
+                        for group in funded_groups:
+                            amount = uint64(sum(payment.payment.amount + payment.fee for payment in group))
+                            puzzle_hash = await wallet.get_puzzle_hash(new=not tx_config.reuse_puzhash)
+                            if any(output.puzzle_hash == puzzle_hash and output.amount == amount for output in outputs):
+                                puzzle_hash = await wallet.get_new_puzzlehash()
+                            outputs.append(Payment(puzzle_hash, amount))
+                        first, *rest = outputs
+                        await wallet.generate_signed_transaction(
+                            first.amount,
+                            first.puzzle_hash,
+                            tx_config,
+                            action_scope,
+                            uint64(sum(payment.fee for payment in funding_group) + bundle_fee),
+                            coins=selected,
+                            memos=first.memos,
+                            primaries=rest or None,
+                        )
+                        async with action_scope.use() as interface:
+                            # its amount is the one it pays, not the coins it creates for the other transactions
+                            funding_tx = dataclasses.replace(
+                                interface.side_effects.transactions[-1],
+                                amount=uint64(sum(payment.payment.amount for payment in funding_group)),
+                            )
+                            interface.side_effects.transactions[-1] = funding_tx
+                            if len(funding_group) > 0:
+                                positions.append((funding_group, len(interface.side_effects.transactions) - 1))
+                            # later bundles can't reuse its coins
+                            tx_config = dataclasses.replace(
+                                tx_config,
+                                excluded_coin_ids=[
+                                    *tx_config.excluded_coin_ids,
+                                    *(c.name() for c in funding_tx.removals),
+                                ],
+                            )
+                        funding_coins = {(c.puzzle_hash, c.amount): c for c in funding_tx.additions}
+                        for group, output in zip(funded_groups, outputs[len(funding_group) :]):
+                            first_payment, *rest_payments = group
+                            try:
+                                await wallet.generate_signed_transaction(
+                                    first_payment.payment.amount,
+                                    first_payment.payment.puzzle_hash,
+                                    tx_config,
+                                    action_scope,
+                                    uint64(sum(payment.fee for payment in group)),
+                                    coins={funding_coins[(output.puzzle_hash, output.amount)]},
+                                    memos=first_payment.payment.memos,
+                                    primaries=[payment.payment for payment in rest_payments] or None,
+                                )
+                            except Exception as e:
+                                # its funding coin stays in the wallet
+                                log.error(f"Failed to send payments {[p.index for p in group]} of bundle {bundle}: {e}")
+                                failures.extend(
+                                    {"index": payment.index, "success": False, "error": str(e)} for payment in group
+                                )
+                                continue
+                            async with action_scope.use() as interface:
+                                positions.append((group, len(interface.side_effects.transactions) - 1))
+            except Exception as e:
+                log.error(f"Failed to send payment bundle {bundle}: {e}")
+                tx_config = bundle_tx_config
+                bundle_results = [{"index": payment.index, "success": False, "error": str(e)} for payment in batch]
+            else:
+                txs = action_scope.side_effects.transactions
+                transactions.extend(txs)
+                spend_bundle = txs[0].spend_bundle
+                bundle_results = [
+                    {
+                        "index": payment.index,
+                        "success": True,
+                        "transaction_id": txs[position].name.hex(),
+                        "spend_bundle_id": None if spend_bundle is None else spend_bundle.name().hex(),
+                    }
+                    for group, position in positions
+                    for payment in group
+                ]
+                bundle_results.extend(failures)
+            for result in bundle_results:
+                result["bundle"] = bundle
+                results[result["index"]] = result
+            wallet_state_manager.state_changed(
+                "batch_payments_sent", wallet_id, {"bundle": bundle, "results": bundle_results}
+            )
+
+        return {
+            "results": results,
+            "transactions": [
+                TransactionRecord.to_json_dict_convenience(tx, self.service.config) for tx in transactions
+            ],
+        }
+
     @tx_endpoint(push=True, merge_spends=False)
     async def spend_clawback_coins(
             self,
@@ -5014,10 +5266,95 @@ class WalletRpcApi:
             "transactions": None,  # tx_endpoint wrapper will take care of this
         }
 
+    ##########################################################################################
+    # Dust consolidation
+    ##########################################################################################
+
+    async def set_auto_consolidate_dust(self, request: Dict[str, Any]) -> EndpointResult:
+        """
+        Set the automatic dust consolidation config
+        :param request: Example {"enabled": true, "interval": 3600, "dust_threshold": 1000000000, "min_coins": 100,
+            "batch_size": 100, "tx_fee": 0, "max_fee": 0, "max_batches": 10}
+        :return:
+        """
+        return self.service.set_auto_consolidate_dust(AutoConsolidateDustSettings.from_json_dict(request))
+
+    async def get_auto_consolidate_dust(self, request: Dict[str, Any]) -> EndpointResult:
+        """
+        Get the automatic dust consolidation config
+        :param request: None
+        :return:
+        """
+        auto_consolidate_dust_settings = AutoConsolidateDustSettings.from_json_dict(
+            self.service.wallet_state_manager.config.get("auto_consolidate_dust", {})
+        )
+        return auto_consolidate_dust_settings.to_json_dict()
+
+    @tx_endpoint(push=True, merge_spends=False)
+    async def consolidate_dust(
+        self,
+        request: Dict[str, Any],
+        action_scope: WalletActionScope,
+        tx_config: TXConfig = DEFAULT_TX_CONFIG,
+        extra_conditions: Tuple[Condition, ...] = tuple(),
+    ) -> EndpointResult:
+        """
+        Merge the dust coins of the standard wallet now, with the configured settings overridden by the ones in
+        the request.
+        :param request: Example {"dry_run": true, "dust_threshold": 1000000000, "batch_size": 100, "tx_fee": 0}
+        :return: the consolidation report, with the transactions unless it's a dry run
+        """
+        if await self.service.wallet_state_manager.synced() is False:
+            raise ValueError("Wallet needs to be fully synced.")
+        settings_fields = AutoConsolidateDustSettings().to_json_dict()
+        settings = AutoConsolidateDustSettings.from_json_dict(
+            {
+                **self.service.wallet_state_manager.config.get("auto_consolidate_dust", {}),
+                **{key: value for key, value in request.items() if key in settings_fields},
+            }
+        )
+        async with self.service.wallet_state_manager.lock:
+            report = await self.service.wallet_state_manager.consolidate_dust(
+                settings, tx_config, action_scope, dry_run=request.get("dry_run", False)
+            )
+
+        return {
+            "success": True,
+            "report": report.to_json_dict(),
+            "transaction_ids": None,  # tx_endpoint wrapper will take care of this
+            "transactions": None,  # tx_endpoint wrapper will take care of this
+        }
+
     ##########################################################################################
     # Wallet Guess Management
     ##########################################################################################
 
+    async def _guess_memo(
+        self, wallet: Wallet, amount: uint64, data: str, award_address: Optional[str], rebate: Optional[Any]
+    ) -> bytes:
+        """
+        Checks the guess data, and returns it as the memo of a guess, with the award address
+        (the wallet's by default) and the rebate.
+        """
+        guess_err, guess_data = check_guess_memos(amount, data)
+        if guess_err is not None:
+            raise ValueError(guess_err)
+
+        selected_network = self.service.config["selected_network"]
+        expected_prefix = self.service.config["network_overrides"]["config"][selected_network]["address_prefix"]
+
+        if award_address is not None and award_address != "":
+            if award_address[0 : len(expected_prefix)] != expected_prefix:
+                raise ValueError("Unexpected Award Address Prefix")
+            puzzle_hash = decode_puzzle_hash(award_address)
+        else:
+            puzzle_hash = await wallet.get_puzzle_hash(False)
+        guess_data["W"] = puzzle_hash.hex()
+
+        if rebate is not None:
+            guess_data["R"] = str(rebate)
+        return json.dumps(guess_data).encode("utf-8")
+
     @tx_endpoint(push=True)
     async def send_guess(
             self,
@@ -5041,24 +5378,9 @@ class WalletRpcApi:
 
         if "data" not in request:
             raise ValueError("Guess data is empty")
-        guess_err, guess_data = check_guess_memos(amount, request["data"])
-        if guess_err is not None:
-            raise ValueError(guess_err)
-
-        selected_network = self.service.config["selected_network"]
-        expected_prefix = self.service.config["network_overrides"]["config"][selected_network]["address_prefix"]
-
-        if "award_address" in request and request["award_address"] != "":
-            address = request["award_address"]
-            if address[0: len(expected_prefix)] != expected_prefix:
-                raise ValueError("Unexpected Award Address Prefix")
-            puzzle_hash = decode_puzzle_hash(address)
-        else:
-            puzzle_hash = await wallet.get_puzzle_hash(False)
-        guess_data["W"] = puzzle_hash.hex()
-
-        if "rebate" in request:
-            guess_data["R"] = str(request["rebate"])
+        memo = await self._guess_memo(
+            wallet, amount, request["data"], request.get("award_address"), request.get("rebate")
+        )
 
         async with self.service.wallet_state_manager.lock:
             await wallet.generate_signed_transaction(
@@ -5067,7 +5389,7 @@ class WalletRpcApi:
                 tx_config,
                 action_scope,
                 fee,
-                memos=[json.dumps(guess_data).encode("utf-8")],
+                memos=[memo],
                 extra_conditions=extra_conditions,
             )
 
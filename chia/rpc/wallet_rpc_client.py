@@ -57,6 +57,7 @@ from chia.types.spend_bundle import SpendBundle
 from chia.util.bech32m import encode_puzzle_hash
 from chia.util.ints import uint16, uint32, uint64
 from chia.wallet.conditions import Condition, ConditionValidTimes, conditions_to_json_dicts
+from chia.wallet.dust_consolidation import AutoConsolidateDustSettings, DustConsolidationReport
 from chia.wallet.trade_record import TradeRecord
 from chia.wallet.trading.offer import Offer
 from chia.wallet.transaction_record import TransactionRecord
@@ -67,6 +68,7 @@ from chia.wallet.util.tx_config import CoinSelectionConfig, TXConfig
 from chia.wallet.util.wallet_types import WalletType
 from chia.wallet.vc_wallet.vc_store import VCRecord
 from chia.wallet.wallet_coin_store import GetCoinRecords
+from chia.wallet.wallet_transaction_store import TransactionHistoryCursor, TransactionSummary
 
 
 def parse_result_transactions(result: Dict[str, Any]) -> Dict[str, Any]:
@@ -148,6 +150,9 @@ class WalletRpcClient(RpcClient):
         # TODO: casting due to lack of type checked deserialization
         return cast(uint32, response["height"])
 
+    async def get_peer_request_cache_stats(self) -> Dict[str, Any]:
+        return await self.fetch("get_peer_request_cache_stats", {})
+
     async def push_tx(self, spend_bundle: SpendBundle) -> Dict[str, Any]:
         return await self.fetch("push_tx", {"spend_bundle": bytes(spend_bundle).hex()})
 
@@ -238,6 +243,34 @@ class WalletRpcClient(RpcClient):
         # TODO: casting due to lack of type checked deserialization
         return cast(int, res["count"])
 
+    async def get_transaction_summaries(
+        self,
+        wallet_id: int,
+        limit: int = 50,
+        cursor: Optional[TransactionHistoryCursor] = None,
+        sort_key: Optional[SortKey] = None,
+        reverse: bool = False,
+        to_address: Optional[str] = None,
+        type_filter: Optional[TransactionTypeFilter] = None,
+        confirmed: Optional[bool] = None,
+    ) -> Tuple[List[TransactionSummary], Optional[TransactionHistoryCursor]]:
+        request: Dict[str, Any] = {"wallet_id": wallet_id, "limit": limit, "reverse": reverse}
+        if cursor is not None:
+            request["cursor"] = bytes(cursor).hex()
+        if sort_key is not None:
+            request["sort_key"] = sort_key.name
+        if to_address is not None:
+            request["to_address"] = to_address
+        if type_filter is not None:
+            request["type_filter"] = type_filter.to_json_dict()
+        if confirmed is not None:
+            request["confirmed"] = confirmed
+        res = await self.fetch("get_transaction_summaries", request)
+        next_cursor = None
+        if res["next_cursor"] is not None:
+            next_cursor = TransactionHistoryCursor.from_bytes(bytes.fromhex(res["next_cursor"]))
+        return [TransactionSummary.from_json_dict(tx) for tx in res["transactions"]], next_cursor
+
     async def get_next_address(self, wallet_id: int, new_address: bool) -> str:
         request = {"wallet_id": wallet_id, "new_address": new_address}
         response = await self.fetch("get_next_address", request)
@@ -301,6 +334,26 @@ class WalletRpcClient(RpcClient):
         response = await self.fetch("send_transaction_multi", request)
         return json_deserialize_with_clvm_streamable(response, SendTransactionMultiResponse)
 
+    async def send_transaction_batch(
+        self,
+        wallet_id: int,
+        payments: List[Dict[str, Any]],
+        tx_config: TXConfig,
+        fee: uint64 = uint64(0),
+        push: bool = True,
+        max_payments_per_bundle: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        request: Dict[str, Any] = {
+            "wallet_id": wallet_id,
+            "payments": payments,
+            "fee": fee,
+            "push": push,
+            **tx_config.to_json_dict(),
+        }
+        if max_payments_per_bundle is not None:
+            request["max_payments_per_bundle"] = max_payments_per_bundle
+        return await self.fetch("send_transaction_batch", request)
+
     async def spend_clawback_coins(
         self,
         coin_ids: List[bytes32],
@@ -1764,6 +1817,36 @@ class WalletRpcClient(RpcClient):
         response = await self.fetch("spend_withdraw_coins", request)
         return response
 
+    async def set_auto_consolidate_dust(self, settings: AutoConsolidateDustSettings) -> AutoConsolidateDustSettings:
+        response = await self.fetch("set_auto_consolidate_dust", settings.to_json_dict())
+        return AutoConsolidateDustSettings.from_json_dict(response)
+
+    async def get_auto_consolidate_dust(self) -> AutoConsolidateDustSettings:
+        response = await self.fetch("get_auto_consolidate_dust", {})
+        return AutoConsolidateDustSettings.from_json_dict(response)
+
+    async def consolidate_dust(
+        self,
+        tx_config: TXConfig,
+        settings: Optional[Dict[str, Any]] = None,
+        dry_run: bool = False,
+        push: bool = True,
+    ) -> Tuple[DustConsolidationReport, List[TransactionRecord]]:
+        """
+        settings override the AutoConsolidateDustSettings fields of the wallet config.
+        """
+        request = {
+            **(settings if settings is not None else {}),
+            "dry_run": dry_run,
+            "push": push,
+            **tx_config.to_json_dict(),
+        }
+        response = await self.fetch("consolidate_dust", request)
+        return (
+            DustConsolidationReport.from_json_dict(response["report"]),
+            [TransactionRecord.from_json_dict_convenience(tx) for tx in response["transactions"]],
+        )
+
     async def guess_send(
         self,
         wallet_id: int,
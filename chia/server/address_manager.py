@@ -2,15 +2,19 @@ from __future__ import annotations
 
 import logging
 import math
+import struct
 import time
+from array import array
 from asyncio import Lock
+from ipaddress import ip_address
 from random import choice, randrange
 from secrets import randbits
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from chia.types.peer_info import PeerInfo, TimestampedPeerInfo
 from chia.util.hash import std_hash
 from chia.util.ints import uint16, uint64
+from chia.util.network import IPAddress
 
 TRIED_BUCKETS_PER_GROUP = 8
 NEW_BUCKETS_PER_SOURCE_GROUP = 64
@@ -27,11 +31,42 @@ MAX_RETRIES = 3
 MIN_FAIL_DAYS = 7
 MAX_FAILURES = 10
 
+# an empty position in the new and tried tables
+EMPTY = -1
+
+# port, timestamp and source port of a binary encoded ExtendedPeerInfo
+_PEER_RECORD = struct.Struct("!HQH")
+
 log = logging.getLogger(__name__)
 
 
+def _encode_ip(ip: IPAddress) -> bytes:
+    packed = ip.packed
+    return bytes([len(packed)]) + packed
+
+
+def _decode_ip(data: bytes, offset: int) -> Tuple[IPAddress, int]:
+    length = data[offset]
+    offset += 1
+    return IPAddress(ip_address(data[offset : offset + length])), offset + length
+
+
 # This is a Python port from 'CAddrInfo' class from Bitcoin core code.
 class ExtendedPeerInfo:
+    __slots__ = (
+        "peer_info",
+        "_timestamp",
+        "src",
+        "random_pos",
+        "is_tried",
+        "ref_count",
+        "last_success",
+        "last_try",
+        "num_attempts",
+        "last_count_attempt",
+        "_encoded",
+    )
+
     def __init__(
         self,
         addr: TimestampedPeerInfo,
@@ -41,7 +76,7 @@ class ExtendedPeerInfo:
             addr.host,
             addr.port,
         )
-        self.timestamp: int = addr.timestamp
+        self._timestamp: int = addr.timestamp
         self.src: Optional[PeerInfo] = src_peer
         if src_peer is None:
             self.src = self.peer_info
@@ -52,6 +87,45 @@ class ExtendedPeerInfo:
         self.last_try: int = 0
         self.num_attempts: int = 0
         self.last_count_attempt: int = 0
+        # cached result of encode(), the encoded fields only change with the timestamp
+        self._encoded: Optional[bytes] = None
+
+    @property
+    def timestamp(self) -> int:
+        return self._timestamp
+
+    @timestamp.setter
+    def timestamp(self, value: int) -> None:
+        if value != self._timestamp:
+            self._timestamp = value
+            self._encoded = None
+
+    def encode(self) -> bytes:
+        """
+        The binary form of the fields to_string() stores, used by the peers file.
+        """
+        if self._encoded is None:
+            assert self.src is not None
+            self._encoded = (
+                _encode_ip(self.peer_info.ip)
+                + _encode_ip(self.src.ip)
+                + _PEER_RECORD.pack(self.peer_info.port, self._timestamp, self.src.port)
+            )
+        return self._encoded
+
+    @classmethod
+    def decode(cls, data: bytes, offset: int) -> Tuple[ExtendedPeerInfo, int]:
+        """
+        Returns the peer encoded at offset in data, and the offset following it.
+        """
+        ip, offset = _decode_ip(data, offset)
+        src_ip, offset = _decode_ip(data, offset)
+        port, timestamp, src_port = _PEER_RECORD.unpack_from(data, offset)
+        info = cls(
+            TimestampedPeerInfo(str(ip), uint16(port), uint64(timestamp)),
+            PeerInfo(src_ip, src_port),
+        )
+        return info, offset + _PEER_RECORD.size
 
     def to_string(self) -> str:
         assert self.src is not None
@@ -158,21 +232,64 @@ class ExtendedPeerInfo:
         return chance
 
 
+class PositionSet:
+    """
+    The used positions of a table, with O(1) insertion, removal and uniform
+    random selection.
+    """
+
+    __slots__ = ("_positions", "_index")
+
+    def __init__(self) -> None:
+        self._positions: List[int] = []
+        # position -> its index in _positions
+        self._index: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, position: int) -> bool:
+        return position in self._index
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._positions)
+
+    def add(self, position: int) -> None:
+        if position not in self._index:
+            self._index[position] = len(self._positions)
+            self._positions.append(position)
+
+    def remove(self, position: int) -> None:
+        index = self._index.pop(position, None)
+        if index is None:
+            return
+        # move the last position into the hole
+        last = self._positions.pop()
+        if index < len(self._positions):
+            self._positions[index] = last
+            self._index[last] = index
+
+    def random(self) -> int:
+        return self._positions[randrange(len(self._positions))]
+
+
 # This is a Python port from 'CAddrMan' class from Bitcoin core code.
 class AddressManager:
     id_count: int
     key: int
     random_pos: List[int]
-    tried_matrix: List[List[int]]
-    new_matrix: List[List[int]]
+    # the tables are stored flat, the node id at (bucket, pos) is at
+    # bucket * BUCKET_SIZE + pos, EMPTY if there is none
+    tried_table: array[int]
+    new_table: array[int]
     tried_count: int
     new_count: int
     map_addr: Dict[str, int]
     map_info: Dict[int, ExtendedPeerInfo]
     last_good: int
     tried_collisions: List[int]
-    used_new_matrix_positions: Set[Tuple[int, int]]
-    used_tried_matrix_positions: Set[Tuple[int, int]]
+    used_new_positions: PositionSet
+    used_tried_positions: PositionSet
     allow_private_subnets: bool
 
     def __init__(self) -> None:
@@ -183,52 +300,51 @@ class AddressManager:
         self.id_count = 0
         self.key = randbits(256)
         self.random_pos = []
-        self.tried_matrix = [[-1 for x in range(BUCKET_SIZE)] for y in range(TRIED_BUCKET_COUNT)]
-        self.new_matrix = [[-1 for x in range(BUCKET_SIZE)] for y in range(NEW_BUCKET_COUNT)]
+        self.tried_table = array("q", [EMPTY]) * (TRIED_BUCKET_COUNT * BUCKET_SIZE)
+        self.new_table = array("q", [EMPTY]) * (NEW_BUCKET_COUNT * BUCKET_SIZE)
         self.tried_count = 0
         self.new_count = 0
         self.map_addr = {}
         self.map_info = {}
         self.last_good = 1
         self.tried_collisions = []
-        self.used_new_matrix_positions = set()
-        self.used_tried_matrix_positions = set()
+        self.used_new_positions = PositionSet()
+        self.used_tried_positions = PositionSet()
         self.allow_private_subnets = False
 
     def make_private_subnets_valid(self) -> None:
         self.allow_private_subnets = True
 
-    # Use only this method for modifying new matrix.
-    def _set_new_matrix(self, row: int, col: int, value: int) -> None:
-        self.new_matrix[row][col] = value
-        if value == -1:
-            if (row, col) in self.used_new_matrix_positions:
-                self.used_new_matrix_positions.remove((row, col))
+    def get_new(self, bucket: int, pos: int) -> int:
+        return self.new_table[bucket * BUCKET_SIZE + pos]
+
+    def get_tried(self, bucket: int, pos: int) -> int:
+        return self.tried_table[bucket * BUCKET_SIZE + pos]
+
+    # Use only this method for modifying the new table.
+    def set_new(self, bucket: int, pos: int, value: int) -> None:
+        position = bucket * BUCKET_SIZE + pos
+        self.new_table[position] = value
+        if value == EMPTY:
+            self.used_new_positions.remove(position)
         else:
-            if (row, col) not in self.used_new_matrix_positions:
-                self.used_new_matrix_positions.add((row, col))
-
-    # Use only this method for modifying tried matrix.
-    def _set_tried_matrix(self, row: int, col: int, value: int) -> None:
-        self.tried_matrix[row][col] = value
-        if value == -1:
-            if (row, col) in self.used_tried_matrix_positions:
-                self.used_tried_matrix_positions.remove((row, col))
+            self.used_new_positions.add(position)
+
+    # Use only this method for modifying the tried table.
+    def set_tried(self, bucket: int, pos: int, value: int) -> None:
+        position = bucket * BUCKET_SIZE + pos
+        self.tried_table[position] = value
+        if value == EMPTY:
+            self.used_tried_positions.remove(position)
         else:
-            if (row, col) not in self.used_tried_matrix_positions:
-                self.used_tried_matrix_positions.add((row, col))
+            self.used_tried_positions.add(position)
 
-    def load_used_table_positions(self) -> None:
-        self.used_new_matrix_positions = set()
-        self.used_tried_matrix_positions = set()
-        for bucket in range(NEW_BUCKET_COUNT):
-            for pos in range(BUCKET_SIZE):
-                if self.new_matrix[bucket][pos] != -1:
-                    self.used_new_matrix_positions.add((bucket, pos))
-        for bucket in range(TRIED_BUCKET_COUNT):
-            for pos in range(BUCKET_SIZE):
-                if self.tried_matrix[bucket][pos] != -1:
-                    self.used_tried_matrix_positions.add((bucket, pos))
+    def new_table_entries(self) -> Iterator[Tuple[int, int]]:
+        """
+        Yields (node id, bucket) for every used position of the new table.
+        """
+        for position in self.used_new_positions:
+            yield self.new_table[position], position // BUCKET_SIZE
 
     def create_(self, addr: TimestampedPeerInfo, addr_src: Optional[PeerInfo]) -> Tuple[ExtendedPeerInfo, int]:
         self.id_count += 1
@@ -261,39 +377,39 @@ class AddressManager:
     def make_tried_(self, info: ExtendedPeerInfo, node_id: int) -> None:
         for bucket in range(NEW_BUCKET_COUNT):
             pos = info.get_bucket_position(self.key, True, bucket)
-            if self.new_matrix[bucket][pos] == node_id:
-                self._set_new_matrix(bucket, pos, -1)
+            if self.get_new(bucket, pos) == node_id:
+                self.set_new(bucket, pos, EMPTY)
                 info.ref_count -= 1
         assert info.ref_count == 0
         self.new_count -= 1
         cur_bucket = info.get_tried_bucket(self.key)
         cur_bucket_pos = info.get_bucket_position(self.key, False, cur_bucket)
-        if self.tried_matrix[cur_bucket][cur_bucket_pos] != -1:
+        node_id_evict = self.get_tried(cur_bucket, cur_bucket_pos)
+        if node_id_evict != EMPTY:
             # Evict the old node from the tried table.
-            node_id_evict = self.tried_matrix[cur_bucket][cur_bucket_pos]
             assert node_id_evict in self.map_info
             old_info = self.map_info[node_id_evict]
             old_info.is_tried = False
-            self._set_tried_matrix(cur_bucket, cur_bucket_pos, -1)
+            self.set_tried(cur_bucket, cur_bucket_pos, EMPTY)
             self.tried_count -= 1
             # Find its position into new table.
             new_bucket = old_info.get_new_bucket(self.key)
             new_bucket_pos = old_info.get_bucket_position(self.key, True, new_bucket)
             self.clear_new_(new_bucket, new_bucket_pos)
             old_info.ref_count = 1
-            self._set_new_matrix(new_bucket, new_bucket_pos, node_id_evict)
+            self.set_new(new_bucket, new_bucket_pos, node_id_evict)
             self.new_count += 1
-        self._set_tried_matrix(cur_bucket, cur_bucket_pos, node_id)
+        self.set_tried(cur_bucket, cur_bucket_pos, node_id)
         self.tried_count += 1
         info.is_tried = True
 
     def clear_new_(self, bucket: int, pos: int) -> None:
-        if self.new_matrix[bucket][pos] != -1:
-            delete_id = self.new_matrix[bucket][pos]
+        delete_id = self.get_new(bucket, pos)
+        if delete_id != EMPTY:
             delete_info = self.map_info[delete_id]
             assert delete_info.ref_count > 0
             delete_info.ref_count -= 1
-            self._set_new_matrix(bucket, pos, -1)
+            self.set_new(bucket, pos, EMPTY)
             if delete_info.ref_count == 0:
                 self.delete_new_entry_(delete_id)
 
@@ -327,7 +443,7 @@ class AddressManager:
         for n in range(NEW_BUCKET_COUNT):
             cur_new_bucket = (n + bucket_rand) % NEW_BUCKET_COUNT
             cur_new_bucket_pos = info.get_bucket_position(self.key, True, cur_new_bucket)
-            if self.new_matrix[cur_new_bucket][cur_new_bucket_pos] == node_id:
+            if self.get_new(cur_new_bucket, cur_new_bucket_pos) == node_id:
                 new_bucket = cur_new_bucket
                 break
 
@@ -342,7 +458,7 @@ class AddressManager:
         tried_bucket_pos = info.get_bucket_position(self.key, False, tried_bucket)
 
         # Will moving this address into tried evict another entry?
-        if test_before_evict and self.tried_matrix[tried_bucket][tried_bucket_pos] != -1:
+        if test_before_evict and self.get_tried(tried_bucket, tried_bucket_pos) != EMPTY:
             if len(self.tried_collisions) < TRIED_COLLISION_SIZE:
                 if node_id not in self.tried_collisions:
                     self.tried_collisions.append(node_id)
@@ -354,7 +470,7 @@ class AddressManager:
         if info is None or info.random_pos is None:
             return None
         self.swap_random_(info.random_pos, len(self.random_pos) - 1)
-        self.random_pos = self.random_pos[:-1]
+        self.random_pos.pop()
         del self.map_addr[info.peer_info.host]
         del self.map_info[node_id]
         self.new_count -= 1
@@ -404,17 +520,18 @@ class AddressManager:
 
         new_bucket = info.get_new_bucket(self.key, source)
         new_bucket_pos = info.get_bucket_position(self.key, True, new_bucket)
-        if self.new_matrix[new_bucket][new_bucket_pos] != node_id:
-            add_to_new = self.new_matrix[new_bucket][new_bucket_pos] == -1
+        existing_id = self.get_new(new_bucket, new_bucket_pos)
+        if existing_id != node_id:
+            add_to_new = existing_id == EMPTY
             if not add_to_new:
-                info_existing = self.map_info[self.new_matrix[new_bucket][new_bucket_pos]]
+                info_existing = self.map_info[existing_id]
                 if info_existing.is_terrible() or (info_existing.ref_count > 1 and info.ref_count == 0):
                     add_to_new = True
             if add_to_new:
                 self.clear_new_(new_bucket, new_bucket_pos)
                 info.ref_count += 1
                 if node_id is not None:
-                    self._set_new_matrix(new_bucket, new_bucket_pos, node_id)
+                    self.set_new(new_bucket, new_bucket_pos, node_id)
             else:
                 if info.ref_count == 0:
                     if node_id is not None:
@@ -443,62 +560,34 @@ class AddressManager:
 
         # Use a 50% chance for choosing between tried and new table entries.
         if not new_only and self.tried_count > 0 and (self.new_count == 0 or randrange(2) == 0):
-            chance = 1.0
-            start = time.time()
-            cached_tried_matrix_positions: List[Tuple[int, int]] = []
-            if len(self.used_tried_matrix_positions) < math.sqrt(TRIED_BUCKET_COUNT * BUCKET_SIZE):
-                cached_tried_matrix_positions = list(self.used_tried_matrix_positions)
-            while True:
-                if len(self.used_tried_matrix_positions) < math.sqrt(TRIED_BUCKET_COUNT * BUCKET_SIZE):
-                    if len(self.used_tried_matrix_positions) == 0:
-                        log.error(f"Empty tried table, but tried_count shows {self.tried_count}.")
-                        return None
-                    # The table is sparse, randomly pick from positions list.
-                    index = randrange(len(cached_tried_matrix_positions))
-                    tried_bucket, tried_bucket_pos = cached_tried_matrix_positions[index]
-                else:
-                    # The table is dense, randomly trying positions is faster than loading positions list.
-                    tried_bucket = randrange(TRIED_BUCKET_COUNT)
-                    tried_bucket_pos = randrange(BUCKET_SIZE)
-                    while self.tried_matrix[tried_bucket][tried_bucket_pos] == -1:
-                        tried_bucket = (tried_bucket + randbits(LOG_TRIED_BUCKET_COUNT)) % TRIED_BUCKET_COUNT
-                        tried_bucket_pos = (tried_bucket_pos + randbits(LOG_BUCKET_SIZE)) % BUCKET_SIZE
-
-                node_id = self.tried_matrix[tried_bucket][tried_bucket_pos]
-                assert node_id != -1
-                info = self.map_info[node_id]
-                if randbits(30) < (chance * info.get_selection_chance() * (1 << 30)):
-                    end = time.time()
-                    log.debug(f"address_manager.select_peer took {(end - start):.2e} seconds in tried table.")
-                    return info
-                chance *= 1.2
+            table_name = "tried"
+            table = self.tried_table
+            used_positions = self.used_tried_positions
+            count = self.tried_count
         else:
-            chance = 1.0
-            start = time.time()
-            cached_new_matrix_positions: List[Tuple[int, int]] = []
-            if len(self.used_new_matrix_positions) < math.sqrt(NEW_BUCKET_COUNT * BUCKET_SIZE):
-                cached_new_matrix_positions = list(self.used_new_matrix_positions)
-            while True:
-                if len(self.used_new_matrix_positions) < math.sqrt(NEW_BUCKET_COUNT * BUCKET_SIZE):
-                    if len(self.used_new_matrix_positions) == 0:
-                        log.error(f"Empty new table, but new_count shows {self.new_count}.")
-                        return None
-                    index = randrange(len(cached_new_matrix_positions))
-                    new_bucket, new_bucket_pos = cached_new_matrix_positions[index]
-                else:
-                    new_bucket = randrange(NEW_BUCKET_COUNT)
-                    new_bucket_pos = randrange(BUCKET_SIZE)
-                    while self.new_matrix[new_bucket][new_bucket_pos] == -1:
-                        new_bucket = (new_bucket + randbits(LOG_NEW_BUCKET_COUNT)) % NEW_BUCKET_COUNT
-                        new_bucket_pos = (new_bucket_pos + randbits(LOG_BUCKET_SIZE)) % BUCKET_SIZE
-                node_id = self.new_matrix[new_bucket][new_bucket_pos]
-                assert node_id != -1
-                info = self.map_info[node_id]
-                if randbits(30) < chance * info.get_selection_chance() * (1 << 30):
-                    end = time.time()
-                    log.debug(f"address_manager.select_peer took {(end - start):.2e} seconds in new table.")
-                    return info
-                chance *= 1.2
+            table_name = "new"
+            table = self.new_table
+            used_positions = self.used_new_positions
+            count = self.new_count
+
+        if len(used_positions) == 0:
+            log.error(f"Empty {table_name} table, but {table_name}_count shows {count}.")
+            return None
+
+        # pick uniformly among the used positions, accepting the entry with
+        # its selection chance (raised after each rejection)
+        chance = 1.0
+        start = time.time()
+        now = int(math.floor(start))
+        while True:
+            node_id = table[used_positions.random()]
+            assert node_id != EMPTY
+            info = self.map_info[node_id]
+            if randbits(30) < chance * info.get_selection_chance(now) * (1 << 30):
+                end = time.time()
+                log.debug(f"address_manager.select_peer took {(end - start):.2e} seconds in {table_name} table.")
+                return info
+            chance *= 1.2
 
     def resolve_tried_collisions_(self) -> None:
         for node_id in self.tried_collisions[:]:
@@ -510,8 +599,8 @@ class AddressManager:
                 peer = info.peer_info
                 tried_bucket = info.get_tried_bucket(self.key)
                 tried_bucket_pos = info.get_bucket_position(self.key, False, tried_bucket)
-                if self.tried_matrix[tried_bucket][tried_bucket_pos] != -1:
-                    old_id = self.tried_matrix[tried_bucket][tried_bucket_pos]
+                old_id = self.get_tried(tried_bucket, tried_bucket_pos)
+                if old_id != EMPTY:
                     old_info = self.map_info[old_id]
                     if time.time() - old_info.last_success < 4 * 60 * 60:
                         resolved = True
@@ -539,7 +628,7 @@ class AddressManager:
         tried_bucket = new_info.get_tried_bucket(self.key)
         tried_bucket_pos = new_info.get_bucket_position(self.key, False, tried_bucket)
 
-        old_id = self.tried_matrix[tried_bucket][tried_bucket_pos]
+        old_id = self.get_tried(tried_bucket, tried_bucket_pos)
         return self.map_info[old_id]
 
     def get_peers_(self) -> List[TimestampedPeerInfo]:
@@ -566,16 +655,14 @@ class AddressManager:
 
     def cleanup(self, max_timestamp_difference: int, max_consecutive_failures: int) -> None:
         now = int(math.floor(time.time()))
-        for bucket in range(NEW_BUCKET_COUNT):
-            for pos in range(BUCKET_SIZE):
-                if self.new_matrix[bucket][pos] != -1:
-                    node_id = self.new_matrix[bucket][pos]
-                    cur_info = self.map_info[node_id]
-                    if (
-                        cur_info.timestamp < now - max_timestamp_difference
-                        and cur_info.num_attempts >= max_consecutive_failures
-                    ):
-                        self.clear_new_(bucket, pos)
+        # clear_new_() modifies the used positions
+        for position in list(self.used_new_positions):
+            cur_info = self.map_info[self.new_table[position]]
+            if (
+                cur_info.timestamp < now - max_timestamp_difference
+                and cur_info.num_attempts >= max_consecutive_failures
+            ):
+                self.clear_new_(position // BUCKET_SIZE, position % BUCKET_SIZE)
 
     def connect_(self, addr: PeerInfo, timestamp: int) -> None:
         info, _ = self.find_(addr)
@@ -1,27 +1,31 @@
 from __future__ import annotations
 
-import asyncio
 import logging
+import struct
 from dataclasses import dataclass
 from pathlib import Path
 from timeit import default_timer as timer
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import aiofiles
 
-from chia.server.address_manager import (
-    BUCKET_SIZE,
-    NEW_BUCKET_COUNT,
-    NEW_BUCKETS_PER_ADDRESS,
-    AddressManager,
-    ExtendedPeerInfo,
-)
+from chia.server.address_manager import EMPTY, NEW_BUCKETS_PER_ADDRESS, AddressManager, ExtendedPeerInfo
 from chia.util.files import write_file_async
 from chia.util.ints import uint64
 from chia.util.streamable import Streamable, streamable
 
 log = logging.getLogger(__name__)
 
+# peers files starting with this are in the binary format, written by
+# AddressManagerStore.serialize(). Anything else is read as a (legacy)
+# PeerDataSerialization
+PEERS_FILE_MAGIC = b"peers-v2"
+# key, new node count, tried node count
+_HEADER = struct.Struct("!32sII")
+_COUNT = struct.Struct("!I")
+# node index, bucket
+_NEW_TABLE_ENTRY = struct.Struct("!IH")
+
 
 @streamable
 @dataclass(frozen=True)
@@ -35,45 +39,62 @@ class PeerDataSerialization(Streamable):
     new_table: List[Tuple[uint64, uint64]]
 
 
-async def makePeerDataSerialization(
-    metadata: List[Tuple[str, Any]], nodes: List[Tuple[int, ExtendedPeerInfo]], new_table: List[Tuple[int, int]]
-) -> bytes:
+@dataclass(frozen=True)
+class PeerDataSnapshot:
     """
-    Create a PeerDataSerialization, adapting the provided collections
+    The peer data to be stored, taken while holding the address manager lock,
+    so it can be encoded and written without it.
     """
-    transformed_nodes: List[Tuple[uint64, str]] = []
-    transformed_new_table: List[Tuple[uint64, uint64]] = []
 
-    for index, [node_id, peer_info] in enumerate(nodes):
-        transformed_nodes.append((uint64(node_id), peer_info.to_string()))
-        # Come up to breathe for a moment
-        if index % 1000 == 0:
-            await asyncio.sleep(0)
+    key: int
+    new_count: int
+    # the encoded ExtendedPeerInfos of the nodes in the new table, followed by
+    # the ones in the tried table
+    nodes: List[bytes]
+    # (index into nodes, bucket) for every entry in the new table
+    new_table: List[Tuple[int, int]]
 
-    for index, [node_id, bucket_id] in enumerate(new_table):
-        transformed_new_table.append((uint64(node_id), uint64(bucket_id)))
-        # Come up to breathe for a moment
-        if index % 1000 == 0:
-            await asyncio.sleep(0)
+    @classmethod
+    def create(cls, address_manager: AddressManager) -> PeerDataSnapshot:
+        nodes: List[bytes] = []
+        unique_ids: Dict[int, int] = {}
+        for node_id, info in address_manager.map_info.items():
+            if info.ref_count > 0:
+                unique_ids[node_id] = len(nodes)
+                # entries only re-encode when their timestamp changed since the previous snapshot
+                nodes.append(info.encode())
+        new_count = len(nodes)
+        for info in address_manager.map_info.values():
+            if info.is_tried:
+                nodes.append(info.encode())
+        new_table = [(unique_ids[node_id], bucket) for node_id, bucket in address_manager.new_table_entries()]
+        return cls(address_manager.key, new_count, nodes, new_table)
 
-    serialized_bytes: bytes = bytes(PeerDataSerialization(metadata, transformed_nodes, transformed_new_table))
-    return serialized_bytes
+    def to_bytes(self) -> bytes:
+        parts = [
+            PEERS_FILE_MAGIC,
+            _HEADER.pack(self.key.to_bytes(32, byteorder="big"), self.new_count, len(self.nodes) - self.new_count),
+        ]
+        parts.extend(self.nodes)
+        parts.append(_COUNT.pack(len(self.new_table)))
+        parts.extend(_NEW_TABLE_ENTRY.pack(index, bucket) for index, bucket in self.new_table)
+        return b"".join(parts)
 
 
 class AddressManagerStore:
     """
-    Metadata table:
+    Header:
     - private key
     - new table count
     - tried table count
-    Nodes table:
-    * Maps entries from new/tried table to unique node ids.
-    - node_id
-    - IP, port, together with the IP, port of the source peer.
+    Nodes:
+    * The entries of the new table, followed by the ones of the tried table.
+      An entry's index is its node id.
+    - IP, port, timestamp, together with the IP, port of the source peer.
     New table:
     * Stores node_id, bucket for each occurrence in the new table of an entry.
     * Once we know the buckets, we can also deduce the bucket positions.
-    Every other information, such as tried_matrix, map_addr, map_info, random_pos,
+    Every other information, such as the tried table, map_addr, map_info, random_pos,
     be deduced and it is not explicitly stored, instead it is recalculated.
     """
 
@@ -99,46 +120,20 @@ class AddressManagerStore:
     @classmethod
     async def serialize(cls, address_manager: AddressManager, peers_file_path: Path) -> None:
         """
-        Serialize the address manager's peer data to a file.
+        Serialize the address manager's peer data to a file. The address
+        manager lock is only held while taking the snapshot, not while writing.
         """
-        metadata: List[Tuple[str, str]] = []
-        nodes: List[Tuple[int, ExtendedPeerInfo]] = []
-        new_table_entries: List[Tuple[int, int]] = []
-        unique_ids: Dict[int, int] = {}
-        count_ids: int = 0
-
         log.info("Serializing peer data")
-        metadata.append(("key", str(address_manager.key)))
-
-        for node_id, info in address_manager.map_info.items():
-            unique_ids[node_id] = count_ids
-            if info.ref_count > 0:
-                assert count_ids != address_manager.new_count
-                nodes.append((count_ids, info))
-                count_ids += 1
-        metadata.append(("new_count", str(count_ids)))
-
-        tried_ids = 0
-        for node_id, info in address_manager.map_info.items():
-            if info.is_tried:
-                assert info is not None
-                assert tried_ids != address_manager.tried_count
-                nodes.append((count_ids, info))
-                count_ids += 1
-                tried_ids += 1
-        metadata.append(("tried_count", str(tried_ids)))
-
-        for bucket in range(NEW_BUCKET_COUNT):
-            for i in range(BUCKET_SIZE):
-                if address_manager.new_matrix[bucket][i] != -1:
-                    index = unique_ids[address_manager.new_matrix[bucket][i]]
-                    new_table_entries.append((index, bucket))
+        start_time = timer()
+        async with address_manager.lock:
+            snapshot = PeerDataSnapshot.create(address_manager)
+        log.debug(f"Taking peer data snapshot took {timer() - start_time} seconds")
 
         try:
             # Ensure the parent directory exists
             peers_file_path.parent.mkdir(parents=True, exist_ok=True)
             start_time = timer()
-            await cls._write_peers(peers_file_path, metadata, nodes, new_table_entries)
+            await write_file_async(peers_file_path, snapshot.to_bytes(), file_mode=0o644)
             log.debug(f"Serializing peer data took {timer() - start_time} seconds")
         except Exception:
             log.exception(f"Failed to write peer data to {peers_file_path}")
@@ -148,90 +143,85 @@ class AddressManagerStore:
         """
         Create an address manager using data deserialized from a peers file.
         """
-        peer_data: Optional[PeerDataSerialization] = None
         address_manager = AddressManager()
         start_time = timer()
         try:
-            peer_data = await cls._read_peers(peers_file_path)
+            data = await cls._read_peers(peers_file_path)
+            if data.startswith(PEERS_FILE_MAGIC):
+                key, new_count, nodes, new_table_entries = cls._decode(data)
+            else:
+                key, new_count, nodes, new_table_entries = cls._decode_legacy(data)
         except Exception:
             log.exception(f"Unable to deserialize peers from {peers_file_path}")
-
-        if peer_data is not None:
-            metadata: Dict[str, str] = {key: value for key, value in peer_data.metadata}
-            nodes: List[Tuple[int, ExtendedPeerInfo]] = [
-                (node_id, ExtendedPeerInfo.from_string(info_str)) for node_id, info_str in peer_data.nodes
-            ]
-            new_table_entries: List[Tuple[int, int]] = [(node_id, bucket) for node_id, bucket in peer_data.new_table]
-            log.debug(f"Deserializing peer data took {timer() - start_time} seconds")
-
-            address_manager.key = int(metadata["key"])
-            address_manager.new_count = int(metadata["new_count"])
-            # address_manager.tried_count = int(metadata["tried_count"])
-            address_manager.tried_count = 0
-
-            new_table_nodes = [(node_id, info) for node_id, info in nodes if node_id < address_manager.new_count]
-            for n, info in new_table_nodes:
-                address_manager.map_addr[info.peer_info.host] = n
-                address_manager.map_info[n] = info
+            return address_manager
+        log.debug(f"Deserializing peer data took {timer() - start_time} seconds")
+
+        address_manager.key = key
+        address_manager.new_count = new_count
+        address_manager.tried_count = 0
+
+        for n, info in enumerate(nodes[:new_count]):
+            address_manager.map_addr[info.peer_info.host] = n
+            address_manager.map_info[n] = info
+            info.random_pos = len(address_manager.random_pos)
+            address_manager.random_pos.append(n)
+        address_manager.id_count = new_count
+
+        for info in nodes[new_count:]:
+            tried_bucket = info.get_tried_bucket(address_manager.key)
+            tried_bucket_pos = info.get_bucket_position(address_manager.key, False, tried_bucket)
+            if address_manager.get_tried(tried_bucket, tried_bucket_pos) == EMPTY:
                 info.random_pos = len(address_manager.random_pos)
-                address_manager.random_pos.append(n)
-            address_manager.id_count = len(new_table_nodes)
-            tried_table_nodes = [(node_id, info) for node_id, info in nodes if node_id >= address_manager.new_count]
-            # lost_count = 0
-            for node_id, info in tried_table_nodes:
-                tried_bucket = info.get_tried_bucket(address_manager.key)
-                tried_bucket_pos = info.get_bucket_position(address_manager.key, False, tried_bucket)
-                if address_manager.tried_matrix[tried_bucket][tried_bucket_pos] == -1:
-                    info.random_pos = len(address_manager.random_pos)
-                    info.is_tried = True
-                    id_count = address_manager.id_count
-                    address_manager.random_pos.append(id_count)
-                    address_manager.map_info[id_count] = info
-                    address_manager.map_addr[info.peer_info.host] = id_count
-                    address_manager.tried_matrix[tried_bucket][tried_bucket_pos] = id_count
-                    address_manager.id_count += 1
-                    address_manager.tried_count += 1
-                # else:
-                #    lost_count += 1
-
-            # address_manager.tried_count -= lost_count
-            for node_id, bucket in new_table_entries:
-                if node_id >= 0 and node_id < address_manager.new_count:
-                    info = address_manager.map_info[node_id]
-                    bucket_pos = info.get_bucket_position(address_manager.key, True, bucket)
-                    if (
-                        address_manager.new_matrix[bucket][bucket_pos] == -1
-                        and info.ref_count < NEW_BUCKETS_PER_ADDRESS
-                    ):
-                        info.ref_count += 1
-                        address_manager.new_matrix[bucket][bucket_pos] = node_id
-
-            for node_id, info in list(address_manager.map_info.items()):
-                if not info.is_tried and info.ref_count == 0:
-                    address_manager.delete_new_entry_(node_id)
-
-            address_manager.load_used_table_positions()
+                info.is_tried = True
+                id_count = address_manager.id_count
+                address_manager.random_pos.append(id_count)
+                address_manager.map_info[id_count] = info
+                address_manager.map_addr[info.peer_info.host] = id_count
+                address_manager.set_tried(tried_bucket, tried_bucket_pos, id_count)
+                address_manager.id_count += 1
+                address_manager.tried_count += 1
+
+        for node_id, bucket in new_table_entries:
+            if node_id >= 0 and node_id < new_count:
+                info = address_manager.map_info[node_id]
+                bucket_pos = info.get_bucket_position(address_manager.key, True, bucket)
+                if address_manager.get_new(bucket, bucket_pos) == EMPTY and info.ref_count < NEW_BUCKETS_PER_ADDRESS:
+                    info.ref_count += 1
+                    address_manager.set_new(bucket, bucket_pos, node_id)
+
+        for node_id, info in list(address_manager.map_info.items()):
+            if not info.is_tried and info.ref_count == 0:
+                address_manager.delete_new_entry_(node_id)
 
         return address_manager
 
     @classmethod
-    async def _read_peers(cls, peers_file_path: Path) -> PeerDataSerialization:
-        """
-        Read the peers file and return the data as a PeerDataSerialization object.
-        """
-        async with aiofiles.open(peers_file_path, "rb") as f:
-            return PeerDataSerialization.from_bytes(await f.read())
+    def _decode(cls, data: bytes) -> Tuple[int, int, List[ExtendedPeerInfo], List[Tuple[int, int]]]:
+        offset = len(PEERS_FILE_MAGIC)
+        key_bytes, new_count, tried_count = _HEADER.unpack_from(data, offset)
+        offset += _HEADER.size
+        nodes: List[ExtendedPeerInfo] = []
+        for _ in range(new_count + tried_count):
+            info, offset = ExtendedPeerInfo.decode(data, offset)
+            nodes.append(info)
+        (num_entries,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        new_table_entries: List[Tuple[int, int]] = [
+            _NEW_TABLE_ENTRY.unpack_from(data, offset + i * _NEW_TABLE_ENTRY.size) for i in range(num_entries)
+        ]
+        return int.from_bytes(key_bytes, byteorder="big"), new_count, nodes, new_table_entries
 
     @classmethod
-    async def _write_peers(
-        cls,
-        peers_file_path: Path,
-        metadata: List[Tuple[str, Any]],
-        nodes: List[Tuple[int, ExtendedPeerInfo]],
-        new_table: List[Tuple[int, int]],
-    ) -> None:
-        """
-        Serializes the given peer data and writes it to the peers file.
-        """
-        serialized_bytes: bytes = await makePeerDataSerialization(metadata, nodes, new_table)
-        await write_file_async(peers_file_path, serialized_bytes, file_mode=0o644)
+    def _decode_legacy(cls, data: bytes) -> Tuple[int, int, List[ExtendedPeerInfo], List[Tuple[int, int]]]:
+        peer_data = PeerDataSerialization.from_bytes(data)
+        metadata: Dict[str, str] = {key: value for key, value in peer_data.metadata}
+        nodes: List[ExtendedPeerInfo] = [
+            ExtendedPeerInfo.from_string(info_str) for _, info_str in sorted(peer_data.nodes, key=lambda n: n[0])
+        ]
+        new_table_entries: List[Tuple[int, int]] = [(node_id, bucket) for node_id, bucket in peer_data.new_table]
+        return int(metadata["key"]), int(metadata["new_count"]), nodes, new_table_entries
+
+    @classmethod
+    async def _read_peers(cls, peers_file_path: Path) -> bytes:
+        async with aiofiles.open(peers_file_path, "rb") as f:
+            return await f.read()
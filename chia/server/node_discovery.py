@@ -29,6 +29,14 @@ from chia.util.network import IPAddress, resolve
 MAX_PEERS_RECEIVED_PER_REQUEST = 1000
 MAX_TOTAL_PEERS_RECEIVED = 3000
 MAX_CONCURRENT_OUTBOUND_CONNECTIONS = 70
+# while more outbound connections are needed, up to this many candidates are
+# dialed at once (in addition to the number of peers needed), the first to
+# connect win
+MAX_DIAL_CANDIDATES = 8
+EXTRA_DIAL_CANDIDATES = 2
+# happy eyeballs style staggering, the next candidate is dialed after this
+# many seconds, or as soon as an earlier attempt fails
+DIAL_STAGGER_SECONDS = 0.25
 NETWORK_ID_DEFAULT_PORTS = {
     "mainnet": 18888,
     "testnet0": 19988,
@@ -221,10 +229,14 @@ class FullNodeDiscovery:
         else:
             await self.on_connect(peer)
 
-    async def start_client_async(self, addr: PeerInfo, is_feeler: bool) -> None:
+    async def start_client_async(self, addr: PeerInfo, is_feeler: bool) -> bool:
+        """
+        Returns True if we connected to addr.
+        """
+        client_connected = False
         try:
             if self.address_manager is None:
-                return
+                return False
             self.pending_outbound_connections.add(addr.host)
             client_connected = await self.server.start_client(
                 addr,
@@ -239,13 +251,47 @@ class FullNodeDiscovery:
                     await self.address_manager.mark_good(addr)
                     await self.address_manager.connect(addr)
                 else:
+                    self.server.peer_scores.record_failure(addr.host)
                     await self.address_manager.attempt(addr, True)
             self.pending_outbound_connections.remove(addr.host)
+        except asyncio.CancelledError:
+            self.pending_outbound_connections.discard(addr.host)
+            raise
         except Exception as e:
             if addr.host in self.pending_outbound_connections:
                 self.pending_outbound_connections.remove(addr.host)
             self.log.error(f"Exception in create outbound connections: {e}")
             self.log.error(f"Traceback: {traceback.format_exc()}")
+        return client_connected
+
+    async def _race_connections(self, candidates: List[PeerInfo], needed: int, is_feeler: bool) -> None:
+        """
+        Dials the candidates, best scored first, until needed of them are
+        connected. Attempts are staggered (happy eyeballs style): the next
+        candidate is dialed DIAL_STAGGER_SECONDS after the previous one, or as
+        soon as an attempt fails, so a slow or dead peer doesn't hold up the
+        others. The attempts still under way once enough peers are connected
+        are cancelled.
+        """
+        remaining = self.server.peer_scores.rank(candidates)
+        attempts: Set[asyncio.Task[bool]] = set()
+        connected = 0
+        try:
+            while connected < needed and (len(remaining) > 0 or len(attempts) > 0):
+                if len(remaining) > 0:
+                    addr = remaining.pop(0)
+                    attempts.add(asyncio.create_task(self.start_client_async(addr, is_feeler)))
+                    timeout: Optional[float] = DIAL_STAGGER_SECONDS if len(remaining) > 0 else None
+                else:
+                    timeout = None
+                done, attempts = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                connected += sum(1 for task in done if task.result())
+        finally:
+            # the attempts still under way would overshoot the outbound target
+            for task in attempts:
+                task.cancel()
+            if len(attempts) > 0:
+                await asyncio.gather(*attempts, return_exceptions=True)
 
     async def _connect_to_peers(self, random: Random) -> None:
         next_feeler = self._poisson_next_send(time.time() * 1000 * 1000, 240, random)
@@ -330,18 +376,25 @@ class FullNodeDiscovery:
                         next_feeler = self._poisson_next_send(time.time() * 1000 * 1000, 240, random)
                         is_feeler = True
 
+                # when outbound connections are needed, several candidates in
+                # distinct network groups are raced against each other
+                num_candidates = 1
+                if not is_feeler and self._num_needed_peers() > 1:
+                    num_candidates = min(MAX_DIAL_CANDIDATES, self._num_needed_peers() + EXTRA_DIAL_CANDIDATES)
+
                 await self.address_manager.resolve_tried_collisions()
                 tries = 0
                 now = time.time()
-                got_peer = False
+                candidates: List[PeerInfo] = []
                 addr: Optional[PeerInfo] = None
                 max_tries = 50
                 if len(groups) < 3:
                     max_tries = 10
                 elif len(groups) <= 5:
                     max_tries = 25
+                max_tries += num_candidates - 1
                 select_peer_interval = max(0.1, len(groups) * 0.25)
-                while not got_peer and not self.is_closed:
+                while len(candidates) < num_candidates and not self.is_closed:
                     self.log.debug(f"Address manager query count: {tries}. Query limit: {max_tries}")
                     try:
                         await asyncio.sleep(select_peer_interval)
@@ -349,29 +402,31 @@ class FullNodeDiscovery:
                         return None
                     tries += 1
                     if tries > max_tries:
-                        addr = None
-                        retry_introducers = True
+                        if len(candidates) == 0:
+                            retry_introducers = True
                         break
                     info: Optional[ExtendedPeerInfo] = await self.address_manager.select_tried_collision()
                     if info is None or time.time() - last_collision_timestamp <= 60:
                         info = await self.address_manager.select_peer(is_feeler)
-                    else:
+                    elif len(candidates) == 0:
                         has_collision = True
                         last_collision_timestamp = int(time.time())
+                    else:
+                        # resolve the collision on its own, next time around
+                        break
                     if info is None:
-                        if not is_feeler:
+                        if not is_feeler and len(candidates) == 0:
                             retry_introducers = True
                         break
                     # Require outbound connections, other than feelers,
                     # to be to distinct network groups.
                     addr = info.peer_info
                     if has_collision:
+                        candidates.append(addr)
                         break
                     if not is_feeler and addr.get_group() in groups:
-                        addr = None
                         continue
-                    if addr in connected:
-                        addr = None
+                    if addr in connected or addr in candidates or addr.host in self.pending_outbound_connections:
                         continue
                     # attempt a node once per 30 minutes.
                     if now - info.last_try < 1800:
@@ -381,8 +436,11 @@ class FullNodeDiscovery:
                         last_timestamp_local_info = uint64(int(time.time()))
                     if local_peerinfo is not None and addr == local_peerinfo:
                         continue
-                    got_peer = True
+                    candidates.append(addr)
+                    groups.add(addr.get_group())
                     self.log.debug(f"Addrman selected address: {addr}.")
+                    # the next candidate doesn't need to wait
+                    select_peer_interval = 0
 
                 disconnect_after_handshake = is_feeler
                 extra_peers_needed = self._num_needed_peers()
@@ -395,12 +453,16 @@ class FullNodeDiscovery:
                 if not initiate_connection:
                     connect_peer_interval += 15
                 connect_peer_interval = min(connect_peer_interval, self.peer_connect_interval)
-                if addr is not None and initiate_connection and addr.host not in self.pending_outbound_connections:
+                if len(candidates) > 0 and initiate_connection:
                     if len(self.pending_outbound_connections) >= MAX_CONCURRENT_OUTBOUND_CONNECTIONS:
                         self.log.debug("Max concurrent outbound connections reached. waiting")
                         await asyncio.wait(self.pending_tasks, return_when=asyncio.FIRST_COMPLETED)
                     self.pending_tasks.add(
-                        asyncio.create_task(self.start_client_async(addr, disconnect_after_handshake))
+                        asyncio.create_task(
+                            self._race_connections(
+                                candidates, max(1, min(extra_peers_needed, len(candidates))), disconnect_after_handshake
+                            )
+                        )
                     )
 
                 await asyncio.sleep(connect_peer_interval)
@@ -419,8 +481,8 @@ class FullNodeDiscovery:
                 continue
             serialize_interval = random.randint(15 * 60, 30 * 60)
             await asyncio.sleep(serialize_interval)
-            async with self.address_manager.lock:
-                await AddressManagerStore.serialize(self.address_manager, self.peers_file_path)
+            # this takes the address manager lock while taking the snapshot to write
+            await AddressManagerStore.serialize(self.address_manager, self.peers_file_path)
 
     async def _periodically_cleanup(self) -> None:
         while not self.is_closed:
@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field
 from enum import IntEnum
-from typing import Optional, SupportsBytes, Union
+from typing import Dict, Optional, SupportsBytes, Union
 
 from chia.protocols.protocol_message_types import ProtocolMessageTypes
 from chia.util.ints import uint8, uint16
@@ -31,3 +32,70 @@ class Message(Streamable):
 
 def make_msg(msg_type: ProtocolMessageTypes, data: Union[bytes, SupportsBytes]) -> Message:
     return Message(uint8(msg_type.value), None, bytes(data))
+
+
+@dataclass
+class BroadcastMetrics:
+    """
+    Statistics about messages broadcast to many peers. The fan-out time is
+    the time from the start of a broadcast until the message was written to
+    the last peer's connection.
+    """
+
+    broadcasts: int = 0
+    bytes_sent: int = 0
+    last_fan_out_seconds: float = 0.0
+    avg_fan_out_seconds: float = 0.0
+    max_fan_out_seconds: float = 0.0
+
+    def record_broadcast(self, message_size: int, num_peers: int) -> None:
+        self.broadcasts += 1
+        self.bytes_sent += message_size * num_peers
+
+    def record_fan_out(self, seconds: float) -> None:
+        self.last_fan_out_seconds = seconds
+        # exponential moving average
+        self.avg_fan_out_seconds = 0.9 * self.avg_fan_out_seconds + 0.1 * seconds
+        self.max_fan_out_seconds = max(self.max_fan_out_seconds, seconds)
+
+    def to_json_dict(self) -> Dict[str, Union[int, float]]:
+        return {
+            "broadcasts": self.broadcasts,
+            "bytes_sent": self.bytes_sent,
+            "last_fan_out_seconds": self.last_fan_out_seconds,
+            "avg_fan_out_seconds": self.avg_fan_out_seconds,
+            "max_fan_out_seconds": self.max_fan_out_seconds,
+        }
+
+
+@dataclass
+class BroadcastFanOut:
+    """
+    Tracks a single broadcast message until every connection it was handed to
+    has written (or dropped) it.
+    """
+
+    metrics: BroadcastMetrics
+    pending: int
+    start: float = field(default_factory=time.monotonic)
+
+    def done(self) -> None:
+        self.pending -= 1
+        if self.pending == 0:
+            self.metrics.record_fan_out(time.monotonic() - self.start)
+
+
+@dataclass(frozen=True)
+class SerializedMessage:
+    """
+    A Message along with its serialized bytes. A message broadcast to many
+    peers is serialized once and the same bytes are shared by all connections.
+    """
+
+    message: Message
+    data: bytes
+    fan_out: Optional[BroadcastFanOut] = None
+
+    @classmethod
+    def create(cls, message: Message, fan_out: Optional[BroadcastFanOut] = None) -> SerializedMessage:
+        return cls(message, bytes(message), fan_out)
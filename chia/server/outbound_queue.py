@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Deque, Dict, List, Optional, Set
+
+from chia.protocols.protocol_message_types import ProtocolMessageTypes
+from chia.server.outbound_message import SerializedMessage
+
+# once this many bytes are queued for a peer, senders wait for the queue to
+# drain before adding more (broadcasts excepted, see OutboundQueue.put())
+MAX_QUEUED_BYTES = 32 * 1024 * 1024
+
+# the outbound handler takes up to this many bytes off the queue at a time and
+# writes them back to back
+MAX_BATCH_BYTES = 1024 * 1024
+
+# how long a message type is held back after we hit our own rate limit for it
+RATE_LIMIT_RETRY_SECONDS = 1.0
+
+
+class OutboundPriority(IntEnum):
+    CONSENSUS = 0
+    RESPONSE = 1
+    DEFAULT = 2
+    MEMPOOL = 3
+
+
+_CONSENSUS_MESSAGE_TYPES: Set[int] = {
+    t.value
+    for t in [
+        ProtocolMessageTypes.handshake,
+        ProtocolMessageTypes.new_proof_of_space,
+        ProtocolMessageTypes.request_signatures,
+        ProtocolMessageTypes.respond_signatures,
+        ProtocolMessageTypes.new_signage_point,
+        ProtocolMessageTypes.declare_proof_of_space,
+        ProtocolMessageTypes.request_signed_values,
+        ProtocolMessageTypes.signed_values,
+        ProtocolMessageTypes.new_peak_timelord,
+        ProtocolMessageTypes.new_unfinished_block_timelord,
+        ProtocolMessageTypes.new_infusion_point_vdf,
+        ProtocolMessageTypes.new_signage_point_vdf,
+        ProtocolMessageTypes.new_end_of_sub_slot_vdf,
+        ProtocolMessageTypes.new_peak,
+        ProtocolMessageTypes.respond_block,
+        ProtocolMessageTypes.new_unfinished_block,
+        ProtocolMessageTypes.new_unfinished_block2,
+        ProtocolMessageTypes.respond_unfinished_block,
+        ProtocolMessageTypes.new_signage_point_or_end_of_sub_slot,
+        ProtocolMessageTypes.respond_signage_point,
+        ProtocolMessageTypes.respond_end_of_sub_slot,
+        ProtocolMessageTypes.new_peak_wallet,
+        ProtocolMessageTypes.new_signage_point_harvester,
+    ]
+}
+
+_MEMPOOL_MESSAGE_TYPES: Set[int] = {
+    t.value
+    for t in [
+        ProtocolMessageTypes.new_transaction,
+        ProtocolMessageTypes.request_transaction,
+        ProtocolMessageTypes.respond_transaction,
+        ProtocolMessageTypes.request_mempool_transactions,
+        ProtocolMessageTypes.new_compact_vdf,
+        ProtocolMessageTypes.request_compact_vdf,
+        ProtocolMessageTypes.respond_compact_vdf,
+        ProtocolMessageTypes.request_peers,
+        ProtocolMessageTypes.respond_peers,
+    ]
+}
+
+# Announcements. Sending the same one twice tells the peer nothing new, so an
+# identical message that's still queued is only sent once
+_COALESCED_MESSAGE_TYPES: Set[int] = {
+    t.value
+    for t in [
+        ProtocolMessageTypes.new_signage_point,
+        ProtocolMessageTypes.new_peak_timelord,
+        ProtocolMessageTypes.new_peak,
+        ProtocolMessageTypes.new_transaction,
+        ProtocolMessageTypes.new_unfinished_block,
+        ProtocolMessageTypes.new_unfinished_block2,
+        ProtocolMessageTypes.new_signage_point_or_end_of_sub_slot,
+        ProtocolMessageTypes.new_compact_vdf,
+        ProtocolMessageTypes.new_peak_wallet,
+        ProtocolMessageTypes.new_signage_point_harvester,
+    ]
+}
+
+
+def message_priority(message: SerializedMessage) -> OutboundPriority:
+    if message.message.type in _CONSENSUS_MESSAGE_TYPES:
+        return OutboundPriority.CONSENSUS
+    if message.message.id is not None:
+        return OutboundPriority.RESPONSE
+    if message.message.type in _MEMPOOL_MESSAGE_TYPES:
+        return OutboundPriority.MEMPOOL
+    return OutboundPriority.DEFAULT
+
+
+def _coalesced(message: SerializedMessage) -> bool:
+    return message.message.id is None and message.message.type in _COALESCED_MESSAGE_TYPES
+
+
+@dataclass
+class OutboundQueue:
+    """
+    The messages waiting to be sent to one peer. Messages are taken off the
+    queue by priority (consensus messages first, mempool traffic last) and in
+    FIFO order within a priority. Message types we've rate limited ourselves
+    on are held back, without reordering messages of the same type.
+    """
+
+    max_bytes: int = MAX_QUEUED_BYTES
+    _queues: Dict[OutboundPriority, Deque[SerializedMessage]] = field(
+        default_factory=lambda: {priority: deque() for priority in OutboundPriority}
+    )
+    # the serialized coalesced messages currently in the queue
+    _queued_announcements: Set[bytes] = field(default_factory=set)
+    # message type -> time.monotonic() until which it's held back
+    _paused: Dict[int, float] = field(default_factory=dict)
+    _size: int = 0
+    _count: int = 0
+    _not_empty: asyncio.Event = field(default_factory=asyncio.Event)
+    _not_full: asyncio.Event = field(default_factory=asyncio.Event)
+    _closed: bool = False
+    coalesced: int = 0
+
+    def __post_init__(self) -> None:
+        self._not_full.set()
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+    def close(self) -> None:
+        self._closed = True
+        self._not_empty.set()
+        self._not_full.set()
+
+    async def put(self, message: SerializedMessage) -> bool:
+        """
+        Adds a message to the queue, waiting while the queue is full. Messages
+        that are part of a broadcast don't wait, a slow peer shouldn't hold up
+        the broadcast to everyone else. Returns False if the queue is closed.
+        """
+        if message.fan_out is None:
+            while self._size >= self.max_bytes and not self._closed:
+                self._not_full.clear()
+                await self._not_full.wait()
+        if self._closed:
+            return False
+
+        if _coalesced(message):
+            if message.data in self._queued_announcements:
+                self.coalesced += 1
+                if message.fan_out is not None:
+                    message.fan_out.done()
+                return True
+        self._append(message)
+        return True
+
+    def drain(self) -> List[SerializedMessage]:
+        """
+        Removes and returns all the queued messages, e.g. the ones left when
+        the connection closes.
+        """
+        messages = [message for queue in self._queues.values() for message in queue]
+        for queue in self._queues.values():
+            queue.clear()
+        self._queued_announcements.clear()
+        self._size = 0
+        self._count = 0
+        self._not_full.set()
+        return messages
+
+    def defer(self, messages: List[SerializedMessage], seconds: float = RATE_LIMIT_RETRY_SECONDS) -> None:
+        """
+        Puts messages that couldn't be sent yet back at the front of the queue
+        and holds back their types for the given number of seconds.
+        """
+        until = time.monotonic() + seconds
+        for message in reversed(messages):
+            self._paused[message.message.type] = until
+            self._append(message, front=True)
+
+    async def get_batch(self, max_bytes: int = MAX_BATCH_BYTES) -> List[SerializedMessage]:
+        """
+        Waits for messages that can be sent and returns them, highest priority
+        first, up to about max_bytes. Returns an empty list if the queue is
+        closed.
+        """
+        while not self._closed:
+            batch = self._take(max_bytes)
+            if len(batch) > 0:
+                return batch
+            self._not_empty.clear()
+            try:
+                await asyncio.wait_for(self._not_empty.wait(), timeout=self._next_unpause())
+            except asyncio.TimeoutError:
+                pass
+        return []
+
+    def _append(self, message: SerializedMessage, front: bool = False) -> None:
+        queue = self._queues[message_priority(message)]
+        if front:
+            queue.appendleft(message)
+        else:
+            queue.append(message)
+        if _coalesced(message):
+            self._queued_announcements.add(message.data)
+        self._size += len(message.data)
+        self._count += 1
+        self._not_empty.set()
+
+    def _take(self, max_bytes: int) -> List[SerializedMessage]:
+        now = time.monotonic()
+        self._paused = {message_type: until for message_type, until in self._paused.items() if until > now}
+
+        batch: List[SerializedMessage] = []
+        batch_size = 0
+        for priority in OutboundPriority:
+            queue = self._queues[priority]
+            held_back: List[SerializedMessage] = []
+            while len(queue) > 0 and batch_size < max_bytes:
+                message = queue.popleft()
+                if message.message.type in self._paused:
+                    held_back.append(message)
+                    continue
+                batch.append(message)
+                batch_size += len(message.data)
+            queue.extendleft(reversed(held_back))
+
+        for message in batch:
+            if _coalesced(message):
+                self._queued_announcements.discard(message.data)
+        self._size -= batch_size
+        self._count -= len(batch)
+        if self._size < self.max_bytes:
+            self._not_full.set()
+        return batch
+
+    def _next_unpause(self) -> Optional[float]:
+        if self._count == 0 or len(self._paused) == 0:
+            return None
+        return max(0.0, min(self._paused.values()) - time.monotonic())
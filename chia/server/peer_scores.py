@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import dataclasses
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from packaging.version import Version
+
+from chia.protocols.shared_protocol import protocol_version
+from chia.server.outbound_message import NodeType
+from chia.types.peer_info import PeerInfo
+
+# weight of the most recent sample in the moving averages
+SCORE_EWMA_ALPHA = 0.3
+# a peer with this handshake latency (seconds), or this block serving
+# throughput (blocks per second), gets half the score of a perfect one
+REFERENCE_HANDSHAKE_LATENCY = 0.5
+REFERENCE_BLOCKS_PER_SECOND = 50.0
+# block serving throughput matters more than latency, it's what sync waits on
+THROUGHPUT_WEIGHT = 2.0
+# peers speaking an older protocol version than ours are less preferred
+OLD_PROTOCOL_FACTOR = 0.75
+# each consecutive failed connection attempt scales the score by this
+FAILURE_FACTOR = 0.66
+MAX_FAILURES = 8
+
+# scores are kept for this many hosts, the least recently updated are dropped
+MAX_SCORED_PEERS = 10000
+
+_our_protocol_version = Version(protocol_version[NodeType.FULL_NODE])
+
+
+def _ewma(previous: Optional[float], sample: float) -> float:
+    if previous is None:
+        return sample
+    return SCORE_EWMA_ALPHA * sample + (1 - SCORE_EWMA_ALPHA) * previous
+
+
+@dataclasses.dataclass
+class PeerScore:
+    handshake_latency: Optional[float] = None
+    protocol_version: Optional[Version] = None
+    blocks_per_second: Optional[float] = None
+    connections: int = 0
+    # consecutive failed connection attempts
+    failures: int = 0
+    last_update: float = 0.0
+
+    def score(self) -> float:
+        """
+        Higher is better. Unknown measurements count as the reference values.
+        """
+        latency = REFERENCE_HANDSHAKE_LATENCY if self.handshake_latency is None else self.handshake_latency
+        bps = REFERENCE_BLOCKS_PER_SECOND if self.blocks_per_second is None else self.blocks_per_second
+        score = REFERENCE_HANDSHAKE_LATENCY / (REFERENCE_HANDSHAKE_LATENCY + latency)
+        score += THROUGHPUT_WEIGHT * bps / (REFERENCE_BLOCKS_PER_SECOND + bps)
+        if self.protocol_version is not None and self.protocol_version < _our_protocol_version:
+            score *= OLD_PROTOCOL_FACTOR
+        return score * FAILURE_FACTOR ** min(self.failures, MAX_FAILURES)
+
+    def to_json_dict(self) -> Dict[str, Any]:
+        return {
+            "handshake_latency": self.handshake_latency,
+            "protocol_version": None if self.protocol_version is None else str(self.protocol_version),
+            "blocks_per_second": self.blocks_per_second,
+            "connections": self.connections,
+            "failures": self.failures,
+            "score": self.score(),
+        }
+
+
+class PeerScores:
+    """
+    Outcomes of connections to full node peers, by host: handshake latency,
+    protocol version and block serving throughput. Used to prefer fast peers
+    when dialing and when assigning sync ranges.
+    """
+
+    def __init__(self, max_peers: int = MAX_SCORED_PEERS) -> None:
+        self.max_peers = max_peers
+        self._scores: OrderedDict[str, PeerScore] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def get(self, host: str) -> Optional[PeerScore]:
+        return self._scores.get(host)
+
+    def _update(self, host: str) -> PeerScore:
+        peer_score = self._scores.get(host)
+        if peer_score is None:
+            peer_score = PeerScore()
+            self._scores[host] = peer_score
+            if len(self._scores) > self.max_peers:
+                self._scores.popitem(last=False)
+        else:
+            self._scores.move_to_end(host)
+        peer_score.last_update = time.time()
+        return peer_score
+
+    def record_connection(self, host: str, handshake_latency: float, version: Version) -> None:
+        peer_score = self._update(host)
+        peer_score.handshake_latency = _ewma(peer_score.handshake_latency, handshake_latency)
+        peer_score.protocol_version = version
+        peer_score.connections += 1
+        peer_score.failures = 0
+
+    def record_failure(self, host: str) -> None:
+        self._update(host).failures += 1
+
+    def record_blocks(self, host: str, num_blocks: int, duration: float) -> None:
+        peer_score = self._update(host)
+        peer_score.blocks_per_second = _ewma(peer_score.blocks_per_second, num_blocks / max(duration, 0.001))
+
+    def score(self, host: str) -> float:
+        peer_score = self._scores.get(host)
+        if peer_score is None:
+            return PeerScore().score()
+        return peer_score.score()
+
+    def rank(self, peers: Iterable[PeerInfo]) -> List[PeerInfo]:
+        """
+        Returns peers, best scored first.
+        """
+        return sorted(peers, key=lambda peer: -self.score(peer.host))
+
+    def to_json_dict(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        The best scored peers.
+        """
+        hosts = sorted(self._scores, key=lambda host: -self._scores[host].score())[:limit]
+        return [{"host": host, **self._scores[host].to_json_dict()} for host in hosts]
@@ -19,11 +19,20 @@ class RLSettings:
     max_total_size: Optional[int] = None  # Max cumulative size of all requests in that period
 
 
-def get_rate_limits_to_use(our_capabilities: List[Capability], peer_capabilities: List[Capability]) -> Dict[str, Any]:
+def get_rate_limits_version(our_capabilities: List[Capability], peer_capabilities: List[Capability]) -> int:
     # This will use the newest possible rate limits that both peers support. At this time there are only two
     # options, v1 and v2.
-
     if Capability.RATE_LIMITS_V2 in our_capabilities and Capability.RATE_LIMITS_V2 in peer_capabilities:
+        return 2
+    return 1
+
+
+def get_rate_limits_to_use(our_capabilities: List[Capability], peer_capabilities: List[Capability]) -> Dict[str, Any]:
+    return get_rate_limits_for_version(get_rate_limits_version(our_capabilities, peer_capabilities))
+
+
+def get_rate_limits_for_version(version: int) -> Dict[str, Any]:
+    if version == 2:
         # Use V2 rate limits
         if 2 in compose_rate_limits_cache:
             return compose_rate_limits_cache[2]
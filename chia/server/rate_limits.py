@@ -3,44 +3,152 @@ from __future__ import annotations
 import dataclasses
 import logging
 import time
-from collections import Counter
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 from chia.protocols.protocol_message_types import ProtocolMessageTypes
 from chia.protocols.shared_protocol import Capability
 from chia.server.outbound_message import Message
-from chia.server.rate_limit_numbers import RLSettings, get_rate_limits_to_use
+from chia.server.rate_limit_numbers import RLSettings, get_rate_limits_for_version, get_rate_limits_version
 
 log = logging.getLogger(__name__)
 
+# message types are sent as a uint8
+NUM_MESSAGE_TYPES = 256
+
+
+@dataclasses.dataclass(frozen=True)
+class MessageLimits:
+    """
+    The limits for one message type, per reset period, already scaled by the
+    limiter's percentage_of_limit.
+    """
+
+    frequency: float
+    max_size: int
+    max_total_size: float
+    non_tx: bool
+
+
+@dataclasses.dataclass(frozen=True)
+class LimitTable:
+    # indexed by message type, None for values that aren't a known message type
+    limits: List[Optional[MessageLimits]]
+    non_tx_frequency: float
+    non_tx_max_total_size: float
+
+
+_limit_tables: Dict[Tuple[int, int], LimitTable] = {}
+
+
+def get_limit_table(version: int, percentage_of_limit: int) -> LimitTable:
+    key = (version, percentage_of_limit)
+    table = _limit_tables.get(key)
+    if table is not None:
+        return table
+
+    rate_limits = get_rate_limits_for_version(version)
+    proportion = percentage_of_limit / 100
+    limits: List[Optional[MessageLimits]] = [None] * NUM_MESSAGE_TYPES
+    for message_type in ProtocolMessageTypes:
+        settings: RLSettings = rate_limits["default_settings"]
+        non_tx = False
+        if message_type in rate_limits["rate_limits_tx"]:
+            settings = rate_limits["rate_limits_tx"][message_type]
+        elif message_type in rate_limits["rate_limits_other"]:
+            settings = rate_limits["rate_limits_other"][message_type]
+            non_tx = True
+        max_total_size = settings.max_total_size
+        if max_total_size is None:
+            max_total_size = settings.frequency * settings.max_size
+        limits[message_type.value] = MessageLimits(
+            frequency=settings.frequency * proportion,
+            max_size=settings.max_size,
+            max_total_size=max_total_size * proportion,
+            non_tx=non_tx,
+        )
+
+    table = LimitTable(
+        limits=limits,
+        non_tx_frequency=rate_limits["non_tx_freq"] * proportion,
+        non_tx_max_total_size=rate_limits["non_tx_max_total_size"] * proportion,
+    )
+    _limit_tables[key] = table
+    return table
+
+
+class TokenBucket:
+    """
+    A message count and a byte count bucket that refill continuously, at a
+    rate of their full capacity per period.
+    """
+
+    __slots__ = ("max_count", "max_size", "count", "size", "last_update")
+
+    def __init__(self, max_count: float, max_size: float, now: float):
+        self.max_count = max_count
+        self.max_size = max_size
+        self.count = max_count
+        self.size = max_size
+        self.last_update = now
+
+    def refill(self, now: float, period: float) -> None:
+        elapsed = now - self.last_update
+        if elapsed <= 0:
+            return
+        self.last_update = now
+        fraction = elapsed / period
+        self.count = min(self.max_count, self.count + self.max_count * fraction)
+        self.size = min(self.max_size, self.size + self.max_size * fraction)
+
+    def has_room(self, size: int) -> bool:
+        return self.count >= 1 and self.size >= size
+
+    def take(self, size: int) -> None:
+        self.count -= 1
+        self.size -= size
+
 
 # TODO: only full node disconnects based on rate limits
 class RateLimiter:
     incoming: bool
     reset_seconds: int
-    current_minute: int
-    message_counts: Counter[ProtocolMessageTypes]
-    message_cumulative_sizes: Counter[ProtocolMessageTypes]
     percentage_of_limit: int
-    non_tx_message_counts: int = 0
-    non_tx_cumulative_size: int = 0
+    # per message type, indexed by the message type
+    message_counts: List[int]
+    message_cumulative_sizes: List[int]
+    rate_limited_counts: List[int]
 
     def __init__(self, incoming: bool, reset_seconds: int = 60, percentage_of_limit: int = 100):
         """
-        The incoming parameter affects whether counters are incremented
-        unconditionally or not. For incoming messages, the counters are always
-        incremented. For outgoing messages, the counters are only incremented
-        if they are allowed to be sent by the rate limiter, since we won't send
-        the messages otherwise.
+        The incoming parameter affects whether the buckets are drawn from
+        unconditionally or not. For incoming messages, the buckets are always
+        drawn from (and may go negative). For outgoing messages, they are only
+        drawn from if the message is allowed to be sent by the rate limiter,
+        since we won't send the messages otherwise.
+
+        Each limit allows its full amount per reset_seconds, replenished
+        continuously, so bursts can't get past the limit at period boundaries.
         """
         self.incoming = incoming
         self.reset_seconds = reset_seconds
-        self.current_minute = int(time.time() // reset_seconds)
-        self.message_counts = Counter()
-        self.message_cumulative_sizes = Counter()
         self.percentage_of_limit = percentage_of_limit
-        self.non_tx_message_counts = 0
-        self.non_tx_cumulative_size = 0
+        self.message_counts = [0] * NUM_MESSAGE_TYPES
+        self.message_cumulative_sizes = [0] * NUM_MESSAGE_TYPES
+        self.rate_limited_counts = [0] * NUM_MESSAGE_TYPES
+        self._version: Optional[int] = None
+        self._table: Optional[LimitTable] = None
+        self._buckets: List[Optional[TokenBucket]] = [None] * NUM_MESSAGE_TYPES
+        self._non_tx_bucket: Optional[TokenBucket] = None
+
+    def _limit_table(self, our_capabilities: List[Capability], peer_capabilities: List[Capability]) -> LimitTable:
+        version = get_rate_limits_version(our_capabilities, peer_capabilities)
+        if self._table is None or version != self._version:
+            # the limits only change once, when the handshake completes
+            self._version = version
+            self._table = get_limit_table(version, self.percentage_of_limit)
+            self._buckets = [None] * NUM_MESSAGE_TYPES
+            self._non_tx_bucket = None
+        return self._table
 
     def process_msg_and_check(
         self, message: Message, our_capabilities: List[Capability], peer_capabilities: List[Capability]
@@ -48,66 +156,58 @@ class RateLimiter:
         """
         Returns True if message can be processed successfully, false if a rate limit is passed.
         """
-
-        current_minute = int(time.time() // self.reset_seconds)
-        if current_minute != self.current_minute:
-            self.current_minute = current_minute
-            self.message_counts = Counter()
-            self.message_cumulative_sizes = Counter()
-            self.non_tx_message_counts = 0
-            self.non_tx_cumulative_size = 0
-        try:
-            message_type = ProtocolMessageTypes(message.type)
-        except Exception as e:
-            log.warning(f"Invalid message: {message.type}, {e}")
+        table = self._limit_table(our_capabilities, peer_capabilities)
+        message_type = message.type
+        limits = table.limits[message_type] if message_type < NUM_MESSAGE_TYPES else None
+        if limits is None:
+            log.warning(f"Invalid message: {message_type}")
             return True
 
-        new_message_counts: int = self.message_counts[message_type] + 1
-        new_cumulative_size: int = self.message_cumulative_sizes[message_type] + len(message.data)
-        new_non_tx_count: int = self.non_tx_message_counts
-        new_non_tx_size: int = self.non_tx_cumulative_size
-        proportion_of_limit: float = self.percentage_of_limit / 100
-
-        ret: bool = False
-        rate_limits = get_rate_limits_to_use(our_capabilities, peer_capabilities)
-
-        try:
-            limits: RLSettings = rate_limits["default_settings"]
-            if message_type in rate_limits["rate_limits_tx"]:
-                limits = rate_limits["rate_limits_tx"][message_type]
-            elif message_type in rate_limits["rate_limits_other"]:
-                limits = rate_limits["rate_limits_other"][message_type]
-                non_tx_freq = rate_limits["non_tx_freq"]
-                non_tx_max_total_size = rate_limits["non_tx_max_total_size"]
-                new_non_tx_count = self.non_tx_message_counts + 1
-                new_non_tx_size = self.non_tx_cumulative_size + len(message.data)
-                if new_non_tx_count > non_tx_freq * proportion_of_limit:
-                    return False
-                if new_non_tx_size > non_tx_max_total_size * proportion_of_limit:
-                    return False
-            else:
-                log.warning(f"Message type {message_type} not found in rate limits")
+        now = time.monotonic()
+        size = len(message.data)
+        bucket = self._buckets[message_type]
+        if bucket is None:
+            bucket = TokenBucket(limits.frequency, limits.max_total_size, now)
+            self._buckets[message_type] = bucket
+        else:
+            bucket.refill(now, self.reset_seconds)
+        allowed = size <= limits.max_size and bucket.has_room(size)
 
-            if limits.max_total_size is None:
-                limits = dataclasses.replace(limits, max_total_size=limits.frequency * limits.max_size)
-            assert limits.max_total_size is not None
+        non_tx_bucket: Optional[TokenBucket] = None
+        if limits.non_tx:
+            non_tx_bucket = self._non_tx_bucket
+            if non_tx_bucket is None:
+                non_tx_bucket = TokenBucket(table.non_tx_frequency, table.non_tx_max_total_size, now)
+                self._non_tx_bucket = non_tx_bucket
+            else:
+                non_tx_bucket.refill(now, self.reset_seconds)
+            allowed = allowed and non_tx_bucket.has_room(size)
 
-            if new_message_counts > limits.frequency * proportion_of_limit:
-                return False
-            if len(message.data) > limits.max_size:
-                return False
-            if new_cumulative_size > limits.max_total_size * proportion_of_limit:
-                return False
+        if self.incoming or allowed:
+            # now that we determined that it's OK to send the message, take it
+            # out of the buckets. Alternatively, if this was an incoming
+            # message, we already received it and it counts unconditionally
+            bucket.take(size)
+            if non_tx_bucket is not None:
+                non_tx_bucket.take(size)
+            self.message_counts[message_type] += 1
+            self.message_cumulative_sizes[message_type] += size
+        if not allowed:
+            self.rate_limited_counts[message_type] += 1
+        return allowed
 
-            ret = True
-            return True
-        finally:
-            if self.incoming or ret:
-                # now that we determined that it's OK to send the message, commit the
-                # updates to the counters. Alternatively, if this was an
-                # incoming message, we already received it and it should
-                # increment the counters unconditionally
-                self.message_counts[message_type] = new_message_counts
-                self.message_cumulative_sizes[message_type] = new_cumulative_size
-                self.non_tx_message_counts = new_non_tx_count
-                self.non_tx_cumulative_size = new_non_tx_size
+    def to_json_dict(self) -> Dict[str, Dict[str, int]]:
+        """
+        Totals per message type, for the message types that have been seen.
+        """
+        ret: Dict[str, Dict[str, int]] = {}
+        for message_type in ProtocolMessageTypes:
+            value = message_type.value
+            if self.message_counts[value] == 0 and self.rate_limited_counts[value] == 0:
+                continue
+            ret[message_type.name] = {
+                "messages": self.message_counts[value],
+                "bytes": self.message_cumulative_sizes[value],
+                "rate_limited": self.rate_limited_counts[value],
+            }
+        return ret
@@ -29,7 +29,8 @@ from chia.protocols.protocol_state_machine import message_requires_reply
 from chia.protocols.protocol_timing import INVALID_PROTOCOL_BAN_SECONDS
 from chia.server.api_protocol import ApiProtocol
 from chia.server.introducer_peers import IntroducerPeers
-from chia.server.outbound_message import Message, NodeType
+from chia.server.outbound_message import BroadcastFanOut, BroadcastMetrics, Message, NodeType, SerializedMessage
+from chia.server.peer_scores import PeerScores
 from chia.server.ssl_context import private_ssl_paths, public_ssl_paths
 from chia.server.ws_connection import ConnectionCallback, WSLotteryConnection
 from chia.types.blockchain_format.sized_bytes import bytes32
@@ -140,6 +141,8 @@ class LotteryServer:
     received_message_callback: Optional[ConnectionCallback] = None
     banned_peers: Dict[str, float] = field(default_factory=dict)
     invalid_protocol_ban_seconds = INVALID_PROTOCOL_BAN_SECONDS
+    broadcast_metrics: BroadcastMetrics = field(default_factory=BroadcastMetrics)
+    peer_scores: PeerScores = field(default_factory=PeerScores)
 
     @classmethod
     def create(
@@ -423,6 +426,7 @@ class LotteryServer:
 
         session = None
         connection: Optional[WSLotteryConnection] = None
+        start_time = time.monotonic()
         try:
             # Crawler/DNS introducer usually uses a lower timeout than the default
             timeout_value = float(self.config.get("peer_connect_timeout", 30))
@@ -485,6 +489,10 @@ class LotteryServer:
                 session=session,
             )
             await connection.perform_handshake(self._network_id, server_port, self._local_type)
+            if connection.connection_type is NodeType.FULL_NODE:
+                self.peer_scores.record_connection(
+                    target_node.host, time.monotonic() - start_time, connection.protocol_version
+                )
             await self.connection_added(connection, on_connect)
             # the session has been adopted by the connection, don't close it at
             # the end of the function
@@ -579,10 +587,12 @@ class LotteryServer:
         exclude: Optional[bytes32] = None,
     ) -> None:
         await self.validate_broadcast_message_type(messages, node_type)
-        for _, connection in self.all_connections.items():
-            if connection.connection_type is node_type and connection.peer_node_id != exclude:
-                for message in messages:
-                    await connection.send_message(message)
+        connections = [
+            connection
+            for connection in self.all_connections.values()
+            if connection.connection_type is node_type and connection.peer_node_id != exclude
+        ]
+        await self._broadcast(messages, connections)
 
     async def send_to_all_if(
         self,
@@ -592,10 +602,27 @@ class LotteryServer:
         exclude: Optional[bytes32] = None,
     ) -> None:
         await self.validate_broadcast_message_type(messages, node_type)
-        for _, connection in self.all_connections.items():
-            if connection.connection_type is node_type and connection.peer_node_id != exclude and predicate(connection):
-                for message in messages:
-                    await connection.send_message(message)
+        connections = [
+            connection
+            for connection in self.all_connections.values()
+            if connection.connection_type is node_type and connection.peer_node_id != exclude and predicate(connection)
+        ]
+        await self._broadcast(messages, connections)
+
+    async def _broadcast(self, messages: List[Message], connections: List[WSLotteryConnection]) -> None:
+        """
+        Sends each message to all connections. Every message is serialized
+        once and the bytes are shared between the connections.
+        """
+        if len(connections) == 0:
+            return
+        for message in messages:
+            fan_out = BroadcastFanOut(self.broadcast_metrics, len(connections))
+            serialized_message = SerializedMessage.create(message, fan_out)
+            self.broadcast_metrics.record_broadcast(len(serialized_message.data), len(connections))
+            for connection in connections:
+                if not await connection.send_serialized_message(serialized_message):
+                    fan_out.done()
 
     async def send_to_specific(self, messages: List[Message], node_id: bytes32) -> None:
         if node_id in self.all_connections:
@@ -25,11 +25,13 @@ from chia.protocols.protocol_timing import (
 from chia.protocols.shared_protocol import Capability, Error, Handshake, protocol_version
 from chia.server.api_protocol import ApiProtocol
 from chia.server.capabilities import known_active_capabilities
-from chia.server.outbound_message import Message, NodeType, make_msg
+from chia.server.outbound_message import Message, NodeType, SerializedMessage, make_msg
+from chia.server.outbound_queue import OutboundQueue
 from chia.server.rate_limits import RateLimiter
 from chia.types.blockchain_format.sized_bytes import bytes32
 from chia.types.peer_info import PeerInfo
 from chia.util.api_decorators import get_metadata
+from chia.util.db_wrapper import ReaderClass, reader_class
 from chia.util.errors import ApiError, ConsensusError, Err, ProtocolError, TimestampError
 from chia.util.ints import int16, uint8, uint16
 from chia.util.log_exceptions import log_exceptions
@@ -46,6 +48,10 @@ ConnectionCallback = Callable[["WSLotteryConnection"], Awaitable[None]]
 
 error_response_version = Version("0.0.35")
 
+# DB reads for these peer requests are served by the peer reader pool, so
+# they don't compete with block validation for connections
+PEER_READER_MESSAGE_PREFIXES = ("request_", "register_interest_")
+
 
 def create_default_last_message_time_dict() -> Dict[ProtocolMessageTypes, float]:
     return {message_type: -math.inf for message_type in ProtocolMessageTypes}
@@ -89,7 +95,7 @@ class WSLotteryConnection:
     # Messaging
     received_message_callback: Optional[ConnectionCallback] = field(repr=False)
     incoming_queue: asyncio.Queue[Message] = field(default_factory=asyncio.Queue, repr=False)
-    outgoing_queue: asyncio.Queue[Message] = field(default_factory=asyncio.Queue, repr=False)
+    outgoing_queue: OutboundQueue = field(default_factory=OutboundQueue, repr=False)
     api_tasks: Dict[bytes32, asyncio.Task[None]] = field(default_factory=dict, repr=False)
     # Contains task ids of api tasks which should not be canceled
     execute_tasks: Set[bytes32] = field(default_factory=set, repr=False)
@@ -203,7 +209,7 @@ class WSLotteryConnection:
                     self.local_capabilities_for_handshake,
                 ),
             )
-            await self._send_message(outbound_handshake)
+            await self._send_message(SerializedMessage.create(outbound_handshake))
             inbound_handshake_msg = await self._read_one_message()
             if inbound_handshake_msg is None:
                 raise ProtocolError(Err.INVALID_HANDSHAKE)
@@ -284,7 +290,7 @@ class WSLotteryConnection:
                     self.local_capabilities_for_handshake,
                 ),
             )
-            await self._send_message(outbound_handshake)
+            await self._send_message(SerializedMessage.create(outbound_handshake))
             self.version = inbound_handshake.software_version
             self.protocol_version = Version(inbound_handshake.protocol_version)
             self.peer_server_port = inbound_handshake.server_port
@@ -315,6 +321,8 @@ class WSLotteryConnection:
             self._close_event.set()
             return None
         self.closed = True
+        self.outgoing_queue.close()
+        self._drop_messages(self.outgoing_queue.drain())
 
         if error is None:
             message = b""
@@ -366,12 +374,39 @@ class WSLotteryConnection:
                 continue
             task.cancel()
 
+    @staticmethod
+    def _drop_messages(messages: List[SerializedMessage]) -> None:
+        """
+        Completes the broadcasts of messages that won't be sent.
+        """
+        for message in messages:
+            if message.fan_out is not None:
+                message.fan_out.done()
+
     async def outbound_handler(self) -> None:
         try:
             while not self.closed:
-                msg = await self.outgoing_queue.get()
-                if msg is not None:
-                    await self._send_message(msg)
+                batch = await self.outgoing_queue.get_batch()
+                # messages we're rate limiting ourselves on wait in the queue
+                # (holding back later messages of the same type too), rather
+                # than being retried out of order
+                deferred: List[SerializedMessage] = []
+                deferred_types: Set[int] = set()
+                # the messages of the batch before it were sent or deferred
+                index = 0
+                try:
+                    for msg in batch:
+                        if msg.message.type in deferred_types or not await self._send_message(msg):
+                            deferred.append(msg)
+                            deferred_types.add(msg.message.type)
+                        index += 1
+                except BaseException:
+                    self._drop_messages([*deferred, *batch[index:]])
+                    raise
+                if self.closed:
+                    self._drop_messages(deferred)
+                elif len(deferred) > 0:
+                    self.outgoing_queue.defer(deferred)
         except asyncio.CancelledError:
             pass
         except Exception as e:
@@ -456,7 +491,12 @@ class WSLotteryConnection:
                     raise
                 return None
 
-            response: Optional[Message] = await asyncio.wait_for(wrapped_coroutine(), timeout=timeout)
+            reader = ReaderClass.CONSENSUS
+            if message_type.startswith(PEER_READER_MESSAGE_PREFIXES):
+                reader = ReaderClass.PEER
+            with reader_class(reader):
+                # wait_for() runs the coroutine in a new task, which inherits the reader class
+                response: Optional[Message] = await asyncio.wait_for(wrapped_coroutine(), timeout=timeout)
             self.log.debug(
                 f"Time taken to process {message_type} from {self.peer_node_id} is "
                 f"{time.time() - start_time} seconds"
@@ -524,10 +564,13 @@ class WSLotteryConnection:
 
     async def send_message(self, message: Message) -> bool:
         """Send message sends a message with no tracking / callback."""
+        return await self.send_serialized_message(SerializedMessage.create(message))
+
+    async def send_serialized_message(self, message: SerializedMessage) -> bool:
+        """Like send_message(), for a message that's already been serialized (e.g. for a broadcast)."""
         if self.closed:
             return False
-        await self.outgoing_queue.put(message)
-        return True
+        return await self.outgoing_queue.put(message)
 
     async def call_api(
         self,
@@ -590,7 +633,7 @@ class WSLotteryConnection:
         message = Message(message_no_id.type, request_id, message_no_id.data)
         assert message.id is not None
         self.pending_requests[message.id] = event
-        await self.outgoing_queue.put(message)
+        await self.outgoing_queue.put(SerializedMessage.create(message))
 
         try:
             await asyncio.wait_for(event.wait(), timeout=timeout)
@@ -609,16 +652,12 @@ class WSLotteryConnection:
 
         return result
 
-    async def _wait_and_retry(self, msg: Message) -> None:
-        try:
-            await asyncio.sleep(1)
-            await self.outgoing_queue.put(msg)
-        except Exception as e:
-            self.log.debug(f"Exception {e} while waiting to retry sending rate limited message")
-            return None
-
-    async def _send_message(self, message: Message) -> None:
-        encoded: bytes = bytes(message)
+    async def _send_message(self, serialized_message: SerializedMessage) -> bool:
+        """
+        Returns False if the message was rate limited and should be sent again later.
+        """
+        message = serialized_message.message
+        encoded: bytes = serialized_message.data
         size = len(encoded)
         assert len(encoded) < (2 ** (LENGTH_BYTES * 8))
         if not self.outbound_rate_limiter.process_msg_and_check(
@@ -635,9 +674,10 @@ class WSLotteryConnection:
 
                 # TODO: fix this special case. This function has rate limits which are too low.
                 if ProtocolMessageTypes(message.type) != ProtocolMessageTypes.respond_peers:
-                    asyncio.create_task(self._wait_and_retry(message))
-
-                return None
+                    return False
+                if serialized_message.fan_out is not None:
+                    serialized_message.fan_out.done()
+                return True
             else:
                 self.log.debug(
                     f"Not rate limiting ourselves. message type: {ProtocolMessageTypes(message.type).name}, "
@@ -649,6 +689,9 @@ class WSLotteryConnection:
             f"-> {ProtocolMessageTypes(message.type).name} to peer {self.peer_info.host} {self.peer_node_id}"
         )
         self.bytes_written += size
+        if serialized_message.fan_out is not None:
+            serialized_message.fan_out.done()
+        return True
 
     async def _read_one_message(self) -> Optional[Message]:
         message: WSMessage = await self.ws.receive()
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import dataclasses
+import hashlib
+import math
+from typing import Any, AsyncIterator, Collection, Dict, List, Optional, TypeVar, Union
+
+_T_Key = TypeVar("_T_Key", bound=bytes)
+
+# a rebuilt filter has room for this many times the keys in the DB (plus
+# PREFILTER_MIN_CAPACITY), keys added after that count towards the next rebuild
+PREFILTER_GROWTH_FACTOR = 1.5
+PREFILTER_MIN_CAPACITY = 100000
+
+
+class BloomFilter:
+    """
+    A set of byte strings that may report false positives (at about the
+    configured rate, as long as no more than capacity items are added) but
+    never false negatives.
+    """
+
+    __slots__ = ("capacity", "false_positive_rate", "count", "_num_bits", "_num_hashes", "_bits")
+
+    def __init__(self, capacity: int, false_positive_rate: float):
+        assert 0 < false_positive_rate < 1
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.count = 0
+        self._num_bits = max(8, math.ceil(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self._num_hashes = max(1, round(self._num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self._num_bits + 7) // 8)
+
+    def _positions(self, key: bytes) -> List[int]:
+        # double hashing, the probe positions are h1 + i * h2
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self._num_bits for i in range(self._num_hashes)]
+
+    def add(self, key: bytes) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: bytes) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def size_bytes(self) -> int:
+        return len(self._bits)
+
+
+@dataclasses.dataclass
+class PrefilterStats:
+    # keys looked up, and how many of them the filter ruled out
+    lookups: int = 0
+    filtered: int = 0
+    # keys that made it past the filter but weren't in the DB. Only counted
+    # where the lookup can tell
+    false_positives: int = 0
+    rebuilds: int = 0
+
+    def to_json_dict(self) -> Dict[str, int]:
+        return dataclasses.asdict(self)
+
+
+@dataclasses.dataclass
+class KeyPrefilter:
+    """
+    A BloomFilter in front of a DB index, so lookups of keys that aren't in
+    the DB don't need to query it. Keys added to the DB must also be added to
+    the prefilter. Keys removed from the DB stay in the filter (only making it
+    less effective) until the next rebuild. Until the first rebuild, every key
+    passes.
+    """
+
+    false_positive_rate: float = 0.01
+    stats: PrefilterStats = dataclasses.field(default_factory=PrefilterStats)
+    _filter: Optional[BloomFilter] = None
+    # while a rebuild is in progress, new keys are added to both filters
+    _building: Optional[BloomFilter] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    def needs_rebuild(self) -> bool:
+        return self._filter is None or self._filter.count > self._filter.capacity
+
+    def add(self, keys: Collection[bytes]) -> None:
+        for f in (self._filter, self._building):
+            if f is not None:
+                for key in keys:
+                    f.add(key)
+
+    def filter_keys(self, keys: Collection[_T_Key]) -> List[_T_Key]:
+        """
+        Returns the keys that may be in the DB.
+        """
+        if self._filter is None:
+            return list(keys)
+        ret = [key for key in keys if key in self._filter]
+        self.stats.lookups += len(keys)
+        self.stats.filtered += len(keys) - len(ret)
+        return ret
+
+    def record_false_positives(self, count: int) -> None:
+        if self._filter is not None:
+            self.stats.false_positives += count
+
+    async def rebuild(self, num_keys: int, keys: AsyncIterator[Union[bytes, memoryview]]) -> None:
+        """
+        Builds a new filter from all the keys in the DB, num_keys is (an upper
+        bound of) the number of keys. Keys written to the DB while this is
+        running must still be passed to add().
+        """
+        capacity = int(num_keys * PREFILTER_GROWTH_FACTOR) + PREFILTER_MIN_CAPACITY
+        building = BloomFilter(capacity, self.false_positive_rate)
+        self._building = building
+        try:
+            async for key in keys:
+                building.add(bytes(key))
+        finally:
+            self._building = None
+        self._filter = building
+        self.stats.rebuilds += 1
+
+    def to_json_dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "keys": 0 if self._filter is None else self._filter.count,
+            "capacity": 0 if self._filter is None else self._filter.capacity,
+            "size_bytes": 0 if self._filter is None else self._filter.size_bytes(),
+            "false_positive_rate": self.false_positive_rate,
+            **self.stats.to_json_dict(),
+        }
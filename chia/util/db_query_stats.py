@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+# upper bounds, in seconds, of the latency histogram buckets. The last bucket
+# counts everything slower
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# statements are keyed by their normalized SQL. Past this many distinct
+# statements, new ones are counted together
+MAX_STATEMENTS = 1000
+OTHER_STATEMENTS = "<other>"
+
+_parameter_list = re.compile(r"\?(\s*,\s*\?)+")
+_whitespace = re.compile(r"\s+")
+
+
+def normalize_statement(sql: str) -> str:
+    """
+    Collapses variable length parameter lists, as used by IN (?, ?, ...)
+    queries, so the statement is counted the same regardless of its number of
+    parameters.
+    """
+    sql = _parameter_list.sub("?, ...", sql)
+    return _whitespace.sub(" ", sql).strip()[:500]
+
+
+@dataclasses.dataclass
+class StatementStats:
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    histogram: List[int] = dataclasses.field(default_factory=lambda: [0] * (len(HISTOGRAM_BUCKETS) + 1))
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if seconds <= bound:
+                self.histogram[i] += 1
+                return
+        self.histogram[-1] += 1
+
+
+@dataclasses.dataclass
+class QueryStats:
+    """
+    Latency per SQL statement, across all connections of a DBWrapper2. The
+    time of a statement includes fetching its rows. Statements are recorded
+    from the connections' worker threads.
+    """
+
+    slow_query_seconds: Optional[float] = None
+    # slow queries are also passed to this (the SQL log's sql_trace_callback),
+    # along with the connection name
+    trace_callback: Optional[Callable[[str, Optional[str]], None]] = None
+    _statements: Dict[str, StatementStats] = dataclasses.field(default_factory=dict)
+    _lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+
+    def record(self, sql: str, seconds: float, name: Optional[str] = None) -> None:
+        statement = normalize_statement(sql)
+        with self._lock:
+            stats = self._statements.get(statement)
+            if stats is None:
+                if len(self._statements) >= MAX_STATEMENTS:
+                    statement = OTHER_STATEMENTS
+                stats = self._statements.setdefault(statement, StatementStats())
+            stats.record(seconds)
+
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            log.warning(f"slow query on {name} ({seconds:0.3f}s): {statement}")
+            if self.trace_callback is not None:
+                self.trace_callback(f"-- slow query ({seconds:0.3f}s): {statement}", name)
+
+    def to_json_dict(self, limit: int = 50) -> Dict[str, Any]:
+        """
+        Returns the statements that took the most time in total.
+        """
+        with self._lock:
+            statements = sorted(self._statements.items(), key=lambda item: item[1].total_seconds, reverse=True)
+            return {
+                "histogram_buckets": list(HISTOGRAM_BUCKETS),
+                "statements": [
+                    {"statement": statement, **dataclasses.asdict(stats)} for statement, stats in statements[:limit]
+                ],
+            }
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    A cursor that records the time spent executing its statement and fetching
+    the rows to the connection's QueryStats.
+    """
+
+    _statement: Optional[str] = None
+    _elapsed: float = 0.0
+
+    def _finish(self) -> None:
+        if self._statement is not None:
+            connection = self.connection
+            assert isinstance(connection, TimedConnection)
+            connection.query_stats.record(self._statement, self._elapsed, connection.name)
+            self._statement = None
+
+    def execute(self, sql: str, parameters: Any = (), /) -> TimedCursor:
+        self._finish()
+        start = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        finally:
+            self._statement = sql
+            self._elapsed = time.perf_counter() - start
+        if self.description is None:
+            # no rows to fetch
+            self._finish()
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters: Any, /) -> TimedCursor:
+        self._finish()
+        start = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        finally:
+            self._statement = sql
+            self._elapsed = time.perf_counter() - start
+            self._finish()
+        return self
+
+    def fetchone(self) -> Any:
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._elapsed += time.perf_counter() - start
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size: Optional[int] = None) -> List[Any]:
+        if size is None:
+            size = self.arraysize
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._elapsed += time.perf_counter() - start
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self) -> List[Any]:
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._elapsed += time.perf_counter() - start
+        self._finish()
+        return rows
+
+    def close(self) -> None:
+        self._finish()
+        super().close()
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    Used as the sqlite3 connection factory, to time every statement executed
+    on the connection.
+    """
+
+    def __init__(self, *args: Any, query_stats: QueryStats, name: Optional[str] = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.query_stats = query_stats
+        self.name = name
+
+    def cursor(self, factory: Any = TimedCursor) -> Any:
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters: Any = (), /) -> Any:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any, /) -> Any:
+        return self.cursor().executemany(sql, seq_of_parameters)
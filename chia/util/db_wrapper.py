@@ -2,19 +2,37 @@ from __future__ import annotations
 
 import asyncio
 import contextlib
+import enum
 import functools
 import secrets
 import sqlite3
 import sys
+from contextvars import ContextVar
 from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
-from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, TextIO, Tuple, Type, Union
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+    Type,
+    Union,
+)
 
 import aiosqlite
 import anyio
 from typing_extensions import final
 
+from chia.util.db_query_stats import QueryStats, TimedConnection
+
 if aiosqlite.sqlite_version_info < (3, 32, 0):
     SQLITE_MAX_VARIABLE_NUMBER = 900
 else:
@@ -51,6 +69,34 @@ class InternalError(DBWrapperError):
     pass
 
 
+class ReaderClass(enum.Enum):
+    """
+    Readers are handed connections from the pool of their class, so heavy
+    queries from RPC clients or peers can't hold up consensus reads. A class
+    without a pool of its own shares the consensus pool.
+    """
+
+    CONSENSUS = "consensus"
+    PEER = "peer"
+    RPC = "rpc"
+
+
+_reader_class: ContextVar[ReaderClass] = ContextVar("db_reader_class", default=ReaderClass.CONSENSUS)
+
+
+@contextlib.contextmanager
+def reader_class(value: ReaderClass) -> Iterator[None]:
+    """
+    DB reads in this context (and tasks created from it) use the reader pool
+    of this class.
+    """
+    token = _reader_class.set(value)
+    try:
+        yield
+    finally:
+        _reader_class.reset(token)
+
+
 def generate_in_memory_db_uri() -> str:
     # We need to use shared cache as our DB wrapper uses different types of connections
     return f"file:db_{secrets.token_hex(16)}?mode=memory&cache=shared"
@@ -70,8 +116,13 @@ async def _create_connection(
     uri: bool = False,
     log_file: Optional[TextIO] = None,
     name: Optional[str] = None,
+    query_stats: Optional[QueryStats] = None,
 ) -> aiosqlite.Connection:
-    connection = await aiosqlite.connect(database=database, uri=uri)
+    if query_stats is None:
+        connection = await aiosqlite.connect(database=database, uri=uri)
+    else:
+        factory = functools.partial(TimedConnection, query_stats=query_stats, name=name)
+        connection = await aiosqlite.connect(database=database, uri=uri, factory=factory)
 
     if log_file is not None:
         await connection.set_trace_callback(functools.partial(sql_trace_callback, file=log_file, name=name))
@@ -85,9 +136,12 @@ async def manage_connection(
     uri: bool = False,
     log_file: Optional[TextIO] = None,
     name: Optional[str] = None,
+    query_stats: Optional[QueryStats] = None,
 ) -> AsyncIterator[aiosqlite.Connection]:
     connection: aiosqlite.Connection
-    connection = await _create_connection(database=database, uri=uri, log_file=log_file, name=name)
+    connection = await _create_connection(
+        database=database, uri=uri, log_file=log_file, name=name, query_stats=query_stats
+    )
 
     try:
         yield connection
@@ -105,6 +159,10 @@ def sql_trace_callback(req: str, file: TextIO, name: Optional[str] = None) -> No
     file.write(line)
 
 
+def _slow_query_trace_callback(req: str, name: Optional[str], file: TextIO) -> None:
+    sql_trace_callback(req, file=file, name=name)
+
+
 def get_host_parameter_limit() -> int:
     # NOTE: This does not account for dynamically adjusted limits since it makes a
     #       separate db and connection.  If aiosqlite adds support we should use it.
@@ -134,18 +192,44 @@ class DBWrapper2:
     _log_file: Optional[TextIO] = None
     host_parameter_limit: int = get_host_parameter_limit()
     _lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # the consensus reader pool, which also serves the reader classes without a pool of their own
     _read_connections: asyncio.Queue[aiosqlite.Connection] = field(default_factory=asyncio.Queue)
     _num_read_connections: int = 0
+    _reader_pools: Dict[ReaderClass, asyncio.Queue[aiosqlite.Connection]] = field(default_factory=dict)
+    _num_reader_pool_connections: Dict[ReaderClass, int] = field(default_factory=dict)
+    query_stats: Optional[QueryStats] = None
     _in_use: Dict[asyncio.Task[object], aiosqlite.Connection] = field(default_factory=dict)
     _current_writer: Optional[asyncio.Task[object]] = None
     _savepoint_name: int = 0
+    # see on_rollback(). Whether any part of the current top level write
+    # transaction was rolled back
+    _rollback_callbacks: List[Callable[[aiosqlite.Connection], Awaitable[None]]] = field(default_factory=list)
+    _rolled_back: bool = False
 
-    async def add_connection(self, c: aiosqlite.Connection) -> None:
+    async def add_connection(self, c: aiosqlite.Connection, reader: ReaderClass = ReaderClass.CONSENSUS) -> None:
         # this guarantees that reader connections can only be used for reading
         assert c != self._write_connection
         await c.execute("pragma query_only")
-        self._read_connections.put_nowait(c)
-        self._num_read_connections += 1
+        if reader is ReaderClass.CONSENSUS:
+            self._read_connections.put_nowait(c)
+            self._num_read_connections += 1
+        else:
+            self._reader_pools.setdefault(reader, asyncio.Queue()).put_nowait(c)
+            self._num_reader_pool_connections[reader] = self._num_reader_pool_connections.get(reader, 0) + 1
+
+    def _reader_pool(self) -> asyncio.Queue[aiosqlite.Connection]:
+        return self._reader_pools.get(_reader_class.get(), self._read_connections)
+
+    @staticmethod
+    def _create_query_stats(
+        log_file: Optional[TextIO], query_stats: bool, slow_query_seconds: Optional[float]
+    ) -> Optional[QueryStats]:
+        if not query_stats:
+            return None
+        trace_callback = None
+        if log_file is not None:
+            trace_callback = functools.partial(_slow_query_trace_callback, file=log_file)
+        return QueryStats(slow_query_seconds=slow_query_seconds, trace_callback=trace_callback)
 
     @classmethod
     @contextlib.asynccontextmanager
@@ -161,7 +245,16 @@ class DBWrapper2:
         synchronous: Optional[str] = None,
         foreign_keys: Optional[bool] = None,
         row_factory: Optional[Type[aiosqlite.Row]] = None,
+        reader_pools: Optional[Dict[ReaderClass, int]] = None,
+        query_stats: bool = False,
+        slow_query_seconds: Optional[float] = None,
     ) -> AsyncIterator[DBWrapper2]:
+        """
+        reader_count is the size of the consensus reader pool, reader_pools
+        gives the other reader classes a pool of their own. With query_stats,
+        the latency of every statement is recorded, and statements taking
+        longer than slow_query_seconds are logged.
+        """
         if foreign_keys is None:
             foreign_keys = False
 
@@ -172,8 +265,9 @@ class DBWrapper2:
                 log_path.parent.mkdir(parents=True, exist_ok=True)
                 log_file = async_exit_stack.enter_context(log_path.open("a", encoding="utf-8"))
 
+            stats = cls._create_query_stats(log_file, query_stats, slow_query_seconds)
             write_connection = await async_exit_stack.enter_async_context(
-                manage_connection(database=database, uri=uri, log_file=log_file, name="writer"),
+                manage_connection(database=database, uri=uri, log_file=log_file, name="writer", query_stats=stats),
             )
             await (await write_connection.execute(f"pragma journal_mode={journal_mode}")).close()
             if synchronous is not None:
@@ -183,19 +277,23 @@ class DBWrapper2:
 
             write_connection.row_factory = row_factory
 
-            self = cls(_write_connection=write_connection, db_version=db_version, _log_file=log_file)
-
-            for index in range(reader_count):
-                read_connection = await async_exit_stack.enter_async_context(
-                    manage_connection(
-                        database=database,
-                        uri=uri,
-                        log_file=log_file,
-                        name=f"reader-{index}",
-                    ),
-                )
-                read_connection.row_factory = row_factory
-                await self.add_connection(c=read_connection)
+            self = cls(_write_connection=write_connection, db_version=db_version, _log_file=log_file, query_stats=stats)
+
+            pool_sizes = {ReaderClass.CONSENSUS: reader_count, **(reader_pools or {})}
+            for reader, count in pool_sizes.items():
+                for index in range(count):
+                    name = f"reader-{index}" if reader is ReaderClass.CONSENSUS else f"reader-{reader.value}-{index}"
+                    read_connection = await async_exit_stack.enter_async_context(
+                        manage_connection(
+                            database=database,
+                            uri=uri,
+                            log_file=log_file,
+                            name=name,
+                            query_stats=stats,
+                        ),
+                    )
+                    read_connection.row_factory = row_factory
+                    await self.add_connection(c=read_connection, reader=reader)
 
             try:
                 yield self
@@ -204,6 +302,10 @@ class DBWrapper2:
                     while self._num_read_connections > 0:
                         await self._read_connections.get()
                         self._num_read_connections -= 1
+                    for reader, pool in self._reader_pools.items():
+                        while self._num_reader_pool_connections[reader] > 0:
+                            await pool.get()
+                            self._num_reader_pool_connections[reader] -= 1
 
     @classmethod
     async def create(
@@ -254,6 +356,10 @@ class DBWrapper2:
             while self._num_read_connections > 0:
                 await (await self._read_connections.get()).close()
                 self._num_read_connections -= 1
+            for reader, pool in self._reader_pools.items():
+                while self._num_reader_pool_connections[reader] > 0:
+                    await (await pool.get()).close()
+                    self._num_reader_pool_connections[reader] -= 1
             await self._write_connection.close()
         finally:
             if self._log_file is not None:
@@ -271,6 +377,7 @@ class DBWrapper2:
         try:
             yield
         except:  # noqa E722
+            self._rolled_back = True
             await self._write_connection.execute(f"ROLLBACK TO {name}")
             raise
         finally:
@@ -278,6 +385,29 @@ class DBWrapper2:
             # just rolls back the state. We need to cancel it regardless
             await self._write_connection.execute(f"RELEASE {name}")
 
+    def on_rollback(self, callback: Callable[[aiosqlite.Connection], Awaitable[None]]) -> None:
+        """
+        Must be called by the current writer. Once its top level transaction
+        ends, if any part of it was rolled back, callback is awaited with the
+        write connection while the write lock is still held. It's meant for
+        state kept in memory alongside the DB, to be reloaded from it.
+        """
+        assert self._current_writer == asyncio.current_task()
+        if callback not in self._rollback_callbacks:
+            self._rollback_callbacks.append(callback)
+
+    @contextlib.asynccontextmanager
+    async def _rollback_callbacks_ctx(self) -> AsyncIterator[None]:
+        self._rolled_back = False
+        try:
+            yield
+        finally:
+            callbacks = self._rollback_callbacks
+            self._rollback_callbacks = []
+            if self._rolled_back:
+                for callback in callbacks:
+                    await callback(self._write_connection)
+
     @contextlib.asynccontextmanager
     async def writer(
         self,
@@ -316,6 +446,7 @@ class DBWrapper2:
                         self._set_foreign_key_enforcement(enabled=foreign_key_enforcement_enabled),
                     )
 
+                await exit_stack.enter_async_context(self._rollback_callbacks_ctx())
                 async with self._savepoint_ctx():
                     self._current_writer = task
                     try:
@@ -372,12 +503,13 @@ class DBWrapper2:
             return
 
         async with self._lock:
-            async with self._savepoint_ctx():
-                self._current_writer = task
-                try:
-                    yield self._write_connection
-                finally:
-                    self._current_writer = None
+            async with self._rollback_callbacks_ctx():
+                async with self._savepoint_ctx():
+                    self._current_writer = task
+                    try:
+                        yield self._write_connection
+                    finally:
+                        self._current_writer = None
 
     @contextlib.asynccontextmanager
     async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
@@ -416,7 +548,8 @@ class DBWrapper2:
         if task in self._in_use:
             yield self._in_use[task]
         else:
-            c = await self._read_connections.get()
+            pool = self._reader_pool()
+            c = await pool.get()
             try:
                 # record our connection in this dict to allow nested calls in
                 # the same task to use the same connection
@@ -424,4 +557,4 @@ class DBWrapper2:
                 yield c
             finally:
                 del self._in_use[task]
-                self._read_connections.put_nowait(c)
+                pool.put_nowait(c)
@@ -2,7 +2,8 @@ from __future__ import annotations
 
 import logging
 import random
-from typing import Dict, List, Optional, Set
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 from chia.types.blockchain_format.coin import Coin
 from chia.types.blockchain_format.sized_bytes import bytes32
@@ -10,6 +11,11 @@ from chia.util.ints import uint64, uint128
 from chia.wallet.util.tx_config import CoinSelectionConfig
 from chia.wallet.wallet_coin_record import WalletCoinRecord
 
+# the branch and bound search gives up after visiting this many selections
+BNB_MAX_TRIES = 100000
+# the randomized knapsack search only considers this many of the largest coins smaller than the target
+KNAPSACK_MAX_COINS = 1000
+
 
 async def select_coins(
     spendable_amount: uint128,
@@ -35,12 +41,15 @@ async def select_coins(
     sum_spendable_coins = 0
     valid_spendable_coins: List[Coin] = []
 
+    # coin ids are only computed when there are coins to exclude by id
+    check_names = len(unconfirmed_removals) > 0 or len(coin_selection_config.excluded_coin_ids) > 0
     for coin_record in spendable_coins:  # remove all the unconfirmed coins, excluded coins and dust.
-        coin_name: bytes32 = coin_record.coin.name()
-        if coin_name in unconfirmed_removals:
-            continue
-        if coin_name in coin_selection_config.excluded_coin_ids:
-            continue
+        if check_names:
+            coin_name: bytes32 = coin_record.coin.name()
+            if coin_name in unconfirmed_removals:
+                continue
+            if coin_name in coin_selection_config.excluded_coin_ids:
+                continue
         if (
             coin_record.coin.amount < coin_selection_config.min_coin_amount
             or coin_record.coin.amount > coin_selection_config.max_coin_amount
@@ -66,52 +75,96 @@ async def select_coins(
 
     # Sort the coins by amount
     valid_spendable_coins.sort(reverse=True, key=lambda r: r.amount)
+    # the same amounts in ascending order, to bisect
+    ascending_amounts = [coin.amount for coin in reversed(valid_spendable_coins)]
 
     # check for exact 1 to 1 coin match.
-    exact_match_coin: Optional[Coin] = check_for_exact_match(valid_spendable_coins, uint64(amount))
+    exact_match_coin: Optional[Coin] = find_exact_match(valid_spendable_coins, ascending_amounts, uint64(amount))
     if exact_match_coin:
         log.debug(f"selected coin with an exact match: {exact_match_coin}")
         return {exact_match_coin}
 
     # Check for an exact match with all of the coins smaller than the amount.
     # If we have more, smaller coins than the amount we run the next algorithm.
-    smaller_coin_sum = 0  # coins smaller than target.
-    smaller_coins: List[Coin] = []
-    for coin in valid_spendable_coins:
-        if coin.amount < amount:
-            smaller_coin_sum += coin.amount
-            smaller_coins.append(coin)
+    smaller_coins: List[Coin] = valid_spendable_coins[
+        len(valid_spendable_coins) - bisect_left(ascending_amounts, amount) :
+    ]
+    smaller_coin_sum = sum(coin.amount for coin in smaller_coins)  # coins smaller than target.
+    greater_coin: Optional[Coin] = find_smallest_coin_over_target(valid_spendable_coins, ascending_amounts, amount)
     if smaller_coin_sum == amount and len(smaller_coins) < max_num_coins and amount != 0:
         log.debug(f"Selected all smaller coins because they equate to an exact match of the target.: {smaller_coins}")
         return set(smaller_coins)
     elif smaller_coin_sum < amount:
-        smallest_coin: Optional[Coin] = select_smallest_coin_over_target(amount, valid_spendable_coins)
-        assert smallest_coin is not None  # Since we know we have enough, there must be a larger coin
-        log.debug(f"Selected closest greater coin: {smallest_coin.name()}")
-        return {smallest_coin}
+        assert greater_coin is not None  # Since we know we have enough, there must be a larger coin
+        log.debug(f"Selected closest greater coin: {greater_coin.name()}")
+        return {greater_coin}
     elif smaller_coin_sum > amount:
-        coin_set: Optional[Set[Coin]] = knapsack_coin_algorithm(
-            smaller_coins, amount, coin_selection_config.max_coin_amount, max_num_coins
-        )
-        log.debug(f"Selected coins from knapsack algorithm: {coin_set}")
+        coin_set: Optional[Set[Coin]] = None
+        bnb_coins, exhausted = branch_and_bound(smaller_coins, amount, max_num_coins)
+        if bnb_coins is not None:
+            coin_set = set(bnb_coins)
+            log.debug(f"Selected coins from branch and bound: {coin_set}")
+        if not exhausted:
+            # the search didn't finish, the randomized one may find less change
+            knapsack_set: Optional[Set[Coin]] = knapsack_coin_algorithm(
+                smaller_coins[:KNAPSACK_MAX_COINS], amount, coin_selection_config.max_coin_amount, max_num_coins
+            )
+            log.debug(f"Selected coins from knapsack algorithm: {knapsack_set}")
+            if knapsack_set is not None and (
+                coin_set is None or selection_waste(knapsack_set, amount) < selection_waste(coin_set, amount)
+            ):
+                coin_set = knapsack_set
         if coin_set is None:
             coin_set = sum_largest_coins(amount, smaller_coins)
-            if coin_set is None or len(coin_set) > max_num_coins:
-                greater_coin = select_smallest_coin_over_target(amount, valid_spendable_coins)
-                if greater_coin is None:
-                    raise ValueError(
-                        f"Transaction of {amount} mojo would use more than "
-                        f"{max_num_coins} coins. Try sending a smaller amount"
-                    )
-                coin_set = {greater_coin}
+            if coin_set is not None and len(coin_set) > max_num_coins:
+                coin_set = None
+        if greater_coin is not None and (
+            coin_set is None or selection_waste([greater_coin], amount) <= selection_waste(coin_set, amount)
+        ):
+            log.debug(f"Selected closest greater coin: {greater_coin.name()}")
+            coin_set = {greater_coin}
+        if coin_set is None:
+            raise ValueError(
+                f"Transaction of {amount} mojo would use more than {max_num_coins} coins. Try sending a smaller amount"
+            )
         return coin_set
     else:
         # if smaller_coin_sum == amount and (len(smaller_coins) >= max_num_coins or amount == 0)
-        potential_large_coin: Optional[Coin] = select_smallest_coin_over_target(amount, valid_spendable_coins)
-        if potential_large_coin is None:
+        if greater_coin is None:
             raise ValueError("Too many coins are required to make this transaction")
-        log.debug(f"Resorted to selecting smallest coin over target due to dust.: {potential_large_coin}")
-        return {potential_large_coin}
+        log.debug(f"Resorted to selecting smallest coin over target due to dust.: {greater_coin}")
+        return {greater_coin}
+
+
+def selection_waste(coins: Iterable[Coin], target: int) -> Tuple[int, int]:
+    """
+    The change a selection of coins leaves, then the number of coins it spends. Lower is better.
+    """
+    total = 0
+    count = 0
+    for coin in coins:
+        total += coin.amount
+        count += 1
+    return total - target, count
+
+
+# Coins must be sorted in descending amount order, ascending_amounts are their amounts in ascending order.
+def find_exact_match(sorted_coins: List[Coin], ascending_amounts: List[int], target: int) -> Optional[Coin]:
+    index = bisect_right(ascending_amounts, target) - 1
+    if index < 0 or ascending_amounts[index] != target:
+        return None
+    return sorted_coins[len(sorted_coins) - 1 - index]
+
+
+# the smallest coin of at least target. Coins must be sorted in descending amount order, ascending_amounts
+# are their amounts in ascending order.
+def find_smallest_coin_over_target(
+    sorted_coins: List[Coin], ascending_amounts: List[int], target: int
+) -> Optional[Coin]:
+    index = bisect_left(ascending_amounts, target)
+    if index == len(ascending_amounts):
+        return None
+    return sorted_coins[len(sorted_coins) - 1 - index]
 
 
 # These algorithms were based off of the algorithms in:
@@ -175,6 +228,57 @@ def knapsack_coin_algorithm(
     return best_set_of_coins
 
 
+# Depth first search of the selections of at most max_num_coins coins adding up to at least target, for
+# the one with the smallest sum. Returns it (None if there is none) and whether the search finished, it
+# stops early at an exact match or after max_tries selections. Coins must be sorted in descending amount order.
+def branch_and_bound(
+    sorted_coins: List[Coin], target: int, max_num_coins: int, max_tries: int = BNB_MAX_TRIES
+) -> Tuple[Optional[List[Coin]], bool]:
+    amounts = [coin.amount for coin in sorted_coins]
+    # remaining[i] is the sum of the coins from i on
+    remaining = [0] * (len(amounts) + 1)
+    for i in range(len(amounts) - 1, -1, -1):
+        remaining[i] = remaining[i + 1] + amounts[i]
+
+    best: Optional[List[int]] = None
+    best_sum = 0
+    selected: List[int] = []
+    selected_sum = 0
+    index = 0
+    for _ in range(max_tries):
+        if selected_sum >= target:
+            # adding more coins only adds change
+            if best is None or selected_sum < best_sum:
+                best = selected.copy()
+                best_sum = selected_sum
+                if selected_sum == target:
+                    return [sorted_coins[i] for i in best], True
+            backtrack = True
+        else:
+            backtrack = (
+                selected_sum + remaining[index] < target
+                or (best is not None and selected_sum + amounts[-1] >= best_sum)
+                or len(selected) >= max_num_coins
+            )
+        if not backtrack:
+            selected.append(index)
+            selected_sum += amounts[index]
+            index += 1
+            continue
+        if len(selected) == 0:
+            break
+        # leave out the last selected coin instead. Selections that only differ by coins of the same amount
+        # have the same sum, so the coins of the same amount that follow are left out as well
+        last = selected.pop()
+        selected_sum -= amounts[last]
+        index = last + 1
+        while index < len(amounts) and amounts[index] == amounts[last]:
+            index += 1
+    else:
+        return None if best is None else [sorted_coins[i] for i in best], False
+    return None if best is None else [sorted_coins[i] for i in best], True
+
+
 # Adds up the largest coins in the list, resulting in the minimum number of selected coins. A solution
 # is guaranteed if and only if the sum(coins) >= target. Coins must be sorted in descending amount order.
 def sum_largest_coins(target: uint128, sorted_coins: List[Coin]) -> Optional[Set[Coin]]:
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import logging
+from concurrent.futures.process import ProcessPoolExecutor
+from multiprocessing.context import BaseContext
+from typing import Dict, List, Optional, Tuple
+
+from chia_rs import G1Element, PrivateKey
+
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.setproctitle import getproctitle, setproctitle
+from chia.wallet.derive_keys import (
+    _derive_path,
+    _derive_pk_unhardened,
+    master_pk_to_wallet_pk_unhardened_intermediate,
+    master_sk_to_wallet_sk_intermediate,
+)
+from chia.wallet.puzzles.p2_delegated_puzzle_or_hidden_puzzle import puzzle_hash_for_pk
+
+log = logging.getLogger(__name__)
+
+# the indexes given to a worker process at once
+DERIVATION_BATCH_SIZE = 100
+
+
+@dataclasses.dataclass(frozen=True)
+class DerivedKeys:
+    """
+    The public keys at a derivation index, with the puzzle hashes of the
+    standard wallet for them. hardened is None without the private key.
+    """
+
+    index: int
+    hardened: Optional[G1Element]
+    unhardened: G1Element
+    hardened_puzzle_hash: Optional[bytes32]
+    unhardened_puzzle_hash: bytes32
+
+
+def derive_keys(
+    intermediate_sk: Optional[bytes], intermediate_pk_unhardened: bytes, start: int, end: int
+) -> List[Tuple[int, Optional[bytes], bytes, Optional[bytes32], bytes32]]:
+    """
+    Derives the keys from start to end (excluded). Runs in the worker
+    processes, so it takes and returns serialized keys.
+    """
+    sk = None if intermediate_sk is None else PrivateKey.from_bytes(intermediate_sk)
+    pk_unhardened = G1Element.from_bytes(intermediate_pk_unhardened)
+    derived: List[Tuple[int, Optional[bytes], bytes, Optional[bytes32], bytes32]] = []
+    for index in range(start, end):
+        hardened: Optional[G1Element] = None if sk is None else _derive_path(sk, [index]).get_g1()
+        unhardened = _derive_pk_unhardened(pk_unhardened, [index])
+        derived.append(
+            (
+                index,
+                None if hardened is None else bytes(hardened),
+                bytes(unhardened),
+                None if hardened is None else puzzle_hash_for_pk(hardened),
+                puzzle_hash_for_pk(unhardened),
+            )
+        )
+    return derived
+
+
+class DerivationPool:
+    """
+    Keys derived ahead of WalletStateManager.create_more_puzzle_hashes(), in
+    worker processes. ensure_ahead() starts deriving in the background the
+    keys up to lookahead indexes past the last one used, get_keys() returns
+    the derived keys and derives the missing ones.
+    """
+
+    def __init__(
+        self,
+        private_key: Optional[PrivateKey],
+        root_pubkey: G1Element,
+        lookahead: int,
+        multiprocessing_context: BaseContext,
+        num_processes: int = 2,
+    ) -> None:
+        self.lookahead = lookahead
+        self._intermediate_sk: Optional[bytes] = (
+            None if private_key is None else bytes(master_sk_to_wallet_sk_intermediate(private_key))
+        )
+        self._intermediate_pk_unhardened = bytes(master_pk_to_wallet_pk_unhardened_intermediate(root_pubkey))
+        self._num_processes = num_processes
+        self._executor = ProcessPoolExecutor(
+            num_processes,
+            mp_context=multiprocessing_context,
+            initializer=setproctitle,
+            initargs=(f"{getproctitle()}_worker",),
+        )
+        self._keys: Dict[int, DerivedKeys] = {}
+        # the keys are being derived in the background up to _target (excluded), from _next
+        self._next = 0
+        self._target = 0
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _derive(self, start: int, end: int) -> List[DerivedKeys]:
+        loop = asyncio.get_running_loop()
+        batches = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    self._executor,
+                    derive_keys,
+                    self._intermediate_sk,
+                    self._intermediate_pk_unhardened,
+                    batch_start,
+                    min(batch_start + DERIVATION_BATCH_SIZE, end),
+                )
+                for batch_start in range(start, end, DERIVATION_BATCH_SIZE)
+            )
+        )
+        return [
+            DerivedKeys(
+                index,
+                None if hardened is None else G1Element.from_bytes(hardened),
+                G1Element.from_bytes(unhardened),
+                hardened_puzzle_hash,
+                unhardened_puzzle_hash,
+            )
+            for batch in batches
+            for index, hardened, unhardened, hardened_puzzle_hash, unhardened_puzzle_hash in batch
+        ]
+
+    def ensure_ahead(self, index: int) -> None:
+        """
+        Drops the keys before index, and derives the ones up to index + lookahead in the background.
+        """
+        for old_index in [old_index for old_index in self._keys if old_index < index]:
+            del self._keys[old_index]
+        self._next = max(self._next, index)
+        self._target = max(self._target, index + self.lookahead)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._derive_ahead())
+
+    async def _derive_ahead(self) -> None:
+        while self._next < self._target:
+            start = self._next
+            end = min(start + DERIVATION_BATCH_SIZE * self._num_processes, self._target)
+            try:
+                derived = await self._derive(start, end)
+            except Exception:
+                log.exception(f"Failed to derive keys from {start} to {end - 1}")
+                return
+            for keys in derived:
+                if keys.index >= self._next:
+                    self._keys[keys.index] = keys
+            self._next = max(self._next, end)
+
+    async def get_keys(self, start: int, end: int) -> List[DerivedKeys]:
+        """
+        Returns the keys from start to end (excluded), deriving the ones that aren't ready.
+        """
+        # copied before deriving, as ensure_ahead() may drop keys meanwhile
+        keys = {index: self._keys[index] for index in range(start, end) if index in self._keys}
+        missing = [index for index in range(start, end) if index not in keys]
+        if len(missing) > 0:
+            log.debug(f"Deriving {len(missing)} keys that weren't derived ahead")
+            for derived in await self._derive(missing[0], missing[-1] + 1):
+                keys.setdefault(derived.index, derived)
+        return [keys[index] for index in range(start, end)]
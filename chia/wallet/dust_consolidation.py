@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import dataclasses
+from typing import List, Tuple
+
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.ints import uint16, uint32, uint64
+from chia.util.streamable import Streamable, streamable
+from chia.wallet.wallet_coin_record import WalletCoinRecord
+
+# the most coins a consolidation transaction spends, as many as coin selection uses
+MAX_CONSOLIDATION_BATCH_SIZE = 500
+
+
+@streamable
+@dataclasses.dataclass(frozen=True)
+class AutoConsolidateDustSettings(Streamable):
+    enabled: bool = False
+    # seconds between two consolidation runs
+    interval: uint32 = uint32(3600)
+    # unspent coins of the standard wallet smaller than this many mojos are dust
+    dust_threshold: uint64 = uint64(1000000000)
+    # a run only consolidates when there are at least this many dust coins
+    min_coins: uint16 = uint16(100)
+    # the dust coins merged into one by each transaction
+    batch_size: uint16 = uint16(100)
+    # the fee of each transaction, and the most fees a run spends (0 for no cap)
+    tx_fee: uint64 = uint64(0)
+    max_fee: uint64 = uint64(0)
+    # the most transactions a run creates
+    max_batches: uint16 = uint16(10)
+
+
+@streamable
+@dataclasses.dataclass(frozen=True)
+class DustConsolidationBatch(Streamable):
+    coin_ids: List[bytes32]
+    # the total of the coins, the merged coin gets amount - fee
+    amount: uint64
+    fee: uint64
+
+
+@streamable
+@dataclasses.dataclass(frozen=True)
+class DustConsolidationReport(Streamable):
+    dry_run: bool
+    # the unspent coins below the dust threshold
+    dust_coins: uint32
+    batches: List[DustConsolidationBatch]
+    # batches left out because their coins don't add up to more than the fee
+    uneconomical_batches: uint32
+
+
+def plan_dust_consolidation(
+    dust_records: List[WalletCoinRecord], settings: AutoConsolidateDustSettings
+) -> Tuple[List[DustConsolidationBatch], int]:
+    """
+    Splits the dust coins into batches, smallest coins first. Returns the
+    batches within the fee cap and max_batches, and the number of batches
+    left out because their coins don't cover the fee.
+    """
+    batch_size = max(2, min(settings.batch_size, MAX_CONSOLIDATION_BATCH_SIZE))
+    max_batches = settings.max_batches
+    if settings.tx_fee > 0 and settings.max_fee > 0:
+        max_batches = min(max_batches, settings.max_fee // settings.tx_fee)
+    records = sorted(dust_records, key=lambda record: record.coin.amount)
+    batches: List[DustConsolidationBatch] = []
+    uneconomical = 0
+    for start in range(0, len(records), batch_size):
+        if len(batches) >= max_batches:
+            break
+        batch = records[start : start + batch_size]
+        if len(batch) < 2:
+            break
+        amount = sum(record.coin.amount for record in batch)
+        if amount <= settings.tx_fee:
+            uneconomical += 1
+            continue
+        batches.append(
+            DustConsolidationBatch([record.coin.name() for record in batch], uint64(amount), uint64(settings.tx_fee))
+        )
+    return batches, uneconomical
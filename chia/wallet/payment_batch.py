@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import List, Optional
+
+from chia.consensus.condition_costs import ConditionCost
+from chia.consensus.constants import ConsensusConstants
+from chia.util.ints import uint64
+from chia.wallet.payment import Payment
+
+# the bytes of a CREATE_COIN condition besides its memos: puzzle hash, amount and the list structure
+CREATE_COIN_BYTES = 50
+
+
+@dataclass(frozen=True)
+class BatchPayment:
+    """
+    A payment of WalletRpcApi.send_transaction_batch(). index is its position
+    in the request. Guess payments get a transaction of their own, as guesses
+    are tracked one per transaction, the other payments of a bundle share one.
+    """
+
+    index: int
+    payment: Payment
+    fee: uint64 = uint64(0)
+    guess: bool = False
+
+
+def estimate_payment_cost(payment: BatchPayment, constants: ConsensusConstants, spend_cost: int) -> int:
+    """
+    The cost a payment adds to a spend bundle, spend_cost being the cost of
+    spending one standard coin. The coins spent to fund the payments aren't
+    included, see max_payments_cost().
+    """
+    size = CREATE_COIN_BYTES + sum(len(memo) for memo in payment.payment.memos)
+    cost = ConditionCost.CREATE_COIN.value + size * constants.COST_PER_BYTE
+    if payment.guess:
+        # its own transaction, spending a coin created for it by the first one
+        cost += spend_cost + ConditionCost.CREATE_COIN.value + CREATE_COIN_BYTES * constants.COST_PER_BYTE
+    return cost
+
+
+def max_payments_cost(constants: ConsensusConstants) -> int:
+    """
+    The most cost the payments of a bundle may add. Like the standard wallet's
+    max_send_quantity, bundles stay within a fifth of a block, half of it
+    being left for the coins selected to fund them.
+    """
+    return int(constants.MAX_BLOCK_COST_CLVM / 5 / 2)
+
+
+def plan_payment_batches(
+    payments: List[BatchPayment],
+    max_cost: int,
+    constants: ConsensusConstants,
+    spend_cost: int,
+    max_payments: Optional[int] = None,
+) -> List[List[BatchPayment]]:
+    """
+    Groups the payments, in order, into as few batches as the cost limit, and
+    max_payments if given, allow. Each batch becomes one spend bundle.
+    """
+    batches: List[List[BatchPayment]] = []
+    batch: List[BatchPayment] = []
+    batch_cost = 0
+    for payment in payments:
+        cost = estimate_payment_cost(payment, constants, spend_cost)
+        if len(batch) > 0 and (
+            batch_cost + cost > max_cost or (max_payments is not None and len(batch) >= max_payments)
+        ):
+            batches.append(batch)
+            batch = []
+            batch_cost = 0
+        batch.append(payment)
+        batch_cost += cost
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import logging
 from time import perf_counter
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 import aiosqlite
 
@@ -81,6 +81,8 @@ class TradeStore:
     cache_size: uint32
     db_wrapper: DBWrapper2
     log: logging.Logger
+    # called whenever trades are added, changed or removed
+    trades_changed_callback: Optional[Callable[[], None]] = None
 
     @classmethod
     async def create(
@@ -220,6 +222,11 @@ class TradeStore:
             await conn.executemany(
                 "INSERT INTO coin_of_interest_to_trade_record (coin_id, trade_id) VALUES(?, ?)", inserts
             )
+        self._trades_changed()
+
+    def _trades_changed(self) -> None:
+        if self.trades_changed_callback is not None:
+            self.trades_changed_callback()
 
     async def set_status(
         self, trade_id: bytes32, status: TradeStatus, offer_name: bytes32 = None, index: uint32 = uint32(0)
@@ -480,11 +487,13 @@ class TradeStore:
             # Delete from storage
             cursor = await conn.execute("DELETE FROM trade_records WHERE confirmed_at_index>?", (block_index,))
             await cursor.close()
+        self._trades_changed()
 
     async def delete_trade_record(self, trade_id: bytes32) -> None:
         async with self.db_wrapper.writer_maybe_transaction() as conn:
             await (await conn.execute("DELETE FROM trade_records WHERE trade_id=?", (trade_id.hex(),))).close()
             await (await conn.execute("DELETE FROM trade_record_times WHERE trade_id=?", (trade_id,))).close()
+        self._trades_changed()
 
     async def _get_new_trade_records_from_old(self, old_records: List[TradeRecordOld]) -> List[TradeRecord]:
         trade_id_to_valid_times: Dict[bytes, ConditionValidTimes] = {}
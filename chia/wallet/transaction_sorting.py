@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import enum
+from typing import List, Tuple
 
 
 class SortKey(enum.Enum):
@@ -12,3 +13,13 @@ class SortKey(enum.Enum):
 
     def descending(self) -> str:
         return self.value.format(ASC="DESC", DESC="ASC")
+
+    def columns(self, reverse: bool = False) -> List[Tuple[str, bool]]:
+        """
+        The sorted columns, with whether each one is in descending order.
+        """
+        columns = []
+        for term in self.value[len("ORDER BY ") :].split(", "):
+            column, order = term.split(" ")
+            columns.append((column, (order == "{DESC}") != reverse))
+        return columns
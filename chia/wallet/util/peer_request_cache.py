@@ -1,77 +1,206 @@
 from __future__ import annotations
 
 import asyncio
-from typing import Any, Dict, List, Optional, Set, Tuple
+import dataclasses
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
+
+from sortedcontainers import SortedDict
 
 from chia.protocols.wallet_protocol import CoinState
 from chia.types.blockchain_format.sized_bytes import bytes32
 from chia.types.header_block import HeaderBlock
 from chia.util.hash import std_hash
 from chia.util.ints import uint32, uint64
-from chia.util.lru_cache import LRUCache
+
+# the default budget of a peer's cache
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# estimated memory of an entry besides the header block it may hold: the key,
+# the value and the references to them in the cache's dicts
+ENTRY_OVERHEAD_BYTES = 300
+
+BLOCKS = "blocks"
+BLOCK_REQUESTS = "block_requests"
+STATES_VALIDATED = "states_validated"
+TIMESTAMPS = "timestamps"
+BLOCKS_VALIDATED = "blocks_validated"
+BLOCK_SIGNATURES_VALIDATED = "block_signatures_validated"
+ADDITIONS_IN_BLOCK = "additions_in_block"
+REMOVALS_IN_BLOCK = "removals_in_block"
+KINDS = (
+    BLOCKS,
+    BLOCK_REQUESTS,
+    STATES_VALIDATED,
+    TIMESTAMPS,
+    BLOCKS_VALIDATED,
+    BLOCK_SIGNATURES_VALIDATED,
+    ADDITIONS_IN_BLOCK,
+    REMOVALS_IN_BLOCK,
+)
+
+
+class SharedHeaderBlocks:
+    """
+    The header blocks cached by the PeerRequestCaches of all peers, by header
+    hash, so a block received from several peers is held once. Header blocks
+    are immutable, a block is dropped when no cache refers to it anymore.
+    """
+
+    def __init__(self) -> None:
+        self._blocks: Dict[bytes32, Tuple[HeaderBlock, int]] = {}  # header_hash -> (block, number of references)
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def acquire(self, header_block: HeaderBlock) -> HeaderBlock:
+        """
+        Returns the shared instance of the block, and counts a reference to it.
+        """
+        header_hash = header_block.header_hash
+        shared, references = self._blocks.get(header_hash, (header_block, 0))
+        self._blocks[header_hash] = (shared, references + 1)
+        return shared
+
+    def release(self, header_block: HeaderBlock) -> None:
+        header_hash = header_block.header_hash
+        shared, references = self._blocks[header_hash]
+        if references <= 1:
+            del self._blocks[header_hash]
+        else:
+            self._blocks[header_hash] = (shared, references - 1)
+
+
+@dataclasses.dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+
+@dataclasses.dataclass
+class _Entry:
+    height: uint32
+    size: int
+    value: Any
 
 
 class PeerRequestCache:
-    _blocks: LRUCache[uint32, HeaderBlock]  # height -> HeaderBlock
-    _block_requests: LRUCache[Tuple[uint32, uint32], asyncio.Task[Any]]  # (start, end) -> Task
-    _states_validated: LRUCache[bytes32, Optional[uint32]]  # coin state hash -> last change height, or None for reorg
-    _timestamps: LRUCache[uint32, uint64]  # block height -> timestamp
-    _blocks_validated: LRUCache[bytes32, uint32]  # header_hash -> height
-    _block_signatures_validated: LRUCache[bytes32, uint32]  # sig_hash -> height
-    _additions_in_block: LRUCache[Tuple[bytes32, bytes32], uint32]  # header_hash, puzzle_hash -> height
+    """
+    What was requested from and validated for a peer. Every entry relates to
+    an event at a height, and is kept in a per-height bucket, so that
+    clear_after_height() only touches the buckets it removes. Entries are
+    evicted least recently used first when their estimated size exceeds
+    max_bytes. Header blocks are shared with the caches of other peers through
+    shared_blocks.
+    """
+
+    # (kind, key) -> entry, least recently used first
+    _entries: OrderedDict[Tuple[str, Hashable], _Entry]
+    # height -> keys of the entries at that height
+    _buckets: SortedDict[uint32, Set[Tuple[str, Hashable]]]
     # The wallet gets the state update before receiving the block. In untrusted mode the block is required for the
     # coin state validation, so we cache them before we apply them once we received the block.
     _race_cache: Dict[uint32, Set[CoinState]]
 
-    def __init__(self) -> None:
-        self._blocks = LRUCache(100)
-        self._block_requests = LRUCache(300)
-        self._states_validated = LRUCache(1000)
-        self._timestamps = LRUCache(1000)
-        self._blocks_validated = LRUCache(1000)
-        self._block_signatures_validated = LRUCache(1000)
-        self._additions_in_block = LRUCache(200)
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, shared_blocks: Optional[SharedHeaderBlocks] = None) -> None:
+        self.max_bytes = max_bytes
+        self.shared_blocks = SharedHeaderBlocks() if shared_blocks is None else shared_blocks
+        self.size = 0
+        self._entries = OrderedDict()
+        self._buckets = SortedDict()
+        self._stats: Dict[str, CacheStats] = {kind: CacheStats() for kind in KINDS}
         self._race_cache = {}
 
+    def _get(self, kind: str, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get((kind, key))
+        stats = self._stats[kind]
+        if entry is None:
+            stats.misses += 1
+            return None
+        stats.hits += 1
+        self._entries.move_to_end((kind, key))
+        return entry.value
+
+    def _put(self, kind: str, key: Hashable, height: uint32, value: Any, size: int = 0) -> None:
+        self._remove((kind, key))
+        entry = _Entry(height, size + ENTRY_OVERHEAD_BYTES, value)
+        self._entries[(kind, key)] = entry
+        self._buckets.setdefault(height, set()).add((kind, key))
+        self.size += entry.size
+        stats = self._stats[kind]
+        stats.entries += 1
+        stats.bytes += entry.size
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, full_key: Tuple[str, Hashable], *, from_bucket: bool = True) -> None:
+        entry = self._entries.pop(full_key, None)
+        if entry is None:
+            return
+        if from_bucket:
+            bucket = self._buckets[entry.height]
+            bucket.discard(full_key)
+            if len(bucket) == 0:
+                del self._buckets[entry.height]
+        kind = full_key[0]
+        if kind == BLOCKS:
+            self.shared_blocks.release(entry.value)
+        self.size -= entry.size
+        stats = self._stats[kind]
+        stats.entries -= 1
+        stats.bytes -= entry.size
+
     def get_block(self, height: uint32) -> Optional[HeaderBlock]:
-        return self._blocks.get(height)
+        block: Optional[HeaderBlock] = self._get(BLOCKS, height)
+        return block
 
     def add_to_blocks(self, header_block: HeaderBlock) -> None:
-        self._blocks.put(header_block.height, header_block)
+        shared = self.shared_blocks.acquire(header_block)
+        self._put(BLOCKS, header_block.height, header_block.height, shared, len(bytes(shared)))
         if header_block.is_transaction_block:
             assert header_block.foliage_transaction_block is not None
-            if self._timestamps.get(header_block.height) is None:
-                self._timestamps.put(header_block.height, header_block.foliage_transaction_block.timestamp)
+            if (TIMESTAMPS, header_block.height) not in self._entries:
+                self._put(
+                    TIMESTAMPS,
+                    header_block.height,
+                    header_block.height,
+                    header_block.foliage_transaction_block.timestamp,
+                )
 
     def get_block_request(self, start: uint32, end: uint32) -> Optional[asyncio.Task[Any]]:
-        return self._block_requests.get((start, end))
+        task: Optional[asyncio.Task[Any]] = self._get(BLOCK_REQUESTS, (start, end))
+        return task
 
     def add_to_block_requests(self, start: uint32, end: uint32, request: asyncio.Task[Any]) -> None:
-        self._block_requests.put((start, end), request)
+        self._put(BLOCK_REQUESTS, (start, end), uint32(max(start, end)), request)
 
     def in_states_validated(self, coin_state_hash: bytes32) -> bool:
-        return self._states_validated.get(coin_state_hash) is not None
+        return self._get(STATES_VALIDATED, coin_state_hash) is not None
 
     def add_to_states_validated(self, coin_state: CoinState) -> None:
-        cs_height: Optional[uint32] = None
         if coin_state.spent_height is not None:
             cs_height = uint32(coin_state.spent_height)
         elif coin_state.created_height is not None:
             cs_height = uint32(coin_state.created_height)
-        self._states_validated.put(coin_state.get_hash(), cs_height)
+        else:
+            # a reorg, which is never looked up as validated
+            return
+        self._put(STATES_VALIDATED, coin_state.get_hash(), cs_height, True)
 
     def get_height_timestamp(self, height: uint32) -> Optional[uint64]:
-        return self._timestamps.get(height)
+        timestamp: Optional[uint64] = self._get(TIMESTAMPS, height)
+        return timestamp
 
     def add_to_blocks_validated(self, reward_chain_hash: bytes32, height: uint32) -> None:
-        self._blocks_validated.put(reward_chain_hash, height)
+        self._put(BLOCKS_VALIDATED, reward_chain_hash, height, True)
 
     def in_blocks_validated(self, reward_chain_hash: bytes32) -> bool:
-        return self._blocks_validated.get(reward_chain_hash) is not None
+        return self._get(BLOCKS_VALIDATED, reward_chain_hash) is not None
 
     def add_to_block_signatures_validated(self, block: HeaderBlock) -> None:
         sig_hash: bytes32 = self._calculate_sig_hash_from_block(block)
-        self._block_signatures_validated.put(sig_hash, block.height)
+        self._put(BLOCK_SIGNATURES_VALIDATED, sig_hash, block.height, True)
 
     @staticmethod
     def _calculate_sig_hash_from_block(block: HeaderBlock) -> bytes32:
@@ -83,13 +212,19 @@ class PeerRequestCache:
 
     def in_block_signatures_validated(self, block: HeaderBlock) -> bool:
         sig_hash: bytes32 = self._calculate_sig_hash_from_block(block)
-        return self._block_signatures_validated.get(sig_hash) is not None
+        return self._get(BLOCK_SIGNATURES_VALIDATED, sig_hash) is not None
 
     def add_to_additions_in_block(self, header_hash: bytes32, addition_ph: bytes32, height: uint32) -> None:
-        self._additions_in_block.put((header_hash, addition_ph), height)
+        self._put(ADDITIONS_IN_BLOCK, (header_hash, addition_ph), height, True)
 
     def in_additions_in_block(self, header_hash: bytes32, addition_ph: bytes32) -> bool:
-        return self._additions_in_block.get((header_hash, addition_ph)) is not None
+        return self._get(ADDITIONS_IN_BLOCK, (header_hash, addition_ph)) is not None
+
+    def add_to_removals_in_block(self, header_hash: bytes32, coin_name: bytes32, height: uint32) -> None:
+        self._put(REMOVALS_IN_BLOCK, (header_hash, coin_name), height, True)
+
+    def in_removals_in_block(self, header_hash: bytes32, coin_name: bytes32) -> bool:
+        return self._get(REMOVALS_IN_BLOCK, (header_hash, coin_name)) is not None
 
     def add_states_to_race_cache(self, coin_states: List[CoinState]) -> None:
         for coin_state in coin_states:
@@ -114,47 +249,26 @@ class PeerRequestCache:
 
     def clear_after_height(self, height: int) -> None:
         # Remove any cached item which relates to an event that happened at a height above height.
-        new_blocks = LRUCache[uint32, HeaderBlock](self._blocks.capacity)
-        for k, v in self._blocks.cache.items():
-            if k <= height:
-                new_blocks.put(k, v)
-        self._blocks = new_blocks
-
-        new_block_requests: LRUCache[Tuple[uint32, uint32], asyncio.Task[Any]] = LRUCache(self._block_requests.capacity)
-        for (start_h, end_h), fetch_task in self._block_requests.cache.items():
-            if start_h <= height and end_h <= height:
-                new_block_requests.put((start_h, end_h), fetch_task)
-        self._block_requests = new_block_requests
-
-        new_states_validated: LRUCache[bytes32, Optional[uint32]] = LRUCache(self._states_validated.capacity)
-        for cs_hash, cs_height in self._states_validated.cache.items():
-            if cs_height is not None and cs_height <= height:
-                new_states_validated.put(cs_hash, cs_height)
-        self._states_validated = new_states_validated
-
-        new_timestamps: LRUCache[uint32, uint64] = LRUCache(self._timestamps.capacity)
-        for h, ts in self._timestamps.cache.items():
-            if h <= height:
-                new_timestamps.put(h, ts)
-        self._timestamps = new_timestamps
-
-        new_blocks_validated: LRUCache[bytes32, uint32] = LRUCache(self._blocks_validated.capacity)
-        for hh, h in self._blocks_validated.cache.items():
-            if h <= height:
-                new_blocks_validated.put(hh, h)
-        self._blocks_validated = new_blocks_validated
-
-        new_block_signatures_validated: LRUCache[bytes32, uint32] = LRUCache(self._block_signatures_validated.capacity)
-        for sig_hash, h in self._block_signatures_validated.cache.items():
-            if h <= height:
-                new_block_signatures_validated.put(sig_hash, h)
-        self._block_signatures_validated = new_block_signatures_validated
-
-        new_additions_in_block: LRUCache[Tuple[bytes32, bytes32], uint32] = LRUCache(self._additions_in_block.capacity)
-        for (hh, ph), h in self._additions_in_block.cache.items():
-            if h <= height:
-                new_additions_in_block.put((hh, ph), h)
-        self._additions_in_block = new_additions_in_block
+        for bucket_height in list(self._buckets.irange(minimum=height + 1)):
+            for full_key in self._buckets.pop(bucket_height):
+                self._remove(full_key, from_bucket=False)
+
+    def clear(self) -> None:
+        """
+        Removes all entries, releasing the header blocks shared with other caches.
+        """
+        self.clear_after_height(-1)
+        self._race_cache = {}
+
+    def to_json_dict(self) -> Dict[str, Any]:
+        return {
+            "max_bytes": self.max_bytes,
+            "bytes": self.size,
+            "entries": len(self._entries),
+            "heights": len(self._buckets),
+            "race_cache_heights": len(self._race_cache),
+            "kinds": {kind: dataclasses.asdict(stats) for kind, stats in self._stats.items()},
+        }
 
 
 def can_use_peer_request_cache(
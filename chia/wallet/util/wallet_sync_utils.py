@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 import asyncio
+import dataclasses
 import logging
 import random
-from typing import Any, List, Optional, Set, Tuple, Union
+from typing import Any, Collection, Dict, List, Optional, Set, Tuple, Union
 
 from chia_rs import compute_merkle_set_root, confirm_included_already_hashed, confirm_not_included_already_hashed
 
@@ -22,11 +23,15 @@ from chia.protocols.wallet_protocol import (
     RequestHeaderBlocks,
     RequestPuzzleSolution,
     RequestRemovals,
+    RequestRemoveCoinSubscriptions,
+    RequestRemovePuzzleSubscriptions,
     RespondAdditions,
     RespondBlockHeaders,
     RespondHeaderBlocks,
     RespondPuzzleSolution,
     RespondRemovals,
+    RespondRemoveCoinSubscriptions,
+    RespondRemovePuzzleSubscriptions,
     RespondToCoinUpdates,
     RespondToPhUpdates,
 )
@@ -41,6 +46,10 @@ from chia.wallet.util.peer_request_cache import PeerRequestCache
 log = logging.getLogger(__name__)
 
 
+# header blocks are requested in ranges of up to this many, the protocol limit
+PREFETCH_BLOCKS_PER_REQUEST = 32
+
+
 class PeerRequestException(Exception):
     pass
 
@@ -80,6 +89,32 @@ async def subscribe_to_coin_updates(
     return all_coins_state.coin_states
 
 
+async def unsubscribe_from_phs(puzzle_hashes: List[bytes32], peer: WSLotteryConnection) -> List[bytes32]:
+    """
+    Tells full nodes that we are no longer interested in puzzle hashes, returns the ones that were removed.
+    """
+    msg = RequestRemovePuzzleSubscriptions(puzzle_hashes)
+    response: Optional[RespondRemovePuzzleSubscriptions] = await peer.call_api(
+        FullNodeAPI.request_remove_puzzle_subscriptions, msg, timeout=300
+    )
+    if response is None:
+        raise ValueError(f"None response from peer {peer.peer_info.host} for request_remove_puzzle_subscriptions")
+    return response.puzzle_hashes
+
+
+async def unsubscribe_from_coin_updates(coin_names: List[bytes32], peer: WSLotteryConnection) -> List[bytes32]:
+    """
+    Tells full nodes that we are no longer interested in coin ids, returns the ones that were removed.
+    """
+    msg = RequestRemoveCoinSubscriptions(coin_names)
+    response: Optional[RespondRemoveCoinSubscriptions] = await peer.call_api(
+        FullNodeAPI.request_remove_coin_subscriptions, msg, timeout=300
+    )
+    if response is None:
+        raise ValueError(f"None response from peer {peer.peer_info.host} for request_remove_coin_subscriptions")
+    return response.coin_ids
+
+
 def validate_additions(
     coins: List[Tuple[bytes32, List[Coin]]],
     proofs: Optional[List[Tuple[bytes32, bytes, Optional[bytes]]]],
@@ -188,8 +223,15 @@ def validate_removals(
 
 
 async def request_and_validate_removals(
-    peer: WSLotteryConnection, height: uint32, header_hash: bytes32, coin_name: bytes32, removals_root: bytes32
+    peer: WSLotteryConnection,
+    peer_request_cache: PeerRequestCache,
+    height: uint32,
+    header_hash: bytes32,
+    coin_name: bytes32,
+    removals_root: bytes32,
 ) -> bool:
+    if peer_request_cache.in_removals_in_block(header_hash, coin_name):
+        return True
     removals_request = RequestRemovals(height, header_hash, [coin_name])
 
     removals_res: Optional[Union[RespondRemovals, RejectRemovalsRequest]] = await peer.call_api(
@@ -197,7 +239,10 @@ async def request_and_validate_removals(
     )
     if removals_res is None or isinstance(removals_res, RejectRemovalsRequest):
         return False
-    return validate_removals(removals_res.coins, removals_res.proofs, removals_root)
+    result = validate_removals(removals_res.coins, removals_res.proofs, removals_root)
+    if result:
+        peer_request_cache.add_to_removals_in_block(header_hash, coin_name, height)
+    return result
 
 
 async def request_and_validate_additions(
@@ -225,6 +270,156 @@ async def request_and_validate_additions(
     return result
 
 
+async def prefetch_header_blocks(
+    peer: WSLotteryConnection, peer_request_cache: PeerRequestCache, heights: Collection[uint32]
+) -> None:
+    """
+    Requests the header blocks at the given heights that aren't cached yet,
+    one request per range of up to PREFETCH_BLOCKS_PER_REQUEST heights, and
+    caches them.
+    """
+    missing = sorted(height for height in set(heights) if peer_request_cache.get_block(height) is None)
+    ranges: List[Tuple[uint32, uint32]] = []
+    for height in missing:
+        if len(ranges) > 0 and height - ranges[-1][0] < PREFETCH_BLOCKS_PER_REQUEST:
+            ranges[-1] = (ranges[-1][0], height)
+        else:
+            ranges.append((height, height))
+
+    async def fetch(start: uint32, end: uint32) -> None:
+        blocks = await request_header_blocks(peer, start, end)
+        for block in [] if blocks is None else blocks:
+            if start <= block.height <= end:
+                peer_request_cache.add_to_blocks(block)
+
+    await asyncio.gather(*(fetch(start, end) for start, end in ranges), return_exceptions=True)
+
+
+async def prefetch_additions(
+    peer: WSLotteryConnection, peer_request_cache: PeerRequestCache, block: HeaderBlock, puzzle_hashes: Set[bytes32]
+) -> None:
+    """
+    Requests and validates the additions of all the puzzle hashes in the block
+    at once, so request_and_validate_additions() finds them in the cache.
+    The proofs are checked in a thread, off the event loop.
+    """
+    assert block.foliage_transaction_block is not None
+    puzzle_hashes = {
+        puzzle_hash
+        for puzzle_hash in puzzle_hashes
+        if not peer_request_cache.in_additions_in_block(block.header_hash, puzzle_hash)
+    }
+    if len(puzzle_hashes) == 0:
+        return
+    additions_res: Optional[Union[RespondAdditions, RejectAdditionsRequest]] = await peer.call_api(
+        FullNodeAPI.request_additions, RequestAdditions(block.height, block.header_hash, list(puzzle_hashes))
+    )
+    if additions_res is None or isinstance(additions_res, RejectAdditionsRequest):
+        return
+    valid = await asyncio.get_running_loop().run_in_executor(
+        None,
+        validate_additions,
+        additions_res.coins,
+        additions_res.proofs,
+        block.foliage_transaction_block.additions_root,
+    )
+    if not valid:
+        return
+    if additions_res.proofs is not None:
+        # only the puzzle hashes with a proof are validated
+        puzzle_hashes = {puzzle_hash for puzzle_hash, _ in additions_res.coins if puzzle_hash in puzzle_hashes}
+    for puzzle_hash in puzzle_hashes:
+        peer_request_cache.add_to_additions_in_block(block.header_hash, puzzle_hash, block.height)
+
+
+async def prefetch_removals(
+    peer: WSLotteryConnection, peer_request_cache: PeerRequestCache, block: HeaderBlock, coin_names: Set[bytes32]
+) -> None:
+    """
+    Like prefetch_additions(), for the removals checked by request_and_validate_removals().
+    """
+    assert block.foliage_transaction_block is not None
+    coin_names = {
+        coin_name
+        for coin_name in coin_names
+        if not peer_request_cache.in_removals_in_block(block.header_hash, coin_name)
+    }
+    if len(coin_names) == 0:
+        return
+    removals_res: Optional[Union[RespondRemovals, RejectRemovalsRequest]] = await peer.call_api(
+        FullNodeAPI.request_removals, RequestRemovals(block.height, block.header_hash, list(coin_names))
+    )
+    if removals_res is None or isinstance(removals_res, RejectRemovalsRequest):
+        return
+    valid = await asyncio.get_running_loop().run_in_executor(
+        None,
+        validate_removals,
+        removals_res.coins,
+        removals_res.proofs,
+        block.foliage_transaction_block.removals_root,
+    )
+    if not valid:
+        return
+    if removals_res.proofs is not None:
+        coin_names = {coin_name for coin_name, _ in removals_res.coins if coin_name in coin_names}
+    for coin_name in coin_names:
+        peer_request_cache.add_to_removals_in_block(block.header_hash, coin_name, block.height)
+
+
+async def prefetch_coin_state_proofs(
+    peer: WSLotteryConnection, peer_request_cache: PeerRequestCache, coin_states: List[CoinState]
+) -> None:
+    """
+    Fetches what validating the coin states needs from the peer in bulk: the
+    header blocks of their heights in ranges, and the additions and removals
+    proofs with one request per block. This is best effort, what's missing
+    is requested again when validating each coin state.
+    """
+    additions: Dict[uint32, Set[bytes32]] = {}
+    removals: Dict[uint32, Set[bytes32]] = {}
+    for coin_state in coin_states:
+        if coin_state.created_height is not None:
+            additions.setdefault(uint32(coin_state.created_height), set()).add(coin_state.coin.puzzle_hash)
+        if coin_state.spent_height is not None:
+            removals.setdefault(uint32(coin_state.spent_height), set()).add(coin_state.coin.name())
+    await prefetch_header_blocks(peer, peer_request_cache, [*additions, *removals])
+
+    requests = []
+    for heights, prefetch in ((additions, prefetch_additions), (removals, prefetch_removals)):
+        for height, names in heights.items():
+            block = peer_request_cache.get_block(height)
+            if block is not None and block.foliage_transaction_block is not None:
+                requests.append(prefetch(peer, peer_request_cache, block, names))
+    # failures are left for the validation of each coin state to handle
+    await asyncio.gather(*requests, return_exceptions=True)
+
+
+@dataclasses.dataclass
+class ValidationChunkSize:
+    """
+    The number of coin states from an untrusted peer to validate at once.
+    Fetching their proofs takes about the same number of round trips for any
+    number of states, so chunks double while the peer serves them faster than
+    target_seconds, and halve when it's slower.
+    """
+
+    size: int = 10
+    min_size: int = 10
+    max_size: int = 100
+    target_seconds: float = 2.0
+    # moving average of the time to fetch the proofs of a chunk
+    seconds: Optional[float] = None
+
+    def record(self, num_states: int, seconds: float) -> None:
+        self.seconds = seconds if self.seconds is None else 0.3 * seconds + 0.7 * self.seconds
+        if seconds < self.target_seconds:
+            # a smaller (last) chunk being fast says nothing about full ones
+            if num_states >= self.size:
+                self.size = min(self.max_size, self.size * 2)
+        elif seconds > 2 * self.target_seconds:
+            self.size = max(self.min_size, self.size // 2)
+
+
 def last_change_height_cs(cs: CoinState) -> uint32:
     if cs.spent_height is not None:
         return uint32(cs.spent_height)
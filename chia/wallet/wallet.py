@@ -97,6 +97,9 @@ class Wallet:
         return int(self.wallet_state_manager.constants.MAX_BLOCK_COST_CLVM / 5 / self.cost_of_single_tx)
 
     async def get_max_spendable_coins(self, records: Optional[Set[WalletCoinRecord]] = None) -> Set[WalletCoinRecord]:
+        if records is None:
+            # read from the amount index of the coin store, the wallet may have many more coins
+            return set(await self.wallet_state_manager.get_largest_spendable_coins(self.id(), self.max_send_quantity))
         spendable: List[WalletCoinRecord] = list(
             await self.wallet_state_manager.get_spendable_coins_for_wallet(self.id(), records)
         )
@@ -120,6 +123,8 @@ class Wallet:
         return await self.wallet_state_manager.get_unconfirmed_balance(self.id(), unspent_records)
 
     async def get_spendable_balance(self, unspent_records: Optional[Set[WalletCoinRecord]] = None) -> uint128:
+        if unspent_records is None:
+            return await self.wallet_state_manager.get_spendable_amount(self.id())
         spendable = await self.wallet_state_manager.get_confirmed_spendable_balance_for_wallet(
             self.id(), unspent_records
         )
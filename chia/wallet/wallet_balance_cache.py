@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import dataclasses
+import logging
+from typing import TYPE_CHECKING, Dict, Optional, Set
+
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.ints import uint32, uint64, uint128
+from chia.util.streamable import Streamable, streamable
+from chia.wallet.util.query_filter import HashFilter
+from chia.wallet.util.transaction_type import CLAWBACK_INCOMING_TRANSACTION_TYPES
+from chia.wallet.util.wallet_types import CoinType, WalletType
+from chia.wallet.wallet import Wallet
+from chia.wallet.wallet_coin_record import WalletCoinRecord
+from chia.wallet.wallet_coin_store import unspent_range
+
+if TYPE_CHECKING:
+    from chia.wallet.wallet_state_manager import WalletStateManager
+
+log = logging.getLogger(__name__)
+
+
+@streamable
+@dataclasses.dataclass(frozen=True)
+class Balance(Streamable):
+    confirmed_wallet_balance: uint128 = uint128(0)
+    unconfirmed_wallet_balance: uint128 = uint128(0)
+    spendable_balance: uint128 = uint128(0)
+    pending_change: uint64 = uint64(0)
+    max_send_amount: uint128 = uint128(0)
+    unspent_coin_count: uint32 = uint32(0)
+    pending_coin_removal_count: uint32 = uint32(0)
+
+
+@dataclasses.dataclass
+class WalletBalanceCache:
+    """
+    The last computed balance of every wallet. The coin, transaction and trade
+    stores report their changes to wallet_changed() and trades_changed(), a
+    balance is only returned by get() if nothing it depends on changed since
+    it was computed, so it can be read without the WalletStateManager lock.
+    Only standard wallets' balances are reused that way, the ones of other
+    wallet types are recomputed on every request.
+    """
+
+    balances: Dict[int, Balance] = dataclasses.field(default_factory=dict)
+    _up_to_date: Set[int] = dataclasses.field(default_factory=set)
+
+    def wallet_changed(self, wallet_id: Optional[int]) -> None:
+        if wallet_id is None:
+            self._up_to_date.clear()
+        else:
+            self._up_to_date.discard(wallet_id)
+
+    def trades_changed(self) -> None:
+        # offers lock coins of any wallet
+        self._up_to_date.clear()
+
+    def get(self, wallet_id: int) -> Optional[Balance]:
+        if wallet_id not in self._up_to_date:
+            return None
+        return self.balances.get(wallet_id)
+
+    async def update(self, wallet_state_manager: WalletStateManager, wallet_id: uint32) -> Balance:
+        """
+        Computes the balance of the wallet, must be called with the
+        WalletStateManager lock held.
+        """
+        # only the balances of standard wallets are known to depend on nothing
+        # but the stores. A change while computing invalidates the result again
+        if isinstance(wallet_state_manager.wallets[wallet_id], Wallet):
+            self._up_to_date.add(wallet_id)
+        try:
+            balance = await compute_balance(wallet_state_manager, wallet_id)
+        except BaseException:
+            self._up_to_date.discard(wallet_id)
+            raise
+        self.balances[wallet_id] = balance
+        return balance
+
+    async def check(self, wallet_state_manager: WalletStateManager, wallet_id: uint32) -> bool:
+        """
+        Computes the balance of the wallet like update(), and checks it against
+        the one recomputed from all its unspent coins. If they differ, the coin
+        store's unspent totals are reloaded and the recomputed balance is kept.
+        Must be called with the WalletStateManager lock held.
+        """
+        balance = await self.update(wallet_state_manager, wallet_id)
+        full_balance = await compute_full_balance(wallet_state_manager, wallet_id)
+        if balance == full_balance:
+            return True
+        log.error(
+            f"Balance of wallet {wallet_id} is {balance} but recomputes to {full_balance},"
+            " reloading the unspent coin totals"
+        )
+        await wallet_state_manager.coin_store.load_unspent_totals()
+        self.balances[wallet_id] = full_balance
+        return False
+
+
+async def compute_balance(wallet_state_manager: WalletStateManager, wallet_id: uint32) -> Balance:
+    """
+    Standard wallets' balances are derived from the unspent totals the coin
+    store maintains, the coins of pending transactions and offers, and the
+    largest unspent coins, without loading all their coins. The balances of
+    other wallet types depend on more than their coins (e.g. CAT lineage
+    proofs, singleton state), they are recomputed in full.
+    """
+    wallet = wallet_state_manager.wallets[wallet_id]
+    if not isinstance(wallet, Wallet):
+        return await compute_full_balance(wallet_state_manager, wallet_id)
+
+    coin_store = wallet_state_manager.coin_store
+    total = coin_store.get_unspent_total(wallet_id, CoinType.NORMAL)
+    unconfirmed_tx = await wallet_state_manager.tx_store.get_unconfirmed_for_wallet(wallet_id)
+    locked_coins = await wallet_state_manager.trade_manager.get_locked_coins()
+
+    # the unspent coins of this wallet that pending transactions and offers involve
+    coin_ids: Set[bytes32] = {coin_id for coin_id, record in locked_coins.items() if record.wallet_id == wallet_id}
+    for tx in unconfirmed_tx:
+        coin_ids.update(coin.name() for coin in tx.additions)
+        coin_ids.update(coin.name() for coin in tx.removals)
+    unspent: Dict[bytes32, WalletCoinRecord] = {}
+    if len(coin_ids) > 0:
+        unspent = (
+            await coin_store.get_coin_records(
+                wallet_id=wallet_id,
+                coin_type=CoinType.NORMAL,
+                coin_id_filter=HashFilter.include(list(coin_ids)),
+                spent_range=unspent_range,
+            )
+        ).coin_id_to_record
+
+    # see WalletStateManager.get_unconfirmed_balance(). Coins added (Coin) or
+    # removed (None) by pending transactions
+    pending: Dict[bytes32, Optional[Coin]] = {}
+    # see WalletStateManager.get_spendable_coins_for_wallet()
+    pending_removals: Set[bytes32] = set()
+    # see WalletStateManager.unconfirmed_removals_for_wallet()
+    unconfirmed_removals: Set[bytes32] = set()
+    for tx in unconfirmed_tx:
+        hint_dict = tx.hint_dict()
+        our_removals = [
+            coin
+            for coin in tx.removals
+            if await wallet_state_manager.does_coin_belong_to_wallet(coin, wallet_id, hint_dict)
+        ]
+        pending_removals.update(coin.name() for coin in our_removals)
+        if tx.type in CLAWBACK_INCOMING_TRANSACTION_TYPES:
+            continue
+        unconfirmed_removals.update(coin.name() for coin in tx.removals)
+        for coin in tx.additions:
+            if await wallet_state_manager.does_coin_belong_to_wallet(coin, wallet_id, hint_dict):
+                pending[coin.name()] = coin
+        for coin in our_removals:
+            coin_id = coin.name()
+            if coin_id in pending:
+                present = pending[coin_id] is not None
+            else:
+                present = coin_id in unspent
+            if present:
+                pending[coin_id] = None
+
+    unconfirmed_balance = total.amount
+    for coin_id, pending_coin in pending.items():
+        if pending_coin is not None and coin_id not in unspent:
+            unconfirmed_balance += pending_coin.amount
+        elif pending_coin is None and coin_id in unspent:
+            unconfirmed_balance -= unspent[coin_id].coin.amount
+
+    excluded = {coin_id for coin_id in unspent if coin_id in pending_removals or coin_id in locked_coins}
+    spendable_balance = total.amount - sum(unspent[coin_id].coin.amount for coin_id in excluded)
+
+    max_send_quantity = wallet.max_send_quantity
+    largest = await coin_store.get_largest_unspent_coins(wallet_id, max_send_quantity + len(excluded))
+    max_send_amount = sum(
+        [record.coin.amount for record in largest if record.name() not in excluded][:max_send_quantity]
+    )
+
+    unconfirmed_removals.update(coin_id for coin_id, record in locked_coins.items() if record.wallet_id == wallet_id)
+    return Balance(
+        confirmed_wallet_balance=uint128(total.amount),
+        unconfirmed_wallet_balance=uint128(unconfirmed_balance),
+        spendable_balance=uint128(spendable_balance),
+        pending_change=await wallet.get_pending_change_balance(),
+        max_send_amount=uint128(max_send_amount),
+        unspent_coin_count=uint32(total.count),
+        pending_coin_removal_count=uint32(len(unconfirmed_removals)),
+    )
+
+
+async def compute_full_balance(wallet_state_manager: WalletStateManager, wallet_id: uint32) -> Balance:
+    """
+    Computes the balance from all the unspent coins of the wallet.
+    """
+    wallet = wallet_state_manager.wallets[wallet_id]
+    if wallet.type() == WalletType.CRCAT:
+        coin_type = CoinType.CRCAT
+    else:
+        coin_type = CoinType.NORMAL
+    unspent_records = await wallet_state_manager.coin_store.get_unspent_coins_for_wallet(wallet_id, coin_type)
+    balance = await wallet.get_confirmed_balance(unspent_records)
+    pending_balance = await wallet.get_unconfirmed_balance(unspent_records)
+    spendable_balance = await wallet.get_spendable_balance(unspent_records)
+    pending_change = await wallet.get_pending_change_balance()
+    max_send_amount = await wallet.get_max_send_amount(unspent_records)
+
+    unconfirmed_removals: Dict[bytes32, Coin] = await wallet_state_manager.unconfirmed_removals_for_wallet(wallet_id)
+    return Balance(
+        confirmed_wallet_balance=balance,
+        unconfirmed_wallet_balance=pending_balance,
+        spendable_balance=spendable_balance,
+        pending_change=pending_change,
+        max_send_amount=max_send_amount,
+        unspent_coin_count=uint32(len(unspent_records)),
+        pending_coin_removal_count=uint32(len(unconfirmed_removals)),
+    )
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import logging
 import sqlite3
 from dataclasses import dataclass
 from enum import IntEnum
-from typing import Dict, List, Optional, Set
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import aiosqlite
 
 from chia.types.blockchain_format.coin import Coin
 from chia.types.blockchain_format.sized_bytes import bytes32
@@ -16,12 +19,15 @@ from chia.wallet.util.query_filter import AmountFilter, FilterMode, HashFilter
 from chia.wallet.util.wallet_types import CoinType, WalletType
 from chia.wallet.wallet_coin_record import WalletCoinRecord
 
+log = logging.getLogger(__name__)
+
 unspent_range = UInt32Range(stop=uint32(0))
 
 
 class CoinRecordOrder(IntEnum):
     confirmed_height = 1
     spent_height = 2
+    amount = 3
 
 
 @streamable
@@ -44,6 +50,15 @@ class GetCoinRecords(Streamable):
     include_total_count: bool = False  # Include the total number of entries for the query without applying offset/limit
 
 
+@dataclass(frozen=True)
+class UnspentTotal:
+    amount: int = 0
+    count: int = 0
+
+    def add(self, amount: int, count: int) -> UnspentTotal:
+        return UnspentTotal(self.amount + amount, self.count + count)
+
+
 @dataclass(frozen=True)
 class GetCoinRecordsResult:
     records: List[WalletCoinRecord]
@@ -58,6 +73,12 @@ class WalletCoinStore:
 
     db_wrapper: DBWrapper2
     total_count_cache: LRUCache[bytes32, uint32]
+    # amount and number of the unspent coins, by (wallet id, coin type). Kept
+    # up to date by every write, so balances don't need to load all the coins
+    unspent_totals: Dict[Tuple[int, int], UnspentTotal]
+    # called with the id of a wallet whose coins changed, or None if it may
+    # have been any wallet
+    wallet_changed_callback: Optional[Callable[[Optional[int]], None]]
 
     @classmethod
     async def create(cls, wrapper: DBWrapper2):
@@ -65,6 +86,8 @@ class WalletCoinStore:
 
         self.db_wrapper = wrapper
         self.total_count_cache = LRUCache(100)
+        self.unspent_totals = {}
+        self.wallet_changed_callback = None
 
         async with self.db_wrapper.writer_maybe_transaction() as conn:
             await conn.execute(
@@ -100,8 +123,74 @@ class WalletCoinStore:
                 await conn.execute("CREATE INDEX IF NOT EXISTS coin_record_coin_type on coin_record(coin_type)")
             except sqlite3.OperationalError:
                 pass
+
+            # Used to find the largest unspent coins of a wallet
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS coin_record_wallet_unspent_amount"
+                " on coin_record(wallet_id, coin_type, spent_height, amount)"
+            )
+
+        await self.load_unspent_totals()
         return self
 
+    async def load_unspent_totals(self) -> None:
+        """
+        Recomputes unspent_totals from all the unspent coins.
+        """
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            await self._load_unspent_totals(conn)
+
+    async def _load_unspent_totals(self, conn: aiosqlite.Connection) -> None:
+        unspent_totals: Dict[Tuple[int, int], UnspentTotal] = {}
+        async with conn.execute("SELECT wallet_id, coin_type, amount FROM coin_record WHERE spent_height=0") as cursor:
+            async for row in cursor:
+                key = (row[0], row[1])
+                unspent_totals[key] = unspent_totals.get(key, UnspentTotal()).add(uint64.from_bytes(row[2]), 1)
+        self.unspent_totals = unspent_totals
+        self.total_count_cache.cache.clear()
+        self._wallet_changed(None)
+
+    async def _reload_after_rollback(self, conn: aiosqlite.Connection) -> None:
+        log.warning("A transaction writing coin records was rolled back, reloading the unspent coin totals")
+        await self._load_unspent_totals(conn)
+
+    def restore_unspent_totals(self, unspent_totals: Dict[Tuple[int, int], UnspentTotal]) -> None:
+        """
+        Used when the transaction that wrote coins was rolled back, with a copy
+        of unspent_totals taken before it started.
+        """
+        self.unspent_totals = unspent_totals
+        self._wallet_changed(None)
+
+    def get_unspent_total(self, wallet_id: int, coin_type: CoinType = CoinType.NORMAL) -> UnspentTotal:
+        return self.unspent_totals.get((wallet_id, coin_type), UnspentTotal())
+
+    def _wallet_changed(self, wallet_id: Optional[int]) -> None:
+        if self.wallet_changed_callback is not None:
+            self.wallet_changed_callback(wallet_id)
+
+    def _update_unspent_totals(self, changes: Iterable[Tuple[int, int, int, int]]) -> None:
+        """
+        Applies (wallet id, coin type, amount, count) deltas to unspent_totals.
+        """
+        for wallet_id, coin_type, amount, count in changes:
+            key = (wallet_id, coin_type)
+            self.unspent_totals[key] = self.unspent_totals.get(key, UnspentTotal()).add(amount, count)
+            self._wallet_changed(wallet_id)
+
+    async def _get_unspent_row(self, conn: aiosqlite.Connection, name: bytes32) -> Optional[Tuple[int, int, int]]:
+        """
+        Returns the wallet id, coin type and amount of the coin, if it's unspent.
+        """
+        row = await execute_fetchone(
+            conn,
+            "SELECT wallet_id, coin_type, amount FROM coin_record WHERE coin_name=? AND spent_height=0",
+            (name.hex(),),
+        )
+        if row is None:
+            return None
+        return row[0], row[1], uint64.from_bytes(row[2])
+
     async def count_small_unspent(self, cutoff: int, coin_type: CoinType = CoinType.NORMAL) -> int:
         amount_bytes = uint64(cutoff).stream_to_bytes()
         async with self.db_wrapper.reader_no_transaction() as conn:
@@ -118,6 +207,8 @@ class WalletCoinStore:
             name = record.name()
         assert record.spent == (record.spent_block_height != 0)
         async with self.db_wrapper.writer_maybe_transaction() as conn:
+            self.db_wrapper.on_rollback(self._reload_after_rollback)
+            previous = await self._get_unspent_row(conn, name)
             await conn.execute_insert(
                 "INSERT OR REPLACE INTO coin_record ("
                 "coin_name, confirmed_height, spent_height, spent, coinbase, puzzle_hash, coin_parent, amount, "
@@ -137,17 +228,29 @@ class WalletCoinStore:
                     None if record.metadata is None else bytes(record.metadata),
                 ),
             )
+        changes = []
+        if previous is not None:
+            changes.append((previous[0], previous[1], -previous[2], -1))
+        if record.spent_block_height == 0:
+            changes.append((record.wallet_id, record.coin_type, record.coin.amount, 1))
+        self._update_unspent_totals(changes)
         self.total_count_cache.cache.clear()
 
     # Sometimes we realize that a coin is actually not interesting to us so we need to delete it
     async def delete_coin_record(self, coin_name: bytes32) -> None:
         async with self.db_wrapper.writer_maybe_transaction() as conn:
+            self.db_wrapper.on_rollback(self._reload_after_rollback)
+            previous = await self._get_unspent_row(conn, coin_name)
             await (await conn.execute("DELETE FROM coin_record WHERE coin_name=?", (coin_name.hex(),))).close()
+        if previous is not None:
+            self._update_unspent_totals([(previous[0], previous[1], -previous[2], -1)])
         self.total_count_cache.cache.clear()
 
     # Update coin_record to be spent in DB
     async def set_spent(self, coin_name: bytes32, height: uint32) -> None:
         async with self.db_wrapper.writer_maybe_transaction() as conn:
+            self.db_wrapper.on_rollback(self._reload_after_rollback)
+            previous = await self._get_unspent_row(conn, coin_name)
             await conn.execute_insert(
                 "UPDATE coin_record SET spent_height=?,spent=? WHERE coin_name=?",
                 (
@@ -156,6 +259,8 @@ class WalletCoinStore:
                     coin_name.hex(),
                 ),
             )
+        if previous is not None and height != 0:
+            self._update_unspent_totals([(previous[0], previous[1], -previous[2], -1)])
         self.total_count_cache.cache.clear()
 
     def coin_record_from_row(self, row: sqlite3.Row) -> WalletCoinRecord:
@@ -301,6 +406,18 @@ class WalletCoinStore:
             )
         return {self.coin_record_from_row(row) for row in rows}
 
+    async def get_largest_unspent_coins(
+        self, wallet_id: int, limit: int, coin_type: CoinType = CoinType.NORMAL
+    ) -> List[WalletCoinRecord]:
+        """Returns the unspent CoinRecords of a wallet with the largest amounts, largest first."""
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT * FROM coin_record INDEXED BY coin_record_wallet_unspent_amount"
+                " WHERE wallet_id=? AND coin_type=? AND spent_height=0 ORDER BY amount DESC LIMIT ?",
+                (wallet_id, coin_type, limit),
+            )
+        return [self.coin_record_from_row(row) for row in rows]
+
     async def get_all_unspent_coins(self, coin_type: CoinType = CoinType.NORMAL) -> Set[WalletCoinRecord]:
         """Returns set of CoinRecords that have not been spent yet for a wallet."""
         async with self.db_wrapper.reader_no_transaction() as conn:
@@ -333,7 +450,22 @@ class WalletCoinStore:
         All coins spent after this point are set to unspent. Can be -1 (rollback all)
         """
 
+        changes = []
         async with self.db_wrapper.writer_maybe_transaction() as conn:
+            self.db_wrapper.on_rollback(self._reload_after_rollback)
+            rows = await conn.execute_fetchall(
+                "SELECT wallet_id, coin_type, amount, confirmed_height, spent_height FROM coin_record"
+                " WHERE confirmed_height>? OR spent_height>?",
+                (height, height),
+            )
+            for wallet_id, coin_type, amount_bytes, confirmed_height, spent_height in rows:
+                if confirmed_height > height:
+                    # deleted
+                    if spent_height == 0:
+                        changes.append((wallet_id, coin_type, -uint64.from_bytes(amount_bytes), -1))
+                else:
+                    # unspent again
+                    changes.append((wallet_id, coin_type, uint64.from_bytes(amount_bytes), 1))
             await (await conn.execute("DELETE FROM coin_record WHERE confirmed_height>?", (height,))).close()
             await (
                 await conn.execute(
@@ -341,10 +473,15 @@ class WalletCoinStore:
                     (height,),
                 )
             ).close()
+        self._update_unspent_totals(changes)
         self.total_count_cache.cache.clear()
 
     async def delete_wallet(self, wallet_id: uint32) -> None:
         async with self.db_wrapper.writer_maybe_transaction() as conn:
+            self.db_wrapper.on_rollback(self._reload_after_rollback)
             cursor = await conn.execute("DELETE FROM coin_record WHERE wallet_id=?", (wallet_id,))
             await cursor.close()
+        for key in [key for key in self.unspent_totals if key[0] == wallet_id]:
+            del self.unspent_totals[key]
+        self._wallet_changed(wallet_id)
         self.total_count_cache.cache.clear()
@@ -14,8 +14,11 @@ from typing import (
     TYPE_CHECKING,
     Any,
     AsyncIterator,
+    Awaitable,
+    Callable,
     ClassVar,
     Dict,
+    Iterator,
     List,
     Literal,
     Optional,
@@ -43,19 +46,18 @@ from chia.protocols.wallet_protocol import (
     RegisterForCoinUpdates,
     RequestBlockHeader,
     RequestChildren,
+    RequestCoinRecords,
     RespondBlockHeader,
     RespondChildren,
+    RespondCoinRecords,
     RespondToCoinUpdates,
     SendTransaction,
-    RespondCoinRecords,
-    RequestCoinRecords,
 )
 from chia.rpc.rpc_server import StateChangedProtocol, default_get_connections
 from chia.server.node_discovery import WalletPeers
 from chia.server.outbound_message import Message, NodeType, make_msg
 from chia.server.server import LotteryServer
 from chia.server.ws_connection import WSLotteryConnection
-from chia.types.blockchain_format.coin import Coin
 from chia.types.blockchain_format.sized_bytes import bytes32
 from chia.types.coin_record import CoinRecord
 from chia.types.header_block import HeaderBlock
@@ -68,27 +70,37 @@ from chia.util.db_wrapper import manage_connection
 from chia.util.errors import KeychainIsEmpty, KeychainIsLocked, KeychainKeyNotFound, KeychainProxyConnectionFailure
 from chia.util.guess import get_guess_height
 from chia.util.hash import std_hash
-from chia.util.ints import uint16, uint32, uint64, uint128
+from chia.util.ints import uint16, uint32, uint64
 from chia.util.keychain import Keychain
 from chia.util.path import path_from_root
 from chia.util.profiler import mem_profile_task, profile_task
-from chia.util.streamable import Streamable, streamable
+from chia.wallet.dust_consolidation import AutoConsolidateDustSettings
 from chia.wallet.puzzles.clawback.metadata import AutoClaimSettings
 from chia.wallet.puzzles.stake.metadata import AutoWithdrawStakeSettings
 from chia.wallet.transaction_record import TransactionRecord
 from chia.wallet.util.new_peak_queue import NewPeakItem, NewPeakQueue, NewPeakQueueTypes
-from chia.wallet.util.peer_request_cache import PeerRequestCache, can_use_peer_request_cache
+from chia.wallet.util.peer_request_cache import (
+    DEFAULT_MAX_BYTES,
+    PeerRequestCache,
+    SharedHeaderBlocks,
+    can_use_peer_request_cache,
+)
+from chia.wallet.util.query_filter import HashFilter
 from chia.wallet.util.wallet_sync_utils import (
     PeerRequestException,
+    ValidationChunkSize,
     fetch_header_blocks_in_range,
+    prefetch_coin_state_proofs,
     request_and_validate_additions,
     request_and_validate_removals,
     request_header_blocks,
     sort_coin_states,
     subscribe_to_coin_updates,
     subscribe_to_phs,
+    unsubscribe_from_coin_updates,
+    unsubscribe_from_phs,
 )
-from chia.wallet.util.wallet_types import CoinType, WalletType
+from chia.wallet.wallet_balance_cache import Balance, WalletBalanceCache
 from chia.wallet.wallet_state_manager import WalletStateManager
 from chia.wallet.wallet_weight_proof_handler import WalletWeightProofHandler, get_wp_fork_point
 
@@ -110,18 +122,6 @@ def get_wallet_db_path(root_path: Path, config: Dict[str, Any], key_fingerprint:
     return path
 
 
-@streamable
-@dataclasses.dataclass(frozen=True)
-class Balance(Streamable):
-    confirmed_wallet_balance: uint128 = uint128(0)
-    unconfirmed_wallet_balance: uint128 = uint128(0)
-    spendable_balance: uint128 = uint128(0)
-    pending_change: uint64 = uint64(0)
-    max_send_amount: uint128 = uint128(0)
-    unspent_coin_count: uint32 = uint32(0)
-    pending_coin_removal_count: uint32 = uint32(0)
-
-
 @dataclasses.dataclass
 class WalletNode:
     if TYPE_CHECKING:
@@ -145,11 +145,13 @@ class WalletNode:
     logged_in_fingerprint: Optional[int] = None
     logged_in: bool = False
     _keychain_proxy: Optional[KeychainProxy] = None
-    _balance_cache: Dict[int, Balance] = dataclasses.field(default_factory=dict)
+    _balance_cache: WalletBalanceCache = dataclasses.field(default_factory=WalletBalanceCache)
     # Peers that we have long synced to
     synced_peers: Set[bytes32] = dataclasses.field(default_factory=set)
     wallet_peers: Optional[WalletPeers] = None
     peer_caches: Dict[bytes32, PeerRequestCache] = dataclasses.field(default_factory=dict)
+    shared_header_blocks: SharedHeaderBlocks = dataclasses.field(default_factory=SharedHeaderBlocks)
+    validation_chunk_sizes: Dict[bytes32, ValidationChunkSize] = dataclasses.field(default_factory=dict)
     validation_semaphore: Optional[asyncio.Semaphore] = None
     local_node_synced: bool = False
     LONG_SYNC_THRESHOLD: int = 300
@@ -227,9 +229,17 @@ class WalletNode:
 
     def get_cache_for_peer(self, peer: WSLotteryConnection) -> PeerRequestCache:
         if peer.peer_node_id not in self.peer_caches:
-            self.peer_caches[peer.peer_node_id] = PeerRequestCache()
+            self.peer_caches[peer.peer_node_id] = PeerRequestCache(
+                self.config.get("peer_request_cache_max_bytes", DEFAULT_MAX_BYTES), self.shared_header_blocks
+            )
         return self.peer_caches[peer.peer_node_id]
 
+    def get_peer_request_cache_stats(self) -> Dict[str, Any]:
+        return {
+            "shared_header_blocks": len(self.shared_header_blocks),
+            "peers": {peer_id.hex(): cache.to_json_dict() for peer_id, cache in self.peer_caches.items()},
+        }
+
     def rollback_request_caches(self, reorg_height: int) -> None:
         # Everything after reorg_height should be removed from the cache
         for cache in self.peer_caches.values():
@@ -473,10 +483,14 @@ class WalletNode:
         self.log_in(fingerprint)
         self.wallet_state_manager.state_changed("sync_changed")
 
-        # Populate the balance caches for all wallets
+        # Keep the balance caches up to date with the stores, and populate them for all wallets
+        self._balance_cache = WalletBalanceCache()
+        self.wallet_state_manager.coin_store.wallet_changed_callback = self._balance_cache.wallet_changed
+        self.wallet_state_manager.tx_store.wallet_changed_callback = self._balance_cache.wallet_changed
+        self.wallet_state_manager.trade_manager.trade_store.trades_changed_callback = self._balance_cache.trades_changed
         async with self.wallet_state_manager.lock:
             for wallet_id in self.wallet_state_manager.wallets:
-                await self._update_balance_cache(wallet_id)
+                await self._balance_cache.check(self.wallet_state_manager, wallet_id)
 
         async with self.wallet_state_manager.puzzle_store.lock:
             index = await self.wallet_state_manager.puzzle_store.get_last_derivation_path()
@@ -516,7 +530,7 @@ class WalletNode:
             await proxy.close()
             await asyncio.sleep(0.5)  # https://docs.aiohttp.org/en/stable/client_advanced.html#graceful-shutdown
         self.wallet_peers = None
-        self._balance_cache = {}
+        self._balance_cache = WalletBalanceCache()
 
     def _set_state_changed_callback(self, callback: StateChangedProtocol) -> None:
         self.state_changed_callback = callback
@@ -737,7 +751,8 @@ class WalletNode:
             self.initialize_wallet_peers()
 
         if peer.peer_node_id in self.peer_caches:
-            self.peer_caches.pop(peer.peer_node_id)
+            self.peer_caches.pop(peer.peer_node_id).clear()
+        self.validation_chunk_sizes.pop(peer.peer_node_id, None)
         if peer.peer_node_id in self.synced_peers:
             self.synced_peers.remove(peer.peer_node_id)
         if peer.peer_node_id in self._tx_messages_in_progress:
@@ -833,47 +848,69 @@ class WalletNode:
             await self.perform_atomic_rollback(fork_height)
             await self.update_ui()
 
+        # Only the primary sync is shared with other peers, a secondary sync is meant to double-check with this one
+        helpers: List[WSLotteryConnection] = []
+        if rollback:
+            helpers = await self.get_long_sync_helpers(full_node, target_height)
+            if len(helpers) > 0:
+                self.log.info(f"Sharing sync with {[helper.peer_info.host for helper in helpers]}")
+
         # We only process new state updates to avoid slow reprocessing. We set the sync height after adding
         # Things, so we don't have to reprocess these later. There can be many things in ph_update_res.
         use_delta_sync = self.config.get("use_delta_sync", False)
         min_height_for_subscriptions = fork_height if use_delta_sync else 0
-        already_checked_ph: Set[bytes32] = set()
-        while not self._shut_down:
-            await self.wallet_state_manager.create_more_puzzle_hashes()
-            all_puzzle_hashes = await self.get_puzzle_hashes_to_subscribe()
-            not_checked_puzzle_hashes = set(all_puzzle_hashes) - already_checked_ph
-            if not_checked_puzzle_hashes == set():
-                break
-            for batch in to_batches(not_checked_puzzle_hashes, 1000):
-                ph_update_res: List[CoinState] = await subscribe_to_phs(
-                    batch.entries, full_node, min_height_for_subscriptions
-                )
-                ph_update_res = list(filter(is_new_state_update, ph_update_res))
-                if not await self.add_states_from_peer(ph_update_res, full_node):
+        # the puzzle hashes and coin ids each helper got subscribed to, by peer node id
+        helper_puzzle_hashes: Dict[bytes32, List[bytes32]] = {}
+        helper_coin_ids: Dict[bytes32, List[bytes32]] = {}
+        all_helpers = list(helpers)
+        try:
+            already_checked_ph: Set[bytes32] = set()
+            while not self._shut_down:
+                await self.wallet_state_manager.create_more_puzzle_hashes()
+                all_puzzle_hashes = await self.get_puzzle_hashes_to_subscribe()
+                not_checked_puzzle_hashes = set(all_puzzle_hashes) - already_checked_ph
+                if not_checked_puzzle_hashes == set():
+                    break
+                if not await self.subscribe_from_peers(
+                    not_checked_puzzle_hashes,
+                    subscribe_to_phs,
+                    full_node,
+                    helpers,
+                    min_height_for_subscriptions,
+                    target_height,
+                    is_new_state_update,
+                    helper_subscriptions=helper_puzzle_hashes,
+                ):
                     # If something goes wrong, abort sync
                     return
-            already_checked_ph.update(not_checked_puzzle_hashes)
+                already_checked_ph.update(not_checked_puzzle_hashes)
 
-        self.log.info(f"Successfully subscribed and updated {len(already_checked_ph)} puzzle hashes")
+            self.log.info(f"Successfully subscribed and updated {len(already_checked_ph)} puzzle hashes")
 
-        # The number of coin id updates are usually going to be significantly less than ph updates, so we can
-        # sync from 0 every time.
-        already_checked_coin_ids: Set[bytes32] = set()
-        while not self._shut_down:
-            all_coin_ids = await self.get_coin_ids_to_subscribe()
-            not_checked_coin_ids = set(all_coin_ids) - already_checked_coin_ids
-            if not_checked_coin_ids == set():
-                break
-            for batch in to_batches(not_checked_coin_ids, 1000):
-                c_update_res: List[CoinState] = await subscribe_to_coin_updates(
-                    batch.entries, full_node, min_height_for_subscriptions
-                )
-
-                if not await self.add_states_from_peer(c_update_res, full_node):
+            # The number of coin id updates are usually going to be significantly less than ph updates, so we can
+            # sync from 0 every time.
+            already_checked_coin_ids: Set[bytes32] = set()
+            while not self._shut_down:
+                all_coin_ids = await self.get_coin_ids_to_subscribe()
+                not_checked_coin_ids = set(all_coin_ids) - already_checked_coin_ids
+                if not_checked_coin_ids == set():
+                    break
+                if not await self.subscribe_from_peers(
+                    not_checked_coin_ids,
+                    subscribe_to_coin_updates,
+                    full_node,
+                    helpers,
+                    min_height_for_subscriptions,
+                    target_height,
+                    helper_subscriptions=helper_coin_ids,
+                ):
                     # If something goes wrong, abort sync
                     return
-            already_checked_coin_ids.update(not_checked_coin_ids)
-        self.log.info(f"Successfully subscribed and updated {len(already_checked_coin_ids)} coin ids")
+                already_checked_coin_ids.update(not_checked_coin_ids)
+            self.log.info(f"Successfully subscribed and updated {len(already_checked_coin_ids)} coin ids")
+        finally:
+            if not self._shut_down:
+                await self.unsubscribe_long_sync_helpers(all_helpers, helper_puzzle_hashes, helper_coin_ids)
 
         # Only update this fully when the entire sync has completed
         await self.wallet_state_manager.blockchain.set_finished_sync_up_to(target_height)
@@ -884,10 +921,155 @@ class WalletNode:
         self.wallet_state_manager.state_changed("new_block")
 
         self.synced_peers.add(full_node.peer_node_id)
+        # the sync touched most coins, check the balances kept since against full recomputes
+        async with self.wallet_state_manager.lock:
+            for wallet_id in list(self.wallet_state_manager.wallets):
+                await self._balance_cache.check(self.wallet_state_manager, wallet_id)
         await self.update_ui()
 
         self.log.info(f"Sync (trusted: {trusted}) duration was: {time.time() - start_time}")
 
+    async def unsubscribe_long_sync_helpers(
+        self,
+        helpers: List[WSLotteryConnection],
+        puzzle_hashes: Dict[bytes32, List[bytes32]],
+        coin_ids: Dict[bytes32, List[bytes32]],
+    ) -> None:
+        """
+        Removes the subscriptions the helpers of a long sync got, so they don't keep sending updates for them.
+        Helpers we're synced with keep theirs, they're subscribed to everything already.
+        """
+        for helper in helpers:
+            if helper.closed or helper.peer_node_id in self.synced_peers:
+                continue
+            try:
+                for batch in to_batches(puzzle_hashes.get(helper.peer_node_id, []), 1000):
+                    await unsubscribe_from_phs(batch.entries, helper)
+                for batch in to_batches(coin_ids.get(helper.peer_node_id, []), 1000):
+                    await unsubscribe_from_coin_updates(batch.entries, helper)
+            except Exception as e:
+                self.log.warning(f"Failed to unsubscribe sync helper {helper.peer_info.host}: {e}")
+
+    async def get_long_sync_helpers(
+        self, full_node: WSLotteryConnection, target_height: uint32
+    ) -> List[WSLotteryConnection]:
+        """
+        Returns up to long_sync_peers - 1 other connected full nodes to share a long sync with full_node. They
+        must be as trusted as full_node, and have the same block as our peak at target_height, which is the
+        peak full_node is synced to.
+        """
+        max_helpers = self.config.get("long_sync_peers", 3) - 1
+        peak = await self.wallet_state_manager.blockchain.get_peak_block()
+        if max_helpers <= 0 or peak is None or peak.height != target_height:
+            return []
+        peak_hash = peak.header_hash
+        trusted = self.is_trusted(full_node)
+        candidates = [
+            peer
+            for peer in self.get_full_node_peers_in_order()
+            if peer.peer_node_id != full_node.peer_node_id and self.is_trusted(peer) == trusted
+        ][: 2 * max_helpers]
+
+        async def on_same_chain(peer: WSLotteryConnection) -> bool:
+            try:
+                response = await peer.call_api(
+                    FullNodeAPI.request_block_header, RequestBlockHeader(target_height), timeout=10
+                )
+            except Exception:
+                return False
+            return isinstance(response, RespondBlockHeader) and response.header_block.header_hash == peak_hash
+
+        results = await asyncio.gather(*(on_same_chain(peer) for peer in candidates))
+        return [peer for peer, same_chain in zip(candidates, results) if same_chain][:max_helpers]
+
+    async def subscribe_from_peers(
+        self,
+        items: Set[bytes32],
+        subscribe: Callable[[List[bytes32], WSLotteryConnection, int], Awaitable[List[CoinState]]],
+        full_node: WSLotteryConnection,
+        helpers: List[WSLotteryConnection],
+        min_height: int,
+        target_height: uint32,
+        state_filter: Optional[Callable[[CoinState], bool]] = None,
+        helper_subscriptions: Optional[Dict[bytes32, List[bytes32]]] = None,
+    ) -> bool:
+        """
+        Subscribes full_node to the items (puzzle hashes or coin ids), in batches of 1000, and adds the states
+        returned. The states of the batches from min_height are fetched from full_node and the helpers, each
+        peer takes the next batch when done with its previous one, while the fetched batches are added in order.
+        full_node is still subscribed to the batches the helpers serve, from target_height, which returns little.
+        A batch a helper fails to serve, or whose states fail to be added (e.g. the helper disconnected while
+        they were validated), is fetched from full_node instead, and that helper is removed from helpers.
+        The items a helper gets subscribed to are added to helper_subscriptions, by its node id, to be
+        unsubscribed once the sync is over. Returns False if adding the states of full_node failed.
+        """
+        batches = [batch.entries for batch in to_batches(items, 1000)]
+        results: List[asyncio.Future[List[Tuple[List[CoinState], WSLotteryConnection]]]] = [
+            asyncio.get_running_loop().create_future() for _ in batches
+        ]
+        pending: asyncio.Queue[int] = asyncio.Queue()
+        for i in range(len(batches)):
+            pending.put_nowait(i)
+        # bounds the number of batches fetched ahead of the ones added
+        fetch_ahead = asyncio.Semaphore(2 * (len(helpers) + 1))
+        failed_helpers: Set[bytes32] = set()
+
+        async def fetch_from_full_node(i: int) -> None:
+            try:
+                states = await subscribe(batches[i], full_node, min_height)
+            except Exception as e:
+                results[i].set_exception(e)
+                raise
+            results[i].set_result([(states, full_node)])
+
+        async def fetch(peer: WSLotteryConnection) -> None:
+            while peer.peer_node_id not in failed_helpers:
+                await fetch_ahead.acquire()
+                if pending.empty():
+                    fetch_ahead.release()
+                    return
+                i = pending.get_nowait()
+                if peer is full_node:
+                    await fetch_from_full_node(i)
+                    continue
+                if helper_subscriptions is not None:
+                    helper_subscriptions.setdefault(peer.peer_node_id, []).extend(batches[i])
+                try:
+                    helper_states, recent_states = await asyncio.gather(
+                        subscribe(batches[i], peer, min_height), subscribe(batches[i], full_node, target_height)
+                    )
+                except Exception as e:
+                    self.log.warning(f"Failed to fetch states from {peer.peer_info.host}, using full node: {e}")
+                    failed_helpers.add(peer.peer_node_id)
+                    await fetch_from_full_node(i)
+                    return
+                results[i].set_result([(helper_states, peer), (recent_states, full_node)])
+
+        tasks = [asyncio.create_task(fetch(peer)) for peer in [full_node, *helpers]]
+        try:
+            for i, result in enumerate(results):
+                for states, peer in await result:
+                    if state_filter is not None:
+                        states = list(filter(state_filter, states))
+                    if await self.add_states_from_peer(states, peer):
+                        continue
+                    if peer is full_node:
+                        return False
+                    self.log.warning(f"Failed to add states from {peer.peer_info.host}, using full node")
+                    failed_helpers.add(peer.peer_node_id)
+                    states = await subscribe(batches[i], full_node, min_height)
+                    if state_filter is not None:
+                        states = list(filter(state_filter, states))
+                    if not await self.add_states_from_peer(states, full_node):
+                        return False
+                fetch_ahead.release()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            helpers[:] = [helper for helper in helpers if helper.peer_node_id not in failed_helpers]
+        return True
+
     async def add_states_from_peer(
         self,
         items_input: List[CoinState],
@@ -941,10 +1123,15 @@ class WalletNode:
         if num_filtered > 0:
             self.log.info(f"Filtered {num_filtered} spam transactions")
 
+        chunk_sizes = self.validation_chunk_sizes.setdefault(peer.peer_node_id, ValidationChunkSize())
+
         async def validate_and_add(inner_states: List[CoinState], inner_idx_start: int) -> None:
             try:
                 assert self.validation_semaphore is not None
                 async with self.validation_semaphore:
+                    prefetch_start = time.monotonic()
+                    await self._prefetch_validation_proofs(inner_states, peer, cache, fork_height)
+                    chunk_sizes.record(len(inner_states), time.monotonic() - prefetch_start)
                     valid_states = [
                         inner_state
                         for inner_state in inner_states
@@ -964,7 +1151,7 @@ class WalletNode:
 
         # Keep chunk size below 1000 just in case, windows has sqlite limits of 999 per query
         # Untrusted has a smaller batch size since validation has to happen which takes a while
-        chunk_size: int = 900 if trusted else 10
+        chunk_size: int = 900 if trusted else ValidationChunkSize.min_size
 
         reorged_coin_states = []
         updated_coin_states = []
@@ -982,8 +1169,16 @@ class WalletNode:
                 self.log.debug("Processing reorged states failed")
                 return False
 
+        def updated_batches() -> Iterator[List[CoinState]]:
+            start = 0
+            while start < len(updated_coin_states):
+                # untrusted peers' chunks are sized by how fast the peer served the previous ones
+                size = chunk_size if trusted or fork_height is not None else chunk_sizes.size
+                yield updated_coin_states[start : start + size]
+                start += size
+
         idx = 1
-        for batch in to_batches(updated_coin_states, chunk_size):
+        for entries in updated_batches():
             if self._server is None:
                 self.log.error("No server")
                 await asyncio.gather(*all_tasks)
@@ -995,13 +1190,13 @@ class WalletNode:
             if trusted:
                 async with self.wallet_state_manager.db_wrapper.writer():
                     self.log.info(
-                        f"new coin state received ({idx}-{idx + len(batch.entries) - 1}/ {len(updated_coin_states)})"
+                        f"new coin state received ({idx}-{idx + len(entries) - 1}/ {len(updated_coin_states)})"
                     )
-                    if not await self.wallet_state_manager.add_coin_states(batch.entries, peer, fork_height):
+                    if not await self.wallet_state_manager.add_coin_states(entries, peer, fork_height):
                         return False
             else:
                 if fork_height is not None:
-                    cache.add_states_to_race_cache(batch.entries)
+                    cache.add_states_to_race_cache(entries)
                 else:
                     while len(all_tasks) >= target_concurrent_tasks:
                         all_tasks = [task for task in all_tasks if not task.done()]
@@ -1010,8 +1205,8 @@ class WalletNode:
                             self.log.info("Terminating receipt and validation due to shut down request")
                             await asyncio.gather(*all_tasks)
                             return False
-                    all_tasks.append(asyncio.create_task(validate_and_add(batch.entries, idx)))
-            idx += len(batch.entries)
+                    all_tasks.append(asyncio.create_task(validate_and_add(entries, idx)))
+            idx += len(entries)
 
         still_connected = self._server is not None and peer.peer_node_id in self.server.all_connections
         await asyncio.gather(*all_tasks)
@@ -1171,6 +1366,8 @@ class WalletNode:
             await self.wallet_state_manager.set_guess_memos(peer)
             if self.config.get("auto_withdraw_stake", {}).get("enabled", False):
                 await self.wallet_state_manager.auto_withdraw_stake_coins()
+            if self.config.get("auto_consolidate_dust", {}).get("enabled", False):
+                await self.wallet_state_manager.auto_consolidate_dust()
 
             # Check if any coin needs auto spending
             if self.config.get("auto_claim", {}).get("enabled", False):
@@ -1225,7 +1422,9 @@ class WalletNode:
             return False
         return True
 
-    async def long_sync_from_untrusted(self, syncing: bool, new_peak_hb: HeaderBlock, peer: WSLotteryConnection) -> None:
+    async def long_sync_from_untrusted(
+        self, syncing: bool, new_peak_hb: HeaderBlock, peer: WSLotteryConnection
+    ) -> None:
         current_height: uint32 = await self.wallet_state_manager.blockchain.get_finished_sync_up_to()
         fork_point_weight_proof = await self.fetch_and_update_weight_proof(peer, new_peak_hb)
         # This usually happens the first time we start up the wallet. We roll back slightly to be
@@ -1388,6 +1587,42 @@ class WalletNode:
         coin_ids.update(await self.wallet_state_manager.interested_store.get_interested_coin_ids())
         return list(coin_ids)
 
+    async def _prefetch_validation_proofs(
+        self,
+        coin_states: List[CoinState],
+        peer: WSLotteryConnection,
+        peer_request_cache: PeerRequestCache,
+        fork_height: Optional[uint32],
+    ) -> None:
+        """
+        Fetches the header blocks and proofs validate_received_state_from_peer()
+        will need for the coin states in bulk, for those that aren't cached or
+        already the same in the DB.
+        """
+        coin_states = [
+            coin_state
+            for coin_state in coin_states
+            if coin_state.created_height is not None
+            and not can_use_peer_request_cache(coin_state, peer_request_cache, fork_height)
+        ]
+        if len(coin_states) == 0:
+            return
+        local_records = (
+            await self.wallet_state_manager.coin_store.get_coin_records(
+                coin_id_filter=HashFilter.include([coin_state.coin.name() for coin_state in coin_states])
+            )
+        ).coin_id_to_record
+        to_validate = []
+        for coin_state in coin_states:
+            local_record = local_records.get(coin_state.coin.name())
+            if (
+                local_record is None
+                or local_record.confirmed_block_height != coin_state.created_height
+                or (local_record.spent_block_height or None) != coin_state.spent_height
+            ):
+                to_validate.append(coin_state)
+        await prefetch_coin_state_proofs(peer, peer_request_cache, to_validate)
+
     async def validate_received_state_from_peer(
         self,
         coin_state: CoinState,
@@ -1488,6 +1723,7 @@ class WalletNode:
 
                 validate_removals_result: bool = await request_and_validate_removals(
                     peer,
+                    peer_request_cache,
                     current.spent_block_height,
                     spent_state_block.header_hash,
                     coin_state.coin.name(),
@@ -1518,6 +1754,7 @@ class WalletNode:
             assert spent_state_block.foliage_transaction_block is not None
             validate_removals_result = await request_and_validate_removals(
                 peer,
+                peer_request_cache,
                 spent_state_block.height,
                 spent_state_block.header_hash,
                 coin_state.coin.name(),
@@ -1734,47 +1971,23 @@ class WalletNode:
         for peer in full_nodes:
             await peer.send_message(msg)
 
-    async def _update_balance_cache(self, wallet_id: uint32) -> None:
-        assert self.wallet_state_manager.lock.locked(), "WalletStateManager.lock required"
-        wallet = self.wallet_state_manager.wallets[wallet_id]
-        if wallet.type() == WalletType.CRCAT:
-            coin_type = CoinType.CRCAT
-        else:
-            coin_type = CoinType.NORMAL
-        unspent_records = await self.wallet_state_manager.coin_store.get_unspent_coins_for_wallet(wallet_id, coin_type)
-        balance = await wallet.get_confirmed_balance(unspent_records)
-        pending_balance = await wallet.get_unconfirmed_balance(unspent_records)
-        spendable_balance = await wallet.get_spendable_balance(unspent_records)
-        pending_change = await wallet.get_pending_change_balance()
-        max_send_amount = await wallet.get_max_send_amount(unspent_records)
-
-        unconfirmed_removals: Dict[bytes32, Coin] = await wallet.wallet_state_manager.unconfirmed_removals_for_wallet(
-            wallet_id
-        )
-        self._balance_cache[wallet_id] = Balance(
-            confirmed_wallet_balance=balance,
-            unconfirmed_wallet_balance=pending_balance,
-            spendable_balance=spendable_balance,
-            pending_change=pending_change,
-            max_send_amount=max_send_amount,
-            unspent_coin_count=uint32(len(unspent_records)),
-            pending_coin_removal_count=uint32(len(unconfirmed_removals)),
-        )
-
     async def get_balance(self, wallet_id: uint32) -> Balance:
         self.log.debug(f"get_balance - wallet_id: {wallet_id}")
+        balance = self._balance_cache.get(wallet_id)
+        if balance is not None:
+            return balance
         if not self.wallet_state_manager.sync_mode:
             self.log.debug(f"get_balance - Updating cache for {wallet_id}")
             async with self.wallet_state_manager.lock:
-                await self._update_balance_cache(wallet_id)
-        return self._balance_cache.get(wallet_id, Balance())
+                return await self._balance_cache.update(self.wallet_state_manager, wallet_id)
+        return self._balance_cache.balances.get(wallet_id, Balance())
 
     def set_auto_withdraw_stake(self, auto_withdraw_stake_config: AutoWithdrawStakeSettings) -> Dict[str, Any]:
         if auto_withdraw_stake_config.batch_size < 1:
             auto_withdraw_stake_config = dataclasses.replace(auto_withdraw_stake_config, batch_size=uint16(50))
         auto_withdraw_stake_config_json = auto_withdraw_stake_config.to_json_dict()
-        if ("auto_withdraw_stake" not in self.config or (
-                self.config["auto_withdraw_stake"] != auto_withdraw_stake_config_json)
+        if "auto_withdraw_stake" not in self.config or (
+            self.config["auto_withdraw_stake"] != auto_withdraw_stake_config_json
         ):
             # Update in memory config
             self.config["auto_withdraw_stake"] = auto_withdraw_stake_config_json
@@ -1784,6 +1997,21 @@ class WalletNode:
                 save_config(self.root_path, "config.yaml", config)
         return auto_withdraw_stake_config.to_json_dict()
 
+    def set_auto_consolidate_dust(self, auto_consolidate_dust_config: AutoConsolidateDustSettings) -> Dict[str, Any]:
+        if auto_consolidate_dust_config.batch_size < 2:
+            auto_consolidate_dust_config = dataclasses.replace(auto_consolidate_dust_config, batch_size=uint16(100))
+        auto_consolidate_dust_config_json = auto_consolidate_dust_config.to_json_dict()
+        if "auto_consolidate_dust" not in self.config or (
+            self.config["auto_consolidate_dust"] != auto_consolidate_dust_config_json
+        ):
+            # Update in memory config
+            self.config["auto_consolidate_dust"] = auto_consolidate_dust_config_json
+            # Update config file
+            with lock_and_load_config(self.root_path, "config.yaml") as config:
+                config["wallet"]["auto_consolidate_dust"] = self.config["auto_consolidate_dust"]
+                save_config(self.root_path, "config.yaml", config)
+        return auto_consolidate_dust_config.to_json_dict()
+
     async def request_coin_records_by_puzzle_hash(
         self,
         puzzle_hash: bytes32,
@@ -1825,4 +2053,3 @@ class WalletNode:
                 guess_num.append(int(num_str, 16) + 1)
         self._guess_header_hashes[guess_height] = guess_num
         return guess_num
-
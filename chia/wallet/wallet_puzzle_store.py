@@ -2,20 +2,156 @@ from __future__ import annotations
 
 import asyncio
 import logging
-from typing import Dict, List, Optional, Set
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
 from chia_rs import G1Element
 
 from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.batches import to_batches
 from chia.util.db_wrapper import DBWrapper2, execute_fetchone
 from chia.util.ints import uint32
-from chia.util.lru_cache import LRUCache
 from chia.wallet.derivation_record import DerivationRecord
 from chia.wallet.util.wallet_types import WalletIdentifier, WalletType
 
 log = logging.getLogger(__name__)
 
 
+# puzzle hashes added since the sorted arrays were built are merged into them
+# once there are more than this, or a quarter of the puzzle hashes
+MIN_RECENT_PUZZLE_HASHES = 10000
+
+
+def _prefix(puzzle_hash: bytes) -> int:
+    return int.from_bytes(puzzle_hash[:8], "big")
+
+
+class PuzzleHashIndex:
+    """
+    The wallet of every derived puzzle hash, in memory. Puzzle hashes are kept
+    sorted in packed arrays: their first 8 bytes as integers to search, the
+    whole hashes, and the position of their WalletIdentifier, about 46 bytes per
+    puzzle hash (see tools/puzzle_hash_index_memory.py). The ones added since
+    the arrays were built are in a dict, until they're merged into them. A
+    puzzle hash derived for several wallets maps to the first one it was added
+    for.
+    """
+
+    def __init__(self) -> None:
+        self._prefixes = array("Q")
+        self._hashes = bytearray()
+        self._slots = array("I")
+        self._recent: Dict[bytes, int] = {}
+        self._identifiers: List[WalletIdentifier] = []
+        self._identifier_slots: Dict[Tuple[int, int], int] = {}
+
+    def extend_sorted(self, rows: Iterable[Tuple[bytes32, int, int]]) -> None:
+        """
+        Appends (puzzle hash, wallet id, wallet type) sorted by puzzle hash, past the ones in the index.
+        """
+        self.compact()
+        for puzzle_hash, wallet_id, wallet_type in rows:
+            if len(self._prefixes) > 0 and self._hashes[-32:] == puzzle_hash:
+                continue
+            self._prefixes.append(_prefix(puzzle_hash))
+            self._hashes.extend(puzzle_hash)
+            self._slots.append(self._slot_for(wallet_id, wallet_type))
+
+    def __len__(self) -> int:
+        return len(self._prefixes) + len(self._recent)
+
+    def __contains__(self, puzzle_hash: bytes32) -> bool:
+        return self._slot(puzzle_hash) is not None
+
+    def _slot_for(self, wallet_id: int, wallet_type: int) -> int:
+        slot = self._identifier_slots.get((wallet_id, wallet_type))
+        if slot is None:
+            slot = len(self._identifiers)
+            self._identifiers.append(WalletIdentifier(uint32(wallet_id), WalletType(wallet_type)))
+            self._identifier_slots[(wallet_id, wallet_type)] = slot
+        return slot
+
+    def _find(self, puzzle_hash: bytes) -> int:
+        """
+        Returns the position of the puzzle hash in the sorted arrays, or -1.
+        """
+        prefix = _prefix(puzzle_hash)
+        position = bisect_left(self._prefixes, prefix)
+        while position < len(self._prefixes) and self._prefixes[position] == prefix:
+            if self._hashes[32 * position : 32 * position + 32] == puzzle_hash:
+                return position
+            position += 1
+        return -1
+
+    def _slot(self, puzzle_hash: bytes32) -> Optional[int]:
+        slot = self._recent.get(puzzle_hash)
+        if slot is not None:
+            return slot
+        position = self._find(puzzle_hash)
+        return None if position < 0 else self._slots[position]
+
+    def get(self, puzzle_hash: bytes32) -> Optional[WalletIdentifier]:
+        slot = self._slot(puzzle_hash)
+        return None if slot is None else self._identifiers[slot]
+
+    def add(self, puzzle_hash: bytes32, wallet_id: int, wallet_type: int) -> None:
+        if puzzle_hash in self:
+            return
+        self._recent[bytes(puzzle_hash)] = self._slot_for(wallet_id, wallet_type)
+        if len(self._recent) > max(MIN_RECENT_PUZZLE_HASHES, len(self._prefixes) // 4):
+            self.compact()
+
+    def compact(self) -> None:
+        if len(self._recent) > 0:
+            self._rebuild(set())
+
+    def remove(self, puzzle_hashes: Iterable[bytes32]) -> None:
+        removed = {bytes(puzzle_hash) for puzzle_hash in puzzle_hashes}
+        if len(removed) > 0:
+            self._rebuild(removed)
+
+    def _rebuild(self, removed: Set[bytes]) -> None:
+        """
+        Merges the recent puzzle hashes into the sorted arrays, without the removed ones. The old arrays are
+        copied in runs, so that no object is created for each of their puzzle hashes. Puzzle hashes with the
+        same prefix are in no particular order, _find() compares all of them.
+        """
+        # (position in the old arrays, puzzle hash to insert before it or None to skip it, slot)
+        changes: List[Tuple[int, Optional[bytes], int]] = []
+        for puzzle_hash in removed:
+            position = self._find(puzzle_hash)
+            if position >= 0:
+                changes.append((position, None, 0))
+        for puzzle_hash, slot in self._recent.items():
+            if puzzle_hash not in removed:
+                changes.append((bisect_left(self._prefixes, _prefix(puzzle_hash)), puzzle_hash, slot))
+        # removals first, and puzzle hashes inserted at the same position in order
+        changes.sort(key=lambda change: (change[0], change[1] is not None, change[1] or b""))
+
+        prefixes = array("Q")
+        hashes = bytearray()
+        slots = array("I")
+        start = 0
+        for position, puzzle_hash, slot in changes:
+            if start < position:
+                prefixes.extend(self._prefixes[start:position])
+                hashes.extend(self._hashes[32 * start : 32 * position])
+                slots.extend(self._slots[start:position])
+                start = position
+            if puzzle_hash is None:
+                start = position + 1
+            else:
+                prefixes.append(_prefix(puzzle_hash))
+                hashes.extend(puzzle_hash)
+                slots.append(slot)
+        prefixes.extend(self._prefixes[start:])
+        hashes.extend(self._hashes[32 * start :])
+        slots.extend(self._slots[start:])
+        self._prefixes, self._hashes, self._slots = prefixes, hashes, slots
+        self._recent = {}
+
+
 class WalletPuzzleStore:
     """
     WalletPuzzleStore keeps track of all generated puzzle_hashes and their derivation path / wallet.
@@ -25,7 +161,7 @@ class WalletPuzzleStore:
 
     lock: asyncio.Lock
     db_wrapper: DBWrapper2
-    wallet_identifier_cache: LRUCache
+    puzzle_hash_index: PuzzleHashIndex
     # maps wallet_id -> last_derivation_index
     last_wallet_derivation_index: Dict[uint32, uint32]
     last_derivation_index: Optional[uint32]
@@ -63,11 +199,27 @@ class WalletPuzzleStore:
 
         # the lock is locked by the users of this class
         self.lock = asyncio.Lock()
-        self.wallet_identifier_cache = LRUCache(100)
+        self.puzzle_hash_index = PuzzleHashIndex()
         self.last_derivation_index = None
         self.last_wallet_derivation_index = {}
+        await self.load_puzzle_hash_index()
         return self
 
+    async def load_puzzle_hash_index(self) -> None:
+        puzzle_hash_index = PuzzleHashIndex()
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            # in order, so the index is built without sorting, and in chunks, not to hold all the rows at once
+            async with conn.execute(
+                "SELECT puzzle_hash, wallet_id, wallet_type FROM derivation_paths ORDER BY puzzle_hash, rowid"
+            ) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(10000)
+                    if len(rows) == 0:
+                        break
+                    puzzle_hash_index.extend_sorted((bytes32.fromhex(row[0]), row[1], row[2]) for row in rows)
+        self.puzzle_hash_index = puzzle_hash_index
+        log.info(f"Loaded {len(puzzle_hash_index)} derived puzzle hashes")
+
     async def add_derivation_paths(self, records: List[DerivationRecord]) -> None:
         """
         Insert many derivation paths into the database.
@@ -109,6 +261,8 @@ class WalletPuzzleStore:
                     sql_records,
                 )
             ).close()
+        for record in records:
+            self.puzzle_hash_index.add(record.puzzle_hash, record.wallet_id, record.wallet_type)
 
     async def get_derivation_record(
         self, index: uint32, wallet_id: uint32, hardened: bool
@@ -137,6 +291,8 @@ class WalletPuzzleStore:
         """
         Returns the derivation record by index and wallet id.
         """
+        if puzzle_hash not in self.puzzle_hash_index:
+            return None
         async with self.db_wrapper.reader_no_transaction() as conn:
             row = await execute_fetchone(
                 conn,
@@ -165,13 +321,7 @@ class WalletPuzzleStore:
         """
         Checks if passed puzzle_hash is present in the db.
         """
-
-        async with self.db_wrapper.reader_no_transaction() as conn:
-            row = await execute_fetchone(
-                conn, "SELECT puzzle_hash FROM derivation_paths WHERE puzzle_hash=?", (puzzle_hash.hex(),)
-            )
-
-        return row is not None
+        return puzzle_hash in self.puzzle_hash_index
 
     def row_to_record(self, row) -> DerivationRecord:
         return DerivationRecord(
@@ -221,6 +371,8 @@ class WalletPuzzleStore:
         Returns the derivation path for the puzzle_hash.
         Returns None if not present.
         """
+        if puzzle_hash not in self.puzzle_hash_index:
+            return None
         async with self.db_wrapper.reader_no_transaction() as conn:
             row = await execute_fetchone(
                 conn, "SELECT derivation_index FROM derivation_paths WHERE puzzle_hash=?", (puzzle_hash.hex(),)
@@ -232,6 +384,8 @@ class WalletPuzzleStore:
         Returns the derivation path for the puzzle_hash.
         Returns None if not present.
         """
+        if puzzle_hash not in self.puzzle_hash_index:
+            return None
         async with self.db_wrapper.reader_no_transaction() as conn:
             row = await execute_fetchone(
                 conn,
@@ -251,21 +405,7 @@ class WalletPuzzleStore:
         Returns the derivation path for the puzzle_hash.
         Returns None if not present.
         """
-        cached = self.wallet_identifier_cache.get(puzzle_hash)
-        if cached is not None:
-            return cached
-
-        async with self.db_wrapper.reader_no_transaction() as conn:
-            row = await execute_fetchone(
-                conn, "SELECT wallet_type, wallet_id FROM derivation_paths WHERE puzzle_hash=?", (puzzle_hash.hex(),)
-            )
-
-        if row is not None:
-            wallet_identifier = WalletIdentifier(uint32(row[1]), WalletType(row[0]))
-            self.wallet_identifier_cache.put(puzzle_hash, wallet_identifier)
-            return wallet_identifier
-
-        return None
+        return self.puzzle_hash_index.get(puzzle_hash)
 
     async def get_all_puzzle_hashes(self, wallet_id: Optional[int] = None) -> Set[bytes32]:
         """
@@ -351,13 +491,20 @@ class WalletPuzzleStore:
             )
             cursor = await conn.execute("DELETE FROM derivation_paths WHERE wallet_id=?;", (wallet_id,))
             await cursor.close()
-        # Clear caches
-        puzzle_hashes = {bytes32.fromhex(row[0]) for row in rows}
-        for puzzle_hash in puzzle_hashes:
-            try:
-                self.wallet_identifier_cache.remove(puzzle_hash)
-            except KeyError:
-                pass
+            # Update the index, puzzle hashes also derived for other wallets now map to one of those
+            puzzle_hashes = [bytes32.fromhex(row[0]) for row in rows]
+            remaining: List[Any] = []
+            for batch in to_batches(puzzle_hashes, 500):
+                remaining.extend(
+                    await conn.execute_fetchall(
+                        "SELECT puzzle_hash, wallet_type, wallet_id FROM derivation_paths "
+                        f"WHERE puzzle_hash IN ({','.join('?' * len(batch.entries))}) ORDER BY rowid",
+                        [puzzle_hash.hex() for puzzle_hash in batch.entries],
+                    )
+                )
+        self.puzzle_hash_index.remove(puzzle_hashes)
+        for row in remaining:
+            self.puzzle_hash_index.add(bytes32.fromhex(row[0]), row[2], row[1])
         try:
             self.last_wallet_derivation_index.pop(wallet_id)
         except KeyError:
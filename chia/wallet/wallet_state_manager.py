@@ -59,12 +59,13 @@ from chia.types.spend_bundle import SpendBundle
 from chia.types.stake_record import STAKE_LOCK_MIN_MOJO
 from chia.util.bech32m import encode_puzzle_hash
 from chia.util.condition_tools import conditions_dict_for_solution, pkm_pairs_for_conditions_dict
+from chia.util.config import process_config_start_method
 from chia.util.db_synchronous import db_synchronous_on
 from chia.util.db_wrapper import DBWrapper2
 from chia.util.errors import Err
 from chia.util.guess import (
-    ISSUE_HEIGHT_PER_LOTTERY,
     GUESS_PUZZLE_HASH,
+    ISSUE_HEIGHT_PER_LOTTERY,
     check_guess_memos,
     generate_bets,
     get_guess_height,
@@ -96,19 +97,22 @@ from chia.wallet.dao_wallet.dao_utils import (
 )
 from chia.wallet.dao_wallet.dao_wallet import DAOWallet
 from chia.wallet.db_wallet.db_wallet_puzzles import MIRROR_PUZZLE_HASH
+from chia.wallet.derivation_pool import DerivationPool
 from chia.wallet.derivation_record import DerivationRecord
 from chia.wallet.derive_keys import (
-    _derive_path,
-    _derive_pk_unhardened,
     master_pk_to_wallet_pk_unhardened,
-    master_pk_to_wallet_pk_unhardened_intermediate,
     master_sk_to_wallet_sk,
-    master_sk_to_wallet_sk_intermediate,
     master_sk_to_wallet_sk_unhardened,
 )
 from chia.wallet.did_wallet.did_info import DIDCoinData
 from chia.wallet.did_wallet.did_wallet import DIDWallet
 from chia.wallet.did_wallet.did_wallet_puzzles import DID_INNERPUZ_MOD, match_did_puzzle
+from chia.wallet.dust_consolidation import (
+    MAX_CONSOLIDATION_BATCH_SIZE,
+    AutoConsolidateDustSettings,
+    DustConsolidationReport,
+    plan_dust_consolidation,
+)
 from chia.wallet.key_val_store import KeyValStore
 from chia.wallet.nft_wallet.nft_puzzles import get_metadata_and_phs, get_new_owner_did
 from chia.wallet.nft_wallet.nft_wallet import NFTWallet
@@ -162,7 +166,7 @@ from chia.wallet.wallet import Wallet
 from chia.wallet.wallet_action_scope import WalletActionScope, new_wallet_action_scope
 from chia.wallet.wallet_blockchain import WalletBlockchain
 from chia.wallet.wallet_coin_record import MetadataTypes, WalletCoinRecord
-from chia.wallet.wallet_coin_store import WalletCoinStore
+from chia.wallet.wallet_coin_store import CoinRecordOrder, WalletCoinStore, unspent_range
 from chia.wallet.wallet_info import WalletInfo
 from chia.wallet.wallet_interested_store import WalletInterestedStore
 from chia.wallet.wallet_nft_store import WalletNftStore
@@ -185,6 +189,8 @@ class WalletStateManager:
     interested_ph_cache: Dict[bytes32, List[int]] = {}
     interested_coin_cache: Dict[bytes32, List[int]] = {}
     spend_coin_cache: Dict[bytes32, int] = {}
+    # time of the last automatic dust consolidation run
+    last_dust_consolidation: float = 0.0
     constants: ConsensusConstants
     config: Dict[str, Any]
     tx_store: WalletTransactionStore
@@ -228,6 +234,7 @@ class WalletStateManager:
     asset_to_wallet_map: Dict[AssetType, Any]
     initial_num_public_keys: int
     decorator_manager: PuzzleDecoratorManager
+    derivation_pool: DerivationPool
 
     @staticmethod
     async def create(
@@ -303,6 +310,17 @@ class WalletStateManager:
                 assert root_pubkey == calculated_root_public_key
             self.root_pubkey = calculated_root_public_key
 
+        self.multiprocessing_context = multiprocessing.get_context(
+            method=process_config_start_method(config=self.config, log=self.log)
+        )
+        self.derivation_pool = DerivationPool(
+            private_key,
+            self.root_pubkey,
+            self.config.get("derivation_lookahead", self.initial_num_public_keys),
+            self.multiprocessing_context,
+            self.config.get("derivation_processes", 2),
+        )
+
         fingerprint = self.root_pubkey.get_fingerprint()
         puzzle_decorators = self.config.get("puzzle_decorators", {}).get(fingerprint, [])
         self.decorator_manager = PuzzleDecoratorManager.create(puzzle_decorators)
@@ -378,6 +396,8 @@ class WalletStateManager:
             if wallet is not None:
                 self.wallets[wallet_info.id] = wallet
 
+        last_derivation_index = await self.puzzle_store.get_last_derivation_path()
+        self.derivation_pool.ensure_ahead(0 if last_derivation_index is None else last_derivation_index + 1)
         return self
 
     def get_public_key_unhardened(self, index: uint32) -> G1Element:
@@ -446,7 +466,6 @@ class WalletStateManager:
 
         # iterate all wallets that need derived keys and establish the start
         # index for all of them
-        start_index: int = 0
         start_index_by_wallet: Dict[uint32, int] = {}
         last_index = unused + to_generate
         for wallet_id in targets:
@@ -460,9 +479,8 @@ class WalletStateManager:
             last: Optional[uint32] = await self.puzzle_store.get_last_derivation_path_for_wallet(wallet_id)
             if last is not None:
                 if last + 1 >= last_index:
-                    self.log.debug(f"Nothing to create for for wallet_id: {wallet_id}, index: {start_index}")
+                    self.log.debug(f"Nothing to create for for wallet_id: {wallet_id}, index: {last + 1}")
                     continue
-                start_index = min(start_index, last + 1)
                 start_index_by_wallet[wallet_id] = last + 1
             else:
                 start_index_by_wallet[wallet_id] = 0
@@ -470,74 +488,71 @@ class WalletStateManager:
         if len(start_index_by_wallet) == 0:
             return
 
-        # now derive the keysfrom start_index to last_index
-        # these maps derivation index to public key
-        hardened_keys: Dict[int, G1Element] = {}
-        unhardened_keys: Dict[int, G1Element] = {}
+        # the keys from start_index to last_index, usually derived ahead by the derivation pool
+        start_index = min(start_index_by_wallet.values())
+        derived_keys = await self.derivation_pool.get_keys(start_index, last_index)
+        self.derivation_pool.ensure_ahead(last_index)
 
-        if self.private_key is not None:
-            # Hardened
-            intermediate_sk = master_sk_to_wallet_sk_intermediate(self.private_key)
-            for index in range(start_index, last_index):
-                hardened_keys[index] = _derive_path(intermediate_sk, [index]).get_g1()
-
-        # Unhardened
-        intermediate_pk_un = master_pk_to_wallet_pk_unhardened_intermediate(self.root_pubkey)
-        for index in range(start_index, last_index):
-            unhardened_keys[index] = _derive_pk_unhardened(intermediate_pk_un, [index])
-
-        for wallet_id, start_index in start_index_by_wallet.items():
+        derivation_paths: List[DerivationRecord] = []
+        main_wallet_puzzle_hashes: List[bytes32] = []
+        for wallet_id, wallet_start_index in start_index_by_wallet.items():
             target_wallet = self.wallets[wallet_id]
             assert target_wallet.type() != WalletType.POOLING_WALLET
-            assert start_index < last_index
+            assert wallet_start_index < last_index
+            # the standard wallet's puzzle hashes are derived along with the keys
+            standard = type(target_wallet) is Wallet
 
-            derivation_paths: List[DerivationRecord] = []
-            creating_msg = f"Creating puzzle hashes from {start_index} to {last_index - 1} for wallet_id: {wallet_id}"
+            wallet_paths: List[DerivationRecord] = []
+            creating_msg = (
+                f"Creating puzzle hashes from {wallet_start_index} to {last_index - 1} for wallet_id: {wallet_id}"
+            )
             self.log.info(f"Start: {creating_msg}")
-            for index in range(start_index, last_index):
-                pubkey: Optional[G1Element] = hardened_keys.get(index)
-                if pubkey is not None:
+            for keys in derived_keys[wallet_start_index - start_index :]:
+                if keys.hardened is not None:
                     # Hardened
-                    puzzlehash: bytes32 = target_wallet.puzzle_hash_for_pk(pubkey)
-                    self.log.debug(f"Puzzle at index {index} wallet ID {wallet_id} puzzle hash {puzzlehash.hex()}")
-                    derivation_paths.append(
+                    puzzlehash: Optional[bytes32] = keys.hardened_puzzle_hash if standard else None
+                    if puzzlehash is None:
+                        puzzlehash = target_wallet.puzzle_hash_for_pk(keys.hardened)
+                    self.log.debug(f"Puzzle at index {keys.index} wallet ID {wallet_id} puzzle hash {puzzlehash.hex()}")
+                    wallet_paths.append(
                         DerivationRecord(
-                            uint32(index),
+                            uint32(keys.index),
                             puzzlehash,
-                            pubkey,
+                            keys.hardened,
                             target_wallet.type(),
                             uint32(target_wallet.id()),
                             True,
                         )
                     )
                 # Unhardened
-                pubkey = unhardened_keys.get(index)
-                assert pubkey is not None
-                puzzlehash_unhardened: bytes32 = target_wallet.puzzle_hash_for_pk(pubkey)
+                puzzlehash_unhardened: bytes32 = (
+                    keys.unhardened_puzzle_hash if standard else target_wallet.puzzle_hash_for_pk(keys.unhardened)
+                )
                 self.log.debug(
-                    f"Puzzle at index {index} wallet ID {wallet_id} puzzle hash {puzzlehash_unhardened.hex()}"
+                    f"Puzzle at index {keys.index} wallet ID {wallet_id} puzzle hash {puzzlehash_unhardened.hex()}"
                 )
-                derivation_paths.append(
+                wallet_paths.append(
                     DerivationRecord(
-                        uint32(index),
+                        uint32(keys.index),
                         puzzlehash_unhardened,
-                        pubkey,
+                        keys.unhardened,
                         target_wallet.type(),
                         uint32(target_wallet.id()),
                         False,
                     )
                 )
             self.log.info(f"Done: {creating_msg} Time: {time.time() - start_t} seconds")
-            if len(derivation_paths) > 0:
-                await self.puzzle_store.add_derivation_paths(derivation_paths)
-                if wallet_id == self.main_wallet.id():
-                    await self.wallet_node.new_peak_queue.subscribe_to_puzzle_hashes(
-                        [record.puzzle_hash for record in derivation_paths]
-                    )
-        if len(unhardened_keys) > 0:
+            derivation_paths.extend(wallet_paths)
+            if wallet_id == self.main_wallet.id():
+                main_wallet_puzzle_hashes.extend(record.puzzle_hash for record in wallet_paths)
+        # all the wallets' paths are stored at once
+        await self.puzzle_store.add_derivation_paths(derivation_paths)
+        if len(main_wallet_puzzle_hashes) > 0:
+            await self.wallet_node.new_peak_queue.subscribe_to_puzzle_hashes(main_wallet_puzzle_hashes)
+        if len(derived_keys) > 0:
             self.state_changed("new_derivation_index", data_object={"index": last_index - 1})
         # By default, we'll mark previously generated unused puzzle hashes as used if we have new paths
-        if mark_existing_as_used and unused > 0 and len(unhardened_keys) > 0:
+        if mark_existing_as_used and unused > 0 and len(derived_keys) > 0:
             self.log.info(f"Updating last used derivation index: {unused - 1}")
             await self.puzzle_store.set_used_up_to(uint32(unused - 1))
 
@@ -1752,9 +1767,11 @@ class WalletStateManager:
             self.log.debug("Add coin state: %s: %s", coin_name, coin_state)
             local_record = local_records.coin_id_to_record.get(coin_name)
             rollback_wallets = None
+            rollback_unspent_totals = None
             try:
                 async with self.db_wrapper.writer():
                     rollback_wallets = self.wallets.copy()  # Shallow copy of wallets if writer rolls back the db
+                    rollback_unspent_totals = self.coin_store.unspent_totals.copy()
                     # This only succeeds if we don't raise out of the transaction
                     await self.retry_store.remove_state(coin_state)
 
@@ -2160,6 +2177,8 @@ class WalletStateManager:
                 self.log.exception(f"Failed to add coin_state: {coin_state}, error: {e}")
                 if rollback_wallets is not None:
                     self.wallets = rollback_wallets  # Restore since DB will be rolled back by writer
+                if rollback_unspent_totals is not None:
+                    self.coin_store.restore_unspent_totals(rollback_unspent_totals)
                 if isinstance(e, (PeerRequestException, aiosqlite.Error)):
                     await self.retry_store.add_state(coin_state, peer.peer_node_id, fork_height)
                 else:
@@ -2542,6 +2561,7 @@ class WalletStateManager:
         return remove_ids
 
     async def _await_closed(self) -> None:
+        self.derivation_pool.close()
         await self.db_wrapper.close()
 
     def unlink_db(self) -> None:
@@ -2602,27 +2622,55 @@ class WalletStateManager:
             else:
                 records = await self.coin_store.get_unspent_coins_for_wallet(wallet_id)
 
+        unspendable: Set[bytes32] = await self.get_unspendable_coin_ids(wallet_id)
+        return {record for record in records if record.coin.name() not in unspendable}
+
+    async def get_unspendable_coin_ids(self, wallet_id: int) -> Set[bytes32]:
+        """
+        Returns the ids of the coins of the wallet that pending transactions spend, and of all the coins
+        offers lock.
+        """
         # Coins that are currently part of a transaction
         unconfirmed_tx: List[TransactionRecord] = await self.tx_store.get_unconfirmed_for_wallet(wallet_id)
-        removal_dict: Dict[bytes32, Coin] = {}
+        unspendable: Set[bytes32] = set()
         for tx in unconfirmed_tx:
             for coin in tx.removals:
                 # TODO, "if" might not be necessary once unconfirmed tx doesn't contain coins for other wallets
                 if await self.does_coin_belong_to_wallet(coin, wallet_id, tx.hint_dict()):
-                    removal_dict[coin.name()] = coin
+                    unspendable.add(coin.name())
 
         # Coins that are part of the trade
         offer_locked_coins: Dict[bytes32, WalletCoinRecord] = await self.trade_manager.get_locked_coins()
+        unspendable.update(offer_locked_coins.keys())
+        return unspendable
 
-        filtered = set()
-        for record in records:
-            if record.coin.name() in offer_locked_coins:
-                continue
-            if record.coin.name() in removal_dict:
-                continue
-            filtered.add(record)
+    async def get_largest_spendable_coins(
+        self, wallet_id: int, limit: int, coin_type: CoinType = CoinType.NORMAL
+    ) -> List[WalletCoinRecord]:
+        """
+        Returns the spendable coins of the wallet with the largest amounts, largest first, read in amount
+        order from the coin store instead of loading all the unspent coins.
+        """
+        unspendable: Set[bytes32] = await self.get_unspendable_coin_ids(wallet_id)
+        largest = await self.coin_store.get_largest_unspent_coins(wallet_id, limit + len(unspendable), coin_type)
+        return [record for record in largest if record.name() not in unspendable][:limit]
 
-        return filtered
+    async def get_spendable_amount(self, wallet_id: int, coin_type: CoinType = CoinType.NORMAL) -> uint128:
+        """
+        Returns the amount of the spendable coins of the wallet, from the unspent total the coin store
+        maintains minus the coins that can't be spent.
+        """
+        total = self.coin_store.get_unspent_total(wallet_id, coin_type).amount
+        unspendable: Set[bytes32] = await self.get_unspendable_coin_ids(wallet_id)
+        if len(unspendable) == 0:
+            return uint128(total)
+        records = await self.coin_store.get_coin_records(
+            wallet_id=uint32(wallet_id),
+            coin_type=coin_type,
+            coin_id_filter=HashFilter.include(list(unspendable)),
+            spent_range=unspent_range,
+        )
+        return uint128(total - sum(record.coin.amount for record in records.records))
 
     async def new_peak(self, height: uint32) -> None:
         for wallet_id, wallet in self.wallets.items():
@@ -3138,6 +3186,88 @@ class WalletStateManager:
         async with action_scope.use() as interface:
             interface.side_effects.transactions.append(tx_record)
 
+    async def auto_consolidate_dust(self) -> None:
+        """
+        Merges the dust coins of the standard wallet, at most once per
+        configured interval. Must be called under the wallet state manager lock.
+        """
+        settings = AutoConsolidateDustSettings.from_json_dict(self.config.get("auto_consolidate_dust", {}))
+        now = time.time()
+        if now - self.last_dust_consolidation < settings.interval:
+            return
+        self.last_dust_consolidation = now
+        if not await self.synced():
+            return
+        assert self.wallet_node.logged_in_fingerprint is not None
+        tx_config_loader: TXConfigLoader = TXConfigLoader.from_json_dict(self.config.get("auto_consolidate_dust", {}))
+        tx_config: TXConfig = tx_config_loader.autofill(
+            constants=self.constants,
+            config=self.config,
+            logged_in_fingerprint=self.wallet_node.logged_in_fingerprint,
+        )
+        try:
+            async with self.new_action_scope(push=True) as action_scope:
+                report = await self.consolidate_dust(settings, tx_config, action_scope)
+        except Exception as e:
+            self.log.error(f"Failed to consolidate dust coins: {e}")
+            return
+        if len(report.batches) > 0:
+            self.log.info(
+                f"Consolidating {sum(len(batch.coin_ids) for batch in report.batches)} of {report.dust_coins} "
+                f"dust coins in {len(report.batches)} transactions"
+            )
+
+    async def consolidate_dust(
+        self,
+        settings: AutoConsolidateDustSettings,
+        tx_config: TXConfig,
+        action_scope: WalletActionScope,
+        dry_run: bool = False,
+    ) -> DustConsolidationReport:
+        """
+        Merges the unspent coins of the standard wallet smaller than the dust
+        threshold, smallest first, settings.batch_size coins per transaction.
+        Nothing is spent with dry_run, or when there are fewer dust coins than
+        settings.min_coins, the report tells what would be.
+        """
+        wallet_id = self.main_wallet.id()
+        unspendable: Set[bytes32] = await self.get_unspendable_coin_ids(wallet_id)
+        dust: List[WalletCoinRecord] = []
+        dust_coins = 0
+        if settings.dust_threshold > 0:
+            # only the smallest coins a run may merge are loaded
+            batch_size = max(2, min(settings.batch_size, MAX_CONSOLIDATION_BATCH_SIZE))
+            result = await self.coin_store.get_coin_records(
+                wallet_id=wallet_id,
+                coin_type=CoinType.NORMAL,
+                spent_range=unspent_range,
+                amount_range=UInt64Range(stop=uint64(settings.dust_threshold - 1)),
+                order=CoinRecordOrder.amount,
+                limit=uint32(min(batch_size * settings.max_batches + len(unspendable), uint32.MAXIMUM)),
+                include_total_count=True,
+            )
+            dust = [record for record in result.records if record.name() not in unspendable]
+            assert result.total_count is not None
+            # unspendable coins past the loaded ones are still counted
+            dust_coins = result.total_count - (len(result.records) - len(dust))
+        batches, uneconomical = ([], 0) if dust_coins < settings.min_coins else plan_dust_consolidation(dust, settings)
+        report = DustConsolidationReport(dry_run, uint32(dust_coins), batches, uint32(uneconomical))
+        if dry_run:
+            return report
+
+        records = {record.name(): record for record in dust}
+        for batch in batches:
+            puzzle_hash = await self.main_wallet.get_puzzle_hash(not tx_config.reuse_puzhash)
+            await self.main_wallet.generate_signed_transaction(
+                uint64(batch.amount - batch.fee),
+                puzzle_hash,
+                tx_config,
+                action_scope,
+                fee=batch.fee,
+                coins={records[coin_id].coin for coin_id in batch.coin_ids},
+            )
+        return report
+
     async def set_guess_memos(self,  peer: WSLotteryConnection) -> None:
         finished_height = await self.blockchain.get_finished_sync_up_to()
         guess_height = get_guess_height(finished_height, False)
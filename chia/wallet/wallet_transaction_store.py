@@ -3,7 +3,7 @@ from __future__ import annotations
 import dataclasses
 import logging
 import time
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import aiosqlite
 
@@ -12,6 +12,7 @@ from chia.types.mempool_inclusion_status import MempoolInclusionStatus
 from chia.util.db_wrapper import DBWrapper2
 from chia.util.errors import Err
 from chia.util.ints import uint8, uint32, uint64
+from chia.util.streamable import Streamable, streamable
 from chia.wallet.conditions import ConditionValidTimes
 from chia.wallet.transaction_record import TransactionRecord, TransactionRecordOld, minimum_send_attempts
 from chia.wallet.transaction_sorting import SortKey
@@ -30,6 +31,84 @@ def filter_ok_mempool_status(sent_to: List[Tuple[str, uint8, Optional[str]]]) ->
     return new_sent_to
 
 
+@streamable
+@dataclasses.dataclass(frozen=True)
+class TransactionSummary(Streamable):
+    """
+    The columns of a transaction record, without decoding the full record.
+    """
+
+    name: bytes32
+    wallet_id: uint32
+    type: uint32  # TransactionType
+    confirmed: bool
+    confirmed_at_height: uint32
+    created_at_time: uint64
+    to_puzzle_hash: bytes32
+    amount: uint64
+    fee_amount: uint64
+    sent: uint32
+    trade_id: Optional[bytes32]
+
+
+@streamable
+@dataclasses.dataclass(frozen=True)
+class TransactionHistoryCursor(Streamable):
+    """
+    The position, in any sort order, of the last transaction of a page of
+    transaction summaries. The next page starts after it.
+    """
+
+    confirmed: bool
+    confirmed_at_height: uint32
+    created_at_time: uint64
+    rowid: uint64
+
+
+def _filter_conditions(
+    confirmed: Optional[bool],
+    to_puzzle_hash: Optional[bytes32],
+    type_filter: Optional[TransactionTypeFilter],
+) -> Tuple[str, List[Any]]:
+    conditions = ""
+    parameters: List[Any] = []
+    if confirmed is not None:
+        conditions += " AND confirmed=?"
+        parameters.append(int(confirmed))
+    if to_puzzle_hash is not None:
+        conditions += " AND to_puzzle_hash=?"
+        parameters.append(to_puzzle_hash.hex())
+    if type_filter is not None:
+        conditions += (
+            f" AND type {'' if type_filter.mode == FilterMode.include else 'NOT'}"
+            f" IN ({','.join('?' * len(type_filter.values))})"
+        )
+        parameters.extend(int(x) for x in type_filter.values)
+    return conditions, parameters
+
+
+def _keyset_segments(columns: List[Tuple[str, bool]], values: Dict[str, Any]) -> List[Tuple[str, List[Any]]]:
+    """
+    The conditions for the rows that come after the given column values, in the
+    order of the given (column, descending) columns. Each condition is an index
+    range, the rows matching the first one come first, then the ones matching
+    the second one, and so on. Columns sorted in the same direction are compared
+    as a single row value, otherwise the first column is split into the rows
+    equal to its value, and the ones after it.
+    """
+    if all(descending == columns[0][1] for _, descending in columns):
+        names = ", ".join(column for column, _ in columns)
+        operator = "<" if columns[0][1] else ">"
+        return [(f"({names}) {operator} ({','.join('?' * len(columns))})", [values[column] for column, _ in columns])]
+    column, descending = columns[0]
+    segments = [
+        (f"{column}=? AND {condition}", [values[column], *parameters])
+        for condition, parameters in _keyset_segments(columns[1:], values)
+    ]
+    segments.append((f"{column}{'<' if descending else '>'}?", [values[column]]))
+    return segments
+
+
 class WalletTransactionStore:
     """
     WalletTransactionStore stores transaction history for the wallet.
@@ -38,12 +117,16 @@ class WalletTransactionStore:
     db_wrapper: DBWrapper2
     tx_submitted: Dict[bytes32, Tuple[int, int]]  # tx_id: [time submitted: count]
     last_wallet_tx_resend_time: int  # Epoch time in seconds
+    # called with the id of a wallet whose transactions changed, or None if it
+    # may have been any wallet
+    wallet_changed_callback: Optional[Callable[[Optional[int]], None]]
 
     @classmethod
     async def create(cls, db_wrapper: DBWrapper2):
         self = cls()
 
         self.db_wrapper = db_wrapper
+        self.wallet_changed_callback = None
         async with self.db_wrapper.writer_maybe_transaction() as conn:
             await conn.execute(
                 "CREATE TABLE IF NOT EXISTS transaction_record("
@@ -79,6 +162,18 @@ class WalletTransactionStore:
                 "CREATE INDEX IF NOT EXISTS transaction_record_trade_id_idx ON transaction_record(trade_id)"
             )
             await conn.execute("CREATE INDEX IF NOT EXISTS tx_type on transaction_record(type)")
+            # Used to page through the history of a wallet, in either sort order
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS tx_wallet_confirmed_height"
+                " on transaction_record(wallet_id, confirmed_at_height)"
+            )
+            # in the directions of the RELEVANCE sort, an index scanned forward or
+            # backward only serves sorts that match its directions
+            await conn.execute("DROP INDEX IF EXISTS tx_wallet_relevance")
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS tx_wallet_relevance_sorted on transaction_record"
+                "(wallet_id, confirmed ASC, confirmed_at_height DESC, created_at_time DESC)"
+            )
 
             try:
                 await conn.execute("CREATE TABLE tx_times(txid blob PRIMARY KEY, valid_times blob)")
@@ -138,10 +233,16 @@ class WalletTransactionStore:
             await conn.execute_insert(
                 "INSERT OR REPLACE INTO tx_times VALUES (?, ?)", (record.name, bytes(record.valid_times))
             )
+        self._wallet_changed(record.wallet_id)
+
+    def _wallet_changed(self, wallet_id: Optional[int]) -> None:
+        if self.wallet_changed_callback is not None:
+            self.wallet_changed_callback(wallet_id)
 
     async def delete_transaction_record(self, tx_id: bytes32) -> None:
         async with self.db_wrapper.writer_maybe_transaction() as conn:
             await (await conn.execute("DELETE FROM transaction_record WHERE bundle_id=?", (tx_id,))).close()
+        self._wallet_changed(None)
 
     async def set_confirmed(self, tx_id: bytes32, height: uint32):
         """
@@ -308,11 +409,6 @@ class WalletTransactionStore:
         """
         limit = end - start
 
-        if to_puzzle_hash is None:
-            puzz_hash_where = ""
-        else:
-            puzz_hash_where = f' AND to_puzzle_hash="{to_puzzle_hash.hex()}"'
-
         if sort_key is None:
             sort_key = "CONFIRMED_AT_HEIGHT"
         if sort_key not in SortKey.__members__:
@@ -323,50 +419,141 @@ class WalletTransactionStore:
         else:
             query_str = SortKey[sort_key].ascending()
 
-        confirmed_str = ""
-        if confirmed is not None:
-            confirmed_str = f"AND confirmed={int(confirmed)}"
+        # ties are broken by rowid, in the order of the first column, as in get_transaction_summaries()
+        descending = SortKey[sort_key].columns(reverse)[0][1]
+        query_str += f", transaction_record.rowid {'DESC' if descending else 'ASC'}"
 
-        if type_filter is None:
-            type_filter_str = ""
-        else:
-            type_filter_str = (
-                f"AND type {'' if type_filter.mode == FilterMode.include else 'NOT'} "
-                f"IN ({','.join([str(x) for x in type_filter.values])})"
-            )
+        filter_str, parameters = _filter_conditions(confirmed, to_puzzle_hash, type_filter)
 
         async with self.db_wrapper.reader_no_transaction() as conn:
             rows = await conn.execute_fetchall(
-                f"SELECT transaction_record FROM transaction_record WHERE wallet_id=?{puzz_hash_where}"
-                f" {type_filter_str} {confirmed_str} {query_str}, rowid"
+                "SELECT transaction_record, valid_times FROM transaction_record"
+                f" LEFT JOIN tx_times ON txid=bundle_id WHERE wallet_id=?{filter_str} {query_str}"
                 f" LIMIT {start}, {limit}",
-                (wallet_id,),
+                (wallet_id, *parameters),
             )
 
-        return await self._get_new_tx_records_from_old([TransactionRecordOld.from_bytes(row[0]) for row in rows])
+        return [self._tx_record_from_row(row[0], row[1]) for row in rows]
 
-    async def get_transaction_count_for_wallet(
+    async def get_transaction_summaries(
         self,
         wallet_id: int,
+        limit: int,
+        cursor: Optional[TransactionHistoryCursor] = None,
+        sort_key: Optional[str] = None,
+        reverse: bool = False,
         confirmed: Optional[bool] = None,
+        to_puzzle_hash: Optional[bytes32] = None,
         type_filter: Optional[TransactionTypeFilter] = None,
-    ) -> int:
-        confirmed_str = ""
-        if confirmed is not None:
-            confirmed_str = f"AND confirmed={int(confirmed)}"
+    ) -> Tuple[List[TransactionSummary], Optional[TransactionHistoryCursor]]:
+        """
+        Returns a page of the wallet's transactions, sorted by the same keys as
+        get_transactions_between(), starting after the cursor. Unlike an
+        offset, the cursor is found through the index, so every page takes the
+        same time. When the sort mixes directions, the page may take a few
+        index ranges, see _keyset_segments(). Also returns the cursor of the
+        next page, if this one is full.
+        The full records can be fetched with get_transaction_records().
+        """
+        if sort_key is None:
+            sort_key = "CONFIRMED_AT_HEIGHT"
+        if sort_key not in SortKey.__members__:
+            raise ValueError(f"There is no known sort {sort_key}")
 
-        if type_filter is None:
-            type_filter_str = ""
-        else:
-            type_filter_str = (
-                f"AND type {'' if type_filter.mode == FilterMode.include else 'NOT'} "
-                f"IN ({','.join([str(x) for x in type_filter.values])})"
+        columns = SortKey[sort_key].columns(reverse)
+        # ties are broken by rowid, in the order of the first column, as the
+        # index has it after the sorted columns in the direction it's scanned
+        columns.append(("rowid", columns[0][1]))
+        query_str = "ORDER BY " + ", ".join(
+            f"{column} {'DESC' if descending else 'ASC'}" for column, descending in columns
+        )
+
+        filter_str, parameters = _filter_conditions(confirmed, to_puzzle_hash, type_filter)
+        segments: List[Tuple[str, List[Any]]] = [("", [])]
+        if cursor is not None:
+            segments = [
+                (f" AND {condition}", keyset_parameters)
+                for condition, keyset_parameters in _keyset_segments(
+                    columns,
+                    {
+                        "confirmed": int(cursor.confirmed),
+                        "confirmed_at_height": cursor.confirmed_at_height,
+                        "created_at_time": cursor.created_at_time,
+                        "rowid": cursor.rowid,
+                    },
+                )
+            ]
+
+        rows: List[Any] = []
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            for keyset_str, keyset_parameters in segments:
+                if len(rows) >= limit:
+                    break
+                rows.extend(
+                    await conn.execute_fetchall(
+                        "SELECT bundle_id, wallet_id, type, confirmed, confirmed_at_height, created_at_time,"
+                        " to_puzzle_hash, amount, fee_amount, sent, trade_id, rowid FROM transaction_record"
+                        f" WHERE wallet_id=?{filter_str}{keyset_str} {query_str} LIMIT ?",
+                        (wallet_id, *parameters, *keyset_parameters, limit - len(rows)),
+                    )
+                )
+
+        summaries = [
+            TransactionSummary(
+                name=bytes32(row[0]),
+                wallet_id=uint32(row[1]),
+                type=uint32(row[2]),
+                confirmed=bool(row[3]),
+                confirmed_at_height=uint32(row[4]),
+                created_at_time=uint64(row[5]),
+                to_puzzle_hash=bytes32.fromhex(row[6]),
+                amount=uint64.from_bytes(row[7]),
+                fee_amount=uint64.from_bytes(row[8]),
+                sent=uint32(row[9]),
+                trade_id=None if row[10] is None else bytes32(row[10]),
+            )
+            for row in rows
+        ]
+        next_cursor: Optional[TransactionHistoryCursor] = None
+        if len(rows) > 0 and len(rows) == limit:
+            next_cursor = TransactionHistoryCursor(
+                confirmed=summaries[-1].confirmed,
+                confirmed_at_height=summaries[-1].confirmed_at_height,
+                created_at_time=summaries[-1].created_at_time,
+                rowid=uint64(rows[-1][11]),
             )
+        return summaries, next_cursor
+
+    async def get_transaction_records(self, tx_ids: List[bytes32]) -> List[TransactionRecord]:
+        """
+        Returns the records of the transactions that exist, in the order of tx_ids.
+        """
+        records: Dict[bytes32, TransactionRecord] = {}
+        async with self.db_wrapper.reader_no_transaction() as conn:
+            for i in range(0, len(tx_ids), self.db_wrapper.host_parameter_limit):
+                chunk = tx_ids[i : i + self.db_wrapper.host_parameter_limit]
+                rows = await conn.execute_fetchall(
+                    "SELECT transaction_record, valid_times FROM transaction_record"
+                    f" LEFT JOIN tx_times ON txid=bundle_id WHERE bundle_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for row in rows:
+                    record = self._tx_record_from_row(row[0], row[1])
+                    records[record.name] = record
+        return [records[tx_id] for tx_id in tx_ids if tx_id in records]
+
+    async def get_transaction_count_for_wallet(
+        self,
+        wallet_id: int,
+        confirmed: Optional[bool] = None,
+        type_filter: Optional[TransactionTypeFilter] = None,
+    ) -> int:
+        filter_str, parameters = _filter_conditions(confirmed, None, type_filter)
         async with self.db_wrapper.reader_no_transaction() as conn:
             rows = list(
                 await conn.execute_fetchall(
-                    f"SELECT COUNT(*) FROM transaction_record where wallet_id=? {type_filter_str} {confirmed_str}",
-                    (wallet_id,),
+                    f"SELECT COUNT(*) FROM transaction_record where wallet_id=?{filter_str}",
+                    (wallet_id, *parameters),
                 )
             )
         return 0 if len(rows) == 0 else rows[0][0]
@@ -419,6 +606,7 @@ class WalletTransactionStore:
         self.tx_submitted = {}
         async with self.db_wrapper.writer_maybe_transaction() as conn:
             await (await conn.execute("DELETE FROM transaction_record WHERE confirmed_at_height>?", (height,))).close()
+        self._wallet_changed(None)
 
     async def delete_unconfirmed_transactions(self, wallet_id: int):
         async with self.db_wrapper.writer_maybe_transaction() as conn:
@@ -433,6 +621,18 @@ class WalletTransactionStore:
                     ),
                 )
             ).close()
+        self._wallet_changed(wallet_id)
+
+    @staticmethod
+    def _tx_record_from_row(transaction_record: bytes, valid_times: Optional[bytes]) -> TransactionRecord:
+        """
+        For rows that were joined with tx_times.
+        """
+        record = TransactionRecordOld.from_bytes(transaction_record)
+        return TransactionRecord(
+            **{field.name: getattr(record, field.name) for field in dataclasses.fields(record)},
+            valid_times=ConditionValidTimes() if valid_times is None else ConditionValidTimes.from_bytes(valid_times),
+        )
 
     async def _get_new_tx_records_from_old(self, old_records: List[TransactionRecordOld]) -> List[TransactionRecord]:
         tx_id_to_valid_times: Dict[bytes, ConditionValidTimes] = {}
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from typing import Callable, Dict, List
+
+import click
+
+from chia.types.blockchain_format.coin import Coin
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.util.ints import uint32, uint64, uint128
+from chia.wallet.coin_selection import select_coins
+from chia.wallet.util.tx_config import DEFAULT_COIN_SELECTION_CONFIG
+from chia.wallet.util.wallet_types import WalletType
+from chia.wallet.wallet_coin_record import WalletCoinRecord
+
+log = logging.getLogger(__name__)
+
+# coin amounts in mojos, of the synthetic coin distributions
+DISTRIBUTIONS: Dict[str, Callable[[random.Random], int]] = {
+    # farming rewards and payments of similar sizes
+    "uniform": lambda rng: rng.randint(1, 2_000_000_000_000),
+    # mostly small coins, a few large ones
+    "exponential": lambda rng: int(rng.expovariate(1 / 1_000_000_000)) + 1,
+    # a lot of dust next to round amounts
+    "dust": lambda rng: rng.randint(1, 1000) if rng.random() < 0.8 else rng.choice([10**9, 10**10, 10**12]),
+}
+
+
+def random_bytes32(rng: random.Random) -> bytes32:
+    return bytes32(rng.getrandbits(256).to_bytes(32, "big"))
+
+
+def make_coin_records(
+    rng: random.Random, num_coins: int, amount: Callable[[random.Random], int]
+) -> List[WalletCoinRecord]:
+    return [
+        WalletCoinRecord(
+            Coin(random_bytes32(rng), random_bytes32(rng), uint64(amount(rng))),
+            uint32(1),
+            uint32(0),
+            False,
+            False,
+            WalletType.STANDARD_WALLET,
+            1,
+        )
+        for _ in range(num_coins)
+    ]
+
+
+@click.command()
+@click.option("--coins", "coin_counts", default=[1000, 10000, 100000, 1000000], multiple=True, type=int)
+@click.option("--distribution", "distributions", default=list(DISTRIBUTIONS), multiple=True)
+@click.option("--targets", default=10, help="number of random amounts to select coins for, per coin set")
+@click.option("--seed", default=1)
+def main(coin_counts: List[int], distributions: List[str], targets: int, seed: int) -> None:
+    """
+    Times coin_selection.select_coins() over synthetic coin sets, and reports
+    the number of coins selected and the change they leave.
+    """
+    rng = random.Random(seed)
+    print(f"{'distribution':<12} {'coins':>8} {'avg ms':>8} {'max ms':>8} {'avg inputs':>10} {'exact':>6}")
+    for distribution in distributions:
+        for num_coins in coin_counts:
+            records = make_coin_records(rng, num_coins, DISTRIBUTIONS[distribution])
+            total = sum(record.coin.amount for record in records)
+            times: List[float] = []
+            inputs = 0
+            exact = 0
+            for _ in range(targets):
+                amount = rng.randint(1, total // 10)
+                start = time.monotonic()
+                coins = asyncio.run(
+                    select_coins(uint128(total), DEFAULT_COIN_SELECTION_CONFIG, records, {}, log, uint128(amount))
+                )
+                times.append(time.monotonic() - start)
+                inputs += len(coins)
+                exact += sum(coin.amount for coin in coins) == amount
+            print(
+                f"{distribution:<12} {num_coins:>8} {1000 * sum(times) / targets:>8.1f} {1000 * max(times):>8.1f}"
+                f" {inputs / targets:>10.1f} {exact:>6}"
+            )
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable = no-value-for-parameter
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import os
+import tracemalloc
+
+import click
+
+from chia.types.blockchain_format.sized_bytes import bytes32
+from chia.wallet.util.wallet_types import WalletType
+from chia.wallet.wallet_puzzle_store import PuzzleHashIndex
+
+
+@click.command()
+@click.option("--derivations", default=1_000_000, help="number of derivation indexes")
+@click.option("--wallets", default=1, help="number of standard wallets the puzzle hashes are derived for")
+def main(derivations: int, wallets: int) -> None:
+    """
+    Reports the memory used by the in-memory puzzle hash index of
+    WalletPuzzleStore, for hardened and unhardened puzzle hashes of the given
+    number of derivation indexes.
+    """
+    puzzle_hashes = [bytes32(os.urandom(32)) for _ in range(2 * derivations * wallets)]
+
+    tracemalloc.start()
+    index = PuzzleHashIndex()
+    for i, puzzle_hash in enumerate(puzzle_hashes):
+        index.add(puzzle_hash, i % wallets + 1, WalletType.STANDARD_WALLET)
+    index.compact()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"puzzle hashes:   {len(index)}")
+    print(f"index size:      {size / 1024 / 1024:0.1f} MiB (peak {peak / 1024 / 1024:0.1f} MiB)")
+    print(f"per puzzle hash: {size / len(index):0.1f} bytes")
+
+
+if __name__ == "__main__":
+    main()  # pylint: disable = no-value-for-parameter